@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+'''
+The CRC32C (Castagnoli) variant used by btrfs send-streams.
+
+Unlike the usual CRC32C, btrfs neither inverts the seed, nor the final
+value, so `btrfs_crc32c(b'')` is 0.  The send-stream command CRC is this
+checksum, seeded with 0, over the command header (with its `crc` field set
+to 0) followed by the command payload.
+
+We depend on the `crc32c` extension module, whose hardware-accelerated
+implementation checksums GB/s.  If it is missing, we fall back to a
+table-driven "slicing-by-8" implementation in pure Python, which is
+correct, but about 300x slower (under 10 MiB/s).
+'''
+import struct
+
+try:
+    from crc32c import crc32c as _std_crc32c
+except ImportError:  # pragma: no cover
+    _std_crc32c = None
+
+_POLYNOMIAL = 0x82F63B78  # Reversed Castagnoli polynomial
+_MASK = 0xFFFFFFFF
+
+
+def _make_tables():
+    table0 = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ (_POLYNOMIAL if crc & 1 else 0)
+        table0.append(crc)
+    # `tables[k][b]` is the CRC of byte `b` followed by `k` zero bytes.
+    tables = [table0]
+    for _ in range(7):
+        prev = tables[-1]
+        tables.append([(c >> 8) ^ table0[c & 0xFF] for c in prev])
+    return tuple(tuple(t) for t in tables)
+
+
+_TABLES = _make_tables()
+_WORD = struct.Struct('<Q')
+
+
+def _py_btrfs_crc32c(data, crc: int) -> int:
+    t0, t1, t2, t3, t4, t5, t6, t7 = _TABLES
+    data = memoryview(data).cast('B')
+    n = len(data)
+    split = n - n % 8
+    # Process 8 bytes per iteration, see "slicing-by-8" by Kounavis & Berry
+    for word, in _WORD.iter_unpack(data[:split]):
+        word ^= crc
+        crc = (
+            t7[word & 0xFF] ^ t6[(word >> 8) & 0xFF] ^
+            t5[(word >> 16) & 0xFF] ^ t4[(word >> 24) & 0xFF] ^
+            t3[(word >> 32) & 0xFF] ^ t2[(word >> 40) & 0xFF] ^
+            t1[(word >> 48) & 0xFF] ^ t0[word >> 56]
+        )
+    for b in data[split:]:
+        crc = (crc >> 8) ^ t0[(crc ^ b) & 0xFF]
+    return crc
+
+
+def btrfs_crc32c(data, crc: int=0) -> int:
+    '''
+    Extends `crc` by the bytes-like `data`, so that
+        `btrfs_crc32c(b, btrfs_crc32c(a)) == btrfs_crc32c(a + b)`
+    '''
+    if _std_crc32c is None:  # pragma: no cover
+        return _py_btrfs_crc32c(data, crc)
+    # The standard CRC inverts on the way in & out, we undo both.
+    return _std_crc32c(data, crc ^ _MASK) ^ _MASK
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''
+Answers "which byte ranges of which files share storage with this file?"
+while send-streams are still being applied, without `freeze`ing the whole
+`SubvolumeSet` to run `extents_to_chunks`.
+
+The index maps each leaf `Extent` (by object identity, just as in
+`extents_to_chunks.py`) to the ranges of the files referencing it.  It is
+opt-in, via `SubvolumeSet.new(clone_index=CloneIndex.new())`, so that
+sets which are only ever frozen do not pay to maintain it.  It is kept
+up-to-date lazily:
+
+ - `SubvolumeSetMutator` calls `mark_dirty` for the files touched by each
+   send-stream item, which is O(1).
+
+ - A query first re-indexes the dirty files, and any `Subvolume` that was
+   never indexed, such as a new snapshot.  Then, it only looks at the leaf
+   extents of the file in question.  So, the work done by a query is
+   proportional to the amount of change since the previous query, plus
+   the number of ranges sharing a leaf extent with the file.
+
+Unlike `ChunkClone`s, the results are not normalized: they are simply the
+pairwise overlaps of the trimmed leaves of the two files.  Refer to the
+docblock of `extents_to_chunks.py` for why that matters in tests.
+
+IMPORTANT: Since leaf extents are keyed by `id()`, the index cannot survive
+a `deepcopy`.  Instead, a copy starts out empty, and gets rebuilt on demand.
+'''
+from typing import Dict, Iterator, Mapping, NamedTuple, Set, Tuple
+
+from .extent import Extent
+from .inode import Clone
+from .inode_id import InodeID
+
+
+class _LeafRef(NamedTuple):
+    'One occurrence of a leaf extent in the `gen_trimmed_leaves` of a file.'
+    offset: int  # Into the file
+    leaf_offset: int  # Into the leaf extent
+    length: int
+
+
+class CloneIndex(NamedTuple):
+    # The `uuid_to_subvolume` keys of the `Subvolume`s that were indexed.
+    indexed_uuids: Set[str]
+    # Files whose extents may have changed since they were last indexed.
+    dirty_ids: Dict[InodeID, 'Subvolume']
+    # Keeps the leaves alive, so that their `id()`s are not reused.
+    leaf_id_to_leaf: Dict[int, Extent]
+    leaf_id_to_refs: Dict[int, Dict[InodeID, Tuple[_LeafRef, ...]]]
+    # The leaf IDs of each file, in file order.
+    id_to_leaf_ids: Dict[InodeID, Tuple[int, ...]]
+
+    @classmethod
+    def new(cls, **kwargs) -> 'CloneIndex':
+        kwargs.setdefault('indexed_uuids', set())
+        kwargs.setdefault('dirty_ids', {})
+        kwargs.setdefault('leaf_id_to_leaf', {})
+        kwargs.setdefault('leaf_id_to_refs', {})
+        kwargs.setdefault('id_to_leaf_ids', {})
+        return cls(**kwargs)
+
+    def __deepcopy__(self, memo) -> 'CloneIndex':
+        return type(self).new()  # See the IMPORTANT note in the docblock.
+
+    def mark_dirty(self, subvol: 'Subvolume', ino_id: InodeID) -> None:
+        self.dirty_ids[ino_id] = subvol
+
+    def _set_extent(self, ino_id: InodeID, extent: Extent) -> None:
+        'Replaces the references of `ino_id`, `extent` may be None.'
+        for leaf_id in self.id_to_leaf_ids.pop(ino_id, ()):
+            refs = self.leaf_id_to_refs[leaf_id]
+            del refs[ino_id]
+            if not refs:
+                del self.leaf_id_to_refs[leaf_id]
+                del self.leaf_id_to_leaf[leaf_id]
+        if extent is None:
+            return
+        leaf_id_to_my_refs = {}  # Ordered, for deterministic queries
+        file_offset = 0
+        for leaf_offset, length, leaf in extent.gen_trimmed_leaves():
+            self.leaf_id_to_leaf[id(leaf)] = leaf
+            leaf_id_to_my_refs.setdefault(id(leaf), []).append(_LeafRef(
+                offset=file_offset, leaf_offset=leaf_offset, length=length,
+            ))
+            file_offset += length
+        for leaf_id, my_refs in leaf_id_to_my_refs.items():
+            self.leaf_id_to_refs.setdefault(leaf_id, {})[ino_id] = \
+                tuple(my_refs)
+        if leaf_id_to_my_refs:
+            self.id_to_leaf_ids[ino_id] = tuple(leaf_id_to_my_refs)
+
+    def _update(self, uuid_to_subvolume: Mapping[str, 'Subvolume']) -> None:
+        for ino_id, subvol in self.dirty_ids.items():
+            self._set_extent(ino_id, getattr(
+                subvol.id_to_inode.get(ino_id.id), 'extent', None,
+            ))
+        self.dirty_ids.clear()
+        for uuid, subvol in uuid_to_subvolume.items():
+            if uuid not in self.indexed_uuids:
+                for ino_id, extent in subvol._inode_ids_and_extents():
+                    self._set_extent(ino_id, extent)
+                self.indexed_uuids.add(uuid)
+
+    def gen_clones(
+        self,
+        uuid_to_subvolume: Mapping[str, 'Subvolume'],
+        ino_id: InodeID,
+    ) -> Iterator[Tuple[Clone, Clone]]:
+        '''
+        Yields `(range of ino_id, range of another file)` for every pair of
+        overlapping references to a leaf extent.  The other file may be
+        `ino_id` itself, if it references the same leaf twice.
+        '''
+        self._update(uuid_to_subvolume)
+        for leaf_id in self.id_to_leaf_ids.get(ino_id, ()):
+            refs = self.leaf_id_to_refs[leaf_id]
+            for mine in refs[ino_id]:
+                for other_id, other_refs in refs.items():
+                    for theirs in other_refs:
+                        if theirs is mine:
+                            continue
+                        start = max(mine.leaf_offset, theirs.leaf_offset)
+                        end = min(
+                            mine.leaf_offset + mine.length,
+                            theirs.leaf_offset + theirs.length,
+                        )
+                        if start >= end:
+                            continue
+                        yield (
+                            Clone(
+                                inode_id=ino_id,
+                                offset=mine.offset + start - mine.leaf_offset,
+                                length=end - start,
+                            ),
+                            Clone(
+                                inode_id=other_id,
+                                offset=theirs.offset + start
+                                    - theirs.leaf_offset,
+                                length=end - start,
+                            ),
+                        )
@@ -13,7 +13,7 @@ Returns 2 if no loops exist, 1 on usage or data errors.
 import os
 import sys
 
-from ..parse_send_stream import parse_send_stream
+from ..parse_send_stream import parse_send_streams
 from ..send_stream import SendStreamItems
 
 
@@ -21,7 +21,10 @@ def main(argv):
     if len(argv) != 1:
         print(__doc__, file=sys.stderr)
         return 1
-    for item in parse_send_stream(sys.stdin.buffer):
+    # We only look at device nodes, so don't bother reading file data.
+    for _stream_idx, item in parse_send_streams(
+        sys.stdin.buffer, skip_data=True,
+    ):
         if isinstance(item, SendStreamItems.mknod) and (
             os.major(item.dev) == 7 or item.dev == os.makedev(10, 237)
         ):
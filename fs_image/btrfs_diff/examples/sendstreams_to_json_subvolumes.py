@@ -28,10 +28,14 @@ A few things to try:
   - Compare our JSON output via `diff`, since its keys are already sorted.
     For unsorted JSON, use `diff <(jq -S . a.json) <(jq -S . b.json)`.
 
+  - For huge subvolumes, pass `--ndjson` to stream one record per line,
+    and filter it with e.g. `jq -c 'select(.path | startswith("etc/"))'`.
+
 '''
 # NB This was cribbed from `test_sendstream_to_subvolume_set_integration.py`
 # to encourage interactive play with send-streams.
 import argparse
+import itertools
 import json
 import sys
 
@@ -41,7 +45,7 @@ from ..inode_utils import (
     erase_mode_and_owner, erase_selinux_xattr, erase_utimes_in_range,
     SELinuxXAttrStats,
 )
-from ..parse_send_stream import parse_send_stream
+from ..parse_send_stream import parse_send_stream_files, parse_send_streams
 from ..rendered_tree import emit_non_unique_traversal_ids
 from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
 
@@ -99,20 +103,62 @@ def main(argv):
             'if necessary: "@minimally-unambuguous-uuid-prefix". If in '
             'doubt, first look at the output without `--show-only`.'
     )
+    parser.add_argument(
+        '--extent-ids', action='store_true',
+        help='Instead of listing, for each chunk, every other chunk that '
+            'clones it, number the shared extents, and annotate each chunk '
+            'with `#extent_id:extent_offset+length@chunk_offset`. The '
+            'output grows linearly, rather than quadratically, in the '
+            'number of clones, which matters for long snapshot chains.',
+    )
+    parser.add_argument(
+        '--ndjson', action='store_true',
+        help='Instead of one JSON tree per subvolume, print one JSON '
+            'object per line for each inode path, with the keys '
+            '"subvolume", "path", "inode", and -- for inodes that occur '
+            'more than once, i.e. hardlinks -- "id". The records are '
+            'written as the subvolume is traversed, bottom-up, so the '
+            'rendered tree is never held in memory.',
+    )
+    parser.add_argument(
+        '--parse-workers', type=int, default=1,
+        help='Parse the send-stream files in this many processes, or pass '
+            '0 to use all CPUs. Each file is still applied in order, while '
+            'the workers parse the next files. The files must be regular '
+            'files, not pipes like `<(...)`.',
+    )
     parser.add_argument(
         'sendstream', type=argparse.FileType('br'), nargs='+',
-        help='A file containing the output of `btrfs send`. Note that '
-            'send-stream order matters, since we will try to apply them '
-            'to our in-memory filesystem from left to right.',
+        help='A file containing the output of `btrfs send`, or several '
+            'such send-streams concatenated. Note that send-stream order '
+            'matters, since we will try to apply them to our in-memory '
+            'filesystem from left to right.',
     )
     args = parser.parse_args(argv[1:])
 
+    # File data is never rendered, only the extent geometry.
+    if args.parse_workers == 1:
+        idxs_and_items = (
+            (sendstream_idx, stream_idx, item)
+                for sendstream_idx, sendstream_in in enumerate(args.sendstream)
+                    for stream_idx, item in parse_send_streams(
+                        sendstream_in, skip_data=True,
+                    )
+        )
+    else:
+        idxs_and_items = parse_send_stream_files(
+            [sendstream_in.name for sendstream_in in args.sendstream],
+            num_workers=args.parse_workers or None,
+            skip_data=True,
+        )
     subvols = SubvolumeSet.new()
-    for sendstream_in in args.sendstream:
-        parsed = parse_send_stream(sendstream_in)
-        mutator = SubvolumeSetMutator.new(subvols, next(parsed))
-        for i in parsed:
-            mutator.apply_item(i)
+    for _idxs, stream_items in itertools.groupby(
+        idxs_and_items, key=lambda idxs_and_item: idxs_and_item[:2],
+    ):
+        _sendstream_idx, _stream_idx, subvol_item = next(stream_items)
+        mutator = SubvolumeSetMutator.new(subvols, subvol_item)
+        for _sendstream_idx, _stream_idx, item in stream_items:
+            mutator.apply_item(item)
 
     # Check that our send-streams completely specified the subvolumes.
     if not args.no_check_complete:
@@ -143,7 +189,7 @@ def main(argv):
             ))
 
     if args.show_only:
-        result = {}
+        name_to_subvol = {}
         # This hides cross-subvolume clone annotations, see `--show-only`.
         for which_subvol in args.show_only:
             subvol = subvols.get_by_rendered_id(which_subvol)
@@ -151,13 +197,26 @@ def main(argv):
                 raise RuntimeError(
                     f'Unknown subvol {which_subvol}, try without --show-only'
                 )
-            result[which_subvol] = emit_non_unique_traversal_ids(
-                freeze(subvol).render()
-            )
+            name_to_subvol[which_subvol] = \
+                freeze(subvol, extent_ids=args.extent_ids)
     else:
-        result = freeze(subvols).map(
-            lambda sv: emit_non_unique_traversal_ids(sv.render())
+        name_to_subvol = freeze(subvols, extent_ids=args.extent_ids).map(
+            lambda sv: sv
         )
+
+    if args.ndjson:
+        for name, subvol in sorted(name_to_subvol.items()):
+            for path, ino_repr, traversal_id in subvol.gen_rendered_inodes():
+                record = {'subvolume': name, 'path': path, 'inode': ino_repr}
+                if traversal_id is not None:
+                    record['id'] = traversal_id
+                print(json.dumps(record, sort_keys=True))
+        return
+
+    result = {
+        name: emit_non_unique_traversal_ids(subvol.render())
+            for name, subvol in name_to_subvol.items()
+    }
     # Future: is there a `pprint`-style compact & pretty JSON output?
     print(json.dumps(result, sort_keys=True, indent=2))
 
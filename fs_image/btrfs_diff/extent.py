@@ -2,7 +2,10 @@
 import enum
 import itertools
 
-from typing import NamedTuple, Optional, Tuple, Union
+from bisect import bisect_right
+from typing import (
+    Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union,
+)
 
 
 # Future: use `deepfrozentype` for true immutability.
@@ -63,9 +66,13 @@ class Extent(NamedTuple):
 
     For the purposes of write/clone/truncate modeling, `Extent` could do a
     lot more on-the-fly normalization, which could save RAM.  E.g. we could
-    discard HOLE provenance (just store "hole of length N"), and we could
-    flatten to trimmed leaves more eagerly.  However, none of this extra
-    complexity seems worthwhile for now.
+    discard HOLE provenance (just store "hole of length N").
+
+    Since every mutation nests the previous `Extent`, a file built from
+    many small writes becomes a deep tree, which `gen_trimmed_leaves` has
+    to recurse through.  `FlatExtent` is the same data model, but it
+    flattens to trimmed leaves eagerly, and is what `IncompleteFile` uses.
+    `Extent` remains the leaf type, and a handy way to write tests.
 
     '''
 
@@ -249,3 +256,148 @@ class Extent(NamedTuple):
 
     def __deepcopy__(self, memo):
         return self  # See the docstring
+
+
+# A trimmed leaf, as yielded by `gen_trimmed_leaves`.
+_Run = Tuple[int, int, Extent]
+
+
+class FlatExtent:
+    '''
+    A drop-in replacement for `Extent` as the data fork of a file.  Instead
+    of a history-preserving tree, this stores the file's trimmed leaves
+    directly: a list of `(offset, length, leaf Extent)` sorted by file
+    offset.  Leaves are never copied, so clone tracking by leaf identity
+    works exactly as with `Extent`.  In particular, `gen_trimmed_leaves`
+    yields the same leaves as it would for the equivalent `Extent`.
+
+    Costs, for a file of `n` leaves:
+     - `gen_trimmed_leaves` is iterative, and finds its starting leaf in
+       O(log n), so `clone` costs O(log n) plus the size of the clone.
+     - A `write`, `clone`, or `truncate` at or past the end of the file is
+       amortized O(1), which is what sequential `btrfs send` writes are.
+     - Other mutations are O(n).
+
+    Like `Extent`, this is immutable from the outside, so `copy` and
+    `deepcopy` return `self`.  To make appends cheap, the run list may be
+    shared with the `FlatExtent`s made by appending to this one.  They may
+    grow the list past `self._count`, but never change its first
+    `self._count` items.  The first append to a `FlatExtent` whose list
+    has already grown takes a private copy.  Files start out sharing one
+    empty `FlatExtent`, whose run lists are immutable, so that a model of
+    millions of empty files does not pay for millions of empty lists.
+    '''
+    __slots__ = ('_runs', '_starts', '_count', 'length')
+
+    def __init__(
+        self,
+        runs: Sequence[_Run],
+        starts: Sequence[int],
+        count: int,
+        length: int,
+    ):
+        'Do not use directly, start each file with `empty()`.'
+        self._runs = runs  # Only the first `count` items belong to us.
+        self._starts = starts  # The file offset of each run.
+        self._count = count
+        self.length = length
+
+    @staticmethod
+    def empty() -> 'FlatExtent':
+        return _EMPTY_FLAT_EXTENT
+
+    def _append(self, runs: Iterable[_Run]) -> 'FlatExtent':
+        'Returns `self` followed by `runs` in O(len(runs)), see docblock.'
+        if self._count and len(self._runs) == self._count:
+            all_runs, starts = self._runs, self._starts
+        else:
+            all_runs = list(self._runs[:self._count])
+            starts = list(self._starts[:self._count])
+        length = self.length
+        for run in runs:
+            if run[1] > 0:  # Like `Extent`, drop empty extents
+                all_runs.append(run)
+                starts.append(length)
+                length += run[1]
+        return FlatExtent(all_runs, starts, len(all_runs), length)
+
+    def truncate(self, length: int) -> 'FlatExtent':
+        if length == self.length:
+            return self
+        if length > self.length:
+            return self._append([(
+                0,
+                length - self.length,
+                Extent(Extent.Kind.HOLE, 0, length - self.length),
+            )])
+        return FlatExtent.empty()._append(self.gen_trimmed_leaves(
+            length=length,
+        ))
+
+    def __put(self, offset: int, what: List[_Run]) -> 'FlatExtent':
+        'Overwrites with `what` a portion of `self` starting at `offset`.'
+        what_length = sum(length for _, length, _ in what)
+        assert what_length > 0, 'Future: not sure how to hangle length = 0'
+        if offset >= self.length:  # The fast path for sequential writes
+            return self.truncate(length=offset)._append(what)
+        end = offset + what_length
+        return FlatExtent.empty()._append(itertools.chain(
+            self.gen_trimmed_leaves(length=offset),
+            what,
+            self.gen_trimmed_leaves(offset=end) if end < self.length else (),
+        ))
+
+    def write(self, *, offset: int, length: int) -> 'FlatExtent':
+        # Leaves are made exactly as `Extent.write` would make them.
+        return self.__put(offset, [
+            (0, length, Extent(Extent.Kind.DATA, 0, length)),
+        ])
+
+    def clone(
+        self,
+        *,
+        to_offset: int,
+        from_extent: Union['FlatExtent', Extent],
+        from_offset: int,
+        length: int,
+    ) -> 'FlatExtent':
+        return self.__put(to_offset, list(from_extent.gen_trimmed_leaves(
+            offset=from_offset, length=length,
+        )))
+
+    def gen_trimmed_leaves(
+        self, *, offset: int=0, length: Optional[int]=None,
+    ) -> Iterable[_Run]:
+        'Has the same semantics as `Extent.gen_trimmed_leaves`.'
+        max_length = self.length - offset
+        if length is None:
+            length = max_length
+        assert length <= max_length, f'len {length}, offset {offset}, {self}'
+        assert offset >= 0 and length >= 0, f'offset {offset}, length {length}'
+
+        end = offset + length
+        # The run containing `offset`.  Since `self._starts[0] == 0`, this
+        # is only -1 if we have no runs.
+        idx = bisect_right(self._starts, offset, 0, self._count) - 1
+        while 0 <= idx < self._count and self._starts[idx] < end:
+            start = self._starts[idx]
+            leaf_offset, leaf_length, leaf = self._runs[idx]
+            trim_start = max(offset, start)
+            trim_end = min(end, start + leaf_length)
+            if trim_end > trim_start:
+                yield leaf_offset + trim_start - start, \
+                    trim_end - trim_start, leaf
+            idx += 1
+
+    # These only rely on `gen_trimmed_leaves`.
+    _gen_leaf_reprs = Extent._gen_leaf_reprs
+    __repr__ = Extent.__repr__
+
+    def __copy__(self):
+        return self  # See the docstring
+
+    def __deepcopy__(self, memo):
+        return self  # See the docstring
+
+
+_EMPTY_FLAT_EXTENT = FlatExtent((), (), 0, 0)
@@ -95,6 +95,25 @@ the structures of the write forks, respecting `truncate`, `write`, and
       by which the N-1 spanning tree edges are selected.  It's easy to make
       such a process deterministic, but it still adds cognitive load.
 
+    * When copy numbers are high -- e.g. a base image's files are shared by
+      hundreds of snapshots -- the quadratic representation is too big to
+      build or to read.  `extents_to_chunks_with_extent_ids()` is then the
+      linear alternative.  Much like `TraversalIDMaker` does for hardlinks,
+      it numbers every leaf extent that is referenced more than once, in
+      the order of first appearance in a path-sorted traversal of the
+      inodes.  Each `Chunk` then carries `ChunkExtent`s instead of
+      `ChunkClone`s.  In the above figure, the backing extent becomes `#0`:
+
+        {'A': {'#0:0+3@0', '#0:6+3@3'},
+         'B': {'#0:1+5@0'},
+         'C': {'#0:3+5@0'}}
+
+      Two byte ranges are clones iff they map to the same extent ID and
+      overlap in extent offsets.  This costs O(L log L) time for L total
+      trimmed leaves, and O(L) space.  Caveat: a leaf extent referenced
+      twice without any overlap (e.g. `A` and `B` take disjoint parts of
+      it) is still numbered, even though no bytes are shared.
+
 [1] The current code tracks clones of HOLEs, because it makes no effort to
     ignore them.  I would guess that btrfs lacks this tracking, since such
     clones would save no space.  Once this is confirmed, it would be very
@@ -111,13 +130,13 @@ the structures of the write forks, respecting `truncate`, `write`, and
 
 '''
 # Future: frozentypes instead of NamedTuples can permit some cleanups below.
-import functools
+import itertools
 
-from collections import defaultdict
+from collections import Counter, defaultdict
 from typing import Dict, Iterable, NamedTuple, Sequence, Tuple
 
 from .extent import Extent
-from .inode import Clone, Chunk, ChunkClone
+from .inode import Clone, Chunk, ChunkClone, ChunkExtent
 from .inode_id import InodeID
 
 
@@ -191,7 +210,9 @@ assert _CloneExtentRef._fields.index('clone') == 0
 #  - relying on the order of field declaration in `_CloneOp` (not bad)
 #  - making `Inode`s comparable (a bit ugly, comparing Extents is pricy,
 #    comparing InodeIDs would require some comparator boilerplate)
-# Luckily, being explicit is not *that* painful.
+# Luckily, being explicit is not *that* painful.  We pass this to `sorted`
+# as a `key` instead of defining comparators on `_CloneOp`, since that
+# computes the key once per op, rather than twice per comparison.
 def _clone_op_compare_key(c: '_CloneOp'):
     return (
         # The preceding asserts make these [1:] hacks tolerable.
@@ -200,21 +221,6 @@ def _clone_op_compare_key(c: '_CloneOp'):
     )
 
 
-def _clone_op_compare(fn):
-    @functools.wraps(fn)
-    def cmp(self: '_CloneOp', other: '_CloneOp'):
-        assert isinstance(other, _CloneOp)
-        # We only compare ops within one extent. The tests assume this to
-        # justify focusing on single-extent examples, so check it.
-        assert self.ref.extent is other.ref.extent
-        # All our items are distinct, since `clone.offset` is `inode_offset`,
-        # which is strictly increasing in each inode.  We have no business
-        # comparing a _CloneOp with itself.
-        assert tuple.__ne__(self, other)
-        return fn(_clone_op_compare_key(self), _clone_op_compare_key(other))
-    return cmp
-
-
 class _CloneOp(NamedTuple):
     PUSH = 'push'
     POP = 'pop'
@@ -224,14 +230,6 @@ class _CloneOp(NamedTuple):
     action: str
     ref: _CloneExtentRef
 
-    # NamedTuple confuses functools.total_ordering, so define all 6 comparators
-    __eq__ = _clone_op_compare(tuple.__eq__)
-    __ne__ = _clone_op_compare(tuple.__ne__)
-    __lt__ = _clone_op_compare(tuple.__lt__)
-    __le__ = _clone_op_compare(tuple.__le__)
-    __gt__ = _clone_op_compare(tuple.__gt__)
-    __ge__ = _clone_op_compare(tuple.__ge__)
-
 
 def _leaf_extent_id_to_clone_ops(
     ids_and_extents: Iterable[Tuple[InodeID, Extent]]
@@ -274,7 +272,7 @@ def _leaf_ref_to_chunk_clones_from_clone_ops(
     'As per `_leaf_extent_id_to_clone_ops`, this computes interval overlaps'
     active_ops: Dict[_CloneExtentRef, _CloneOp] = {}  # Tracks open intervals
     leaf_ref_to_chunk_clones = defaultdict(list)
-    for op in sorted(clone_ops):
+    for op in sorted(clone_ops, key=_clone_op_compare_key):
         # Whenever an interval (aka an Inode's Extent's "trimmed leaf")
         # ends, we create `ChunkClone` objects **to** and **from** all the
         # concurrently open intervals.
@@ -403,3 +401,67 @@ def extents_to_chunks_with_clones(
                 chunk_clones=frozenset(c.chunk_clones),
             ) for c in new_chunks
         )
+
+
+def extents_to_chunks_with_extent_ids(
+    ids_and_extents: Sequence[Tuple[InodeID, Extent]],
+) -> Iterable[Tuple[InodeID, Sequence[Chunk]]]:
+    '''
+    Like `extents_to_chunks_with_clones`, but annotates shared parts of
+    each `Chunk` with `ChunkExtent`s, whose size is linear in the number of
+    clones.  See this file's docblock.
+
+    The inodes are yielded in the order that determines the extent IDs,
+    which is sorted by `repr(InodeID)`, i.e. by subvolume & paths.
+    '''
+    ids_and_leaves = [
+        (ino_id, list(extent.gen_trimmed_leaves()))
+            for ino_id, extent in sorted(
+                ids_and_extents, key=lambda id_and_extent: repr(
+                    id_and_extent[0]
+                ),
+            )
+    ]
+    # Number only the leaf extents that occur more than once, just as
+    # `emit_non_unique_traversal_ids` hides unique IDs.
+    leaf_id_to_refcount = Counter(
+        id(leaf) for _, leaves in ids_and_leaves for _, _, leaf in leaves
+    )
+    leaf_id_to_extent_id = {}
+    extent_id_counter = itertools.count()
+    for ino_id, leaves in ids_and_leaves:
+        new_chunks = []
+        for offset, length, extent in leaves:
+            assert isinstance(extent.content, Extent.Kind)
+
+            # If the chunk kind matches, merge into the previous chunk.
+            if new_chunks and new_chunks[-1].kind == extent.content:
+                prev_length = new_chunks[-1].length
+                prev_extents = new_chunks[-1].chunk_extents
+            else:  # Otherwise, make a new one.
+                prev_length = 0
+                prev_extents = set()
+                new_chunks.append(None)
+
+            if leaf_id_to_refcount[id(extent)] > 1:
+                extent_id = leaf_id_to_extent_id.get(id(extent))
+                if extent_id is None:
+                    extent_id = next(extent_id_counter)
+                    leaf_id_to_extent_id[id(extent)] = extent_id
+                prev_extents.add(ChunkExtent(
+                    offset=prev_length,
+                    extent_id=extent_id,
+                    extent_offset=offset,
+                    length=length,
+                ))
+
+            new_chunks[-1] = Chunk(
+                kind=extent.content,
+                length=length + prev_length,
+                chunk_clones=frozenset(),
+                chunk_extents=prev_extents,
+            )
+        yield ino_id, tuple(
+            c._replace(chunk_extents=frozenset(c.chunk_extents))
+                for c in new_chunks
+        )
@@ -17,11 +17,16 @@ Future: Once `deepfrozen` is landed, this sort of thing should get nicer.
 '''
 from enum import Enum
 from types import MappingProxyType
+from typing import Any, Callable, Dict
 
 
 def freeze(obj, *, _memo=None, **kwargs):
+    freezer = _TYPE_TO_FREEZER.get(type(obj))
+    if freezer is None:
+        freezer = _TYPE_TO_FREEZER[type(obj)] = _pick_freezer(type(obj))
+
     # Don't bother memoizing primitive types
-    if isinstance(obj, (bytes, Enum, float, int, str, type(None))):
+    if freezer is _freeze_primitive:
         return obj
 
     if _memo is None:
@@ -30,31 +35,106 @@ def freeze(obj, *, _memo=None, **kwargs):
     if id(obj) in _memo:  # Already frozen?
         return _memo[id(obj)]
 
-    if hasattr(obj, 'freeze'):
-        frozen = obj.freeze(_memo=_memo, **kwargs)
-    else:
-        # At the moment, I don't have a need for passing extra data into
-        # items that live inside containers.  If we're relaxing this, just
-        # be sure to add `**kwargs` to each `freeze()` call below.
-        assert kwargs == {}, kwargs
-        # This is a lame-o way of identifying `NamedTuple`s. Using
-        # `deepfrozen` would avoid this kludge.
-        if (
-            isinstance(obj, tuple) and hasattr(obj, '_replace') and
-            hasattr(obj, '_fields') and hasattr(obj, '_make')
-        ):
-            frozen = obj._make(freeze(i, _memo=_memo) for i in obj)
-        elif isinstance(obj, (list, tuple)):
-            frozen = tuple(freeze(i, _memo=_memo) for i in obj)
-        elif isinstance(obj, dict):
-            frozen = MappingProxyType({
-                freeze(k, _memo=_memo): freeze(v, _memo=_memo)
-                    for k, v in obj.items()
-            })
-        elif isinstance(obj, (set, frozenset)):
-            frozen = frozenset(freeze(i, _memo=_memo) for i in obj)
-        else:
-            raise NotImplementedError(type(obj))
+    # At the moment, I don't have a need for passing extra data into items
+    # that live inside containers.  If we're relaxing this, just be sure to
+    # add `**kwargs` to each `freeze()` call in the freezers below.
+    assert freezer is _freeze_custom or kwargs == {}, kwargs
+    frozen = freezer(obj, _memo, kwargs)
 
     _memo[id(obj)] = frozen
     return frozen
+
+
+# The freezers take `(obj, _memo, kwargs)`.  Those for immutable containers
+# return `obj` itself if its items are already frozen, much like `deepcopy`
+# does not copy a tuple of atoms.
+
+
+def _freeze_primitive(obj, _memo, kwargs):  # pragma: no cover
+    'A marker, since `freeze` & `_freeze_items` return primitives as-is.'
+    return obj
+
+
+def _freeze_custom(obj, _memo, kwargs):
+    return obj.freeze(_memo=_memo, **kwargs)
+
+
+def _freeze_items(items, _memo):
+    # Skipping the `freeze` call for primitives is a big speedup.
+    get_freezer = _TYPE_TO_FREEZER.get
+    return [
+        i if get_freezer(type(i)) is _freeze_primitive
+            else freeze(i, _memo=_memo)
+                for i in items
+    ]
+
+
+def _is_unchanged(frozen_items, items) -> bool:
+    for frozen, i in zip(frozen_items, items):
+        if frozen is not i:
+            return False
+    return True
+
+
+def _freeze_namedtuple(obj, _memo, kwargs):
+    items = _freeze_items(obj, _memo)
+    return obj if _is_unchanged(items, obj) else obj._make(items)
+
+
+def _freeze_tuple(obj, _memo, kwargs):
+    items = _freeze_items(obj, _memo)
+    return obj if _is_unchanged(items, obj) else tuple(items)
+
+
+def _freeze_list(obj, _memo, kwargs):
+    return tuple(_freeze_items(obj, _memo))
+
+
+def _freeze_dict(obj, _memo, kwargs):
+    return MappingProxyType(dict(zip(
+        _freeze_items(obj.keys(), _memo),
+        _freeze_items(obj.values(), _memo),
+    )))
+
+
+def _freeze_frozenset(obj, _memo, kwargs):
+    items = _freeze_items(obj, _memo)
+    return obj if _is_unchanged(items, obj) else frozenset(items)
+
+
+def _freeze_set(obj, _memo, kwargs):
+    return frozenset(_freeze_items(obj, _memo))
+
+
+def _freeze_not_implemented(obj, _memo, kwargs):
+    raise NotImplementedError(type(obj))
+
+
+def _pick_freezer(cls: type) -> Callable[[Any, Dict[int, Any], Dict], Any]:
+    'Runs once per type, `freeze` caches the result in `_TYPE_TO_FREEZER`.'
+    if issubclass(cls, (bytes, Enum, float, int, str, type(None))):
+        return _freeze_primitive
+    if hasattr(cls, 'freeze'):
+        return _freeze_custom
+    # This is a lame-o way of identifying `NamedTuple`s. Using `deepfrozen`
+    # would avoid this kludge.
+    if (
+        issubclass(cls, tuple) and hasattr(cls, '_replace') and
+        hasattr(cls, '_fields') and hasattr(cls, '_make')
+    ):
+        return _freeze_namedtuple
+    # Only exact types are reused as-is, subclasses become the base type.
+    if cls is tuple:
+        return _freeze_tuple
+    if issubclass(cls, (list, tuple)):
+        return _freeze_list
+    if issubclass(cls, dict):
+        return _freeze_dict
+    if cls is frozenset:
+        return _freeze_frozenset
+    if issubclass(cls, (set, frozenset)):
+        return _freeze_set
+    return _freeze_not_implemented
+
+
+_TYPE_TO_FREEZER: Dict[type, Callable[[Any, Dict[int, Any], Dict], Any]] = {}
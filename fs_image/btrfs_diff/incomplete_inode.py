@@ -7,10 +7,24 @@ state, and knows how to apply parsed `SendStreamItems` to mutate the state.
 Once the filesystem is done, we will "freeze" it into immutable, hashable,
 easily comparable `Inode` objects, making it a "breeze" to validate it.
 
-IMPORTANT: Keep these objects correctly `deepcopy`able. That is the case at
-the time of writing because:
- - `Extent` is recursively immutable and customizes copy operations to
-   return the original object -- this lets us correctly track clones.
+`Subvolume` snapshots share `IncompleteInode`s with their parent, and use
+`copy.copy` to make a private copy before the first mutation.  That is
+cheap, since we customize `__copy__` to copy just the mutable `xattrs`.
+
+Filesystem images can have millions of inodes, so these objects are kept
+compact:
+ - All classes in the hierarchy declare `__slots__`, so there is no
+   per-instance `__dict__`.
+ - xattr names & small xattr values, owners, and utimes are interned,
+   since an image usually has few distinct ones (think SELinux labels, or
+   the fixed timestamps of a reproducible build).  The interning tables
+   are process-global, so each stops growing once its values take up
+   `_MAX_INTERNED_BYTES`, and stores further new values as-is.
+
+IMPORTANT: Keep these objects correctly `copy`able and `deepcopy`able. That
+is the case at the time of writing because:
+ - `FlatExtent` is immutable and customizes copy operations to return
+   the original object -- this lets us correctly track clones.
  - All other attributes store plain-old-data, or POD immutable classes that
    do not care about object identity.
  - We omit InodeID -- i.e. these objects are **just** the inode's data.
@@ -27,14 +41,56 @@ partly-modified copy, in the style of `NamedTuple._replace`.
 '''
 import itertools
 import stat
+import sys
 
-from typing import Dict, Optional, Sequence
+from typing import Dict, Hashable, Optional, Sequence
 
-from .extent import Extent
+from .extent import FlatExtent
 from .freeze import freeze
 from .inode import Chunk, Inode, InodeOwner, InodeUtimes
 from .parse_dump import SendStreamItem, SendStreamItems
 
+# Interning pays off for short, repetitive values like SELinux labels.  A
+# large xattr value is unlikely to repeat, and would just fill the table.
+_MAX_INTERNED_XATTR_LEN = 256
+# The tables live as long as the process, so this bounds how much memory
+# each one can pin, even for a pathological stream of distinct values.
+_MAX_INTERNED_BYTES = 2 ** 20
+
+
+class _InternTable:
+    'Maps each value to a canonical equal instance, see the module doc.'
+    __slots__ = ('value_to_interned', 'num_bytes')
+
+    def __init__(self):
+        self.value_to_interned: Dict[Hashable, Hashable] = {}
+        self.num_bytes = 0
+
+    def intern(self, value: Hashable) -> Hashable:
+        interned = self.value_to_interned.get(value)
+        if interned is not None:
+            return interned
+        # A shallow estimate, plus one level for the tuples in `utimes`.
+        size = sys.getsizeof(value) + (
+            sum(sys.getsizeof(v) for v in value)
+                if isinstance(value, tuple) else 0
+        )
+        if self.num_bytes + size <= _MAX_INTERNED_BYTES:
+            self.value_to_interned[value] = value
+            self.num_bytes += size
+        return value
+
+
+_XATTR_BYTES = _InternTable()
+_OWNERS = _InternTable()
+_UTIMES = _InternTable()
+
+
+def _intern_xattr_bytes(b: bytes) -> bytes:
+    if len(b) > _MAX_INTERNED_XATTR_LEN:
+        return b
+    return _XATTR_BYTES.intern(b)
+
 
 class IncompleteInode:
     '''
@@ -50,14 +106,31 @@ class IncompleteInode:
     # If any of these are None, the filesystem was created badly.
     # Exception: symlinks don't have permissions.
 
+    __slots__ = ('file_type', 'mode', 'owner', 'utimes', 'xattrs')
+
     def __init__(self, *, item: SendStreamItem):
         assert isinstance(item, self.INITIAL_ITEM)
-        self.file_type = self.FILE_TYPE
+        self.file_type = self._file_type(item)
         self.mode = None
         self.owner = None
         self.utimes = None
         self.xattrs = {}
 
+    def __copy__(self) -> 'IncompleteInode':
+        '''
+        Returns a copy that is safe to mutate independently of `self`.  All
+        other attributes are immutable, so they may be shared.
+        '''
+        ino = object.__new__(type(self))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                setattr(ino, name, getattr(self, name))
+        ino.xattrs = self.xattrs.copy()
+        return ino
+
+    def _file_type(self, item: SendStreamItem) -> int:
+        return self.FILE_TYPE
+
     def freeze(self, *, _memo, chunks: Sequence[Chunk]) -> Inode:
         'Returns a recursively immutable `Inode` based on `self`.'
         # NB: If any freezing bugs turn up in this implementation, consider
@@ -82,7 +155,8 @@ class IncompleteInode:
         if isinstance(item, SendStreamItems.remove_xattr):
             del self.xattrs[item.name]
         elif isinstance(item, SendStreamItems.set_xattr):
-            self.xattrs[item.name] = item.data
+            self.xattrs[_intern_xattr_bytes(item.name)] = \
+                _intern_xattr_bytes(item.data)
         elif isinstance(item, SendStreamItems.chmod):
             if stat.S_IFMT(item.mode) != 0:
                 raise RuntimeError(
@@ -90,13 +164,13 @@ class IncompleteInode:
                 )
             self.mode = item.mode
         elif isinstance(item, SendStreamItems.chown):
-            self.owner = InodeOwner(uid=item.uid, gid=item.gid)
+            self.owner = _OWNERS.intern(InodeOwner(uid=item.uid, gid=item.gid))
         elif isinstance(item, SendStreamItems.utimes):
-            self.utimes = InodeUtimes(
+            self.utimes = _UTIMES.intern(InodeUtimes(
                 ctime=item.ctime,
                 mtime=item.mtime,
                 atime=item.atime,
-            )
+            ))
         else:
             raise RuntimeError(f'{self} cannot apply {item}')
 
@@ -110,19 +184,23 @@ class IncompleteInode:
 
 
 class IncompleteDir(IncompleteInode):
+    __slots__ = ()
+
     FILE_TYPE = stat.S_IFDIR
     INITIAL_ITEM = SendStreamItems.mkdir
 
 
 class IncompleteFile(IncompleteInode):
-    extent: Extent
+    extent: FlatExtent
+
+    __slots__ = ('extent',)
 
     FILE_TYPE = stat.S_IFREG
     INITIAL_ITEM = SendStreamItems.mkfile
 
     def __init__(self, *, item: SendStreamItem):
         super().__init__(item=item)
-        self.extent = Extent.empty()
+        self.extent = FlatExtent.empty()
 
     def _freeze_kwargs(self, *, _memo, chunks: Sequence[Chunk]):
         assert (chunks is None) ^ (self.extent is not None)
@@ -153,7 +231,7 @@ class IncompleteFile(IncompleteInode):
         assert isinstance(item, SendStreamItems.clone)
         if not isinstance(from_ino, IncompleteFile):
             raise RuntimeError(f'Cannot {item} from {from_ino}')
-        # The validation isn't required in the sense that `Extent.clone` is
+        # The validation isn't required in the sense that `FlatExtent.clone` is
         # meant to handle any input appropriately, but it's probably a
         # symptom of incorrect usage, so let's report a more useful error.
         if not (
@@ -183,11 +261,15 @@ class IncompleteFile(IncompleteInode):
 
 
 class IncompleteSocket(IncompleteInode):
+    __slots__ = ()
+
     FILE_TYPE = stat.S_IFSOCK
     INITIAL_ITEM = SendStreamItems.mksock
 
 
 class IncompleteFifo(IncompleteInode):
+    __slots__ = ()
+
     FILE_TYPE = stat.S_IFIFO
     INITIAL_ITEM = SendStreamItems.mkfifo
 
@@ -195,18 +277,23 @@ class IncompleteFifo(IncompleteInode):
 class IncompleteDevice(IncompleteInode):
     dev: int
 
+    __slots__ = ('dev',)
+
     INITIAL_ITEM = SendStreamItems.mknod
 
     def __init__(self, *, item: SendStreamItem):
-        self.FILE_TYPE = stat.S_IFMT(item.mode)
-        if self.FILE_TYPE not in (stat.S_IFBLK, stat.S_IFCHR):
-            raise RuntimeError(f'unexpected device mode in {item}')
         super().__init__(item=item)
         # NB: At present, `btrfs send` redundantly sends a `chmod` after
         # device creation, but we've already saved the file type.
-        self.mode = item.mode & ~self.FILE_TYPE
+        self.mode = item.mode & ~self.file_type
         self.dev = item.dev
 
+    def _file_type(self, item: SendStreamItem) -> int:
+        file_type = stat.S_IFMT(item.mode)
+        if file_type not in (stat.S_IFBLK, stat.S_IFCHR):
+            raise RuntimeError(f'unexpected device mode in {item}')
+        return file_type
+
     def _freeze_kwargs(self, *, _memo, chunks: Sequence[Chunk]):
         return {
             'dev': self.dev,
@@ -217,6 +304,8 @@ class IncompleteDevice(IncompleteInode):
 class IncompleteSymlink(IncompleteInode):
     dest: bytes
 
+    __slots__ = ('dest',)
+
     FILE_TYPE = stat.S_IFLNK
     INITIAL_ITEM = SendStreamItems.symlink
 
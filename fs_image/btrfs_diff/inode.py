@@ -9,6 +9,7 @@ construct, and easy to compare in tests.
 These are used for tests, so they must be compact & reasonably lossless.
 Avoid whitespace when possible, since IncompleteInode uses space separators.
 '''
+import itertools
 import stat
 
 from datetime import datetime
@@ -165,9 +166,11 @@ class Inode(NamedTuple):
             yield ''.join(
                 f'{EXTENT_KIND_TO_ABBREV[c.kind]}{c.length}' + (
                     ('(' + '/'.join(sorted(
-                        repr(cc) for cc in c.chunk_clones
+                        repr(cc) for cc in itertools.chain(
+                            c.chunk_clones, c.chunk_extents,
+                        )
                     )) + ')')
-                        if c.chunk_clones else ''
+                        if c.chunk_clones or c.chunk_extents else ''
                 ) for c in self.chunks
             )
         if self.dev is not None:
@@ -203,13 +206,34 @@ class ChunkClone(NamedTuple):
         return f'{repr(self.clone)}@{self.offset}'
 
 
+class ChunkExtent(NamedTuple):
+    '''
+    The linear-size alternative to `ChunkClone`s: instead of pointing at
+    every other `Chunk` that shares some bytes, each sharer points at the
+    same numbered extent.  See `extents_to_chunks_with_extent_ids`.
+    '''
+    offset: int  # Offset into the `Chunk`
+    extent_id: int  # Deterministic, numbered in order of first appearance
+    extent_offset: int  # Offset into the shared extent
+    length: int
+
+    def __repr__(self):
+        return (
+            f'#{self.extent_id}:{self.extent_offset}+{self.length}'
+            f'@{self.offset}'
+        )
+
+
 class Chunk(NamedTuple):
     kind: Extent.Kind
     length: int
     chunk_clones: Set[ChunkClone]
+    # Only populated by `extents_to_chunks_with_extent_ids`, which in turn
+    # leaves `chunk_clones` empty.
+    chunk_extents: Set[ChunkExtent] = frozenset()
 
     def __repr__(self):
+        refs = [*self.chunk_clones, *self.chunk_extents]
         return f'({self.kind.name}/{self.length}' + (
-            (': ' + ', '.join(repr(c) for c in self.chunk_clones))
-                if self.chunk_clones else ''
+            (': ' + ', '.join(repr(c) for c in refs)) if refs else ''
         ) + ')'
@@ -5,14 +5,26 @@ arbtirarily selected integer inode IDs is unnecessarily hard.  For this
 reason, InodeIDs are tightly integrated with a path mapping, which is used
 to represent the Inode instead of the underlying integer ID, whenever
 possible.
+
+Since `Subvolume` looks up a path for every send-stream item, path handling
+is kept cheap:
+ - `_norm_split_path` is memoized, so a path that is used repeatedly (as
+   in `mkfile`, `write`, `chown`, `chmod`, `utimes`) is normalized and
+   split only once, and its components are shared.
+ - `_InnerInodeIDMap.id_to_reverse_entries` doubles as a directory-entry
+   cache (inode -> parent, name).  It lets us build an inode's path, and
+   find its `_PathEntry`, without splitting or normalizing any paths.
 '''
+import copy
+import functools
 import itertools
 import os
 
-from collections import defaultdict, deque
+from collections import deque
 
 from typing import (
-    Any, Iterator, Mapping, NamedTuple, Optional, Sequence, Set, Tuple,
+    Any, Dict, FrozenSet, Iterator, List, Mapping, NamedTuple, Optional,
+    Sequence, Set, Tuple,
 )
 
 from .freeze import freeze
@@ -25,13 +37,16 @@ def tail(n: int, iterable):
 
 class InodeID(NamedTuple):
     '''
-    IMPORTANT: To support `Subvolume` snapshots, this must be correctly
-    `deepcopy`able in a copy operation that directly includes its
-    `.inner_id_map`.  I mean "directly" in the sense that we must also copy
-    the ground-truth reference to our `InodeIDMap`, i.e.  via the field of
-    `Subvolume`.  In contrast, `deepcopy`ing `InodeID`s without copying the
-    whole map would result in decoupling between those objects, which is
-    incorrect.
+    IMPORTANT: This must be correctly `deepcopy`able in a copy operation
+    that directly includes its `.inner_id_map`.  I mean "directly" in the
+    sense that we must also copy the ground-truth reference to our
+    `InodeIDMap`, i.e.  via the field of `Subvolume`.  In contrast,
+    `deepcopy`ing `InodeID`s without copying the whole map would result in
+    decoupling between those objects, which is incorrect.
+
+    `InodeIDMap` does not store `InodeID`s, it makes them on demand from
+    the underlying integer IDs.  This is what lets `InodeIDMap.snapshot`
+    share its path entries with the parent map.
     '''
     id: int
     # While this field creates some aliasing issues with `deepcopy` (see
@@ -74,14 +89,15 @@ class InodeID(NamedTuple):
         )
 
 
-def _norm_split_path(p: bytes) -> Sequence[bytes]:
+@functools.lru_cache(maxsize=2 ** 16)
+def _norm_split_path(p: bytes) -> Tuple[bytes, ...]:
     # Check explicitly since the downstream errors are incomprehensible.
     if not isinstance(p, bytes):
         raise TypeError(f'Expected bytes, got {p}')
     p = os.path.normpath(p)
     if os.path.isabs(p):
         raise ValueError(f'Need relative path, got {p}')
-    return [] if p == b'.' else p.split(b'/')
+    return () if p == b'.' else tuple(p.split(b'/'))
 
 
 class _ReversePathEntry(NamedTuple):
@@ -109,7 +125,10 @@ class _InnerInodeIDMap(NamedTuple):
     # The key is not an `InodeID` to avoid a circular dependency.  The
     # values correspond to different hardlinks to the same file inode.
     # Directories will always have a single element in the set.
-    id_to_reverse_entries: Mapping[int, Set[_ReversePathEntry]]
+    #
+    # The sets are immutable, and get replaced on update, which lets
+    # snapshots share them.
+    id_to_reverse_entries: Mapping[int, FrozenSet[_ReversePathEntry]]
 
     def _assert_mine(self, inode_id: InodeID) -> InodeID:
         if inode_id.inner_id_map is not self:
@@ -117,12 +136,17 @@ class _InnerInodeIDMap(NamedTuple):
             raise RuntimeError(f'Wrong map for InodeID #{inode_id.id}')
         return inode_id
 
-    def _rev_entry_to_path(self, rev_entry: _ReversePathEntry) -> bytes:
-        # Directories don't have hardlink, so they have just 1 reverese entry
-        parent, = self.id_to_reverse_entries[rev_entry.parent_int_id]
-        if parent != _ROOT_REVERSE_ENTRY:
-            yield from self._rev_entry_to_path(parent)
-        yield rev_entry.name
+    def _rev_entry_to_parts(
+        self, rev_entry: _ReversePathEntry,
+    ) -> List[bytes]:
+        'The path components leading to `rev_entry`, starting at the root.'
+        parts = []
+        while rev_entry != _ROOT_REVERSE_ENTRY:
+            parts.append(rev_entry.name)
+            # Directories don't have hardlinks, so they have 1 reverse entry
+            rev_entry, = self.id_to_reverse_entries[rev_entry.parent_int_id]
+        parts.reverse()
+        return parts
 
     def gen_paths(self, inode_id: InodeID) -> Iterator[bytes]:
         for rev_entry in self.id_to_reverse_entries.get(
@@ -132,11 +156,13 @@ class _InnerInodeIDMap(NamedTuple):
             if rev_entry == _ROOT_REVERSE_ENTRY:
                 yield b'.'
             else:
-                yield b'/'.join(self._rev_entry_to_path(rev_entry))
+                yield b'/'.join(self._rev_entry_to_parts(rev_entry))
 
 
 class _PathEntry(NamedTuple):
-    id: InodeID
+    # An integer, rather than an `InodeID`, so that snapshots of an
+    # `InodeIDMap` can share entries with their parent.
+    id: int
     # `None` -> the entry is a file, a mapping -> it's a directory.
     name_to_child: Optional[Mapping[bytes, '_PathEntry']]
 
@@ -149,47 +175,85 @@ class InodeIDMap(NamedTuple):
 
     Unlike a real filesystem, this does not resolve symlinks.
 
-    IMPORTANT: Keep this object `deepcopy`able for the purpose of
-    snapshotting subvolumes -- it currently has a test to check this, but
-    the test may not catch every kind of copy-related problem.  In
-    particular, because `description` has type `Any`, it can bring
-    `deepcopy` issues -- see the notes on the `deepcopy`ability
-    of `SubvolumeDescription` in `volume.py` to understand the risks.
+    `snapshot()` makes a copy-on-write copy of the map: the directory
+    entries are shared with the parent map until either map needs to
+    mutate them.  The maps are still independent, but a snapshot does not
+    cost time or memory proportional to the size of the filesystem.
+
+    IMPORTANT: Keep this object `deepcopy`able -- it currently has a test
+    to check this, but the test may not catch every kind of copy-related
+    problem.  In particular, because `description` has type `Any`, it can
+    bring `deepcopy` issues -- see the notes on the `deepcopy`ability of
+    `SubvolumeDescription` in `volume.py` to understand the risks.
     '''
     inode_id_counter: Iterator[int]
-    # `_PathEntry.id`s contain references to `self.inner`.
     root: _PathEntry
     # This structure is separated from `self` so that `InodeID`s do NOT have
     # a circular dependency on `InodeIDMap`.  This dependency-factoring is
     # necessary so that our `freeze()` can make a recursively-immutable
     # variant of `InodeIDMap`.
     inner: _InnerInodeIDMap
+    # The directory entries (other than `root`) that are not shared with
+    # any snapshot, and may thus be mutated in place.  Since directories
+    # have no hardlinks, each ID identifies a single `_PathEntry`.
+    owned_dir_ids: Set[int]
+    # Counts the in-place mutations of each directory entry, including any
+    # mutations of its descendants.  Lets callers memoizing on entry
+    # identity, like `SubvolumeFreezer`, see changes.
+    dir_id_to_version: Dict[int, int]
 
     @classmethod
     def new(cls, *, description: Any=''):
-        inner = _InnerInodeIDMap(
-            description=description,
-            id_to_reverse_entries=defaultdict(set),
-        )
         counter = itertools.count()
-        self = cls(
+        root_id = next(counter)
+        return cls(
             inode_id_counter=counter,
-            root=_PathEntry(
-                id=InodeID(id=next(counter), inner_id_map=inner),
-                name_to_child={},
+            root=_PathEntry(id=root_id, name_to_child={}),
+            inner=_InnerInodeIDMap(
+                description=description,
+                id_to_reverse_entries={
+                    root_id: frozenset([_ROOT_REVERSE_ENTRY]),
+                },
             ),
-            inner=inner,
+            owned_dir_ids=set(),
+            dir_id_to_version={},
         )
-        self.inner.id_to_reverse_entries[self.root.id.id].add(
-            _ROOT_REVERSE_ENTRY
+
+    def snapshot(self, *, description: Any=''):
+        '''
+        Returns a copy-on-write copy of `self`, whose `InodeID`s will have
+        the new `description`.  Only the root directory is copied, as are
+        the top-level tables that are indexed by inode ID (these are
+        flat, so the copy is a fast, shallow one).
+        '''
+        # The two maps now share all our directory entries.
+        self.owned_dir_ids.clear()
+        return type(self)(
+            # Like `deepcopy`, this resumes counting from the same place.
+            inode_id_counter=copy.copy(self.inode_id_counter),
+            root=self.root._replace(
+                name_to_child=dict(self.root.name_to_child),
+            ),
+            inner=_InnerInodeIDMap(
+                description=description,
+                id_to_reverse_entries=dict(self.inner.id_to_reverse_entries),
+            ),
+            owned_dir_ids=set(),
+            dir_id_to_version={},
         )
-        return self
 
     def freeze(self, *, _memo):
-        'Returns a recursively immutable copy of `self`.'
+        '''
+        Returns a recursively immutable copy of `self`.  Nothing mutates a
+        frozen map, so it has none of the copy-on-write bookkeeping.
+        '''
         return self._make(
             freeze(i, _memo=_memo)  # can't add IDs once frozen
-                for i in self._replace(inode_id_counter=None)
+                for i in self._replace(
+                    inode_id_counter=None,
+                    owned_dir_ids=frozenset(),
+                    dir_id_to_version={},
+                )
         )
 
     def next(self) -> InodeID:
@@ -197,27 +261,56 @@ class InodeIDMap(NamedTuple):
             id=next(self.inode_id_counter), inner_id_map=self.inner,
         )
 
-    def _gen_entries(self, parts: Sequence[bytes]) -> Iterator[_PathEntry]:
+    def _gen_entries_for_write(
+        self, parts: Sequence[bytes],
+    ) -> Iterator[_PathEntry]:
+        '''
+        Any yielded directory entry may be mutated, since we first replace
+        the ones that we share with a snapshot by copies.  Read-only
+        lookups should use the faster `_get_entry`.
+        '''
         entry = self.root
         yield entry
         for name in parts:
             if entry.name_to_child is None:
                 raise RuntimeError(f"{name}'s parent in {parts} is a file")
-            entry = entry.name_to_child.get(name)
+            child = entry.name_to_child.get(name)
+            if (
+                child is not None
+                and child.name_to_child is not None
+                and child.id not in self.owned_dir_ids
+            ):
+                child = child._replace(name_to_child=dict(child.name_to_child))
+                entry.name_to_child[name] = child
+                self.owned_dir_ids.add(child.id)
+            entry = child
             yield entry
             if entry is None:
                 # The path is missing some ancestors -- our callers handle
                 # this differently.  A last value of `None` is a sentinel.
                 break
 
+    def _bump_dir_versions(self, int_id: int) -> None:
+        'Call after mutating directory `int_id`, see `dir_id_to_version`.'
+        while True:
+            self.dir_id_to_version[int_id] = \
+                self.dir_id_to_version.get(int_id, 0) + 1
+            reverse_entry, = self.inner.id_to_reverse_entries[int_id]
+            if reverse_entry == _ROOT_REVERSE_ENTRY:
+                return
+            int_id = reverse_entry.parent_int_id
+
     def _get_parts_parent_and_entry(
         self, path: bytes,
     ) -> Tuple[_PathEntry, _PathEntry]:
-        'Contract: never call this on the root, aka empty `parts`'
+        '''
+        Contract: never call this on the root, aka empty `parts`.  The
+        parent is safe to mutate.
+        '''
         parts = _norm_split_path(path)
         if not parts:
             raise RuntimeError(f'Cannot remove the root path')
-        parent, entry = tail(2, self._gen_entries(parts))
+        parent, entry = tail(2, self._gen_entries_for_write(parts))
         if entry is None:
             raise RuntimeError(f'Cannot remove non-existent {path}')
         return parts, parent, entry
@@ -227,28 +320,30 @@ class InodeIDMap(NamedTuple):
     # to a file, which would unnecessarily complicate our implementation.
 
     def add_file(self, ino_id: InodeID, path: bytes) -> InodeID:
-        self._add_path(_PathEntry(id=ino_id, name_to_child=None), path)
+        self.inner._assert_mine(ino_id)
+        self._add_path(_PathEntry(id=ino_id.id, name_to_child=None), path)
         return ino_id
 
     def add_dir(self, ino_id: InodeID, path: bytes) -> InodeID:
-        self._add_path(_PathEntry(id=ino_id, name_to_child={}), path)
+        self.inner._assert_mine(ino_id)
+        self._add_path(_PathEntry(id=ino_id.id, name_to_child={}), path)
+        self.owned_dir_ids.add(ino_id.id)
         return ino_id
 
     def _add_path(self, entry: _PathEntry, path: bytes) -> None:
-        self.inner._assert_mine(entry.id)
-
         # Block an ID from being added as both a file and a directory, ban
         # directory hardlinks.
-        for prev_path in self.inner.gen_paths(entry.id):
+        for prev_path in self.inner.gen_paths(self._inode_id(entry.id)):
             prev_entry = self._get_entry(prev_path)
             if (entry.name_to_child, prev_entry.name_to_child) != (None, None):
                 raise RuntimeError(
-                    f'Tried to add non-file hardlink for {entry.id}'
+                    'Tried to add non-file hardlink for '
+                    f'{self._inode_id(entry.id)}'
                 )
             break  # It's enough to check 1 entry
 
         parts = _norm_split_path(path)
-        parent, = tail(1, self._gen_entries(parts[:-1]))
+        parent, = tail(1, self._gen_entries_for_write(parts[:-1]))
         if parent is None:
             raise RuntimeError(f'Missing ancestor for {path}')
         if parent.name_to_child is None:
@@ -257,23 +352,29 @@ class InodeIDMap(NamedTuple):
         old = parent.name_to_child.get(parts[-1])
         if old is not None:
             raise RuntimeError(
-                f'Adding #{entry.id.id} to {path} which has #{old.id.id}'
+                f'Adding #{entry.id} to {path} which has #{old.id}'
             )
 
-        reverse_parent = self.inner.id_to_reverse_entries.get(parent.id.id)
-        assert isinstance(reverse_parent, set) and len(reverse_parent) == 1
+        reverse_parent = self.inner.id_to_reverse_entries.get(parent.id)
+        assert isinstance(reverse_parent, frozenset)
+        assert len(reverse_parent) == 1
 
         parent.name_to_child[parts[-1]] = entry
-        self.inner.id_to_reverse_entries[entry.id.id].add(_ReversePathEntry(
-            name=parts[-1],
-            parent_int_id=parent.id.id,
-        ))
+        self.inner.id_to_reverse_entries[entry.id] = (
+            self.inner.id_to_reverse_entries.get(entry.id, frozenset())
+            | {_ReversePathEntry(name=parts[-1], parent_int_id=parent.id)}
+        )
+        self._bump_dir_versions(parent.id)
 
     def remove_path(self, path: bytes) -> InodeID:
         _parts, parent, entry = self._get_parts_parent_and_entry(path)
         if entry.name_to_child:
             raise RuntimeError(f'Cannot remove {path} since it has children')
-        return self._remove_path_unsafe(path).id
+        self._remove_path_unsafe(path)
+        # IDs are never reused, so a removed directory is gone for good.
+        # Not so for `rename_path`, which must keep counting versions.
+        self.dir_id_to_version.pop(entry.id, None)
+        return self._inode_id(entry.id)
 
     def _reverse_entry_matches_path_parts(
         self, reverse_entry: _ReversePathEntry, parts: Sequence[bytes]
@@ -286,7 +387,8 @@ class InodeIDMap(NamedTuple):
             reverse_entry = self.inner.id_to_reverse_entries.get(
                 reverse_entry.parent_int_id
             )
-            assert isinstance(reverse_entry, set) and len(reverse_entry) == 1
+            assert isinstance(reverse_entry, frozenset)
+            assert len(reverse_entry) == 1
             reverse_entry, = reverse_entry
         # Since `parts` never has a component corresponding to the root
         # inode, if we got this far, it must be that all of `parts` had a
@@ -318,11 +420,14 @@ class InodeIDMap(NamedTuple):
         parts, parent, entry = self._get_parts_parent_and_entry(path)
 
         del parent.name_to_child[parts[-1]]
+        self._bump_dir_versions(parent.id)
 
-        entries = self.inner.id_to_reverse_entries[entry.id.id]
-        entries.remove(self._matching_reverse_path_entry(entries, parts))
-        if not entries:
-            del self.inner.id_to_reverse_entries[entry.id.id]
+        entries = self.inner.id_to_reverse_entries[entry.id]
+        entries = entries - {self._matching_reverse_path_entry(entries, parts)}
+        if entries:
+            self.inner.id_to_reverse_entries[entry.id] = entries
+        else:
+            del self.inner.id_to_reverse_entries[entry.id]
 
         return entry
 
@@ -341,8 +446,19 @@ class InodeIDMap(NamedTuple):
             self._add_path(entry, src)
             raise
 
-    def _get_entry(self, path: bytes) -> _PathEntry:
-        entry, = tail(1, self._gen_entries(_norm_split_path(path)))
+    def _inode_id(self, int_id: int) -> InodeID:
+        return InodeID(id=int_id, inner_id_map=self.inner)
+
+    def _get_entry(self, path: bytes) -> Optional[_PathEntry]:
+        'Returns None if `path` does not exist.'
+        parts = _norm_split_path(path)
+        entry = self.root
+        for name in parts:
+            if entry.name_to_child is None:
+                raise RuntimeError(f"{name}'s parent in {parts} is a file")
+            entry = entry.name_to_child.get(name)
+            if entry is None:
+                break
         return entry
 
     def get_id(self, path: bytes) -> Optional[InodeID]:
@@ -351,7 +467,7 @@ class InodeIDMap(NamedTuple):
         contains a file as a non-final component.
         '''
         entry = self._get_entry(path)
-        return None if entry is None else entry.id
+        return None if entry is None else self._inode_id(entry.id)
 
     def get_paths(self, inode_id: InodeID) -> Set[bytes]:
         return set(self.inner.gen_paths(inode_id))
@@ -361,12 +477,18 @@ class InodeIDMap(NamedTuple):
         Returns None if the is a file, raises if the path contains a file as
         a non-final component.
         '''
-        paths = list(self.inner.gen_paths(inode_id))
-        if len(paths) > 1:  # Directories have 1 path, 0 paths is an error
+        rev_entries = self.inner.id_to_reverse_entries[
+            self.inner._assert_mine(inode_id).id
+        ]
+        if len(rev_entries) > 1:  # Directories have 1 path
             return None  # A file
-        path, = paths
-        entry = self._get_entry(path)  # Not None since we started from InodeID
-        return None if entry.name_to_child is None else {
-            os.path.normpath(os.path.join(path, name))
-                for name in entry.name_to_child
-        }
+        rev_entry, = rev_entries
+        # Walk down the reverse entry's path, which is already normalized.
+        parts = self.inner._rev_entry_to_parts(rev_entry)
+        entry = self.root
+        for name in parts:
+            entry = entry.name_to_child[name]
+        if entry.name_to_child is None:
+            return None
+        prefix = b''.join(name + b'/' for name in parts)
+        return {prefix + name for name in entry.name_to_child}
@@ -53,11 +53,14 @@ Limitations of `btrfs receive --dump` (filed as T25376790):
    unravel the source of a clone when more than one source is in use.
 '''
 import datetime
+import functools
 import os
 import re
 
 from collections import OrderedDict
-from typing import Any, BinaryIO, Dict, Iterable, Optional, Pattern
+from typing import (
+    Any, BinaryIO, Callable, Dict, Iterable, Optional, Pattern, Tuple,
+)
 
 from .send_stream import SendStreamItem, SendStreamItems
 
@@ -89,9 +92,11 @@ _ESCAPED_TO_UNESCAPED = OrderedDict([
 #           fillvalue=(None, None),
 #       )
 #   ))
-_ESCAPED_REGEX = re.compile(
-    b'|'.join(re.escape(e) for e in _ESCAPED_TO_UNESCAPED)
-)
+# One alternative per escape sequence would make a 266-way alternation that
+# is tried at every backslash.  All the sequences are a backslash followed
+# by either one character, or by three octal digits, so this is equivalent.
+_ESCAPED_REGEX = re.compile(br'\\(?:[abefnrtv \\]|[0-3][0-7]{2})')
+assert all(_ESCAPED_REGEX.fullmatch(e) for e in _ESCAPED_TO_UNESCAPED)
 
 
 def unquote_btrfs_progs_path(s):
@@ -102,6 +107,8 @@ def unquote_btrfs_progs_path(s):
     custom un-quoting function.  Future: fix `btrfs-progs` so that other
     fields (paths & data) are quoted too.
     '''
+    if b'\\' not in s:  # Fast path: most paths have no escapes
+        return s
     return _ESCAPED_REGEX.sub(lambda m: _ESCAPED_TO_UNESCAPED[m.group(0)], s)
 
 
@@ -109,33 +116,63 @@ class RegexItemParser:
     'Almost all item types can be parsed with a single regex.'
 
     regex: Pattern = re.compile(b'')
+    # Computed once per subclass from the `conv_*` attributes, see below.
+    _field_convs: Tuple[Tuple[str, Callable, Callable], ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Handle `conv_FIELD_NAME` class methods for converting fields.
+        # These take a single positional argument, and handle most cases.
+        #
+        # We currently only use `context_conv_FIELD_NAME` when a detail
+        # field needs to know the subvolume name, see e.g. `clone`.
+        #
+        # Looking these up here, rather than for each parsed item, keeps
+        # the per-item work down to the fields that need converting.
+        cls._field_convs = tuple(
+            (
+                k,
+                getattr(cls, f'conv_{k}', _identity),
+                getattr(cls, f'context_conv_{k}', _context_identity),
+            ) for k in cls.regex.groupindex
+                if hasattr(cls, f'conv_{k}')
+                    or hasattr(cls, f'context_conv_{k}')
+        )
 
     @classmethod
     def parse_details(
         cls, subvol_name: bytes, details: bytes,
     ) -> Optional[Dict[str, Any]]:
         m = cls.regex.fullmatch(details)
-        return {
-            # Handle `conv_FIELD_NAME` class methods for converting fields.
-            # These take a single positional argument, and handle most
-            # cases.
-            #
-            # We currently only use `context_conv_FIELD_NAME` when a detail
-            # field needs to know the subvolume name, see e.g. `clone`.
-            k: getattr(
-                cls, f'context_conv_{k}', lambda value, subvol_name: value
-            )(
-                getattr(cls, f'conv_{k}', lambda x: x)(v),
-                subvol_name=subvol_name,
-            )
-                for k, v in m.groupdict().items()
-        } if m else None
+        if not m:
+            return None
+        fields = m.groupdict()
+        for k, conv, context_conv in cls._field_convs:
+            fields[k] = context_conv(conv(fields[k]), subvol_name=subvol_name)
+        return fields
+
+
+def _identity(value):
+    return value
+
+
+def _context_identity(value, *, subvol_name: bytes):
+    return value
 
 
 def _normalize_subvolume_path(s: bytes, *, subvol_name: bytes) -> bytes:
     # `normpath` is needed since `btrfs receive --dump` is inconsistent
     # about trailing slashes on directory paths.
-    stripped = os.path.relpath(s, subvol_name)
+    #
+    # For relative paths, this is what `relpath` computes, but without its
+    # two `abspath` calls, which dominated the runtime of this parser.
+    normalized = os.path.normpath(s)
+    if normalized == subvol_name:
+        stripped = b'.'
+    elif normalized.startswith(subvol_name + b'/'):
+        stripped = normalized[len(subvol_name) + 1:]
+    else:
+        stripped = os.path.relpath(s, subvol_name)
     if len(stripped) >= len(s) or stripped.startswith(b'..'):
         raise RuntimeError(f'{s} did not start with {subvol_name}')
     return stripped
@@ -145,6 +182,14 @@ def _from_octal(s: bytes) -> int:
     return int(s, base=8)
 
 
+# Many items in a dump share timestamps, and `strptime` is slow.
+@functools.lru_cache(maxsize=1024)
+def _from_dump_time(t: bytes) -> Tuple[int, int]:
+    return (int(datetime.datetime.strptime(
+        t.decode(), '%Y-%m-%dT%H:%M:%S%z'
+    ).timestamp()), 0)  # --dump discards nanoseconds
+
+
 class SendStreamItemParsers:
     '''
     This class exists to group its inner classes, see NAME_TO_PARSER_TYPE.
@@ -306,14 +351,9 @@ class SendStreamItemParsers:
             br'ctime=(?P<ctime>[^ ]+)'
         )
 
-        @classmethod
-        def conv_atime(cls, t: bytes) -> float:
-            return (int(datetime.datetime.strptime(
-                t.decode(), '%Y-%m-%dT%H:%M:%S%z'
-            ).timestamp()), 0)  # --dump discards nanoseconds
-
-        conv_mtime = conv_atime
-        conv_ctime = conv_atime
+        conv_atime = staticmethod(_from_dump_time)
+        conv_mtime = staticmethod(_from_dump_time)
+        conv_ctime = staticmethod(_from_dump_time)
 
     # This is used instead of `write` when `btrfs send --no-data` is used.
     class update_extent(RegexItemParser):
@@ -335,27 +375,33 @@ NAME_TO_ITEM_TYPE = {
 }
 assert set(NAME_TO_PARSER_TYPE.keys()) == set(NAME_TO_ITEM_TYPE.keys())
 
+# Dispatches on the item name in a `--dump` line.
+_NAME_TO_ITEM_TYPE_AND_PARSE_FN = {
+    name: (item_type, NAME_TO_PARSER_TYPE[name].parse_details)
+        for name, item_type in NAME_TO_ITEM_TYPE.items()
+}
+# This parser maps `write` to `update_extent` regardless of whether the
+# send-stream used `--no-data` or not.  The reason is that `btrfs receive
+# --dump` never displays the `data` field (because it can be huge, and not
+# very illuminating to the user).
+_NAME_TO_ITEM_TYPE_AND_PARSE_FN[b'write'] = \
+    _NAME_TO_ITEM_TYPE_AND_PARSE_FN[b'update_extent']
+
+_LINE_REGEX = re.compile(br'([^ ]+) +((?:\\ |[^ ])+) *(.*)\n')
+
 
 def parse_btrfs_dump(binary_infile: BinaryIO) -> Iterable[SendStreamItem]:
-    reg = re.compile(br'([^ ]+) +((\\ |[^ ])+) *(.*)\n')
     subvol_name = None
     for l in binary_infile:
-        m = reg.fullmatch(l)
+        m = _LINE_REGEX.fullmatch(l)
         if not m:
             raise RuntimeError(f'line has unexpected format: {repr(l)}')
-        item_name, path, _, details = m.groups()
-
-        # This parser maps `write` to `update_extent` regardless of whether
-        # the send-stream used `--no-data` or not.  The reason is that
-        # `btrfs receive --dump` never displays the `data` field (because it
-        # can be huge, and not very illuminating to the user).
-        if item_name == b'write':
-            item_name = b'update_extent'
+        item_name, path, details = m.groups()
 
-        item_class = NAME_TO_ITEM_TYPE.get(item_name)
-        if not item_class:
+        item_type_and_parse_fn = _NAME_TO_ITEM_TYPE_AND_PARSE_FN.get(item_name)
+        if not item_type_and_parse_fn:
             raise RuntimeError(f'unknown item type {item_name} in {repr(l)}')
-        item_parser = NAME_TO_PARSER_TYPE[item_name]
+        item_class, parse_details = item_type_and_parse_fn
 
         # We MUST unquote here, or paths in field 1 will not be comparable
         # with as-of-now unquoted paths in the other fields.  For example,
@@ -380,7 +426,7 @@ def parse_btrfs_dump(binary_infile: BinaryIO) -> Iterable[SendStreamItem]:
                 unnormalized_path, subvol_name=subvol_name,
             )
 
-        fields = item_parser.parse_details(subvol_name, details)
+        fields = parse_details(subvol_name, details)
         if fields is None:
             raise RuntimeError(f'unexpected format in line details: {repr(l)}')
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''
+Measures the throughput of `parse_btrfs_dump`.  The input is the gold
+`btrfs receive --dump` of the `create_ops` demo send-stream, repeated
+`--repetitions` times (the `subvol` line only occurs once), with an extra
+`mkfile` of an escape-heavy path in each repetition.  The default makes
+about 92k lines, or 8 MB.
+
+This only uses `parse_btrfs_dump`, so to compare with an older
+implementation, run the same command from an older checkout.  Run from
+`fs_image`:
+
+buck run .../btrfs_diff:parse-dump-benchmark -- --repetitions 1000
+'''
+import io
+import time
+
+from typing import Iterator
+
+from .parse_dump import parse_btrfs_dump
+
+# Has every kind of escape that `btrfs receive --dump` emits.
+_ESCAPE_HEAVY_NAME = (
+    br'esc\ \a\b\e\f\n\r\t\v\\' +
+    b''.join(b'\\%03o' % c for c in b'\x01\x7f\xe2\x98\x83') +
+    br'\ tail'
+)
+
+
+def gen_dump_lines(repetitions: int) -> Iterator[bytes]:
+    from .tests.demo_sendstreams import gold_demo_sendstreams
+    first_line, *lines = gold_demo_sendstreams()['create_ops']['dump']
+    yield first_line + b'\n'
+    for i in range(repetitions):
+        for line in lines:
+            yield line + b'\n'
+        yield b'mkfile          ./create_ops/%s%d\n' % (_ESCAPE_HEAVY_NAME, i)
+
+
+def parse_dump_benchmark(*, repetitions: int) -> dict:
+    dump = b''.join(gen_dump_lines(repetitions))
+    start_time = time.monotonic()
+    num_items = sum(1 for _ in parse_btrfs_dump(io.BytesIO(dump)))
+    seconds = time.monotonic() - start_time
+    return {
+        'lines': dump.count(b'\n'),
+        'megabytes': round(len(dump) / 2 ** 20, 1),
+        'items': num_items,
+        'seconds': round(seconds, 3),
+        'lines_per_second': round(dump.count(b'\n') / seconds, 1),
+    }
+
+
+# Not unit-tested, it is a tool for measuring `parse_dump.py`.
+if __name__ == '__main__':  # pragma: no cover
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        '--repetitions', type=int, default=1000,
+        help='How many times to repeat the demo dump.',
+    )
+    opts = parser.parse_args()
+
+    print(json.dumps(
+        parse_dump_benchmark(repetitions=opts.repetitions), indent=4,
+    ))
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 'Parses the btrfs send-stream binary format. Only version 1 is supported.'
 import enum
+import itertools
+import mmap
 import os
 import struct
 import uuid
 
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
-from typing import NamedTuple, Iterable
+from typing import Iterable, Iterator, NamedTuple, Optional, Sequence, Tuple
 
+from .btrfs_crc32c import btrfs_crc32c
 from .send_stream import SendStreamItem, SendStreamItems
 
 BTRFS_SEND_STREAM_MAGIC = b'btrfs-stream\0'
@@ -123,8 +127,13 @@ class AttributeHeader(NamedTuple):
         return AttributeHeader(kind=AttributeKind(kind), length=length)
 
 
+_COMMAND_HEADER = struct.Struct('<IHI')
+_ATTRIBUTE_HEADER = struct.Struct('<HH')
+
+
 def conv_uuid(s: bytes) -> str:
-    return str(uuid.UUID(bytes=s)).encode()  # All our other strings are bytes
+    # All our other strings are bytes
+    return str(uuid.UUID(bytes=bytes(s))).encode()
 
 
 def conv_uint64(s: bytes) -> int:
@@ -136,70 +145,153 @@ def conv_time(s: bytes) -> float:
     return struct.unpack('<QI', s)
 
 
+def _conv_path(s: bytes) -> bytes:
+    return os.path.normpath(bytes(s))
+
+
+# Indexed by the integer value of `AttributeKind`, so that the parse loop
+# can dispatch without constructing an enum per attribute.  Every converter
+# accepts any bytes-like object, including `memoryview` slices.
+_ATTRIBUTE_KIND_TO_CONV = {
+    kind.value: (kind, conv) for kind, conv in [
+        (AttributeKind.UUID, conv_uuid),
+        (AttributeKind.CTRANSID, conv_uint64),
+        (AttributeKind.INO, conv_uint64),
+        (AttributeKind.SIZE, conv_uint64),
+        (AttributeKind.MODE, conv_uint64),
+        (AttributeKind.UID, conv_uint64),
+        (AttributeKind.GID, conv_uint64),
+        (AttributeKind.RDEV, conv_uint64),
+        (AttributeKind.CTIME, conv_time),
+        (AttributeKind.MTIME, conv_time),
+        (AttributeKind.ATIME, conv_time),
+        (AttributeKind.XATTR_NAME, bytes),
+        (AttributeKind.XATTR_DATA, bytes),
+        (AttributeKind.PATH, _conv_path),
+        (AttributeKind.PATH_TO, _conv_path),
+        # NB This is NOT normalized since we don't want to normalize symlinks
+        (AttributeKind.PATH_LINK, bytes),
+        (AttributeKind.FILE_OFFSET, conv_uint64),
+        # Not copied: `parse_send_stream_buffer` leaves this as a view.
+        (AttributeKind.DATA, lambda s: s),
+        (AttributeKind.CLONE_UUID, conv_uuid),
+        (AttributeKind.CLONE_CTRANSID, conv_uint64),
+        (AttributeKind.CLONE_PATH, _conv_path),
+        (AttributeKind.CLONE_OFFSET, conv_uint64),
+        (AttributeKind.CLONE_LEN, conv_uint64),
+    ]
+}
+assert set(AttributeKind) == {k for k, _ in _ATTRIBUTE_KIND_TO_CONV.values()}
+
+
 def read_attribute(infile):
     attr_header = AttributeHeader.from_file(infile)
     attr_data = infile.read(attr_header.length)
     if len(attr_data) != attr_header.length:
         raise RuntimeError(f'{attr_header} got {len(attr_data)} bytes')
+    kind, conv = _ATTRIBUTE_KIND_TO_CONV[attr_header.kind.value]
+    return kind, conv(attr_data)
 
-    if attr_header.kind == AttributeKind.UUID:
-        return attr_header.kind, conv_uuid(attr_data)
-    elif attr_header.kind == AttributeKind.CTRANSID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.INO:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.SIZE:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.MODE:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.UID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.GID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.RDEV:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CTIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.MTIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.ATIME:
-        return attr_header.kind, conv_time(attr_data)
-    elif attr_header.kind == AttributeKind.XATTR_NAME:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.XATTR_DATA:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.PATH:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.PATH_TO:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.PATH_LINK:
-        # NB This is NOT normalized since we don't want to normalize symlinks
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.FILE_OFFSET:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.DATA:
-        return attr_header.kind, attr_data
-    elif attr_header.kind == AttributeKind.CLONE_UUID:
-        return attr_header.kind, conv_uuid(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_CTRANSID:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_PATH:
-        return attr_header.kind, os.path.normpath(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_OFFSET:
-        return attr_header.kind, conv_uint64(attr_data)
-    elif attr_header.kind == AttributeKind.CLONE_LEN:
-        return attr_header.kind, conv_uint64(attr_data)
-
-    raise RuntimeError(f'Fix me: unhandled {attr_header}')  # pragma: no cover
-
-
-def read_command(infile):
+
+_SKIP_CHUNK_SIZE = 2 ** 16
+
+
+def _skip_bytes(infile, length: int) -> None:
+    'Advances `infile` by `length` bytes without retaining them.'
+    if infile.seekable():
+        infile.seek(length, os.SEEK_CUR)
+        return
+    while length > 0:  # Pipes cannot seek, so read in bounded pieces.
+        b = infile.read(min(length, _SKIP_CHUNK_SIZE))
+        if not b:
+            raise RuntimeError(f'Stream ended with {length} bytes to skip')
+        length -= len(b)
+
+
+def _read_write_attributes_skipping_data(infile, cmd_header: CommandHeader):
+    '''
+    Reads the attributes of a `WRITE` command one at a time, skipping the
+    body of `DATA`, which is replaced by its length.
+    '''
+    kind_to_attr = {}
+    remaining = cmd_header.length
+    while remaining > 0:
+        attr_header = AttributeHeader.from_file(infile)
+        remaining -= _ATTRIBUTE_HEADER.size + attr_header.length
+        if remaining < 0:
+            raise RuntimeError(f'{attr_header} overflows {cmd_header}')
+        if attr_header.kind in kind_to_attr:
+            raise RuntimeError(
+                f'{attr_header.kind} occurred twice in {cmd_header}'
+            )
+        if attr_header.kind == AttributeKind.DATA:
+            _skip_bytes(infile, attr_header.length)
+            kind_to_attr[attr_header.kind] = attr_header.length
+            continue
+        attr_data = infile.read(attr_header.length)
+        if len(attr_data) != attr_header.length:
+            raise RuntimeError(f'{attr_header} got {len(attr_data)} bytes')
+        _kind, conv = _ATTRIBUTE_KIND_TO_CONV[attr_header.kind.value]
+        kind_to_attr[attr_header.kind] = conv(attr_data)
+    return kind_to_attr
+
+
+def _header_crc(cmd_header: CommandHeader) -> int:
+    'The CRC of the command header with its `crc` field set to 0'
+    return btrfs_crc32c(_COMMAND_HEADER.pack(
+        cmd_header.length, cmd_header.kind.value, 0,
+    ))
+
+
+def _check_crc(cmd_header: CommandHeader, crc: int) -> None:
+    if crc != cmd_header.crc:
+        raise RuntimeError(f'{cmd_header} has bad CRC {crc}')
+
+
+class _CRCReader:
+    'Checksums everything read from `infile`. Cannot seek, by design.'
+
+    def __init__(self, infile, crc: int):
+        self.infile = infile
+        self.crc = crc
+
+    def read(self, size: int) -> bytes:
+        b = self.infile.read(size)
+        self.crc = btrfs_crc32c(b, self.crc)
+        return b
+
+    def seekable(self) -> bool:
+        return False
+
+
+def read_command(infile, *, skip_data: bool=False, check_crc: bool=False):
+    '''
+    With `skip_data`, `WRITE` commands become `update_extent` items, just as
+    with `btrfs send --no-data`, and their `DATA` is never read into RAM.
+
+    With `check_crc`, raises if the command's CRC32C does not match.
+    '''
     cmd_header = CommandHeader.from_file(infile)
 
+    if skip_data and cmd_header.kind == CommandKind.WRITE:
+        if check_crc:
+            # `DATA` is still checksummed, but only in bounded pieces.
+            reader = _CRCReader(infile, _header_crc(cmd_header))
+            kind_to_attr = _read_write_attributes_skipping_data(
+                reader, cmd_header,
+            )
+            _check_crc(cmd_header, reader.crc)
+        else:
+            kind_to_attr = _read_write_attributes_skipping_data(
+                infile, cmd_header,
+            )
+        return _item_from_attributes(cmd_header, kind_to_attr, skip_data=True)
+
     s = infile.read(cmd_header.length)
     if len(s) != cmd_header.length:
         raise RuntimeError(f'{cmd_header} got {len(s)} bytes')
-    # Future: pull in the `crc32c` module and check the CRC.
+    if check_crc:
+        _check_crc(cmd_header, btrfs_crc32c(s, _header_crc(cmd_header)))
 
     attr_bytes = BytesIO(s)
     kind_to_attr = {}
@@ -209,6 +301,16 @@ def read_command(infile):
             raise RuntimeError(f'{kind} occurred twice in {cmd_header}')
         kind_to_attr[kind] = attr
 
+    return _item_from_attributes(cmd_header, kind_to_attr)
+
+
+def _item_from_attributes(
+    cmd_header: CommandHeader, kind_to_attr, *, skip_data: bool=False,
+):
+    '''
+    Returns None for END, otherwise the `SendStreamItem` for the command.
+    With `skip_data`, `kind_to_attr` maps `DATA` to its length.
+    '''
     if cmd_header.kind == CommandKind.SUBVOL:
         return SendStreamItems.subvol(
             path=kind_to_attr[AttributeKind.PATH],
@@ -257,6 +359,12 @@ def read_command(infile):
         return SendStreamItems.unlink(path=kind_to_attr[AttributeKind.PATH])
     elif cmd_header.kind == CommandKind.RMDIR:
         return SendStreamItems.rmdir(path=kind_to_attr[AttributeKind.PATH])
+    elif cmd_header.kind == CommandKind.WRITE and skip_data:
+        return SendStreamItems.update_extent(
+            path=kind_to_attr[AttributeKind.PATH],
+            offset=kind_to_attr[AttributeKind.FILE_OFFSET],
+            len=kind_to_attr[AttributeKind.DATA],
+        )
     elif cmd_header.kind == CommandKind.WRITE:
         return SendStreamItems.write(
             path=kind_to_attr[AttributeKind.PATH],
@@ -319,11 +427,359 @@ def read_command(infile):
     raise AssertionError(f'Fix me: unhandled {cmd_header}')  # pragma: no cover
 
 
-def parse_send_stream(infile) -> Iterable[SendStreamItem]:
+def parse_send_stream(
+    infile, *, skip_data: bool=False, check_crc: bool=False,
+) -> Iterable[SendStreamItem]:
+    '''
+    Pass `skip_data=True` if you only need extent geometry, not file bytes.
+    Then, each `write` is emitted as an `update_extent` carrying just the
+    offset & length, and the data is skipped (via `seek` if possible), so
+    memory use does not depend on the amount of file data in the stream.
+
+    Pass `check_crc=True` to raise on corrupted commands, instead of
+    producing confusing errors further downstream.  To validate a whole
+    file before parsing it, `verify_send_stream_crcs` is faster.
+    '''
     check_magic(infile)
     check_version(infile)
+    yield from _gen_commands(infile, skip_data=skip_data, check_crc=check_crc)
+
+
+def _gen_commands(infile, **kwargs) -> Iterator[SendStreamItem]:
+    'Yields the items following the stream header, up to the END command.'
     while True:
-        cmd = read_command(infile)
+        cmd = read_command(infile, **kwargs)
         if cmd is None:
             return
         yield cmd
+
+
+def parse_send_streams(
+    infile, **kwargs,
+) -> Iterator[Tuple[int, SendStreamItem]]:
+    '''
+    Handles any number of send-streams concatenated in `infile`, which may
+    be a pipe.  Every send-stream finishes with an END command, after which
+    we expect either the next stream's magic, or the end of the input.
+
+    Yields `(index of the send-stream, item)`.  The items of each stream
+    are the same as `parse_send_stream(infile, **kwargs)` would produce.
+
+    To jump to a specific send-stream in a seekable file without parsing
+    the preceding ones, see `index_send_streams`.
+    '''
+    for stream_idx in itertools.count():
+        magic = infile.read(len(BTRFS_SEND_STREAM_MAGIC))
+        if stream_idx and not magic:
+            return
+        check_magic(BytesIO(magic))
+        check_version(infile)
+        for item in _gen_commands(infile, **kwargs):
+            yield stream_idx, item
+
+
+class SendStreamIndexEntry(NamedTuple):
+    '''
+    Byte offsets into a file of concatenated send-streams. Seek to
+    `offset`, and `parse_send_stream` will read exactly this stream.
+    '''
+    offset: int  # Where this stream's magic starts
+    # Where each command header starts, the last one is always END
+    command_offsets: Sequence[int]
+    end: int  # One past the END command, i.e. the next stream's `offset`
+
+
+def index_send_streams(infile) -> Sequence[SendStreamIndexEntry]:
+    '''
+    Scans a seekable file of concatenated send-streams, reading only the
+    command headers, and seeking past the payloads.  Starts at the current
+    file position.  For example, to parse just the last of 50 layers:
+
+        index = index_send_streams(infile)
+        infile.seek(index[-1].offset)
+        items = list(parse_send_stream(infile))
+    '''
+    return [
+        SendStreamIndexEntry(
+            offset=offset,
+            command_offsets=tuple(o for o, _ in offsets_and_headers),
+            end=end,
+        ) for offset, offsets_and_headers, end in _gen_stream_headers(infile)
+    ]
+
+
+def parse_send_stream_buffer(
+    buf, *, skip_data: bool=False, check_crc: bool=False,
+) -> Iterable[SendStreamItem]:
+    '''
+    Yields the same items as `parse_send_stream`, but reads from an
+    in-memory buffer, e.g. `bytes` or an `mmap` of the send-stream file:
+
+        with open(path, 'rb') as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ,
+        ) as m:
+            for item in parse_send_stream_buffer(m):
+                ...
+
+    Attributes are decoded straight out of a `memoryview` of `buf`, without
+    copying each command into an intermediate file object.
+
+    The `data` of `write` items is NOT copied -- it is a read-only
+    `memoryview` into `buf`, which compares equal to the corresponding
+    `bytes`.  Call `bytes(item.data)` if you need to keep the payload
+    beyond the lifetime of `buf`.  Caveat: an `mmap` cannot be closed while
+    such views are alive.
+
+    `skip_data` and `check_crc` behave as in `parse_send_stream`.
+    '''
+    view = memoryview(buf).cast('B').toreadonly()
+    offset = len(BTRFS_SEND_STREAM_MAGIC)
+    check_magic(BytesIO(view[:offset]))
+    check_version(BytesIO(view[offset:offset + 4]))
+    offset += 4
+
+    size = len(view)
+    while True:
+        if offset + _COMMAND_HEADER.size > size:
+            raise RuntimeError(
+                f'Not enough bytes {bytes(view[offset:])} for command header'
+            )
+        length, kind, crc = _COMMAND_HEADER.unpack_from(view, offset)
+        cmd_header = CommandHeader(
+            kind=CommandKind(kind), length=length, crc=crc,
+        )
+        offset += _COMMAND_HEADER.size
+        end = offset + length
+        if end > size:
+            raise RuntimeError(f'{cmd_header} got {size - offset} bytes')
+        if check_crc:
+            _check_crc(cmd_header, btrfs_crc32c(
+                view[offset:end], _header_crc(cmd_header),
+            ))
+
+        kind_to_attr = {}
+        while offset != end:
+            if offset + _ATTRIBUTE_HEADER.size > end:
+                raise RuntimeError(
+                    f'Not enough bytes {bytes(view[offset:end])} for '
+                    f'attribute header in {cmd_header}'
+                )
+            attr_kind, attr_len = _ATTRIBUTE_HEADER.unpack_from(view, offset)
+            offset += _ATTRIBUTE_HEADER.size
+            kind_and_conv = _ATTRIBUTE_KIND_TO_CONV.get(attr_kind)
+            if kind_and_conv is None:
+                AttributeKind(attr_kind)  # Raises the usual `ValueError`
+            attr_kind, conv = kind_and_conv
+            if offset + attr_len > end:
+                raise RuntimeError(
+                    f'{AttributeHeader(kind=attr_kind, length=attr_len)} '
+                    f'got {end - offset} bytes'
+                )
+            if attr_kind in kind_to_attr:
+                raise RuntimeError(
+                    f'{attr_kind} occurred twice in {cmd_header}'
+                )
+            if skip_data and attr_kind is AttributeKind.DATA:
+                kind_to_attr[attr_kind] = attr_len
+            else:
+                kind_to_attr[attr_kind] = conv(view[offset:offset + attr_len])
+            offset += attr_len
+
+        cmd = _item_from_attributes(
+            cmd_header, kind_to_attr, skip_data=skip_data,
+        )
+        if cmd is None:
+            return
+        yield cmd
+
+
+# `verify_send_stream_crcs` hands commands to workers in batches at least
+# this large, so that the per-task overhead is negligible.
+_CRC_BATCH_BYTES = 2 ** 24
+
+
+def _gen_command_offsets_and_headers(
+    infile,
+) -> Iterator[Tuple[int, CommandHeader]]:
+    'Scans the headers up to & including END, seeking past the payloads.'
+    check_magic(infile)
+    check_version(infile)
+    while True:
+        offset = infile.tell()
+        cmd_header = CommandHeader.from_file(infile)
+        yield offset, cmd_header
+        if cmd_header.kind == CommandKind.END:
+            return
+        infile.seek(cmd_header.length, os.SEEK_CUR)
+
+
+def _gen_stream_headers(
+    infile,
+) -> Iterator[Tuple[int, Sequence[Tuple[int, CommandHeader]], int]]:
+    '''
+    For each send-stream concatenated in the seekable `infile`, from the
+    current position up to EOF, yields its offset, the output of
+    `_gen_command_offsets_and_headers`, and the offset past its END.
+    '''
+    for stream_idx in itertools.count():
+        offset = infile.tell()
+        if not infile.read(len(BTRFS_SEND_STREAM_MAGIC)):
+            if not stream_idx:
+                check_magic(BytesIO(b''))  # An empty file is an error
+            return
+        infile.seek(offset)
+        offsets_and_headers = list(_gen_command_offsets_and_headers(infile))
+        end_offset, end_header = offsets_and_headers[-1]
+        end = end_offset + _COMMAND_HEADER.size + end_header.length
+        yield offset, offsets_and_headers, end
+        infile.seek(end)
+
+
+def _verify_crcs_of_commands(
+    path: str, offsets_and_headers: Sequence[Tuple[int, CommandHeader]],
+) -> None:
+    with open(path, 'rb') as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ,
+    ) as m, memoryview(m) as view:
+        # The header scan already ensured that the payloads are in the file
+        for offset, cmd_header in offsets_and_headers:
+            start = offset + _COMMAND_HEADER.size
+            end = start + cmd_header.length
+            _check_crc(cmd_header, btrfs_crc32c(
+                view[start:end], _header_crc(cmd_header),
+            ))
+
+
+def verify_send_stream_crcs(
+    path: str, *, num_workers: Optional[int]=None,
+) -> None:
+    '''
+    Checks the CRC32C of every command in the file at `path`, which may
+    hold several concatenated send-streams, raising on the first mismatch.
+    Only the command headers are read sequentially.  The payloads are
+    checksummed from an `mmap` by a pool of `num_workers` processes
+    (defaulting to the CPU count).  With `num_workers=1`, the work is done
+    in the current process.
+
+    Run this before parsing with `parse_send_stream`.  On one CPU, with
+    the `crc32c` module, it runs at about 2 GB/s.  That is faster than a
+    full parse, but about as fast as a `skip_data` parse, so it pays off
+    mainly with several workers.  With the pure-Python CRC fallback, it
+    is much slower than either parse.  See `parse_send_stream_benchmark`.
+    '''
+    batches = [[]]
+    batch_bytes = 0
+    with open(path, 'rb') as infile:
+        for _, offsets_and_headers, _ in _gen_stream_headers(infile):
+            for offset, cmd_header in offsets_and_headers:
+                if batch_bytes >= _CRC_BATCH_BYTES:
+                    batches.append([])
+                    batch_bytes = 0
+                batches[-1].append((offset, cmd_header))
+                batch_bytes += _COMMAND_HEADER.size + cmd_header.length
+
+    if num_workers == 1 or len(batches) == 1:
+        for batch in batches:
+            _verify_crcs_of_commands(path, batch)
+        return
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # Consuming the results re-raises any worker exception.
+        for _ in executor.map(
+            _verify_crcs_of_commands, [path] * len(batches), batches,
+        ):
+            pass
+
+
+# Item types by their index in `_encode_items`, in declaration order.  Every
+# process imports the same `send_stream.py`, so they agree on the indices.
+_ITEM_TYPES = tuple(
+    item_type for item_type in vars(SendStreamItems).values()
+        if isinstance(item_type, SendStreamItem)
+)
+_ITEM_TYPE_TO_IDX = {
+    item_type: idx for idx, item_type in enumerate(_ITEM_TYPES)
+}
+
+
+def _encode_items(items: Iterable[SendStreamItem]) -> Sequence[tuple]:
+    '''
+    `SendStreamItem`s cannot be pickled, so workers send us plain tuples of
+    `(item type index, *fields)`.  Paths recur in a stream, so we intern
+    them to let `pickle` send each distinct path once.
+    '''
+    path_to_interned = {}
+    encoded = []
+    for item in items:
+        _item_type, path, *fields = item
+        encoded.append((
+            _ITEM_TYPE_TO_IDX[type(item)],
+            path_to_interned.setdefault(path, path),
+            *fields,
+        ))
+    return encoded
+
+
+def _decode_items(encoded: Sequence[tuple]) -> Iterator[SendStreamItem]:
+    for idx, *fields in encoded:
+        item_type = _ITEM_TYPES[idx]
+        # Skip the field validation, the worker made valid items.
+        yield item_type._make((item_type, *fields))
+
+
+def _parse_and_encode_send_stream_file(
+    path: str, kwargs,
+) -> Sequence[Tuple[int, Sequence[tuple]]]:
+    'Returns `(stream index, encoded items)` for each stream in the file.'
+    with open(path, 'rb') as infile:
+        return [
+            (stream_idx, _encode_items(item for _, item in idx_items))
+                for stream_idx, idx_items in itertools.groupby(
+                    parse_send_streams(infile, **kwargs),
+                    key=lambda idx_item: idx_item[0],
+                )
+        ]
+
+
+def parse_send_stream_files(
+    paths: Sequence[str], *, num_workers: Optional[int]=None, **kwargs,
+) -> Iterator[Tuple[int, int, SendStreamItem]]:
+    '''
+    Yields `(index into paths, index of the send-stream, item)` for the
+    files at `paths`, each of which may contain several concatenated
+    send-streams.  The items are exactly those of `parse_send_streams(f,
+    **kwargs)`, in the same order as parsing the files one by one.
+
+    The files are parsed by a pool of `num_workers` processes (defaulting
+    to the CPU count).  Since we yield the files in order, the workers
+    parse the next files while the caller applies the items of the current
+    one, e.g. to a `SubvolumeSetMutator`.  To bound memory use, at most
+    `num_workers` parsed files wait to be consumed.  With `num_workers=1`,
+    or a single file, the files are parsed in the current process.
+
+    The workers open `paths` themselves, so these must be re-openable files,
+    not pipes.
+    '''
+    if num_workers == 1 or len(paths) < 2:
+        for path_idx, path in enumerate(paths):
+            with open(path, 'rb') as infile:
+                for stream_idx, item in parse_send_streams(infile, **kwargs):
+                    yield path_idx, stream_idx, item
+        return
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        lookahead = num_workers or os.cpu_count() or 1
+        futures = [
+            executor.submit(_parse_and_encode_send_stream_file, path, kwargs)
+                for path in paths[:lookahead]
+        ]
+        for path_idx in range(len(paths)):
+            if path_idx + lookahead < len(paths):
+                futures.append(executor.submit(
+                    _parse_and_encode_send_stream_file,
+                    paths[path_idx + lookahead],
+                    kwargs,
+                ))
+            # `result` re-raises any worker exception.
+            for stream_idx, encoded in futures[path_idx].result():
+                for item in _decode_items(encoded):
+                    yield path_idx, stream_idx, item
+            futures[path_idx] = None  # Free the parsed file
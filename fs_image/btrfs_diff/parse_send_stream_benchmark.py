@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+'''
+Measures the throughput of the send-stream parsers.  Each `--send-stream`
+(by default, the two demo send-streams) is parsed `--rounds` times by:
+
+  - `file`: `parse_send_stream` on a buffered file object,
+  - `bytes`: `parse_send_stream_buffer` on the file's contents in memory,
+  - `mmap`: `parse_send_stream_buffer` on a fresh `mmap` of the file,
+
+each with & without `skip_data`.  It also times `verify_send_stream_crcs`
+on each file.  Prints the item & byte throughput of each mode.
+
+The demo send-streams are tiny, and carry little file data.  To measure
+the data-heavy case, `--synthetic-megabytes` replaces them with a stream
+of 1 MiB files, written in 48 KiB `write` commands as the kernel does:
+
+buck run .../btrfs_diff:parse-send-stream-benchmark -- \\
+    --synthetic-megabytes 512 --rounds 1
+'''
+import itertools
+import mmap
+import os
+import tempfile
+import time
+
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional, Sequence
+
+from .parse_send_stream import (
+    parse_send_stream, parse_send_stream_buffer, verify_send_stream_crcs,
+)
+from .send_stream import SendStreamItems
+from .write_send_stream import write_send_stream
+
+# The kernel sends file data in chunks of at most this size.
+_WRITE_SIZE = 48 * 2 ** 10
+
+
+def _parse_file(path: str, **kwargs) -> int:
+    with open(path, 'rb') as infile:
+        return sum(1 for _ in parse_send_stream(infile, **kwargs))
+
+
+def _parse_bytes(path: str, data: bytes, **kwargs) -> int:
+    return sum(1 for _ in parse_send_stream_buffer(data, **kwargs))
+
+
+def _parse_mmap(path: str, **kwargs) -> int:
+    with open(path, 'rb') as infile, mmap.mmap(
+        infile.fileno(), 0, access=mmap.ACCESS_READ,
+    ) as m:
+        # No item outlives the `sum`, so `m` can be closed.
+        return sum(1 for _ in parse_send_stream_buffer(m, **kwargs))
+
+
+@contextmanager
+def demo_send_stream_paths() -> Iterator[Sequence[str]]:
+    'Writes the gold demo send-streams to temporary files.'
+    from .tests.demo_sendstreams import gold_demo_sendstreams
+    with tempfile.TemporaryDirectory() as td:
+        paths = []
+        for name, d in sorted(gold_demo_sendstreams().items()):
+            paths.append(os.path.join(td, name))
+            with open(paths[-1], 'wb') as outfile:
+                outfile.write(d['sendstream'])
+        yield paths
+
+
+def write_synthetic_send_stream(
+    outfile: BinaryIO, *, num_files: int, file_size: int,
+) -> None:
+    'Writes a send-stream that creates `num_files` random files.'
+    data = os.urandom(_WRITE_SIZE)  # Incompressible, but cheap to make
+    write_send_stream(itertools.chain(
+        [SendStreamItems.subvol(
+            path=b'synthetic',
+            uuid=b'00000000-0000-0000-0000-000000000001',
+            transid=1,
+        )],
+        itertools.chain.from_iterable(
+            itertools.chain(
+                [SendStreamItems.mkfile(path=b'f%d' % i)],
+                (
+                    SendStreamItems.write(
+                        path=b'f%d' % i,
+                        offset=offset,
+                        data=data[:min(_WRITE_SIZE, file_size - offset)],
+                    ) for offset in range(0, file_size, _WRITE_SIZE)
+                ),
+            ) for i in range(num_files)
+        ),
+    ), outfile)
+
+
+@contextmanager
+def synthetic_send_stream_paths(megabytes: int) -> Iterator[Sequence[str]]:
+    'Writes `write_synthetic_send_stream` with 1 MiB files to a temp file.'
+    with tempfile.NamedTemporaryFile() as outfile:
+        write_synthetic_send_stream(
+            outfile, num_files=megabytes, file_size=2 ** 20,
+        )
+        outfile.flush()
+        yield [outfile.name]
+
+
+def parse_send_stream_benchmark(
+    *, paths: Sequence[str], rounds: int, crc_workers: Optional[int]=None,
+) -> dict:
+    path_to_data = {}
+    for path in paths:
+        with open(path, 'rb') as infile:
+            path_to_data[path] = infile.read()
+    num_bytes = rounds * sum(len(d) for d in path_to_data.values())
+
+    def add_result(mode, num_items, seconds):
+        results[mode] = {
+            'items': num_items,
+            'seconds': round(seconds, 3),
+            'items_per_second': round(num_items / seconds, 1),
+            'megabytes_per_second': round(num_bytes / seconds / 2 ** 20, 1),
+        }
+
+    results = {}
+    for mode, parse in [
+        ('file', _parse_file),
+        ('bytes', lambda path, **kw: _parse_bytes(
+            path, path_to_data[path], **kw,
+        )),
+        ('mmap', _parse_mmap),
+    ]:
+        for skip_data in [False, True]:
+            num_items = 0
+            start_time = time.monotonic()
+            for _ in range(rounds):
+                for path in paths:
+                    num_items += parse(path, skip_data=skip_data)
+            add_result(
+                mode + ('+skip_data' if skip_data else ''),
+                num_items, time.monotonic() - start_time,
+            )
+
+    start_time = time.monotonic()
+    for _ in range(rounds):
+        for path in paths:
+            verify_send_stream_crcs(path, num_workers=crc_workers)
+    add_result(
+        'verify_send_stream_crcs', num_items, time.monotonic() - start_time,
+    )
+    return results
+
+
+# Not unit-tested, it is a tool for measuring `parse_send_stream.py`.
+if __name__ == '__main__':  # pragma: no cover
+    import argparse
+    import contextlib
+    import json
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        '--send-stream', action='append', dest='send_streams',
+        help='Parse this send-stream file. Can be repeated. Defaults to the '
+            'demo send-streams.',
+    )
+    parser.add_argument(
+        '--synthetic-megabytes', type=int,
+        help='Instead of the demo send-streams, parse a synthetic one with '
+            'this many 1 MiB files, see `write_synthetic_send_stream`.',
+    )
+    parser.add_argument(
+        '--crc-workers', type=int,
+        help='The `num_workers` of `verify_send_stream_crcs`. Defaults to '
+            'the CPU count.',
+    )
+    parser.add_argument(
+        '--rounds', type=int, default=200,
+        help='Parse each send-stream this many times in each mode.',
+    )
+    opts = parser.parse_args()
+
+    if opts.send_streams:
+        paths_ctx = contextlib.nullcontext(opts.send_streams)
+    elif opts.synthetic_megabytes:
+        paths_ctx = synthetic_send_stream_paths(opts.synthetic_megabytes)
+    else:
+        paths_ctx = demo_send_stream_paths()
+    with paths_ctx as paths:
+        print(json.dumps(parse_send_stream_benchmark(
+            paths=paths, rounds=opts.rounds, crc_workers=opts.crc_workers,
+        ), indent=4))
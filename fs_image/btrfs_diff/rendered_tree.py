@@ -23,6 +23,13 @@ Since `RenderedTree` is plain-old-data (not a class), this module instead
 offers helpers for operating on the data structure: `map_bottom_up` for
 rewriting `RenderedTrees`, and the underlying traversal `gather_bottom_up`.
 
+Both this `gather_bottom_up` and `Subvolume.gather_bottom_up` are built on
+`gather_bottom_up_with_stack`, which keeps an explicit stack instead of
+recursing.  So, deep trees neither hit the recursion limit, nor pay for a
+chain of `yield from` on every step.  When results need not flow upwards,
+`gen_bottom_up_with_stack` visits the same nodes in the same order, but
+only keeps the path from the root to the current node in memory.
+
 There are two aspects to rendering a `Subvolume`:
 
 (1) The structure of the `RenderedTree` should permit storing arbitrary
@@ -68,7 +75,8 @@ wraps only objects that occur more than once. For example, (ii) becomes:
 import os
 
 from typing import (
-    Any, Coroutine, Hashable, Mapping, NamedTuple, Optional, Tuple, Union,
+    Any, Callable, Coroutine, Dict, Hashable, Iterable, Iterator, Mapping,
+    NamedTuple, Optional, Tuple, Union,
 )
 from itertools import count
 
@@ -77,20 +85,105 @@ from .coroutine_utils import while_not_exited
 RenderedTree = Union[Tuple[Any], Tuple[Any, Mapping[bytes, 'RenderedTree']]]
 
 
-def gather_bottom_up(
-    ser: RenderedTree,
-    *,
-    # Private, and NOT like the public `top_path` arg of `gather_bottom_up`.
-    # Not `bytes` since we `surrogateescape` everything at render time to
-    # let us produce JSON-friendly `utf-8`.
-    _path: str='.',
-) -> Coroutine[
+# `expand(node)` returns `(path, inode, children)`, where `children` is None
+# for files.  For directories, it iterates over `(child name, child node)`
+# in traversal order.  Nodes are opaque to the traversal.
+BottomUpExpander = Callable[
+    [Any], Tuple[Any, Any, Optional[Iterable[Tuple[Any, Any]]]]
+]
+
+
+class _BottomUpFrame(NamedTuple):
+    name: Any  # The key of this node in its parent's `child_results`
+    path: Any
+    ino: Any
+    children: Optional[Iterator[Tuple[Any, Any]]]  # None for files
+    child_results: Optional[Dict[Any, Any]]  # None for files
+
+
+def _push_frame(stack, expand, name, node, *, gather: bool):
+    path, ino, children = expand(node)
+    is_dir = children is not None
+    stack.append(_BottomUpFrame(
+        name=name,
+        path=path,
+        ino=ino,
+        children=iter(children) if is_dir else None,
+        child_results={} if (gather and is_dir) else None,
+    ))
+
+
+def _pop_finished_frame(stack, expand, *, gather: bool) -> _BottomUpFrame:
+    'Descends from the top frame to its next post-order node, & pops it.'
+    while True:
+        frame = stack[-1]
+        if frame.children is not None:
+            child = next(frame.children, None)
+            if child is not None:
+                _push_frame(stack, expand, *child, gather=gather)
+                continue
+        return stack.pop()
+
+
+def gather_bottom_up_with_stack(top_node: Any, expand: BottomUpExpander):
+    '''
+    The traversal engine behind both `gather_bottom_up`s, which implements
+    their coroutine protocol without recursion.
+    '''
+    stack = []
+    _push_frame(stack, expand, None, top_node, gather=True)
+    while True:
+        frame = _pop_finished_frame(stack, expand, gather=True)
+        result = yield (frame.path, frame.ino, frame.child_results)
+        if not stack:
+            return result
+        stack[-1].child_results[frame.name] = result
+
+
+def gen_bottom_up_with_stack(
+    top_node: Any, expand: BottomUpExpander,
+) -> Iterator[Tuple[Any, Any]]:
+    '''
+    Yields `(path, inode)` in the order of `gather_bottom_up_with_stack`.
+    Memory use is bounded by the depth of the tree, and by the size of the
+    `children` iterables on the current path.
+    '''
+    stack = []
+    _push_frame(stack, expand, None, top_node, gather=False)
+    while stack:
+        frame = _pop_finished_frame(stack, expand, gather=False)
+        yield (frame.path, frame.ino)
+
+
+def _expand_rendered(path_and_ser: Tuple[str, RenderedTree]):
+    path, ser = path_and_ser
+    if not isinstance(ser, list):
+        raise RuntimeError(f'Unknown type in rendered subvolume: {ser}')
+    elif len(ser) == 1:
+        return path, ser[0], None
+    elif len(ser) != 2:
+        raise RuntimeError(f'Rendered inode list length != 1, 2: {ser}')
+
+    ino, children = ser
+    # Normally, we'd just get a 1-element list, but this is OK too.
+    if children is None:
+        return path, ino, None
+    # Traverse children in the same order as `gather_bottom_up`,
+    # ensuring that in tests actual & expected traversal IDs agree.
+    return path, ino, (
+        # normpath to remove the leading ./
+        (name, (os.path.normpath(os.path.join(path, name)), child_ser))
+            for name, child_ser in sorted(children.items())
+    )
+
+
+def gather_bottom_up(ser: RenderedTree) -> Coroutine[
     Tuple[
-        bytes,  # full path to current inode
+        str,  # full path to current inode
         Any,  # the current inode
         # None for files. For directories, maps the names of the child
         # inodes to whatever result type they had sent us.
-        Optional[Mapping[bytes, Any]],
+        Optional[Mapping[str, Any]],
     ],  # yield
     Any,  # send -- whatever result type we are aggregating.
     Any,  # return -- the final result, whatever you sent for `top_path`
@@ -100,29 +193,11 @@ def gather_bottom_up(
     `Subvolume.render`.  This matches the traversal order of
     `Subvolume.gather_bottom_up`.  See that docblock for a discussion of the
     merits of traversal coroutines.
-    '''
-    if not isinstance(ser, list):
-        raise RuntimeError(f'Unknown type in rendered subvolume: {ser}')
-    elif len(ser) == 1:
-        return (yield _path, ser[0], None)
-    elif len(ser) != 2:
-        raise RuntimeError(f'Rendered inode list length != 1, 2: {ser}')
 
-    ino, children = ser
-    # Normally, we'd just get a 1-element list, but this is OK too.
-    if children is None:
-        child_results = None
-    else:
-        child_results = {}
-        # Traverse children in the same order as `gather_bottom_up`,
-        # ensuring that in tests actual & expected traversal IDs agree.
-        for name, child_ser in sorted(children.items()):
-            child_results[name] = (yield from gather_bottom_up(
-                child_ser,
-                # normpath to remove the leading ./
-                _path=os.path.normpath(os.path.join(_path, name)),
-            ))
-    return (yield (_path, ino, child_results))  # noqa: B901
+    Paths are `str`, not `bytes`, since we `surrogateescape` everything at
+    render time to let us produce JSON-friendly `utf-8`.
+    '''
+    return gather_bottom_up_with_stack(('.', ser), _expand_rendered)
 
 
 def map_bottom_up(ser: RenderedTree, fn) -> RenderedTree:
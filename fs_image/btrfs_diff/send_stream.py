@@ -8,7 +8,7 @@ number of limitations, but we find it useful for testing -- refer to the
 `parse_dump.py` docblock.
 '''
 from collections import Counter
-from typing import Callable, Iterable
+from typing import Callable, Iterable, Mapping
 
 from compiler.enriched_namedtuple import metaclass_new_enriched_namedtuple
 
@@ -135,22 +135,134 @@ class SendStreamItems:
         fields = ['offset', 'len']
 
 
+# Maps each item type to a function that returns the filtered item (of
+# the same type), or `None` to drop the item.  Item types that are absent
+# from the mapping pass through unchanged.
+ItemTypeToTransform = Mapping[
+    type, Callable[[SendStreamItem], SendStreamItem],
+]
+
+# Besides `path`, the fields that are paths inside the subvolume.
+_ITEM_TYPE_TO_PATH_FIELDS = {
+    SendStreamItems.rename: ('path', 'dest'),
+    SendStreamItems.link: ('path', 'dest'),
+    SendStreamItems.clone: ('path', 'from_path'),
+}
+
+
 def get_frequency_of_selinux_xattrs(items):
     'Returns {"xattr_value": <count>}. Useful for ItemFilters.selinux_xattr.'
     counter = Counter()
-    for item in items:
-        if isinstance(item, SendStreamItems.set_xattr):
+    for _ in ItemFilters.fused(
+        items, ItemTransforms.count_selinux_xattrs(counter),
+    ):
+        pass
+    return counter
+
+
+class ItemTransforms:
+    '''
+    A namespace of `ItemTypeToTransform` factories, which `ItemFilters.fused`
+    composes into a single pass over a stream.  The statistics-gathering
+    transforms return their item unchanged.
+    '''
+
+    @staticmethod
+    def count_selinux_xattrs(counter: Counter) -> ItemTypeToTransform:
+        'Counts the values of SELinux xattrs into `counter`.'
+        def count(item):
             if item.name == _SELINUX_XATTR:
                 counter[item.data] += 1
-    return counter
+            return item
+
+        return {SendStreamItems.set_xattr: count}
+
+    @staticmethod
+    def selinux_xattr(
+        discard_fn: Callable[[bytes, bytes], bool],
+    ) -> ItemTypeToTransform:
+        'See `ItemFilters.selinux_xattr`.'
+        def discard(item):
+            if item.name == _SELINUX_XATTR and discard_fn(item.path, item.data):
+                return None
+            return item
+
+        return {SendStreamItems.set_xattr: discard}
+
+    @staticmethod
+    def normalize_utimes(
+        start_time: float, end_time: float,
+    ) -> ItemTypeToTransform:
+        'See `ItemFilters.normalize_utimes`.'
+        def normalize_time(t):
+            return start_time if start_time <= t <= end_time else t
+
+        def normalize(item):
+            times = (item.atime, item.mtime, item.ctime)
+            atime, mtime, ctime = new_times = tuple(
+                normalize_time(t) for t in times
+            )
+            # Most timestamps need no change, so avoid making a new item.
+            if new_times == times:
+                return item
+            return item._replace(atime=atime, mtime=mtime, ctime=ctime)
+
+        return {SendStreamItems.utimes: normalize}
+
+    @staticmethod
+    def rewrite_paths(
+        rewrite_fn: Callable[[bytes], bytes],
+    ) -> ItemTypeToTransform:
+        '''
+        Applies `rewrite_fn` to every path inside the subvolume, including
+        the destinations of `rename` & `link`, and the source of `clone`.
+        The subvolume names of `subvol` & `snapshot`, and the targets of
+        `symlink`, are not paths inside the subvolume, and are kept.
+        '''
+        def rewrite_fields(fields):
+            return lambda item: item._replace(**{
+                field: rewrite_fn(getattr(item, field)) for field in fields
+            })
+
+        return {
+            item_type: rewrite_fields(
+                _ITEM_TYPE_TO_PATH_FIELDS.get(item_type, ('path',))
+            ) for item_type in vars(SendStreamItems).values()
+                if isinstance(item_type, SendStreamItem)
+                    and not item_type.sets_subvol_name
+        }
 
 
 class ItemFilters:
     '''
     A namespace of filters for taking a just-parsed Iterable[SendStreamItems],
     and making it useful for filesystem testing.
+
+    To apply several filters, and to gather statistics, in one pass over
+    the stream, pass the corresponding `ItemTransforms` to `fused`.
     '''
 
+    @staticmethod
+    def fused(
+        items: Iterable[SendStreamItem], *transforms: ItemTypeToTransform,
+    ) -> Iterable[SendStreamItem]:
+        '''
+        Applies `transforms` in order to each item, dispatching on the item
+        type through one table, instead of one `isinstance` chain per filter.
+        An item that is dropped is not shown to the later transforms.
+        '''
+        type_to_fns = {}
+        for item_type_to_fn in transforms:
+            for item_type, fn in item_type_to_fn.items():
+                type_to_fns.setdefault(item_type, []).append(fn)
+        for item in items:
+            for fn in type_to_fns.get(type(item), ()):
+                item = fn(item)
+                if item is None:
+                    break
+            else:
+                yield item
+
     @staticmethod
     def selinux_xattr(
         items: Iterable[SendStreamItem],
@@ -161,14 +273,9 @@ class ItemFilters:
         images will not ship data with non-default contexts, so it is easiest to
         just filter out these `set_xattr`s
         '''
-        for item in items:
-            if isinstance(item, SendStreamItems.set_xattr):
-                if (
-                    item.name == _SELINUX_XATTR and
-                    discard_fn(item.path, item.data)
-                ):
-                    continue
-            yield item
+        return ItemFilters.fused(
+            items, ItemTransforms.selinux_xattr(discard_fn),
+        )
 
     @staticmethod
     def normalize_utimes(
@@ -181,16 +288,16 @@ class ItemFilters:
         We can make them predictable by replacing any timestamp within the
         build time-range by `start_time`.
         '''
-        def normalize_time(t):
-            return start_time if start_time <= t <= end_time else t
+        return ItemFilters.fused(
+            items, ItemTransforms.normalize_utimes(start_time, end_time),
+        )
 
-        for item in items:
-            if isinstance(item, SendStreamItems.utimes):
-                yield type(item)(
-                    path=item.path,
-                    atime=normalize_time(item.atime),
-                    mtime=normalize_time(item.mtime),
-                    ctime=normalize_time(item.ctime),
-                )
-            else:
-                yield item
+    @staticmethod
+    def rewrite_paths(
+        items: Iterable[SendStreamItem],
+        rewrite_fn: Callable[[bytes], bytes],
+    ) -> Iterable[SendStreamItem]:
+        'See `ItemTransforms.rewrite_paths`.'
+        return ItemFilters.fused(
+            items, ItemTransforms.rewrite_paths(rewrite_fn),
+        )
@@ -22,16 +22,19 @@ mutate its state.
 
 - Maximum path lengths are not checked.
 '''
+import copy
 import os
 
 from types import MappingProxyType
 from typing import (
-    Any, Coroutine, Iterator, Mapping, NamedTuple, Optional, Sequence,
-    Tuple, Union,
+    Any, Coroutine, Dict, Iterator, Mapping, NamedTuple, Optional, Sequence,
+    Set, Tuple, Union,
 )
 
 from .coroutine_utils import while_not_exited
-from .extents_to_chunks import extents_to_chunks_with_clones
+from .extents_to_chunks import (
+    extents_to_chunks_with_clones, extents_to_chunks_with_extent_ids,
+)
 from .freeze import freeze
 from .inode_id import InodeID, InodeIDMap
 from .incomplete_inode import (
@@ -39,7 +42,10 @@ from .incomplete_inode import (
     IncompleteInode, IncompleteSocket, IncompleteSymlink,
 )
 from .send_stream import SendStreamItem, SendStreamItems
-from .rendered_tree import RenderedTree, TraversalIDMaker
+from .rendered_tree import (
+    gather_bottom_up_with_stack, gen_bottom_up_with_stack, RenderedTree,
+    TraversalIDMaker,
+)
 
 _DUMP_ITEM_TO_INCOMPLETE_INODE = {
     SendStreamItems.mkdir: IncompleteDir,
@@ -58,14 +64,18 @@ class Subvolume(NamedTuple):
     Models a btrfs subvolume, knows how to apply SendStreamItem mutations
     to itself.
 
-    IMPORTANT: Keep this object correctly `deepcopy`able, we need that
-    for snapshotting. Notes:
+    `snapshot()` is copy-on-write: the snapshot shares the parent's
+    inodes & directory entries, and either subvolume copies an inode just
+    before it first mutates it.  Any code that mutates the inodes of a
+    `Subvolume` directly, instead of via `apply_item`, should be aware
+    that they may be shared with snapshots.
+
+    IMPORTANT: Keep this object correctly `deepcopy`able for the sake of
+    tests. Notes:
 
       - `InodeIDMap` opaquely holds a `description`, which in practice
         is a `SubvolumeDescription` that is **NOT** safely `deepcopy`able
-        unless the whole `Volume` is being copied in one call.  For
-        single-volume snapshots, `SubvolumeSetMutator` has an icky
-        workaround :)
+        unless the whole `Volume` is being copied in one call.
 
       - The tests for `InodeIDMap` try to ensure that it is safely
         `deepcopy`able.  Changes to its members should be validated there.
@@ -87,21 +97,48 @@ class Subvolume(NamedTuple):
     # where a subvolume is mounted within a volume, but this does not
     # require us to share inodes across subvolumes.
     id_map: InodeIDMap
-    id_to_inode: Mapping[InodeID, Union[IncompleteInode, 'Inode']]
+    # Keyed by `InodeID.id`, so that snapshots can share this map's values.
+    id_to_inode: Mapping[int, Union[IncompleteInode, 'Inode']]
+    # The keys of `id_to_inode` whose inodes are not shared with any
+    # snapshot, and may thus be mutated in place.
+    owned_inode_ids: Set[int]
+    # Counts the mutations of each inode by `apply_item` & `apply_clone`.
+    # An owned inode is mutated in place, so callers memoizing on inode
+    # identity, like `SubvolumeFreezer`, need this to see its changes.
+    id_to_version: Dict[int, int]
 
     @classmethod
     def new(cls, *, id_map, **kwargs) -> 'Subvolume':
         kwargs.setdefault('id_to_inode', {})
-        kwargs['id_to_inode'][id_map.get_id(b'.')] = IncompleteDir(
+        kwargs.setdefault('owned_inode_ids', set())
+        kwargs.setdefault('id_to_version', {})
+        root_id = id_map.get_id(b'.').id
+        kwargs['id_to_inode'][root_id] = IncompleteDir(
             item=SendStreamItems.mkdir(path=b'.'),
         )
+        kwargs['owned_inode_ids'].add(root_id)
         return cls(id_map=id_map, **kwargs)
 
+    def snapshot(self, *, description: Any='') -> 'Subvolume':
+        '''
+        Returns a copy-on-write copy of `self`, whose `InodeIDMap` has the
+        new `description`.  This does not copy any inodes, see the class
+        docblock.
+        '''
+        # The two subvolumes now share all our inodes.
+        self.owned_inode_ids.clear()
+        return type(self)(
+            id_map=self.id_map.snapshot(description=description),
+            id_to_inode=dict(self.id_to_inode),
+            owned_inode_ids=set(),
+            id_to_version={},
+        )
+
     def inode_at_path(self, path: bytes) -> Optional[IncompleteInode]:
         id = self.id_map.get_id(path)
         # Using `[]` instead of `.get()` to assert that `id_to_inode`
         # remains a superset of `id_map`.  The converse is harder to check.
-        return None if id is None else self.id_to_inode[id]
+        return None if id is None else self.id_to_inode[id.id]
 
     def _require_inode_at_path(
         self, item: SendStreamItem, path: bytes,
@@ -111,10 +148,31 @@ class Subvolume(NamedTuple):
             raise RuntimeError(f'Cannot apply {item}, {path} does not exist')
         return ino
 
+    def _require_mutable_inode_at_path(
+        self, item: SendStreamItem, path: bytes,
+    ) -> Tuple[int, IncompleteInode]:
+        '''
+        Like `_require_inode_at_path`, but first replaces an inode that is
+        shared with a snapshot by a private copy.  Also returns the inode's
+        `id_to_inode` key, to pass to `_bump_version` after mutating it.
+        '''
+        ino = self._require_inode_at_path(item, path)
+        ino_id = self.id_map.get_id(path)
+        if ino_id.id not in self.owned_inode_ids:
+            ino = copy.copy(ino)
+            self.id_to_inode[ino_id.id] = ino
+            self.owned_inode_ids.add(ino_id.id)
+        return ino_id.id, ino
+
+    def _bump_version(self, int_id: int) -> None:
+        self.id_to_version[int_id] = self.id_to_version.get(int_id, 0) + 1
+
     def _delete(self, path):
         ino_id = self.id_map.remove_path(path)
         if not self.id_map.get_paths(ino_id):
-            del self.id_to_inode[ino_id]
+            del self.id_to_inode[ino_id.id]
+            self.owned_inode_ids.discard(ino_id.id)
+            self.id_to_version.pop(ino_id.id, None)
 
     def apply_item(self, item: SendStreamItem) -> None:
         for item_type, inode_class in _DUMP_ITEM_TO_INCOMPLETE_INODE.items():
@@ -124,8 +182,9 @@ class Subvolume(NamedTuple):
                     self.id_map.add_dir(ino_id, item.path)
                 else:
                     self.id_map.add_file(ino_id, item.path)
-                assert ino_id not in self.id_to_inode
-                self.id_to_inode[ino_id] = inode_class(item=item)
+                assert ino_id.id not in self.id_to_inode
+                self.id_to_inode[ino_id.id] = inode_class(item=item)
+                self.owned_inode_ids.add(ino_id.id)
                 return  # Done applying item
 
         if isinstance(item, SendStreamItems.rename):
@@ -147,15 +206,15 @@ class Subvolume(NamedTuple):
                 return
 
             # Overwrite an existing path.
-            if isinstance(self.id_to_inode[old_id], IncompleteDir):
-                new_ino = self.id_to_inode[new_id]
+            if isinstance(self.id_to_inode[old_id.id], IncompleteDir):
+                new_ino = self.id_to_inode[new_id.id]
                 # _delete() below will ensure that the destination is empty
                 if not isinstance(new_ino, IncompleteDir):
                     raise RuntimeError(
                         f'{item} cannot overwrite {new_ino}, since a '
                         'directory may only overwrite an empty directory'
                     )
-            elif isinstance(self.id_to_inode[new_id], IncompleteDir):
+            elif isinstance(self.id_to_inode[new_id.id], IncompleteDir):
                 raise RuntimeError(
                     f'{item} cannot overwrite a directory with a non-directory'
                 )
@@ -177,59 +236,82 @@ class Subvolume(NamedTuple):
             old_id = self.id_map.get_id(item.dest)
             if old_id is None:
                 raise RuntimeError(f'{item} source does not exist')
-            if isinstance(self.id_to_inode[old_id], IncompleteDir):
+            if isinstance(self.id_to_inode[old_id.id], IncompleteDir):
                 raise RuntimeError(f'Cannot {item} a directory')
             self.id_map.add_file(old_id, item.path)
         else:  # Any other operation must be handled at inode scope.
             ino = self.inode_at_path(item.path)
             if ino is None:
                 raise RuntimeError(f'Cannot apply {item}, path does not exist')
-            self._require_inode_at_path(item, item.path).apply_item(item=item)
+            int_id, ino = self._require_mutable_inode_at_path(item, item.path)
+            ino.apply_item(item=item)
+            self._bump_version(int_id)
 
     def apply_clone(
         self, item: SendStreamItems.clone, from_subvol: 'Subvolume',
     ):
         assert isinstance(item, SendStreamItems.clone)
-        return self._require_inode_at_path(item, item.path).apply_clone(
-            item, from_subvol._require_inode_at_path(item, item.from_path),
-        )
+        # Look up the source first, so that a bad `from_path` does not
+        # make us copy the destination inode in vain.
+        from_ino = from_subvol._require_inode_at_path(item, item.from_path)
+        int_id, ino = self._require_mutable_inode_at_path(item, item.path)
+        ino.apply_clone(item, from_ino)
+        self._bump_version(int_id)
 
     # Exposed as a method for the benefit of `SubvolumeSet`.
     def _inode_ids_and_extents(self):
         for id, ino in self.id_to_inode.items():
             if hasattr(ino, 'extent'):
-                yield (id, ino.extent)
+                yield (
+                    InodeID(id=id, inner_id_map=self.id_map.inner),
+                    ino.extent,
+                )
 
     def freeze(
         self,
         *,
         _memo,
         id_to_chunks: Optional[Mapping[InodeID, Sequence['Chunk']]]=None,
+        extent_ids: bool=False,
     ):
         '''
         Returns a recursively immutable copy of `self`, replacing
         `IncompleteInode`s by `Inode`s, using the provided `id_to_chunks` to
         populate them with `Chunk`s instead of `Extent`s.
 
-        If `id_to_chunks` is omitted, we'll detect clones only within `self`.
+        If `id_to_chunks` is omitted, we'll detect clones only within `self`,
+        numbering shared extents if `extent_ids` is set, as in
+        `SubvolumeSet.freeze`.
 
         IMPORTANT: Our lookups assume that the `id_to_chunks` has the
         pre-`freeze` variants of the `InodeID`s.
         '''
         if id_to_chunks is None:
-            id_to_chunks = dict(extents_to_chunks_with_clones(
-                list(self._inode_ids_and_extents()),
-            ))
+            id_to_chunks = dict((
+                extents_to_chunks_with_extent_ids if extent_ids
+                    else extents_to_chunks_with_clones
+            )(list(self._inode_ids_and_extents())))
         return type(self)(
             id_map=freeze(self.id_map, _memo=_memo),
             id_to_inode=MappingProxyType({
-                freeze(id, _memo=_memo):
-                        freeze(ino, _memo=_memo, chunks=id_to_chunks.get(id))
-                    for id, ino in self.id_to_inode.items()
+                # Call `ino.freeze` directly, since `freeze` would memoize
+                # on `id(ino)`, but an inode shared with a snapshot may
+                # need different `chunks` in each `Subvolume`.
+                id: ino.freeze(_memo=_memo, chunks=id_to_chunks.get(
+                    InodeID(id=id, inner_id_map=self.id_map.inner)
+                )) for id, ino in self.id_to_inode.items()
             }),
+            # Nothing mutates a frozen subvolume, so it has none of the
+            # copy-on-write bookkeeping.
+            owned_inode_ids=frozenset(),
+            id_to_version=MappingProxyType({}),
         )
 
     def inodes(self) -> Iterator[Union['Inode', 'IncompleteInode']]:
+        '''
+        NB: Inodes may be shared with snapshots, so mutating them in place
+        will affect those snapshots too.
+        '''
         return self.id_to_inode.values()
 
     def gather_bottom_up(self, top_path=b'.') -> Coroutine[
@@ -283,25 +365,34 @@ class Subvolume(NamedTuple):
             # NB `ctx.result` will contain the result at `top_path`, which is
             # the same as `result` in this case.
 
-        See also: `rendered_tree.gather_bottom_up()`
+        Deep trees are fine, since the traversal does not recurse.
+
+        See also: `rendered_tree.gather_bottom_up()`, `gen_bottom_up()`
         '''
-        ino_id = self.id_map.get_id(top_path)
+        return gather_bottom_up_with_stack(top_path, self._expand_path)
+
+    def _expand_path(self, path: bytes):
+        'The `BottomUpExpander` for `gather_bottom_up`.'
+        ino_id = self.id_map.get_id(path)
         child_paths = self.id_map.get_children(ino_id)
-        # While I'd love the next code to be a single expression using a
-        # dictionary comprehension, Python does not allow `yield` inside
-        # comprehensions.  See https://stackoverflow.com/questions/32139885
-        if child_paths is None:
-            child_results = None
-        else:
-            child_results = {}
-            for child_path in sorted(child_paths):
-                child_results[os.path.relpath(child_path, top_path)] = (
-                    yield from self.gather_bottom_up(child_path)
-                )
-        return (  # noqa: B901
-            yield (top_path, self.id_to_inode[ino_id], child_results)
+        return path, self.id_to_inode[ino_id.id], None if (
+            child_paths is None
+        ) else (
+            (os.path.basename(child_path), child_path)
+                for child_path in sorted(child_paths)
         )
 
+    def gen_bottom_up(self, top_path=b'.') -> Iterator[Tuple[
+        bytes, Union['Inode', 'IncompleteInode'],
+    ]]:
+        '''
+        Yields `(path, inode)` in the order of `gather_bottom_up`, for
+        clients that do not aggregate results from children to parents.
+        Unlike `gather_bottom_up`, this does not keep the results for the
+        whole tree in memory, so it suits streaming output.
+        '''
+        return gen_bottom_up_with_stack(top_path, self._expand_path)
+
     def map_bottom_up(self, fn, top_path=b'.') -> RenderedTree:
         '''
         Applies `fn` to each inode from `top_path` down, in the
@@ -333,3 +424,30 @@ class Subvolume(NamedTuple):
             lambda ino: id_maker.next_with_nonce(id(ino)).wrap(repr(ino)),
             top_path=top_path,
         )
+
+    def gen_rendered_inodes(self) -> Iterator[Tuple[str, str, Optional[int]]]:
+        '''
+        A streaming counterpart of `emit_non_unique_traversal_ids(render())`
+        for the whole subvolume.  Yields `(path, inode repr, traversal ID)`
+        in the order of `gen_bottom_up`, where the ID is None for inodes
+        that occur just once.  Memory use is proportional to the number of
+        hardlinked inodes, rather than to the size of the subvolume.
+        '''
+        # The first pass: an inode is visited once per path, so only the
+        # inodes with several paths can need a traversal ID.
+        non_unique_inode_ids = {
+            id(self.id_to_inode[int_id])
+                for int_id, rev_entries
+                    in self.id_map.inner.id_to_reverse_entries.items()
+                        if len(rev_entries) > 1
+        }
+        # The second pass numbers them in traversal order, exactly like
+        # `emit_non_unique_traversal_ids`.
+        id_maker = TraversalIDMaker()
+        for path, ino in self.gen_bottom_up():
+            yield (
+                path.decode(errors='surrogateescape'),
+                repr(ino),
+                id_maker.next_with_nonce(id(ino)).id
+                    if id(ino) in non_unique_inode_ids else None,
+            )
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+'''
+`gen_subvolume_diffs` compares two `Subvolume`s -- typically, an image
+layer and the layer built on top of it -- and yields typed differences,
+rather than making you diff two rendered JSON blobs.
+
+The `Subvolume`s may be frozen or not, but the two must be of the same
+kind, or every data byte will compare as changed.  The comparison walks
+the `InodeIDMap` directory trees of both subvolumes together, one
+directory pair at a time, with the children in sorted order.  Each
+directory entry is visited once, and only differences are yielded.
+
+## Identity & sharing
+
+A `btrfs` snapshot keeps the inode numbers of its parent, and so does
+`Subvolume.snapshot`.  With `same_inode_ids=True`, we rely on this:
+ - Each path is only compared with a path bearing the same inode ID.
+ - A file or directory that moved is reported as `RenamedPath`, and a
+   renamed directory's contents are compared with their new location.
+   Files with several hardlinks are reported as links being added and
+   removed, since pairing up old & new links would be arbitrary.
+Without it, the subvolumes are compared path-by-path, and no renames are
+detected.
+
+Regardless of `same_inode_ids`, content shared by a snapshot is skipped:
+ - Inodes that the two subvolumes still share (see `Subvolume.snapshot`)
+   are not compared at all.
+ - For unfrozen files, data is compared by leaf `Extent` identity, and
+   a data fork that is shared as a whole is not traversed.
+ - For frozen files, the clones (or, with `extent_ids`, the extent IDs)
+   computed by `SubvolumeSet.freeze` show which bytes are shared.  Files
+   from subvolumes that were not frozen together share no bytes.
+Data that was written to both subvolumes separately counts as changed,
+even if the bytes happen to be equal -- file contents are not stored.
+'''
+import stat
+
+from typing import (
+    Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union,
+)
+
+from .extent import Extent
+from .inode import InodeOwner, InodeUtimes
+from .inode_id import InodeID, _PathEntry
+from .subvolume import Subvolume
+
+
+class AddedPath(NamedTuple):
+    path: bytes
+
+
+class RemovedPath(NamedTuple):
+    path: bytes
+
+
+class RenamedPath(NamedTuple):
+    path: bytes
+    dest: bytes
+
+
+# In the below, `path` is the path in the right subvolume.
+
+class ChangedMode(NamedTuple):
+    path: bytes
+    old: Optional[int]
+    new: Optional[int]
+
+
+class ChangedOwner(NamedTuple):
+    path: bytes
+    old: Optional[InodeOwner]
+    new: Optional[InodeOwner]
+
+
+class ChangedUtimes(NamedTuple):
+    path: bytes
+    old: Optional[InodeUtimes]
+    new: Optional[InodeUtimes]
+
+
+class ChangedXAttr(NamedTuple):
+    path: bytes
+    name: bytes
+    old: Optional[bytes]  # None if the xattr was added
+    new: Optional[bytes]  # None if the xattr was removed
+
+
+class ChangedData(NamedTuple):
+    'A maximal byte range, in which the two data forks may differ.'
+    path: bytes
+    offset: int
+    length: int
+
+
+SubvolumeDiff = Union[
+    AddedPath, RemovedPath, RenamedPath, ChangedMode, ChangedOwner,
+    ChangedUtimes, ChangedXAttr, ChangedData,
+]
+
+# Keys of data-fork segments.  Two aligned segments are the same iff their
+# keys are equal and not None.  A `None` key means "unknown identity".
+_HOLE = 'HOLE'
+_SHARED = 'SHARED'  # Frozen: cloned to the other file at the same offset
+_Segment = Tuple[int, int, Any]  # offset, length, key
+
+
+def _gen_extent_segments(extent: Extent) -> Iterator[_Segment]:
+    offset = 0
+    for leaf_offset, length, leaf in extent.gen_trimmed_leaves():
+        yield offset, length, _HOLE if leaf.content == Extent.Kind.HOLE else (
+            # Same leaf, same alignment -> same bytes.
+            id(leaf), leaf_offset - offset,
+        )
+        offset += length
+
+
+def _gen_chunk_segments(chunks, other_id: InodeID) -> Iterator[_Segment]:
+    chunk_offset = 0
+    for chunk in chunks:
+        if chunk.kind == Extent.Kind.HOLE:
+            yield chunk_offset, chunk.length, _HOLE
+            chunk_offset += chunk.length
+            continue
+        known = []  # (start, end, key) within the file
+        for cc in chunk.chunk_clones:
+            start = chunk_offset + cc.offset
+            if cc.clone.inode_id == other_id and cc.clone.offset == start:
+                known.append((start, start + cc.clone.length, _SHARED))
+        for ce in chunk.chunk_extents:
+            start = chunk_offset + ce.offset
+            known.append((
+                start, start + ce.length,
+                (ce.extent_id, ce.extent_offset - start),
+            ))
+        pos = chunk_offset
+        for start, end, key in sorted(known):
+            if end <= pos:
+                continue  # Clones to the same place may overlap
+            if start > pos:
+                yield pos, start - pos, None
+            else:
+                start = pos
+            yield start, end - start, key
+            pos = end
+        chunk_offset += chunk.length
+        if pos < chunk_offset:
+            yield pos, chunk_offset - pos, None
+
+
+def _gen_segments(ino, other_id: InodeID) -> Iterator[_Segment]:
+    extent = getattr(ino, 'extent', None)
+    if extent is not None:
+        return _gen_extent_segments(extent)
+    return _gen_chunk_segments(ino.chunks, other_id)
+
+
+def _gen_changed_ranges(
+    left: Iterable[_Segment], right: Iterable[_Segment],
+) -> Iterator[Tuple[int, int]]:
+    'Yields the maximal `(offset, length)` ranges where the keys differ.'
+    segs = [list(left), list(right)]
+    idxs = [0, 0]
+    boundaries = sorted({
+        o for side in segs for offset, length, _ in side
+            for o in (offset, offset + length)
+    })
+    changed_start = None
+    for start, end in zip(boundaries, boundaries[1:]):
+        keys = []
+        for side, (seg_list, idx) in enumerate(zip(segs, idxs)):
+            while (
+                idx < len(seg_list)
+                and seg_list[idx][0] + seg_list[idx][1] <= start
+            ):
+                idx += 1
+            idxs[side] = idx
+            keys.append(seg_list[idx][2] if idx < len(seg_list) else None)
+        if keys[0] is not None and keys[0] == keys[1]:
+            if changed_start is not None:
+                yield changed_start, start - changed_start
+                changed_start = None
+        elif changed_start is None:
+            changed_start = start
+    if changed_start is not None:
+        yield changed_start, boundaries[-1] - changed_start
+
+
+def _is_replaced(left_ino, right_ino) -> bool:
+    'True if the two inodes cannot be the same inode, changed in place.'
+    return left_ino.file_type != right_ino.file_type or any(
+        getattr(left_ino, attr, None) != getattr(right_ino, attr, None)
+            for attr in ('dest', 'dev')
+    )
+
+
+def _gen_inode_diffs(
+    path: bytes, left_ino, right_ino, left_id: InodeID, right_id: InodeID,
+) -> Iterator[SubvolumeDiff]:
+    'Compares two inodes of the same type, `path` is from the right.'
+    if left_ino is right_ino:
+        return  # Still shared with a snapshot
+    if left_ino.mode != right_ino.mode:
+        yield ChangedMode(path=path, old=left_ino.mode, new=right_ino.mode)
+    if left_ino.owner != right_ino.owner:
+        yield ChangedOwner(path=path, old=left_ino.owner, new=right_ino.owner)
+    if left_ino.utimes != right_ino.utimes:
+        yield ChangedUtimes(
+            path=path, old=left_ino.utimes, new=right_ino.utimes,
+        )
+    for name in sorted({*left_ino.xattrs, *right_ino.xattrs}):
+        old = left_ino.xattrs.get(name)
+        new = right_ino.xattrs.get(name)
+        if old != new:
+            yield ChangedXAttr(path=path, name=name, old=old, new=new)
+    if not stat.S_ISREG(left_ino.file_type):
+        return
+    if getattr(left_ino, 'extent', None) is not None and (
+        left_ino.extent is right_ino.extent
+    ):
+        return  # The whole data fork is shared
+    for offset, length in _gen_changed_ranges(
+        _gen_segments(left_ino, right_id), _gen_segments(right_ino, left_id),
+    ):
+        yield ChangedData(path=path, offset=offset, length=length)
+
+
+def _join(parent: bytes, name: bytes) -> bytes:
+    return name if parent == b'.' else parent + b'/' + name
+
+
+class _DirPair(NamedTuple):
+    'A side is None when the directory exists on only the other side.'
+    left_path: Optional[bytes]
+    left_entry: Optional[_PathEntry]
+    right_path: Optional[bytes]
+    right_entry: Optional[_PathEntry]
+
+
+class _Differ(NamedTuple):
+    left: Subvolume
+    right: Subvolume
+    same_inode_ids: bool
+
+    def _sole_path(self, subvol: Subvolume, int_id: int) -> Optional[bytes]:
+        'The path of `int_id`, if it has exactly one.'
+        paths = subvol.id_map.get_paths(
+            InodeID(id=int_id, inner_id_map=subvol.id_map.inner),
+        )
+        return paths.pop() if len(paths) == 1 else None
+
+    def _rename(self, int_id: int) -> Optional[Tuple[bytes, bytes]]:
+        'The left & right paths of an inode that was moved, or None.'
+        if not self.same_inode_ids:
+            return None
+        left_path = self._sole_path(self.left, int_id)
+        right_path = self._sole_path(self.right, int_id)
+        if left_path is None or right_path is None or left_path == right_path:
+            return None
+        if _is_replaced(
+            self.left.id_to_inode[int_id], self.right.id_to_inode[int_id],
+        ):
+            return None  # Only possible if the IDs are not, in fact, shared
+        return left_path, right_path
+
+    def gen_matched_diffs(
+        self,
+        left_path: bytes,
+        left_entry: _PathEntry,
+        right_path: bytes,
+        right_entry: _PathEntry,
+        pairs_out: List[_DirPair],
+    ):
+        '''
+        Diffs two inodes, adding their `_DirPair` to `pairs_out` if they
+        are directories.  Returns False if they are not comparable.
+        '''
+        left_ino = self.left.id_to_inode[left_entry.id]
+        right_ino = self.right.id_to_inode[right_entry.id]
+        if _is_replaced(left_ino, right_ino):
+            return False
+        yield from _gen_inode_diffs(
+            right_path, left_ino, right_ino,
+            InodeID(id=left_entry.id, inner_id_map=self.left.id_map.inner),
+            InodeID(id=right_entry.id, inner_id_map=self.right.id_map.inner),
+        )
+        if left_entry.name_to_child is not None:
+            pairs_out.append(
+                _DirPair(left_path, left_entry, right_path, right_entry),
+            )
+        return True
+
+    def gen_pair_diffs(
+        self, pair: _DirPair, pairs_out: List[_DirPair],
+    ) -> Iterator[SubvolumeDiff]:
+        'Diffs the children of `pair`, adding their pairs to `pairs_out`.'
+        left_children = {} if pair.left_entry is None \
+            else pair.left_entry.name_to_child
+        right_children = {} if pair.right_entry is None \
+            else pair.right_entry.name_to_child
+        for name in sorted({*left_children, *right_children}):
+            left_entry = left_children.get(name)
+            right_entry = right_children.get(name)
+            if left_entry is not None and right_entry is not None and (
+                not self.same_inode_ids or left_entry.id == right_entry.id
+            ):
+                if (yield from self.gen_matched_diffs(
+                    _join(pair.left_path, name), left_entry,
+                    _join(pair.right_path, name), right_entry,
+                    pairs_out,
+                )):
+                    continue
+            # Moved inodes are reported as `RenamedPath` at the destination.
+            if left_entry is not None and self._rename(left_entry.id) is None:
+                path = _join(pair.left_path, name)
+                yield RemovedPath(path=path)
+                if left_entry.name_to_child is not None:
+                    pairs_out.append(_DirPair(path, left_entry, None, None))
+            if right_entry is None:
+                continue
+            path = _join(pair.right_path, name)
+            rename = self._rename(right_entry.id)
+            if rename is None:
+                yield AddedPath(path=path)
+                if right_entry.name_to_child is not None:
+                    pairs_out.append(_DirPair(None, None, path, right_entry))
+            else:
+                left_path, _ = rename
+                yield RenamedPath(path=left_path, dest=path)
+                yield from self.gen_matched_diffs(
+                    left_path, self.left.id_map._get_entry(left_path),
+                    path, right_entry,
+                    pairs_out,
+                )
+
+
+def gen_subvolume_diffs(
+    left: Subvolume, right: Subvolume, *, same_inode_ids: bool=False,
+) -> Iterator[SubvolumeDiff]:
+    '''
+    Yields the differences that turn `left` into `right`.  Pass
+    `same_inode_ids=True` if one is a (possibly indirect) snapshot of the
+    other -- see the docblock.
+
+    The entries of each directory are reported together, in sorted order.
+    Then, its subdirectories are visited depth-first.  The contents of an
+    added or removed directory are reported as added or removed, too.
+    '''
+    differ = _Differ(left=left, right=right, same_inode_ids=same_inode_ids)
+    pairs = []
+    yield from differ.gen_matched_diffs(
+        b'.', left.id_map.root, b'.', right.id_map.root, pairs,
+    )
+    while pairs:
+        pair = pairs.pop()
+        child_pairs = []
+        yield from differ.gen_pair_diffs(pair, child_pairs)
+        pairs.extend(reversed(child_pairs))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+'''
+`SubvolumeFreezer` repeatedly `freeze`s one `Subvolume` while send-stream
+items are still being applied to it, e.g. to `assert_valid_and_complete`
+its inodes every so often during a long stream.  Each call returns the same
+result as `freeze(subvol)` would, but only re-freezes what changed since
+the previous call:
+
+ - Inodes & directory entries are memoized on their object identity,
+   together with their `Subvolume.id_to_version` or
+   `InodeIDMap.dir_id_to_version`.  An object that is shared with a
+   snapshot is copied before it is mutated, while an owned one is
+   mutated in place, and gets a new version.  Either way, the memo is
+   invalidated, so the freezer does not have to change the ownership of
+   any objects.  Directory versions also count changes to descendants, so
+   an unchanged version means that the whole subtree is unchanged.  The
+   root directory is re-frozen on every call.
+
+ - Chunks are recomputed only for files whose extent changed, and for the
+   files that shared a leaf extent with those, either before or after the
+   change.  `CloneIndex` finds these, and they are the only ones whose
+   `ChunkClone`s could have changed.
+
+ - The frozen `InodeIDMap` changes with every call, and the `InodeID`s of a
+   frozen `ChunkClone` must refer to it.  So, files with clones get
+   re-frozen every time, though their chunks are reused.
+
+Like `freeze(subvol)`, this only detects clones within the subvolume.
+Numbering shared extents, as `extent_ids=True` does, is not supported,
+since the numbering is global.  As with `SubvolumeHasher`, code mutating
+inodes directly (see `Subvolume.inodes`) will make the memo stale.
+'''
+from types import MappingProxyType
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .clone_index import CloneIndex
+from .extent import Extent
+from .extents_to_chunks import extents_to_chunks_with_clones
+from .freeze import freeze
+from .inode import Chunk, Inode
+from .inode_id import _PathEntry, InodeID, InodeIDMap
+from .subvolume import Subvolume
+
+
+class SubvolumeFreezer(NamedTuple):
+    subvol: Subvolume
+    # Indexes the leaf extents of `subvol`, as of the previous `freeze`.
+    clone_index: CloneIndex
+    # The extent of each file, as indexed by `clone_index`.
+    id_to_extent: Dict[int, Extent]
+    # Maps the inode ID to the inode (kept to check its identity, and to
+    # keep its `id()` valid), its version, its chunks, and its frozen
+    # variant.
+    id_to_inode_memo: Dict[
+        int, Tuple[Any, Optional[int], Optional[Sequence[Chunk]], Inode],
+    ]
+    # Maps a directory's inode ID to its `_PathEntry`, its version, and the
+    # frozen variant.
+    id_to_dir_memo: Dict[int, Tuple[_PathEntry, Optional[int], _PathEntry]]
+
+    @classmethod
+    def new(cls, subvol: Subvolume, **kwargs) -> 'SubvolumeFreezer':
+        kwargs.setdefault('clone_index', CloneIndex.new())
+        kwargs.setdefault('id_to_extent', {})
+        kwargs.setdefault('id_to_inode_memo', {})
+        kwargs.setdefault('id_to_dir_memo', {})
+        return cls(subvol=subvol, **kwargs)
+
+    def _gen_sharer_ids(self, ino_id: InodeID):
+        'Yields the int IDs of files sharing a leaf extent with `ino_id`.'
+        for leaf_id in self.clone_index.id_to_leaf_ids.get(ino_id, ()):
+            for other_id in self.clone_index.leaf_id_to_refs[leaf_id]:
+                yield other_id.id
+
+    def _update_chunks(self) -> Dict[int, Sequence[Chunk]]:
+        'Returns the new chunks of each file that may have new clones.'
+        inner = self.subvol.id_map.inner
+        id_to_inode = self.subvol.id_to_inode
+        changed_ids = self.id_to_extent.keys() - id_to_inode.keys()
+        for int_id, ino in id_to_inode.items():
+            if getattr(ino, 'extent', None) is not self.id_to_extent.get(
+                int_id
+            ):
+                changed_ids.add(int_id)
+        affected_ids: Set[int] = set()
+        for int_id in changed_ids:
+            ino_id = InodeID(id=int_id, inner_id_map=inner)
+            affected_ids.update(self._gen_sharer_ids(ino_id))  # Before
+            extent = getattr(id_to_inode.get(int_id), 'extent', None)
+            self.clone_index._set_extent(ino_id, extent)
+            if extent is None:
+                self.id_to_extent.pop(int_id, None)
+            else:
+                self.id_to_extent[int_id] = extent
+                affected_ids.add(int_id)
+                affected_ids.update(self._gen_sharer_ids(ino_id))  # After
+        # The chunks of the affected files depend on those that share
+        # their leaf extents, so compute those too, then discard them.
+        context_ids = set(affected_ids)
+        for int_id in affected_ids:
+            context_ids.update(self._gen_sharer_ids(
+                InodeID(id=int_id, inner_id_map=inner),
+            ))
+        return {
+            ino_id.id: chunks
+                for ino_id, chunks in extents_to_chunks_with_clones([
+                    (InodeID(id=int_id, inner_id_map=inner), extent)
+                        for int_id, extent in self.id_to_extent.items()
+                            if int_id in context_ids
+                ]) if ino_id.id in affected_ids
+        }
+
+    def _freeze_dir(self, entry: _PathEntry) -> _PathEntry:
+        version = self.subvol.id_map.dir_id_to_version.get(entry.id)
+        memo = self.id_to_dir_memo.get(entry.id)
+        if memo is not None and memo[0] is entry and memo[1] == version:
+            return memo[2]
+        frozen = entry._replace(name_to_child=MappingProxyType({
+            name: child if child.name_to_child is None
+                else self._freeze_dir(child)
+                    for name, child in entry.name_to_child.items()
+        }))
+        self.id_to_dir_memo[entry.id] = (entry, version, frozen)
+        return frozen
+
+    def freeze(self) -> Subvolume:
+        'Returns `freeze(self.subvol)`, see the docblock.'
+        subvol = self.subvol
+        id_map = subvol.id_map
+
+        _memo = {}
+        frozen_inner = id_map.inner._make([
+            freeze(id_map.inner.description, _memo=_memo),
+            # The reverse entries are immutable, see `_InnerInodeIDMap`.
+            MappingProxyType(dict(id_map.inner.id_to_reverse_entries)),
+        ])
+        # Our `InodeID`s become ones referring to `frozen_inner`.
+        _memo[id(id_map.inner)] = frozen_inner
+
+        id_to_chunks = self._update_chunks()
+        id_to_inode = {}
+        for int_id, ino in subvol.id_to_inode.items():
+            version = subvol.id_to_version.get(int_id)
+            memo = self.id_to_inode_memo.get(int_id)
+            if (
+                memo is None or memo[0] is not ino or memo[1] != version
+                    or int_id in id_to_chunks
+            ):
+                chunks = id_to_chunks.get(int_id)
+                if chunks is None and int_id in self.id_to_extent:
+                    # `_update_chunks` recomputes the chunks of any new or
+                    # changed extent, so this one was frozen before.
+                    if memo is None:  # pragma: no cover
+                        raise AssertionError(f'No chunks for inode {int_id}')
+                    chunks = memo[2]  # The inode changed, but not its extent
+                frozen = ino.freeze(_memo=_memo, chunks=chunks)
+                self.id_to_inode_memo[int_id] = (ino, version, chunks, frozen)
+            else:
+                chunks, frozen = memo[2:]
+                if chunks and any(c.chunk_clones for c in chunks):
+                    frozen = ino.freeze(_memo=_memo, chunks=chunks)
+            id_to_inode[int_id] = frozen
+        for int_id in self.id_to_inode_memo.keys() - id_to_inode.keys():
+            del self.id_to_inode_memo[int_id]
+
+        frozen_root = self._freeze_dir(id_map.root)
+        del self.id_to_dir_memo[id_map.root.id]  # Mutable, don't memoize
+        for int_id in (
+            self.id_to_dir_memo.keys() - id_map.inner.id_to_reverse_entries
+        ):
+            del self.id_to_dir_memo[int_id]
+
+        return Subvolume(
+            id_map=InodeIDMap(
+                inode_id_counter=None,
+                root=frozen_root,
+                inner=frozen_inner,
+                owned_dir_ids=frozenset(),
+                dir_id_to_version=MappingProxyType({}),
+            ),
+            id_to_inode=MappingProxyType(id_to_inode),
+            owned_inode_ids=frozenset(),
+            id_to_version=MappingProxyType({}),
+        )
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+'''
+`SubvolumeHasher` computes deterministic, content-addressed Merkle hashes
+of `Subvolume`s, e.g. to use as build-cache keys, or to recognize that two
+image layers are identical without sending either of them.
+
+## What is hashed
+
+ - Each inode hashes its own metadata (file type, mode, owner, utimes,
+   xattrs, device, symlink target), and the `Chunk` structure of its data
+   fork, i.e. the kind & length of each chunk.  Our model does not store
+   file contents, so there are none to hash.
+
+ - Each directory hashes its inode together with the sorted names & hashes
+   of its children.  Equal subtrees thus have equal hashes, regardless of
+   the inode IDs, or of the send-stream items that built them.
+
+ - Sharing is not a property of any one subtree, so the subvolume hash
+   combines the root directory's hash with a digest of:
+    * hardlinks: which paths lead to the same inode, and
+    * clones: which byte ranges of which files share storage.
+   Inodes are identified by `TraversalIDMaker` in the deterministic order
+   of `Subvolume.gather_bottom_up`.  Shared extents are numbered in order
+   of first appearance, just as in `extents_to_chunks_with_extent_ids`.
+   Only sharing within the subvolume counts, so a layer hashes the same
+   whether or not it shares storage with other layers.
+
+An unfrozen `Subvolume` hashes the same as its `freeze(..., extent_ids=True)`.
+`ChunkClone`s describe clones pairwise, so subvolumes frozen with clones
+hash differently, albeit just as deterministically.
+
+## Memoization
+
+The per-inode work is memoized on the inode object.  `Subvolume.snapshot`
+shares inodes with its parent, so re-hashing a snapshot only hashes the
+inodes that it changed, and then walks the tree to combine the memoized
+hashes.
+
+An `IncompleteInode` is only memoized once it is not in `owned_inode_ids`,
+since until then, `Subvolume.apply_item` may mutate it in place.  After
+that, it gets copied before any mutation -- but note that code mutating
+inodes directly (see `Subvolume.inodes`) will make the memo stale.  `Inode`s
+are immutable, and are always memoized.  The hasher keeps the memoized
+inodes alive, so that their `id()`s are not reused.
+'''
+import hashlib
+import itertools
+
+from collections import Counter
+from typing import Any, Dict, Hashable, NamedTuple, Tuple, Union
+
+from .coroutine_utils import while_not_exited
+from .inode import Inode
+from .inode_id import InodeID
+from .rendered_tree import TraversalIDMaker
+from .subvolume import Subvolume
+
+
+def _digest(pod: Any) -> bytes:
+    'The `repr` of plain-old-data tuples is unambiguous & deterministic.'
+    return hashlib.sha256(repr(pod).encode()).digest()
+
+
+class _ExtentRef(NamedTuple):
+    'A byte range of a file, which may share storage with other files.'
+    offset: int  # Into the file
+    length: int
+    # The `InodeID` of a `ChunkClone`, or else the `id()` of a leaf
+    # `Extent`, or the `extent_id` of a `ChunkExtent`.
+    key: Union[InodeID, int]
+    key_offset: int  # Into the clone's inode, or into the extent
+
+
+class _InodeHash(NamedTuple):
+    digest: bytes
+    refs: Tuple[_ExtentRef, ...]  # Sorted by `offset`
+
+
+def _chunks_and_refs(ino):
+    'The `Chunk` structure of the data fork, and its `_ExtentRef`s.'
+    refs = []
+    extent = getattr(ino, 'extent', None)
+    if extent is not None:
+        chunks = []
+        offset = 0
+        for leaf_offset, length, leaf in extent.gen_trimmed_leaves():
+            refs.append(_ExtentRef(
+                offset=offset,
+                length=length,
+                key=id(leaf),
+                key_offset=leaf_offset,
+            ))
+            offset += length
+            # Merge adjacent leaves of the same kind, as `freeze` does.
+            if chunks and chunks[-1][0] == leaf.content.name:
+                chunks[-1] = (leaf.content.name, chunks[-1][1] + length)
+            else:
+                chunks.append((leaf.content.name, length))
+        return tuple(chunks), refs
+    chunks = getattr(ino, 'chunks', None)
+    if chunks is None:
+        return None, refs
+    chunk_offset = 0
+    for chunk in chunks:
+        refs.extend(_ExtentRef(
+            offset=chunk_offset + cc.offset,
+            length=cc.clone.length,
+            key=cc.clone.inode_id,
+            key_offset=cc.clone.offset,
+        ) for cc in chunk.chunk_clones)
+        refs.extend(_ExtentRef(
+            offset=chunk_offset + ce.offset,
+            length=ce.length,
+            key=ce.extent_id,
+            key_offset=ce.extent_offset,
+        ) for ce in chunk.chunk_extents)
+        chunk_offset += chunk.length
+    return tuple((c.kind.name, c.length) for c in chunks), refs
+
+
+def _hash_inode(ino) -> _InodeHash:
+    chunks, refs = _chunks_and_refs(ino)
+    return _InodeHash(
+        digest=_digest((
+            ino.file_type,
+            ino.mode,
+            None if ino.owner is None else tuple(ino.owner),
+            None if ino.utimes is None else tuple(ino.utimes),
+            tuple(sorted(ino.xattrs.items())),
+            chunks,
+            getattr(ino, 'dev', None),
+            getattr(ino, 'dest', None),
+        )),
+        # Extent refs cannot overlap within a file, so this order is
+        # deterministic wherever it matters, see `_sharing_digest`.
+        refs=tuple(sorted(refs, key=lambda r: r.offset)),
+    )
+
+
+class SubvolumeHasher(NamedTuple):
+    # Maps `id(ino)` to the inode (to keep its `id()` valid) & its hash.
+    id_to_memo: Dict[int, Tuple[Any, _InodeHash]]
+
+    @classmethod
+    def new(cls, **kwargs) -> 'SubvolumeHasher':
+        kwargs.setdefault('id_to_memo', {})
+        return cls(**kwargs)
+
+    def _memoized_hash_inode(self, ino, *, memoize: bool) -> _InodeHash:
+        memo = self.id_to_memo.get(id(ino))
+        if memo is not None:
+            return memo[1]
+        ino_hash = _hash_inode(ino)
+        if memoize:
+            self.id_to_memo[id(ino)] = (ino, ino_hash)
+        return ino_hash
+
+    def hash_subvolume(self, subvol: Subvolume) -> bytes:
+        'Returns the digest of `subvol`, as described in the docblock.'
+        owned_ids = {
+            id(subvol.id_to_inode[int_id])
+                for int_id in subvol.owned_inode_ids
+        }
+        non_unique_ids = {
+            id(subvol.id_to_inode[int_id])
+                for int_id, rev_entries
+                    in subvol.id_map.inner.id_to_reverse_entries.items()
+                        if len(rev_entries) > 1
+        }
+        id_maker = TraversalIDMaker()
+        links = []  # Paths & traversal IDs of hardlinked inodes
+        trav_ids_and_refs = []  # Once per inode, in traversal order
+        with while_not_exited(subvol.gather_bottom_up()) as ctx:
+            result = None
+            while True:
+                path, ino, child_results = ctx.send(result)
+                ino_hash = self._memoized_hash_inode(
+                    ino,
+                    memoize=isinstance(ino, Inode) or id(ino) not in owned_ids,
+                )
+                trav_id = id_maker.next_with_nonce(id(ino))
+                if trav_id.refcount == 1 and ino_hash.refs:
+                    trav_ids_and_refs.append((trav_id.id, ino_hash.refs))
+                if id(ino) in non_unique_ids:
+                    links.append((path, trav_id.id))
+                # `gather_bottom_up` sends the children in sorted order.
+                result = ino_hash.digest if child_results is None else (
+                    _digest((ino_hash.digest, tuple(child_results.items())))
+                )
+        return _digest((ctx.result, tuple(links), _sharing_digest(
+            subvol, id_maker.nonce_to_id, trav_ids_and_refs,
+        )))
+
+
+def _sharing_digest(subvol, nonce_to_trav_id, trav_ids_and_refs) -> bytes:
+    'Hashes the clones within `subvol`, numbering the shared extents.'
+    key_to_count = Counter()
+    key_to_min_offset = {}
+    for _, refs in trav_ids_and_refs:
+        for ref in refs:
+            if not isinstance(ref.key, InodeID):
+                key_to_count[ref.key] += 1
+                key_to_min_offset[ref.key] = min(
+                    ref.key_offset,
+                    key_to_min_offset.get(ref.key, ref.key_offset),
+                )
+    key_to_extent_num: Dict[Hashable, int] = {}
+    extent_num_counter = itertools.count()
+    shared = []
+    for trav_id, refs in trav_ids_and_refs:
+        for ref in refs:
+            if isinstance(ref.key, InodeID):
+                if ref.key.inner_id_map is not subvol.id_map.inner:
+                    continue  # Sharing with other subvolumes is ignored
+                # A clone identifies its inode, and offset into the inode.
+                target = ('clone', nonce_to_trav_id[
+                    id(subvol.id_to_inode[ref.key.id])
+                ].id, ref.key_offset)
+            elif key_to_count[ref.key] > 1:
+                extent_num = key_to_extent_num.get(ref.key)
+                if extent_num is None:
+                    extent_num = next(extent_num_counter)
+                    key_to_extent_num[ref.key] = extent_num
+                # Offsets into the extent only matter relative to each
+                # other, since the extent's other bytes are unreferenced.
+                target = ('extent', extent_num, (
+                    ref.key_offset - key_to_min_offset[ref.key]
+                ))
+            else:
+                continue
+            shared.append((trav_id, ref.offset, ref.length, target))
+    return _digest(tuple(sorted(shared)))
@@ -9,17 +9,20 @@ directory tree the way they would be in a real btrfs filesystem.  This is
 not done here simply because we don't have a need to model it, but you can
 easily imagine a path-aware `Volume` abstraction on top of this.
 '''
-import copy
 import itertools
 
 from collections import Counter
 from types import MappingProxyType
 # Future: `deepfrozen` would let us lose the `new` methods on NamedTuples,
 # and avoid `deepcopy`.
-from typing import Iterator, Mapping, NamedTuple, Optional, Union
+from typing import Iterator, Mapping, NamedTuple, Optional, Tuple, Union
 
-from .extents_to_chunks import extents_to_chunks_with_clones
+from .clone_index import CloneIndex
+from .extents_to_chunks import (
+    extents_to_chunks_with_clones, extents_to_chunks_with_extent_ids,
+)
 from .freeze import freeze
+from .inode import Clone
 from .inode_id import InodeIDMap
 from .send_stream import SendStreamItem, SendStreamItems
 from .subvolume import Subvolume
@@ -63,8 +66,8 @@ class SubvolumeDescription(NamedTuple):
     owned by a `SubvolumeSet`, this object would ONLY be safely
     `deepcopy`able if we were to copy the `SubvolumeSet` in one call -- but
     we never do that.  When we make snapshots in `SubvolumeSetMutator`, we
-    have to work around this problem, since a naive implementation would
-    `deepcopy` this object via `Subvolume.id_map.description`.
+    do not copy the parent's description, but pass a new one to
+    `Subvolume.snapshot`.
     '''
     name: bytes
     id: SubvolumeID
@@ -95,11 +98,17 @@ class SubvolumeSet(NamedTuple):
     # each possible length of prefix (from 0 to `len(uuid)`).  When the name
     # is unique, `@uuid_prefix` is omitted (aka prefix length 0).
     name_uuid_prefix_counts: Mapping[str, int]
+    # Opt-in via `new(clone_index=CloneIndex.new())`, since keeping it
+    # current costs `SubvolumeSetMutator.apply_item` an extra path lookup
+    # per write or clone.  See `gen_clones`.  This is None once frozen,
+    # since frozen `Inode`s record their clones in `Chunk`s.
+    clone_index: Optional[CloneIndex]
 
     @classmethod
     def new(cls, **kwargs) -> 'SubvolumeSet':
         kwargs.setdefault('uuid_to_subvolume', {})
         kwargs.setdefault('name_uuid_prefix_counts', Counter())
+        kwargs.setdefault('clone_index', None)
         return cls(**kwargs)
 
     def get_by_rendered_id(self, rendered_id: str) -> Subvolume:
@@ -108,14 +117,20 @@ class SubvolumeSet(NamedTuple):
                 return subvol
         return None
 
-    def freeze(self, *, _memo) -> 'SubvolumeSet':
+    def freeze(self, *, _memo, extent_ids: bool=False) -> 'SubvolumeSet':
         '''
         Return a recursively immutable copy of `self`, replacing all
         `IncompleteInode`s by `Inode`s, and checking that all inode metadata
         are populated.  Correctly resolving cloned extents has to happen at
         the level of the `SubvolumeSet`.
+
+        With `extent_ids`, shared extents are numbered instead of listing
+        all their clones, see `extents_to_chunks_with_extent_ids`.
         '''
-        id_to_chunks = dict(extents_to_chunks_with_clones(
+        id_to_chunks = dict((
+            extents_to_chunks_with_extent_ids if extent_ids
+                else extents_to_chunks_with_clones
+        )(
             list(itertools.chain.from_iterable(
                 subvol._inode_ids_and_extents()
                     for subvol in self.uuid_to_subvolume.values()
@@ -129,8 +144,29 @@ class SubvolumeSet(NamedTuple):
             name_uuid_prefix_counts=freeze(
                 self.name_uuid_prefix_counts, _memo=_memo,
             ),
+            clone_index=None,
         )
 
+    def gen_clones(
+        self, subvol: Subvolume, path: bytes,
+    ) -> Iterator[Tuple[Clone, Clone]]:
+        '''
+        Without `freeze`ing, yields `(range of path, range of another file)`
+        for each part of the file at `path` in `subvol` that shares storage
+        with some file in this `SubvolumeSet`.  Refer to `clone_index.py`.
+
+        Requires a `clone_index`, see its comment.  The first query after
+        a `snapshot` indexes the whole new subvolume.
+        '''
+        if self.clone_index is None:
+            raise RuntimeError(
+                'Only a SubvolumeSet made with a clone_index has gen_clones'
+            )
+        ino_id = subvol.id_map.get_id(path)
+        if ino_id is None:
+            raise RuntimeError(f'No {path} in {subvol}')
+        return self.clone_index.gen_clones(self.uuid_to_subvolume, ino_id)
+
     def inodes(self) -> Iterator[Union['Inode', 'IncompleteInode']]:
         return itertools.chain.from_iterable(
             sv.inodes() for sv in self.uuid_to_subvolume.values()
@@ -151,6 +187,18 @@ class SubvolumeSet(NamedTuple):
         }
 
 
+# The path fields of the items that can change or delete a file's extent.
+# Other items leave files' extents alone, or create new, empty files.
+_ITEM_TO_EXTENT_CHANGING_FIELDS = {
+    SendStreamItems.write: ('path',),
+    SendStreamItems.truncate: ('path',),
+    SendStreamItems.update_extent: ('path',),
+    SendStreamItems.clone: ('path',),
+    SendStreamItems.unlink: ('path',),
+    SendStreamItems.rename: ('path', 'dest'),  # Can replace `dest`
+}
+
+
 class SubvolumeSetMutator(NamedTuple):
     '''
     A send-stream always starts with a command defining the subvolume,
@@ -186,19 +234,10 @@ class SubvolumeSetMutator(NamedTuple):
             name_uuid_prefix_counts=subvol_set.name_uuid_prefix_counts,
         )
         if isinstance(subvol_item, SendStreamItems.snapshot):
-            parent_subvol = subvol_set.uuid_to_subvolume[parent_id.uuid]
-            # `SubvolumeDescription` references a part `SubvolumeSet`, so it
-            # is not correctly `deepcopy`able as part of a `Subvolume`.  And
-            # we want to modify the `InodeIDMap`'s `description` in any
-            # case, so let's just bulk-replace the old description instance.
-            # This would not be sane if the old instance were of a type that
-            # may be interned by the runtime, like `int`, hence the assert.
-            assert isinstance(
-                parent_subvol.id_map.inner.description, SubvolumeDescription
+            # Copy-on-write, so this is cheap even for a huge parent.
+            subvol = subvol_set.uuid_to_subvolume[parent_id.uuid].snapshot(
+                description=description,
             )
-            subvol = copy.deepcopy(parent_subvol, memo={
-                id(parent_subvol.id_map.inner.description): description,
-            })
         else:
             subvol = Subvolume.new(
                 id_map=InodeIDMap.new(description=description),
@@ -217,11 +256,24 @@ class SubvolumeSetMutator(NamedTuple):
         return cls(subvolume=subvol, subvolume_set=subvol_set)
 
     def apply_item(self, item: SendStreamItem):
+        clone_index = self.subvolume_set.clone_index
+        # Look these up before `item` can unlink or rename them.
+        ino_ids = [
+            ino_id for ino_id in (
+                self.subvolume.id_map.get_id(getattr(item, field))
+                    for field in _ITEM_TO_EXTENT_CHANGING_FIELDS.get(
+                        type(item), ()
+                    )
+            ) if ino_id is not None
+        ] if clone_index is not None else ()
         if isinstance(item, SendStreamItems.clone):
             from_subvol = self.subvolume_set.uuid_to_subvolume.get(
                 item.from_uuid.decode()
             )
             if not from_subvol:
                 raise RuntimeError(f'Unknown from_uuid for {item}')
-            return self.subvolume.apply_clone(item, from_subvol)
-        return self.subvolume.apply_item(item)
+            self.subvolume.apply_clone(item, from_subvol)
+        else:
+            self.subvolume.apply_item(item)
+        for ino_id in ino_ids:
+            clone_index.mark_dirty(self.subvolume, ino_id)
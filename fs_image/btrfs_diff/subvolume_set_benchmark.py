@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+'''
+Measures how fast `SubvolumeSet`s are built from send-stream items, in
+one of these scenarios, chosen via `--benchmark`:
+
+  - `snapshot-chain`: Applies a synthetic base subvolume of `--num-files`
+    files, and then a chain of `--num-layers` incremental snapshots, each
+    of which just adds a file.  Reports the time spent on the chain, which
+    would be quadratic if each snapshot copied its parent.
+
+  - `path-lookups`: Applies both demo send-streams `--rounds` times.  Then,
+    in each subvolume, walks the tree via `map_bottom_up`, and lists every
+    path via `InodeIDMap.get_children`.  It also `repr`s the `InodeID` of
+    each path, which has to reconstruct all of its paths.
+
+  - `ingest`: Writes a base subvolume of `--num-files` files of
+    `--file-size` bytes, and `--num-layers` incremental snapshots, each of
+    which rewrites a different part of the files, to one send-stream file
+    per layer.  Times parsing them alone, and parsing & applying them with
+    `skip_data`, both serially, and via `parse_send_stream_files` with
+    `--parse-workers`.
+
+Prints the results as JSON.  To compare with an older implementation, run
+the same command from an older checkout -- the scenarios only use APIs
+that predate the optimizations that they measure.  Run from `fs_image`:
+
+buck run .../btrfs_diff:subvolume-set-benchmark -- \\
+    --benchmark snapshot-chain --num-files 2000 --num-layers 40
+buck run .../btrfs_diff:subvolume-set-benchmark -- \\
+    --benchmark path-lookups --rounds 200
+buck run .../btrfs_diff:subvolume-set-benchmark -- \\
+    --benchmark ingest --num-files 4000 --num-layers 8 --parse-workers 2
+'''
+import io
+import itertools
+import os
+import tempfile
+import time
+
+from typing import Iterable, Iterator, Optional, Sequence
+
+from .parse_send_stream import parse_send_stream, parse_send_streams
+from .send_stream import SendStreamItem, SendStreamItems
+from .subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+
+def _uuid(layer: int) -> bytes:
+    return b'00000000-0000-0000-0000-%012d' % layer
+
+
+def gen_synthetic_base_items(
+    *, num_files: int, file_size: int, files_per_dir: int=100,
+) -> Iterator[SendStreamItem]:
+    '''
+    A subvolume of `num_files` files of `file_size` bytes, with an owner,
+    mode & timestamps, `files_per_dir` to a directory.
+    '''
+    si = SendStreamItems
+    yield si.subvol(path=b'layer0', uuid=_uuid(0), transid=0)
+    data = b'x' * file_size
+    for i in range(num_files):
+        dir_path = b'd%d' % (i // files_per_dir)
+        if i % files_per_dir == 0:
+            yield si.mkdir(path=dir_path)
+        path = dir_path + b'/f%d' % i
+        yield si.mkfile(path=path)
+        if file_size:
+            yield si.write(path=path, offset=0, data=data)
+        yield si.chown(path=path, gid=0, uid=0)
+        yield si.chmod(path=path, mode=0o644)
+        yield si.utimes(path=path, atime=(i, 0), mtime=(i, 0), ctime=(i, 0))
+
+
+def snapshot_item(layer: int) -> SendStreamItem:
+    'Starts layer `layer` as an incremental snapshot of `layer - 1`.'
+    return SendStreamItems.snapshot(
+        path=b'layer%d' % layer, uuid=_uuid(layer), transid=layer,
+        parent_uuid=_uuid(layer - 1), parent_transid=layer - 1,
+    )
+
+
+def apply_items(
+    subvols: SubvolumeSet, items: Iterable[SendStreamItem],
+) -> SubvolumeSetMutator:
+    'Applies one send-stream, starting with a `subvol` or `snapshot`.'
+    items = iter(items)
+    mutator = SubvolumeSetMutator.new(subvols, next(items))
+    for item in items:
+        mutator.apply_item(item)
+    return mutator
+
+
+def _gen_paths_top_down(id_map, path: bytes=b'.') -> Iterator[bytes]:
+    yield path
+    for child_path in sorted(
+        id_map.get_children(id_map.get_id(path)) or (),
+    ):
+        yield from _gen_paths_top_down(id_map, child_path)
+
+
+def path_lookups_benchmark(*, rounds: int) -> dict:
+    from .tests.demo_sendstreams import gold_demo_sendstreams
+
+    gold = gold_demo_sendstreams()
+    create_items, mutate_items = (
+        list(parse_send_stream(io.BytesIO(gold[name]['sendstream'])))
+            for name in ['create_ops', 'mutate_ops']
+    )
+    start_time = time.monotonic()
+    subvol_list = []
+    for _ in range(rounds):
+        subvols = SubvolumeSet.new()
+        for items in [create_items, mutate_items]:
+            subvol_list.append(apply_items(subvols, items).subvolume)
+    apply_seconds = time.monotonic() - start_time
+
+    start_time = time.monotonic()
+    num_paths = 0
+    for subvol in subvol_list:
+        subvol.map_bottom_up(lambda ino: None)
+        for path in _gen_paths_top_down(subvol.id_map):
+            repr(subvol.id_map.get_id(path))
+            num_paths += 1
+    lookup_seconds = time.monotonic() - start_time
+    return {
+        'apply_seconds': round(apply_seconds, 3),
+        'lookup_seconds': round(lookup_seconds, 3),
+        'paths': num_paths,
+    }
+
+
+def snapshot_chain_benchmark(*, num_files: int, num_layers: int) -> dict:
+    subvols = SubvolumeSet.new()
+    start_time = time.monotonic()
+    apply_items(subvols, gen_synthetic_base_items(
+        num_files=num_files, file_size=0,
+    ))
+    base_seconds = time.monotonic() - start_time
+
+    start_time = time.monotonic()
+    for layer in range(1, num_layers + 1):
+        apply_items(subvols, [
+            snapshot_item(layer),
+            SendStreamItems.mkfile(path=b'layer%d' % layer),
+        ])
+    chain_seconds = time.monotonic() - start_time
+    return {
+        'base_seconds': round(base_seconds, 3),
+        'chain_seconds': round(chain_seconds, 3),
+        'seconds_per_snapshot': round(chain_seconds / num_layers, 5),
+    }
+
+
+def gen_synthetic_layer_items(
+    *, layer: int, num_files: int, num_layers: int, file_size: int,
+    files_per_dir: int=100,
+) -> Iterator[SendStreamItem]:
+    '''
+    A snapshot of `layer - 1`, which rewrites every `num_layers`-th file of
+    `gen_synthetic_base_items`, and updates its timestamps.
+    '''
+    si = SendStreamItems
+    yield snapshot_item(layer)
+    data = b'%d' % layer * file_size
+    for i in range(layer % num_layers, num_files, num_layers):
+        path = b'd%d/f%d' % (i // files_per_dir, i)
+        yield si.write(path=path, offset=0, data=data[:file_size])
+        yield si.utimes(
+            path=path, atime=(layer, 0), mtime=(layer, 0), ctime=(layer, 0),
+        )
+
+
+def _time_ingestion(
+    paths: Sequence[str], parse_workers: Optional[int],
+) -> dict:
+    start_time = time.monotonic()
+    num_items = 0
+    for path in paths:
+        with open(path, 'rb') as infile:
+            num_items += sum(
+                1 for _ in parse_send_streams(infile, skip_data=True)
+            )
+    parse_seconds = time.monotonic() - start_time
+
+    start_time = time.monotonic()
+    subvols = SubvolumeSet.new()
+    for path in paths:
+        with open(path, 'rb') as infile:
+            for _, stream in itertools.groupby(
+                parse_send_streams(infile, skip_data=True),
+                key=lambda idx_and_item: idx_and_item[0],
+            ):
+                apply_items(subvols, (item for _, item in stream))
+    serial_seconds = time.monotonic() - start_time
+    results = {
+        'items': num_items,
+        'parse_seconds': round(parse_seconds, 3),
+        'serial_ingest_seconds': round(serial_seconds, 3),
+    }
+    if parse_workers is None:
+        return results
+
+    # Imported here, so that the other measurements still work in checkouts
+    # that predate `parse_send_stream_files`.
+    from .parse_send_stream import parse_send_stream_files
+    start_time = time.monotonic()
+    subvols = SubvolumeSet.new()
+    for _, stream in itertools.groupby(
+        parse_send_stream_files(
+            paths, num_workers=parse_workers, skip_data=True,
+        ),
+        key=lambda idxs_and_item: idxs_and_item[:2],
+    ):
+        apply_items(subvols, (item for _, _, item in stream))
+    results['pooled_ingest_seconds'] = round(
+        time.monotonic() - start_time, 3,
+    )
+    return results
+
+
+def ingest_benchmark(
+    *, num_files: int, num_layers: int, file_size: int,
+    parse_workers: Optional[int],
+) -> dict:
+    from .write_send_stream import write_send_stream
+
+    with tempfile.TemporaryDirectory() as td:
+        paths = []
+        for layer in range(num_layers + 1):
+            paths.append(os.path.join(td, f'layer{layer}'))
+            with open(paths[-1], 'wb') as outfile:
+                write_send_stream(gen_synthetic_base_items(
+                    num_files=num_files, file_size=file_size,
+                ) if layer == 0 else gen_synthetic_layer_items(
+                    layer=layer, num_files=num_files, num_layers=num_layers,
+                    file_size=file_size,
+                ), outfile)
+        num_bytes = sum(os.path.getsize(p) for p in paths)
+        return {
+            'megabytes': round(num_bytes / 2 ** 20, 1),
+            **_time_ingestion(paths, parse_workers),
+        }
+
+
+# Not unit-tested, it is a tool for measuring `SubvolumeSet`.
+if __name__ == '__main__':  # pragma: no cover
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        '--benchmark', required=True,
+        choices=['ingest', 'path-lookups', 'snapshot-chain'],
+    )
+    parser.add_argument(
+        '--num-files', type=int, default=2000,
+        help='The number of files in the base subvolume.',
+    )
+    parser.add_argument(
+        '--num-layers', type=int, default=40,
+        help='The number of incremental snapshots on top of the base.',
+    )
+    parser.add_argument(
+        '--file-size', type=int, default=2048,
+        help='`ingest` writes this many bytes to each file.',
+    )
+    parser.add_argument(
+        '--parse-workers', type=int,
+        help='`ingest` also times `parse_send_stream_files` with this many '
+            'workers.',
+    )
+    parser.add_argument(
+        '--rounds', type=int, default=200,
+        help='`path-lookups` applies the demo send-streams this many times.',
+    )
+    opts = parser.parse_args()
+
+    if opts.benchmark == 'ingest':
+        result = ingest_benchmark(
+            num_files=opts.num_files, num_layers=opts.num_layers,
+            file_size=opts.file_size, parse_workers=opts.parse_workers,
+        )
+    elif opts.benchmark == 'path-lookups':
+        result = path_lookups_benchmark(rounds=opts.rounds)
+    else:
+        result = snapshot_chain_benchmark(
+            num_files=opts.num_files, num_layers=opts.num_layers,
+        )
+    print(json.dumps(result, indent=4))
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+'''
+Saves a frozen `SubvolumeSet` to a compact file, and loads it back lazily
+via `mmap`, so that repeated analyses of the same send-streams need not
+re-parse & re-`freeze` them.
+
+    write_subvolume_set(freeze(subvols), outfile)
+    ...
+    subvols = load_subvolume_set(path)  # Takes milliseconds
+
+The loaded `SubvolumeSet` has the same read-only API as the frozen one:
+its `Subvolume`s, `InodeIDMap`s & `Inode`s are the usual classes, but the
+mappings inside of them decode their values from the file on first
+access.  So, `inode_at_path`, `render`, `gen_rendered_inodes`, etc, only
+pay for the inodes & directories that they actually visit.
+
+## Format
+
+ - `_MAGIC`, then the records & tables, then the header, and lastly
+   the header's offset as a little-endian `uint64`.
+
+ - A record is a tuple of plain-old-data in `marshal` format, which is
+   compact, and fast to load.  A record is an `Inode`, a directory
+   listing, or the set of `_ReversePathEntry`s of an inode.  Records are
+   written once per distinct content, so the inodes & directories that
+   snapshots share with their parents take no extra space.  Directory
+   listings refer to their subdirectories' records, so an unchanged
+   subtree is one shared record, too.
+
+ - A table maps the `int` inode IDs of a subvolume to the offsets of
+   records.  It is an array of native-endian `uint64`s indexed by the
+   ID, with 0 for missing IDs, plus an array of the IDs in their
+   original order.  These are read in place from the `mmap`.  Equal
+   arrays are also written just once.
+
+ - The header is a `marshal`ed tuple with the subvolume descriptions, and
+   the offsets of their tables & root directories.
+
+`Clone`s refer to their subvolume by its index in the header, so a
+`SubvolumeSet` can only be written together with all the subvolumes that
+its clones refer to.
+
+Like `pickle`, `marshal` is not secure against maliciously constructed
+data, so only load files that you wrote.  The files are also specific to
+the Python version & byte order that wrote them.
+'''
+import array
+import marshal
+import mmap
+import struct
+import sys
+
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Any, BinaryIO, Callable, Dict, List, NamedTuple, Tuple
+
+from .extent import Extent
+from .inode import (
+    Chunk, ChunkClone, ChunkExtent, Clone, Inode, InodeOwner, InodeUtimes,
+)
+from .inode_id import (
+    InodeID, InodeIDMap, _InnerInodeIDMap, _PathEntry, _ReversePathEntry,
+)
+from .subvolume import Subvolume
+from .subvolume_set import SubvolumeDescription, SubvolumeID, SubvolumeSet
+
+_MAGIC = b'btrfs_diff.SubvolumeSet\n'  # 24 bytes, keeps the tables aligned
+_VERSION = 1
+_HEADER_OFFSET = struct.Struct('<Q')
+_OFFSET_TYPECODE = 'Q'  # `array` & `memoryview.cast` both use this
+
+
+def _inode_to_pod(ino: Inode, inner_id_to_idx: Mapping) -> Tuple[Any, ...]:
+    def subvol_idx(inode_id: InodeID) -> int:
+        idx = inner_id_to_idx.get(id(inode_id.inner_id_map))
+        if idx is None:
+            raise RuntimeError(f'{inode_id} is not in the SubvolumeSet')
+        return idx
+
+    if not isinstance(ino, Inode):
+        raise RuntimeError(f'Only frozen subvolumes can be written: {ino}')
+    return (
+        ino.file_type,
+        ino.mode,
+        None if ino.owner is None else tuple(ino.owner),
+        None if ino.utimes is None else tuple(ino.utimes),
+        tuple(ino.xattrs.items()),
+        None if ino.chunks is None else tuple((
+            chunk.kind.name,
+            chunk.length,
+            # Sorted, so that equal inodes make equal records.
+            tuple(sorted(
+                (
+                    cc.offset, subvol_idx(cc.clone.inode_id),
+                    cc.clone.inode_id.id, cc.clone.offset, cc.clone.length,
+                ) for cc in chunk.chunk_clones
+            )),
+            tuple(sorted(tuple(ce) for ce in chunk.chunk_extents)),
+        ) for chunk in ino.chunks),
+        ino.dev,
+        ino.dest,
+    )
+
+
+def _pod_to_inode(pod: Tuple[Any, ...], inode_id: Callable) -> Inode:
+    file_type, mode, owner, utimes, xattrs, chunks, dev, dest = pod
+    return Inode(
+        file_type=file_type,
+        mode=mode,
+        owner=None if owner is None else InodeOwner(*owner),
+        utimes=None if utimes is None else InodeUtimes(*utimes),
+        xattrs=MappingProxyType(dict(xattrs)),
+        chunks=None if chunks is None else tuple(
+            Chunk(
+                kind=Extent.Kind[kind],
+                length=length,
+                # Positional, since there can be very many of these.
+                chunk_clones=frozenset(
+                    ChunkClone(offset, Clone(
+                        inode_id(idx, int_id), clone_offset, clone_length,
+                    )) for offset, idx, int_id, clone_offset, clone_length
+                        in clones
+                ),
+                chunk_extents=frozenset(ChunkExtent(*ce) for ce in extents),
+            ) for kind, length, clones, extents in chunks
+        ),
+        dev=dev,
+        dest=dest,
+    )
+
+
+class _Writer:
+    'Writes each distinct record once, and tracks the file position.'
+
+    def __init__(self, outfile: BinaryIO):
+        self.outfile = outfile
+        self.position = 0
+        self.record_to_offset: Dict[bytes, int] = {}
+        # Unchanged snapshots have the same tables as their parents.
+        self.offsets_to_offset: Dict[bytes, int] = {}
+        # Frozen snapshots share directory entries, so this spares us from
+        # re-encoding the subtrees that they have in common.
+        self.id_to_dir_offset: Dict[int, int] = {}
+
+    def write(self, data: bytes) -> int:
+        offset = self.position
+        self.outfile.write(data)
+        self.position += len(data)
+        return offset
+
+    def write_record(self, pod: Tuple[Any, ...]) -> int:
+        data = marshal.dumps(pod)
+        offset = self.record_to_offset.get(data)
+        if offset is None:
+            offset = self.write(data)
+            self.record_to_offset[data] = offset
+        return offset
+
+    def write_offsets(self, offsets: array.array) -> Tuple[int, int]:
+        data = offsets.tobytes()
+        offset = self.offsets_to_offset.get(data)
+        if offset is None:
+            self.write(b'\0' * (-self.position % offsets.itemsize))  # Align
+            offset = self.write(data)
+            self.offsets_to_offset[data] = offset
+        return offset, len(offsets)
+
+    def write_table(self, int_id_to_record: Mapping) -> Tuple[int, ...]:
+        'Takes `int_id -> pod`, returns the table position for the header.'
+        int_ids = array.array(_OFFSET_TYPECODE, int_id_to_record.keys())
+        offsets = array.array(
+            _OFFSET_TYPECODE, bytes(8 * (max(int_ids, default=-1) + 1)),
+        )
+        for int_id, pod in int_id_to_record.items():
+            offsets[int_id] = self.write_record(pod)
+        return (*self.write_offsets(int_ids), *self.write_offsets(offsets))
+
+    def write_dir(self, entry: _PathEntry) -> int:
+        'Writes the directory listings under `entry`, children first.'
+        # A stack instead of recursion, so that deep trees are fine.
+        stack = [entry]
+        while stack:
+            entry = stack[-1]
+            unwritten_subdirs = [
+                child for child in entry.name_to_child.values()
+                    if child.name_to_child is not None
+                        and id(child) not in self.id_to_dir_offset
+            ]
+            if unwritten_subdirs:
+                stack.extend(unwritten_subdirs)
+                continue
+            stack.pop()
+            self.id_to_dir_offset[id(entry)] = self.write_record(tuple(
+                (name, child.id, 0 if child.name_to_child is None
+                    else self.id_to_dir_offset[id(child)])
+                    for name, child in entry.name_to_child.items()
+            ))
+        return self.id_to_dir_offset[id(entry)]
+
+
+def write_subvolume_set(subvols: SubvolumeSet, outfile: BinaryIO) -> None:
+    'Writes a frozen `SubvolumeSet` in the format of the module docblock.'
+    inner_id_to_idx = {
+        id(subvol.id_map.inner): idx
+            for idx, subvol in enumerate(subvols.uuid_to_subvolume.values())
+    }
+    writer = _Writer(outfile)
+    writer.write(_MAGIC)
+    subvol_headers = []
+    for subvol in subvols.uuid_to_subvolume.values():
+        desc = subvol.id_map.inner.description
+        if not isinstance(desc, SubvolumeDescription):
+            raise RuntimeError(f'{desc} is not a SubvolumeDescription')
+        subvol_headers.append((
+            desc.id.uuid,
+            desc.id.transid,
+            desc.name,
+            None if desc.parent_id is None else tuple(desc.parent_id),
+            subvol.id_map.root.id,
+            writer.write_dir(subvol.id_map.root),
+            writer.write_table({
+                int_id: _inode_to_pod(ino, inner_id_to_idx)
+                    for int_id, ino in subvol.id_to_inode.items()
+            }),
+            writer.write_table({
+                int_id: tuple(sorted(tuple(e) for e in rev_entries))
+                    for int_id, rev_entries
+                        in subvol.id_map.inner.id_to_reverse_entries.items()
+            }),
+        ))
+    header_offset = writer.write(marshal.dumps((
+        _VERSION,
+        sys.byteorder,
+        tuple(subvols.name_uuid_prefix_counts.items()),
+        tuple(subvol_headers),
+    )))
+    writer.write(_HEADER_OFFSET.pack(header_offset))
+
+
+class _LazyIDMapping(Mapping):
+    'Maps `int` inode IDs to values decoded from a table on first access.'
+
+    def __init__(self, view: memoryview, table, decode: Callable):
+        ids_pos, num_ids, offsets_pos, num_offsets = table
+        self._ids = view[ids_pos:ids_pos + 8 * num_ids].cast(_OFFSET_TYPECODE)
+        self._offsets = view[
+            offsets_pos:offsets_pos + 8 * num_offsets
+        ].cast(_OFFSET_TYPECODE)
+        self._decode = decode
+        # Caching by ID, not by offset, keeps equal inodes distinct objects,
+        # since clients detect hardlinks via `id(ino)`.
+        self._int_id_to_value = {}
+
+    def __getitem__(self, int_id):
+        value = self.get(int_id)
+        if value is None:
+            raise KeyError(int_id)
+        return value
+
+    # Faster than the `Mapping` mixin, which catches `KeyError`.
+    def get(self, int_id, default=None):
+        value = self._int_id_to_value.get(int_id)
+        if value is None:
+            if not (
+                isinstance(int_id, int) and 0 <= int_id < len(self._offsets)
+            ) or not self._offsets[int_id]:
+                return default
+            value = self._decode(self._offsets[int_id])
+            self._int_id_to_value[int_id] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class _LazyDirectory(Mapping):
+    'The `name_to_child` of a `_PathEntry`, decoded on first access.'
+
+    def __init__(self, loader: '_Loader', offset: int):
+        self._loader = loader
+        self._offset = offset
+        self._name_to_child = None
+
+    def _children(self) -> Dict[bytes, _PathEntry]:
+        if self._name_to_child is None:
+            self._name_to_child = {
+                name: _PathEntry(
+                    id=int_id,
+                    name_to_child=self._loader.directory(dir_offset)
+                        if dir_offset else None,
+                ) for name, int_id, dir_offset
+                    in self._loader.load_record(self._offset)
+            }
+        return self._name_to_child
+
+    def __getitem__(self, name):
+        return self._children()[name]
+
+    # `InodeIDMap` looks up paths with `.get`, so skip the `Mapping` mixin.
+    def get(self, name, default=None):
+        return self._children().get(name, default)
+
+    def __iter__(self):
+        return iter(self._children())
+
+    def __len__(self):
+        return len(self._children())
+
+
+class _Loader(NamedTuple):
+    view: memoryview
+    inners: List[_InnerInodeIDMap]  # Indexed like the header's subvolumes
+    # Directory listings & reverse entries are immutable, and may be
+    # shared by the subvolumes, just as they are by frozen snapshots.
+    offset_to_directory: Dict[int, _LazyDirectory]
+    offset_to_reverse_entries: Dict[int, frozenset]
+    # Clones refer to the same few inodes over & over.
+    idx_and_int_id_to_inode_id: Dict[Tuple[int, int], InodeID]
+
+    def load_record(self, offset: int) -> Tuple[Any, ...]:
+        return marshal.loads(self.view[offset:])  # Ignores trailing bytes
+
+    def directory(self, offset: int) -> _LazyDirectory:
+        directory = self.offset_to_directory.get(offset)
+        if directory is None:
+            directory = _LazyDirectory(self, offset)
+            self.offset_to_directory[offset] = directory
+        return directory
+
+    def reverse_entries(self, offset: int) -> frozenset:
+        rev_entries = self.offset_to_reverse_entries.get(offset)
+        if rev_entries is None:
+            rev_entries = frozenset(
+                _ReversePathEntry(*e) for e in self.load_record(offset)
+            )
+            self.offset_to_reverse_entries[offset] = rev_entries
+        return rev_entries
+
+    def inode_id(self, idx: int, int_id: int) -> InodeID:
+        inode_id = self.idx_and_int_id_to_inode_id.get((idx, int_id))
+        if inode_id is None:
+            inode_id = InodeID(id=int_id, inner_id_map=self.inners[idx])
+            self.idx_and_int_id_to_inode_id[(idx, int_id)] = inode_id
+        return inode_id
+
+    def inode(self, offset: int) -> Inode:
+        return _pod_to_inode(self.load_record(offset), self.inode_id)
+
+
+def load_subvolume_set(path: str) -> SubvolumeSet:
+    '''
+    Maps a file from `write_subvolume_set` into memory, and returns its
+    `SubvolumeSet`.  This only decodes the header, everything else is
+    decoded on demand, see the module docblock.
+    '''
+    with open(path, 'rb') as infile:
+        size = infile.seek(0, 2)
+        if size < len(_MAGIC) + _HEADER_OFFSET.size:
+            raise RuntimeError(f'{path} is not a SubvolumeSet file')
+        # The mapping remains valid after the file is closed.
+        view = memoryview(
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        )
+    if view[:len(_MAGIC)] != _MAGIC:
+        raise RuntimeError(f'{path} is not a SubvolumeSet file')
+    header_offset, = _HEADER_OFFSET.unpack(view[-_HEADER_OFFSET.size:])
+    version, byteorder, prefix_counts, subvol_headers = \
+        marshal.loads(view[header_offset:])
+    if (version, byteorder) != (_VERSION, sys.byteorder):
+        raise RuntimeError(
+            f'Cannot load {path}: format {version} & {byteorder} byte order '
+            f'are not {_VERSION} & {sys.byteorder}'
+        )
+
+    name_uuid_prefix_counts = MappingProxyType(dict(prefix_counts))
+    loader = _Loader(
+        view=view, inners=[], offset_to_directory={},
+        offset_to_reverse_entries={}, idx_and_int_id_to_inode_id={},
+    )
+    uuid_to_subvolume = {}
+    for (
+        uuid, transid, name, parent_id, root_id, root_offset, inode_table,
+        rev_entries_table,
+    ) in subvol_headers:
+        loader.inners.append(_InnerInodeIDMap(
+            description=SubvolumeDescription(
+                name=name,
+                id=SubvolumeID(uuid=uuid, transid=transid),
+                parent_id=None if parent_id is None
+                    else SubvolumeID(*parent_id),
+                name_uuid_prefix_counts=name_uuid_prefix_counts,
+            ),
+            id_to_reverse_entries=_LazyIDMapping(
+                view, rev_entries_table, loader.reverse_entries,
+            ),
+        ))
+        uuid_to_subvolume[uuid] = Subvolume(
+            id_map=InodeIDMap(
+                inode_id_counter=None,  # As in `InodeIDMap.freeze`
+                root=_PathEntry(
+                    id=root_id, name_to_child=loader.directory(root_offset),
+                ),
+                inner=loader.inners[-1],
+                owned_dir_ids=frozenset(),
+                dir_id_to_version=MappingProxyType({}),
+            ),
+            id_to_inode=_LazyIDMapping(view, inode_table, loader.inode),
+            # Nothing may mutate the loaded inodes, so none are "owned".
+            owned_inode_ids=frozenset(),
+            id_to_version=MappingProxyType({}),
+        )
+    return SubvolumeSet(
+        uuid_to_subvolume=MappingProxyType(uuid_to_subvolume),
+        name_uuid_prefix_counts=name_uuid_prefix_counts,
+        clone_index=None,
+    )
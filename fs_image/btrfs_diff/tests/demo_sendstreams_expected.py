@@ -11,14 +11,14 @@ the constants below.  The actual send-stream may need to change if the
 import logging
 import os
 
+from collections import Counter
 from typing import List, Sequence, Tuple
 
 from . import render_subvols
 from .subvolume_utils import InodeRepr
 
 from ..send_stream import (
-    get_frequency_of_selinux_xattrs, ItemFilters, SendStreamItem,
-    SendStreamItems,
+    ItemFilters, ItemTransforms, SendStreamItem, SendStreamItems,
 )
 
 
@@ -49,23 +49,22 @@ def get_filtered_and_expected_items(
 ) -> Tuple[List[SendStreamItem], List[SendStreamItem]]:
 
     # Our test program does not touch the SELinux context, so if it's
-    # set, it will be set to the default, and we can just filter out the
-    # most frequent value.  We don't want to drop all SELinux attributes
-    # blindly because having varying contexts suggests something broken
-    # about the test or our environment.
-    selinux_freqs = get_frequency_of_selinux_xattrs(items)
-    assert len(selinux_freqs) > 0  # Our `gold` has SELinux attrs
-    max_name, _count = max(selinux_freqs.items(), key=lambda p: p[1])
-    logging.info(f'This test ignores SELinux xattrs set to {max_name}')
-    filtered_items = items
-    filtered_items = ItemFilters.selinux_xattr(
-        filtered_items,
-        discard_fn=lambda _path, ctx: ctx == max_name,
-    )
-    filtered_items = ItemFilters.normalize_utimes(
-        filtered_items, start_time=build_start_time, end_time=build_end_time,
-    )
-    filtered_items = list(filtered_items)
+    # set, it will be set to the default, and we can just filter it out.
+    # We don't want to drop SELinux attributes blindly because having
+    # varying contexts suggests something broken about the test or our
+    # environment, so we count them in the same pass, and check.
+    selinux_freqs = Counter()
+    filtered_items = list(ItemFilters.fused(
+        items,
+        ItemTransforms.count_selinux_xattrs(selinux_freqs),
+        ItemTransforms.selinux_xattr(discard_fn=lambda _path, _ctx: True),
+        ItemTransforms.normalize_utimes(
+            start_time=build_start_time, end_time=build_end_time,
+        ),
+    ))
+    # Our `gold` has SELinux attrs, all set to the default.
+    assert len(selinux_freqs) == 1, selinux_freqs
+    logging.info(f'This test ignores SELinux xattrs set to {selinux_freqs}')
 
     di = SendStreamItems
 
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import copy
+import itertools
+import unittest
+
+from io import BytesIO
+
+from ..clone_index import CloneIndex
+from ..freeze import freeze
+from ..parse_dump import SendStreamItems
+from ..parse_send_stream import parse_send_stream
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+
+def _repr_clones(subvols, subvol, path):
+    return sorted(
+        (repr(mine), repr(theirs))
+            for mine, theirs in subvols.gen_clones(subvol, path)
+    )
+
+
+def _chunk_clones_by_file_offset(frozen_subvol, path):
+    'The same information as `gen_clones`, but from a frozen `Subvolume`.'
+    ino_id = frozen_subvol.id_map.get_id(path)
+    chunk_offset = 0
+    res = []
+    for chunk in frozen_subvol.id_to_inode[ino_id.id].chunks:
+        for cc in chunk.chunk_clones:
+            res.append((
+                f'{ino_id}:{chunk_offset + cc.offset}+{cc.clone.length}',
+                repr(cc.clone),
+            ))
+        chunk_offset += chunk.length
+    return sorted(res)
+
+
+class CloneIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def test_clone_index(self):
+        si = SendStreamItems
+        subvols = SubvolumeSet.new(clone_index=CloneIndex.new())
+        cat_mutator = SubvolumeSetMutator.new(subvols, si.subvol(
+            path=b'cat', uuid=b'abe', transid=3,
+        ))
+        cat = cat_mutator.subvolume
+        cat_mutator.apply_item(si.mkfile(path=b'from'))
+        cat_mutator.apply_item(si.write(path=b'from', offset=0, data=b'hi!'))
+        cat_mutator.apply_item(si.mkfile(path=b'to'))
+        self.assertEqual([], _repr_clones(subvols, cat, b'from'))
+
+        # Once indexed, `cat` is kept up-to-date as items are applied.
+        clone = si.clone(
+            path=b'to', offset=0, len=2, from_uuid=b'abe', from_transid=3,
+            from_path=b'from', clone_offset=1,
+        )
+        cat_mutator.apply_item(clone)
+        self.assertEqual(
+            [('cat@from:1+2', 'cat@to:0+2')],
+            _repr_clones(subvols, cat, b'from'),
+        )
+        self.assertEqual(
+            [('cat@to:0+2', 'cat@from:1+2')],
+            _repr_clones(subvols, cat, b'to'),
+        )
+
+        # A file can share storage with itself.
+        cat_mutator.apply_item(clone._replace(path=b'from', offset=3))
+        self.assertEqual([
+            ('cat@from:1+2', 'cat@from:3+2'),
+            ('cat@from:1+2', 'cat@to:0+2'),
+            ('cat@from:3+2', 'cat@from:1+2'),
+            ('cat@from:3+2', 'cat@to:0+2'),
+        ], _repr_clones(subvols, cat, b'from'))
+
+        # Overwriting some of the shared bytes un-shares them.
+        cat_mutator.apply_item(si.write(path=b'from', offset=2, data=b'x'))
+        cat_mutator.apply_item(si.truncate(path=b'from', size=3))
+        self.assertEqual(
+            [('cat@from:1+1', 'cat@to:0+1')],
+            _repr_clones(subvols, cat, b'from'),
+        )
+
+        # A snapshot shares everything, and is indexed on demand.
+        tiger_mutator = SubvolumeSetMutator.new(subvols, si.snapshot(
+            path=b'tiger', uuid=b'ee', transid=7,
+            parent_uuid=b'abe', parent_transid=3,
+        ))
+        tiger = tiger_mutator.subvolume
+        self.assertEqual([
+            ('cat@to:0+1', 'cat@from:1+1'),
+            ('cat@to:0+1', 'tiger@from:1+1'),
+            ('cat@to:0+2', 'tiger@to:0+2'),
+        ], _repr_clones(subvols, cat, b'to'))
+
+        # `rename` over a file removes the destination's references.
+        tiger_mutator.apply_item(si.rename(path=b'from', dest=b'to'))
+        self.assertEqual([
+            ('tiger@to:0+2', 'cat@from:0+2'),
+            ('tiger@to:1+1', 'cat@to:0+1'),
+            ('tiger@to:2+1', 'cat@from:2+1'),
+        ], _repr_clones(subvols, tiger, b'to'))
+        tiger_mutator.apply_item(si.unlink(path=b'to'))
+        self.assertEqual(
+            [('cat@to:0+1', 'cat@from:1+1')],
+            _repr_clones(subvols, cat, b'to'),
+        )
+
+        # `far` and `to` reference different bytes of the same leaf extent.
+        cat_mutator.apply_item(si.mkfile(path=b'far'))
+        cat_mutator.apply_item(clone._replace(
+            path=b'far', len=1, clone_offset=0,
+        ))
+        self.assertEqual(
+            [('cat@far:0+1', 'cat@from:0+1')],
+            _repr_clones(subvols, cat, b'far'),
+        )
+
+        # A copy gets a fresh index, which answers the same.
+        subvols_copy = copy.deepcopy(subvols)
+        self.assertEqual({}, subvols_copy.clone_index.id_to_leaf_ids)
+        self.assertEqual(
+            [('cat@to:0+1', 'cat@from:1+1')],
+            _repr_clones(
+                subvols_copy,
+                subvols_copy.uuid_to_subvolume['abe'],
+                b'to',
+            ),
+        )
+
+    def test_gold_demo_sendstreams(self):
+        gold = gold_demo_sendstreams()
+        subvols = SubvolumeSet.new(clone_index=CloneIndex.new())
+        for op in ['create_ops', 'mutate_ops']:
+            items = parse_send_stream(BytesIO(gold[op]['sendstream']))
+            mutator = SubvolumeSetMutator.new(subvols, next(items))
+            for item in items:
+                mutator.apply_item(item)
+            # Query mid-stream, so that `mutate_ops` exercises the index
+            # updates, rather than just the initial indexing.
+            frozen = freeze(subvols)
+            for uuid, subvol in subvols.uuid_to_subvolume.items():
+                frozen_subvol = frozen.uuid_to_subvolume[uuid]
+                for path in itertools.chain.from_iterable(
+                    subvol.id_map.get_paths(ino_id)
+                        for ino_id, _ in subvol._inode_ids_and_extents()
+                ):
+                    self.assertEqual(
+                        _chunk_clones_by_file_offset(frozen_subvol, path),
+                        _repr_clones(subvols, subvol, path),
+                    )
+
+
+if __name__ == '__main__':
+    unittest.main()
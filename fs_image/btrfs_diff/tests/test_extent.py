@@ -3,11 +3,12 @@ import copy
 import functools
 import itertools
 import math
+import random
 import unittest
 
 from types import SimpleNamespace
 
-from ..extent import Extent
+from ..extent import Extent, FlatExtent
 
 # `unittest`'s output shortening makes tests much harder to debug.
 unittest.util._MAX_LENGTH = 12345
@@ -462,5 +463,94 @@ class ExtentTestCase(unittest.TestCase):
         self.assertIs(e, copy.copy(e))
 
 
+def _canonical_leaves(extents):
+    '''
+    `FlatExtent` and `Extent` make distinct, but equivalent leaves.  Number
+    the leaves in order of first appearance, to compare the leaf identity
+    structure of two engines.
+    '''
+    leaf_id_to_idx = {}
+    return [[
+        (o, l, leaf.content, leaf.length, leaf_id_to_idx.setdefault(
+            id(leaf), len(leaf_id_to_idx),
+        )) for o, l, leaf in e.gen_trimmed_leaves()
+    ] for e in extents]
+
+
+class FlatExtentTestCase(unittest.TestCase):
+
+    def test_matches_extent(self):
+        rng = random.Random(1337)
+        # Both engines get the same random operations on 3 files.  We keep
+        # every intermediate version, since `FlatExtent`s share run lists.
+        versions = []
+        files = {engine: [engine.empty()] * 3 for engine in [
+            Extent, FlatExtent,
+        ]}
+        for _ in range(300):
+            to_idx = rng.randrange(3)
+            from_idx = rng.randrange(3)
+            to_length = files[Extent][to_idx].length
+            from_length = files[Extent][from_idx].length
+            op = rng.choice(['write', 'truncate', 'clone'])
+            if op == 'write':
+                kwargs = {
+                    'offset': rng.randrange(to_length + 5),
+                    'length': rng.randrange(1, 9),
+                }
+            elif op == 'truncate':
+                kwargs = {'length': rng.randrange(to_length + 5)}
+            elif from_length:
+                from_offset = rng.randrange(from_length)
+                kwargs = {
+                    'to_offset': rng.randrange(to_length + 5),
+                    'from_offset': from_offset,
+                    'length': rng.randrange(1, from_length - from_offset + 1),
+                }
+            else:
+                continue
+            for engine, exts in files.items():
+                if op == 'clone':
+                    kwargs['from_extent'] = exts[from_idx]
+                exts[to_idx] = getattr(exts[to_idx], op)(**kwargs)
+            self.assertEqual(*(
+                _canonical_leaves(exts) for exts in files.values()
+            ))
+            self.assertEqual(*(repr(exts) for exts in files.values()))
+            versions.append((
+                files[FlatExtent][to_idx],
+                list(files[FlatExtent][to_idx].gen_trimmed_leaves()),
+            ))
+        # Appending to a version did not change older ones.
+        for e, leaves in versions:
+            self.assertEqual(leaves, list(e.gen_trimmed_leaves()))
+
+    def test_sequential_writes(self):
+        # An `Extent` would be nested 20000 deep, exceeding the recursion
+        # limit in `gen_trimmed_leaves`.
+        e = FlatExtent.empty()
+        for i in range(20000):
+            e = e.write(offset=i * 2, length=2)
+        self.assertEqual('d40000', repr(e))
+        self.assertEqual(20000, len(list(e.gen_trimmed_leaves())))
+        (_, _, leaf), = e.gen_trimmed_leaves(offset=39998)
+        self.assertEqual(
+            [(1, 1, leaf)], list(e.gen_trimmed_leaves(offset=39999)),
+        )
+        self.assertEqual([], list(e.gen_trimmed_leaves(offset=7, length=0)))
+        self.assertIs(e, e.truncate(length=40000))
+        # The writes shared one run list, so the second append must fork.
+        with_hole = e.truncate(length=40001)
+        with_data = e.write(offset=40000, length=1)
+        self.assertEqual('d40000h1', repr(with_hole))
+        self.assertEqual('d40001', repr(with_data))
+        self.assertEqual('d40000', repr(e))
+
+    def test_copy(self):
+        e = FlatExtent.empty().write(offset=5, length=5)
+        self.assertIs(e, copy.deepcopy(e))
+        self.assertIs(e, copy.copy(e))
+
+
 if __name__ == '__main__':
     unittest.main()
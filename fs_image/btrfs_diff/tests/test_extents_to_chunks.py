@@ -8,8 +8,11 @@ import unittest
 from typing import Iterable, Tuple
 
 from ..extent import Extent
+from ..inode import ChunkClone, Clone
 from ..inode_id import InodeIDMap
-from ..extents_to_chunks import extents_to_chunks_with_clones
+from ..extents_to_chunks import (
+    extents_to_chunks_with_clones, extents_to_chunks_with_extent_ids,
+)
 
 # `unittest`'s output shortening makes tests much harder to debug.
 unittest.util._MAX_LENGTH = 12345
@@ -44,6 +47,55 @@ def _repr_ids_and_chunks(ids_and_chunks: Iterable[Tuple['InodeID', 'Chunk']]):
     }
 
 
+def _repr_ids_and_chunk_extents(ids_and_chunks):
+    return {
+        repr(id): [
+            (f'{c.kind.name}/{c.length}', {repr(ce) for ce in c.chunk_extents})
+                for c in chunks
+        ] for id, chunks in ids_and_chunks
+    }
+
+
+def _chunk_clones_from_chunk_extents(ids_and_chunks):
+    '''
+    Two `ChunkExtent`s are clones iff they share an extent ID, and their
+    extent ranges overlap.  Derive the quadratic `ChunkClone` representation
+    from this in the most obvious way, to cross-check the two algorithms.
+    '''
+    ids_and_chunks = list(ids_and_chunks)
+    refs = []  # (ino_id, chunk_idx, file offset, ChunkExtent)
+    for ino_id, chunks in ids_and_chunks:
+        file_offset = 0
+        for chunk_idx, chunk in enumerate(chunks):
+            for ce in chunk.chunk_extents:
+                refs.append((ino_id, chunk_idx, file_offset + ce.offset, ce))
+            file_offset += chunk.length
+    id_to_chunk_clones = {repr(ino_id): {} for ino_id, _ in ids_and_chunks}
+    for ino_id, chunk_idx, _, ce in refs:
+        for other_id, _, other_file_offset, other_ce in refs:
+            start = max(ce.extent_offset, other_ce.extent_offset)
+            end = min(
+                ce.extent_offset + ce.length,
+                other_ce.extent_offset + other_ce.length,
+            )
+            if other_ce is ce or other_ce.extent_id != ce.extent_id or (
+                start >= end
+            ):
+                continue
+            id_to_chunk_clones[repr(ino_id)].setdefault(chunk_idx, set()).add(
+                repr(ChunkClone(
+                    offset=ce.offset + start - ce.extent_offset,
+                    clone=Clone(
+                        inode_id=other_id,
+                        offset=other_file_offset + start
+                            - other_ce.extent_offset,
+                        length=end - start,
+                    ),
+                ))
+            )
+    return id_to_chunk_clones
+
+
 class ExtentsToChunksTestCase(unittest.TestCase):
     '''
     This test has one main focus, plus a few additional checks.
@@ -176,6 +228,21 @@ class ExtentsToChunksTestCase(unittest.TestCase):
             self._gen_ids_and_extents_from_figure(s, **kwargs)
         )))
 
+    def _assert_extent_ids_imply_clones(self, ids_and_extents):
+        self.assertEqual(
+            {
+                repr(id): {
+                    idx: {repr(cc) for cc in c.chunk_clones}
+                        for idx, c in enumerate(chunks) if c.chunk_clones
+                } for id, chunks in extents_to_chunks_with_clones(
+                    ids_and_extents,
+                )
+            },
+            _chunk_clones_from_chunk_extents(
+                extents_to_chunks_with_extent_ids(ids_and_extents),
+            ),
+        )
+
     def test_gen_ranges_from_figure(self):
         self.assertEqual(
             [
@@ -406,6 +473,92 @@ class ExtentsToChunksTestCase(unittest.TestCase):
             01234567890123456789
         '''))
 
+    def _repr_chunk_extents_from_figure(self, s, **kwargs):
+        return _repr_ids_and_chunk_extents(extents_to_chunks_with_extent_ids(
+            list(self._gen_ids_and_extents_from_figure(s, **kwargs))
+        ))
+
+    def test_extent_ids_module_docstring_example(self):
+        self.assertEqual({
+            'A': [('DATA/6', {'#0:0+3@0', '#0:6+3@3'})],
+            'B': [('DATA/5', {'#0:1+5@0'})],
+            'C': [('DATA/5', {'#0:3+5@0'})],
+        }, self._repr_chunk_extents_from_figure('''
+             BBBBBAAA
+            AAACCCCC
+            0123456789
+        '''))
+
+    def test_extent_ids_with_spacing_extent_left_and_right(self):
+        hole = ('HOLE/100', set())
+        self.assertEqual({
+            'A': [hole, ('DATA/9', {'#0:17+9@0'}), hole, ('DATA/3', {
+                '#0:33+3@0',
+            })],
+            'B': [hole, ('DATA/5', {'#0:26+5@0'})],
+            'C': [hole, ('DATA/9', {'#0:22+9@0'})],
+            'D': [hole, ('DATA/7', {'#0:20+7@0'})],
+            'E': [hole, ('DATA/7', {'#0:27+7@0'})],
+            'F': [hole, ('DATA/2', {'#0:28+2@0'})],
+        }, self._repr_chunk_extents_from_figure(
+            self.FIG1, extent_left=17, extent_right=23, slice_spacing=100,
+        ))
+
+    def test_extent_ids_disjoint_use_is_numbered(self):
+        # The docblock caveat: `a` and `b` share no bytes, but they do
+        # reference the same leaf extent, so it gets an ID.
+        self.assertEqual({
+            'a': [('DATA/4', {'#0:0+2@0', '#0:5+2@2'})],
+            'b': [('DATA/6', {'#0:2+3@0', '#0:7+3@3'})],
+        }, self._repr_chunk_extents_from_figure('aabbbaabbb'))
+
+    def test_extent_ids_are_deterministic(self):
+        x = Extent.empty().write(offset=0, length=3)
+        y = Extent.empty().write(offset=0, length=4)
+        unique = Extent.empty().write(offset=0, length=5)
+        ids_and_extents = [
+            (self.id_map.add_file(self.id_map.next(), p), e) for p, e in [
+                (b'c', x.clone(
+                    to_offset=3, from_extent=y, from_offset=0, length=4,
+                )),
+                (b'b', Extent.empty().clone(
+                    to_offset=0, from_extent=x, from_offset=1, length=2,
+                )),
+                (b'a', y),
+                (b'u', unique),
+            ]
+        ]
+        expected = {
+            # Numbered in path order, so `a`'s extent is first.
+            'a': [('DATA/4', {'#0:0+4@0'})],
+            'b': [('DATA/2', {'#1:1+2@0'})],
+            'c': [('DATA/7', {'#1:0+3@0', '#0:0+4@3'})],
+            'u': [('DATA/5', set())],  # Unique extents are not numbered
+        }
+        for order in (ids_and_extents, ids_and_extents[::-1]):
+            self.assertEqual(['a', 'b', 'c', 'u'], [
+                repr(id) for id, _ in extents_to_chunks_with_extent_ids(order)
+            ])
+            self.assertEqual(expected, _repr_ids_and_chunk_extents(
+                extents_to_chunks_with_extent_ids(order),
+            ))
+        self._assert_extent_ids_imply_clones(ids_and_extents)
+
+    def test_extent_ids_imply_clones_in_figures(self):
+        for fig, kwargs in [
+            (self.FIG1, {}),
+            (self.FIG1, {
+                'extent_left': 17, 'extent_right': 23, 'slice_spacing': 100,
+            }),
+            ('AAA  AAA\n  BBBBCCCCCC\n CCC', {}),
+            ('   ddd\n  ccc\n bbbeee\naaa  fff', {}),
+            ('bbaa\naabb', {}),
+        ]:
+            self.id_map = InodeIDMap.new()  # Figures reuse file names
+            self._assert_extent_ids_imply_clones(
+                list(self._gen_ids_and_extents_from_figure(fig, **kwargs))
+            )
+
     def test_multi_extent(self):
         # There are 3 `write` commands below, one for each of `a`, `b`, and
         # `c`.  We also create a few HOLE leaf extents along the way.  All
@@ -456,14 +609,16 @@ class ExtentsToChunksTestCase(unittest.TestCase):
         # files, let's make sure the clone detection does the right thing.
         # Also add an empty file to make sure that corner case works.
 
-        ids_and_chunks = list(extents_to_chunks_with_clones([
+        ids_and_extents = [
             (self.id_map.add_file(self.id_map.next(), p), e) for p, e in [
                 (b'a', a),
                 (b'b', b),
                 (b'c', c),
                 (b'e', Extent.empty()),
             ]
-        ]))
+        ]
+        ids_and_chunks = list(extents_to_chunks_with_clones(ids_and_extents))
+        self._assert_extent_ids_imply_clones(ids_and_extents)
 
         # I iteratively built this up from the "trimmed leaves" data above,
         # and checked against the real output, one file at a time.  So, this
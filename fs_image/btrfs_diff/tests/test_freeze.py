@@ -58,6 +58,33 @@ class FreezeTestCase(unittest.TestCase):
             [type(i) for i in f],
         )
 
+    def test_reuse_immutable(self):
+
+        class Pair(NamedTuple):
+            a: int
+            b: Sequence[int]
+
+        # Already-immutable structures are returned as-is, not copied.
+        for obj in [(1, 'a'), frozenset([2, 3]), Pair(a=1, b=(2, (3,)))]:
+            self.assertIs(obj, freeze(obj))
+        pair = Pair(a=1, b=[2])
+        self.assertEqual(Pair(a=1, b=(2,)), freeze(pair))
+        self.assertIsNot(pair, freeze(pair))
+        # Only the mutable parts are copied.
+        t = ((1,), [2])
+        self.assertIs(t[0], freeze(t)[0])
+        self.assertEqual(((1,), (2,)), freeze(t))
+
+        # Subclasses of `tuple` & `frozenset` still become the base type.
+        class Tup(tuple):
+            pass
+
+        class FrozenSet(frozenset):
+            pass
+
+        self.assertIs(tuple, type(freeze(Tup([1]))))
+        self.assertIs(frozenset, type(freeze(FrozenSet([1]))))
+
     def test_not_implemented(self):
         with self.assertRaises(NotImplementedError):
             freeze(object())
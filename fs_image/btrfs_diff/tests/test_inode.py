@@ -6,7 +6,7 @@ from ..extent import Extent
 from ..extents_to_chunks import extents_to_chunks_with_clones
 from ..inode import (
     _time_delta, _repr_time, _repr_time_delta,
-    Chunk, ChunkClone, Clone, Inode, InodeOwner, InodeUtimes,
+    Chunk, ChunkClone, ChunkExtent, Clone, Inode, InodeOwner, InodeUtimes,
 )
 from ..inode_id import InodeIDMap
 
@@ -142,6 +142,19 @@ class InodeTestCase(unittest.TestCase):
             ('(DATA/12: a:7+2@3, a:5+6@4)', '(DATA/12: a:5+6@4, a:7+2@3)'),
         )
 
+    def test_chunk_extent(self):
+        ce = ChunkExtent(offset=3, extent_id=7, extent_offset=5, length=2)
+        self.assertEqual('#7:5+2@3', repr(ce))
+        chunk = Chunk(
+            kind=Extent.Kind.HOLE, length=9, chunk_clones=frozenset(),
+            chunk_extents=frozenset([ce]),
+        )
+        self.assertEqual('(HOLE/9: #7:5+2@3)', repr(chunk))
+        self.assertEqual('(File h9(#7:5+2@3))', repr(Inode(
+            file_type=stat.S_IFREG, chunks=(chunk,),
+            mode=None, owner=None, utimes=None, xattrs={},
+        )))
+
     def test_repr_owner(self):
         self.assertEqual('12:345', repr(InodeOwner(uid=12, gid=345)))
 
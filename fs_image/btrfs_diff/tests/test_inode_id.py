@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
+import os
 import random
 import unittest
 
+from io import BytesIO
 from types import SimpleNamespace
 
 from ..freeze import freeze
 from ..inode_id import (
     InodeID, InodeIDMap, _PathEntry, _ReversePathEntry, _ROOT_REVERSE_ENTRY,
 )
+from ..parse_send_stream import parse_send_stream
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
 
 from .deepcopy_test import DeepCopyTestCase
+from .demo_sendstreams import gold_demo_sendstreams
 
 
 class InodeIDTestCase(DeepCopyTestCase):
@@ -105,11 +110,12 @@ class InodeIDTestCase(DeepCopyTestCase):
             self.assertEqual({b'a/c', b'a/d'}, im.get_paths(ns.ino2))
             self.assertEqual('a/c,a/d', repr(ns.ino2))
         # Try removing from the frozen map before changing the original one.
+        # A frozen map owns no directories, so it fails trying to copy `a`.
         with self.assertRaisesRegex(
-            TypeError, 'mappingproxy.* does not support item deletion',
+            TypeError, 'mappingproxy.* does not support item assignment',
         ):
             freeze(id_map).remove_path(b'a/c')
-        self.assertIs(mut_ns.ino2, id_map.remove_path(b'a/c'))
+        self.assertEqual(mut_ns.ino2, id_map.remove_path(b'a/c'))
         saved_frozen_map = freeze(id_map)  # We'll check this later
         id_map = yield from maybe_replace_map(id_map, 'removed a/c name')
         for im, ns in unfrozen_and_frozen(id_map, mut_ns):
@@ -119,15 +125,12 @@ class InodeIDTestCase(DeepCopyTestCase):
 
             self.assertEqual({b'a'}, im.get_children(ns.ino_root))
 
-        # Look-up by ID
-        for (im, ns), check_same in zip(
-            unfrozen_and_frozen(id_map, mut_ns),
-            # `is` comparison would be harder to implement for the frozen
-            # variant, and meaningless because we just constructed it.
-            [self.assertIs, self.assertEqual],
-        ):
-            check_same(ns.ino1, im.get_id(b'a'))
-            check_same(ns.ino2, im.get_id(b'a/d'))
+        # Look-up by ID.  `InodeID`s are made on demand, so we can only
+        # compare them for equality.
+        for im, ns in unfrozen_and_frozen(id_map, mut_ns):
+            self.assertEqual(ns.ino1, im.get_id(b'a'))
+            self.assertEqual(ns.ino2, im.get_id(b'a/d'))
+            self.assertIs(im.inner, im.get_id(b'a/d').inner_id_map)
 
         # Cannot remove non-empty directories
         with self.assertRaisesRegex(RuntimeError, "remove b'a'.*has children"):
@@ -141,7 +144,7 @@ class InodeIDTestCase(DeepCopyTestCase):
         # Check that we clean up empty path sets
         for im, ns in unfrozen_and_frozen(id_map, mut_ns):
             self.assertIn(ns.ino2.id, im.inner.id_to_reverse_entries)
-        self.assertIs(mut_ns.ino2, id_map.remove_path(b'a/d'))
+        self.assertEqual(mut_ns.ino2, id_map.remove_path(b'a/d'))
         id_map = yield from maybe_replace_map(id_map, 'removed a/d name')
         for im, _ns in unfrozen_and_frozen(id_map, mut_ns):
             self.assertNotIn(INO2_ID, im.inner.id_to_reverse_entries)
@@ -184,9 +187,7 @@ class InodeIDTestCase(DeepCopyTestCase):
             self.assertEqual(
                 {0: {_ROOT_REVERSE_ENTRY}}, im.inner.id_to_reverse_entries,
             )
-            self.assertEqual(_PathEntry(
-                id=InodeID(id=0, inner_id_map=im.inner), name_to_child={},
-            ), im.root)
+            self.assertEqual(_PathEntry(id=0, name_to_child={}), im.root)
 
         # Test renaming directories
         id_map.add_dir(id_map.next(), b'x')
@@ -263,6 +264,8 @@ class InodeIDTestCase(DeepCopyTestCase):
         # Test some more errors
         with self.assertRaisesRegex(RuntimeError, f"foo''s parent.*is a file"):
             id_map.get_id(b'x1/y/z/foo/bar')
+        with self.assertRaisesRegex(RuntimeError, f"foo''s parent.*is a file"):
+            id_map.add_file(id_map.next(), b'x1/y/z/foo/bar')
         with self.assertRaisesRegex(RuntimeError, f'Cannot remove the root'):
             id_map.remove_path(b'.')
         with self.assertRaisesRegex(RuntimeError, f'Cannot remove non-exist'):
@@ -279,18 +282,11 @@ class InodeIDTestCase(DeepCopyTestCase):
         # Even though we changed `id_map` a lot, `saved_frozen` is still
         # in the same state where we took the snapshot.
         self.assertIsNone(saved_frozen_map.inode_id_counter)
-        self.assertEqual(_PathEntry(
-            id=InodeID(id=0, inner_id_map=saved_frozen_map.inner),
-            name_to_child={
-                b'a': _PathEntry(id=InodeID(
-                    id=INO1_ID, inner_id_map=saved_frozen_map.inner,
-                ), name_to_child={
-                    b'd': _PathEntry(id=InodeID(
-                        id=INO2_ID, inner_id_map=saved_frozen_map.inner,
-                    ), name_to_child=None)
-                }),
-            },
-        ), saved_frozen_map.root)
+        self.assertEqual(_PathEntry(id=0, name_to_child={
+            b'a': _PathEntry(id=INO1_ID, name_to_child={
+                b'd': _PathEntry(id=INO2_ID, name_to_child=None),
+            }),
+        }), saved_frozen_map.root)
         self.assertEqual('', saved_frozen_map.inner.description)
         self.assertEqual({
             0: {_ROOT_REVERSE_ENTRY},
@@ -307,6 +303,68 @@ class InodeIDTestCase(DeepCopyTestCase):
             'cat@food', repr(cat_map.add_file(cat_map.next(), b'food')),
         )
 
+    def test_snapshot(self):
+        cat_map = InodeIDMap.new(description='cat')
+        cat_map.add_dir(cat_map.next(), b'a')
+        cat_map.add_dir(cat_map.next(), b'a/b')
+        cat_map.add_file(cat_map.next(), b'a/b/f')
+        cat_map.add_dir(cat_map.next(), b'x')
+        cat_map.add_dir(cat_map.next(), b'x/y')
+        cat_x_entry = cat_map.root.name_to_child[b'x']
+
+        def check_cat():
+            self.assertEqual(
+                {b'a', b'x'}, cat_map.get_children(cat_map.get_id(b'.')),
+            )
+            self.assertEqual(
+                {b'a/b/f'}, cat_map.get_children(cat_map.get_id(b'a/b')),
+            )
+            self.assertEqual('cat@a/b/f', repr(cat_map.get_id(b'a/b/f')))
+            self.assertIsNone(cat_map.get_id(b'a/b/g'))
+
+        tiger_map = cat_map.snapshot(description='tiger')
+        self.assertEqual('tiger@a/b/f', repr(tiger_map.get_id(b'a/b/f')))
+        self.assertNotEqual(cat_map.get_id(b'a'), tiger_map.get_id(b'a'))
+        # The snapshot shares all entries except the root.
+        self.assertIsNot(cat_map.root, tiger_map.root)
+        self.assertIs(cat_x_entry, tiger_map.root.name_to_child[b'x'])
+
+        tiger_map.add_file(tiger_map.next(), b'a/b/g')
+        tiger_map.rename_path(b'a/b/f', b'a/f')
+        tiger_map.remove_path(b'a/f')
+        self.assertEqual(
+            {b'a/b/g'}, tiger_map.get_children(tiger_map.get_id(b'a/b')),
+        )
+        check_cat()
+        # Only the entries on the mutated paths got copied.
+        self.assertIs(cat_x_entry, tiger_map.root.name_to_child[b'x'])
+        self.assertIsNot(
+            cat_map.root.name_to_child[b'a'],
+            tiger_map.root.name_to_child[b'a'],
+        )
+
+        # Moving a shared directory, and then mutating it, copies it.
+        tiger_map.rename_path(b'x', b'a/x')
+        tiger_map.add_dir(tiger_map.next(), b'a/x/y/z')
+        self.assertEqual({b'a/x/y/z'}, tiger_map.get_paths(
+            tiger_map.get_id(b'a/x/y/z'),
+        ))
+        self.assertEqual(set(), cat_map.get_children(cat_map.get_id(b'x/y')))
+
+        # The parent may also keep changing, without affecting the snapshot.
+        cat_map.add_file(cat_map.next(), b'x/y/q')
+        cat_map.remove_path(b'a/b/f')
+        self.assertIsNone(tiger_map.get_id(b'a/x/y/q'))
+        self.assertIsNone(tiger_map.get_id(b'a/b/f'))
+        self.assertEqual({b'x/y/q'}, cat_map.get_children(
+            cat_map.get_id(b'x/y'),
+        ))
+
+        # Both maps keep counting from where the parent was.
+        self.assertEqual(
+            cat_map.get_id(b'x/y/q').id, tiger_map.get_id(b'a/b/g').id,
+        )
+
     def test_hashing_and_equality(self):
         maps = [InodeIDMap.new() for i in range(100)]
         hashes = {hash(m.get_id(b'.')) for m in maps}
@@ -320,6 +378,41 @@ class InodeIDTestCase(DeepCopyTestCase):
         self.assertEqual(id1, id2)
         self.assertEqual(hash(id1), hash(id2))
 
+    def test_demo_sendstreams(self):
+        '''
+        Checks the path lookups of the maps made by the demo send-streams.
+        This doubles as a micro-benchmark of the path-handling code, since
+        `Subvolume.apply_item` looks up a path for each item.
+        '''
+        gold = gold_demo_sendstreams()
+        subvols = SubvolumeSet.new()
+        for op in ['create_ops', 'mutate_ops']:
+            items = parse_send_stream(BytesIO(gold[op]['sendstream']))
+            mutator = SubvolumeSetMutator.new(subvols, next(items))
+            for item in items:
+                mutator.apply_item(item)
+        for subvol in subvols.uuid_to_subvolume.values():
+            id_map = subvol.id_map
+            num_paths = 0
+            for int_id in id_map.inner.id_to_reverse_entries:
+                ino_id = id_map._inode_id(int_id)
+                paths = id_map.get_paths(ino_id)
+                num_paths += len(paths)
+                for path in paths:
+                    self.assertEqual(ino_id, id_map.get_id(path))
+                children = id_map.get_children(ino_id)
+                if len(paths) > 1:
+                    self.assertIsNone(children)
+                    continue
+                path, = paths
+                # Compare against joining & normalizing the child names.
+                name_to_child = id_map._get_entry(path).name_to_child
+                self.assertEqual(None if name_to_child is None else {
+                    os.path.normpath(os.path.join(path, name))
+                        for name in name_to_child
+                }, children)
+            self.assertGreater(num_paths, 10)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 import io
+import os
+import random
+import re
 import sys
 import unittest
 
@@ -7,6 +10,7 @@ from typing import List, Sequence
 
 from ..parse_dump import (
     NAME_TO_PARSER_TYPE, parse_btrfs_dump, unquote_btrfs_progs_path,
+    _ESCAPED_TO_UNESCAPED, _normalize_subvolume_path,
 )
 from ..send_stream import SendStreamItem, SendStreamItems
 
@@ -38,6 +42,35 @@ class ParseBtrfsDumpTestCase(unittest.TestCase):
             )
         )
 
+        # Matches the naive implementation, one alternative per escape.
+        naive_regex = re.compile(
+            b'|'.join(re.escape(e) for e in _ESCAPED_TO_UNESCAPED)
+        )
+        rng = random.Random(1234)
+        alphabet = b'\\\\\\ 0123478abenvxz/'
+        for _ in range(10000):
+            s = bytes(rng.choice(alphabet) for _ in range(rng.randrange(9)))
+            self.assertEqual(
+                naive_regex.sub(lambda m: _ESCAPED_TO_UNESCAPED[m.group()], s),
+                unquote_btrfs_progs_path(s),
+                s,
+            )
+
+    def test_normalize_subvolume_path(self):
+        for path in [
+            b's/', b'./s', b'./s/', b's//a', b'./s/a/', b's/./a/b',
+            b's/a/../b', b's/../s/a', b'./s/a\\ b',
+        ]:
+            self.assertEqual(
+                os.path.relpath(path, b's'),
+                _normalize_subvolume_path(path, subvol_name=b's'),
+                path,
+            )
+        # NB: `s` is rejected only because it is too short.
+        for path in [b's', b'x/a', b's/..', b'sa/b', b'/s/a', b's/..a']:
+            with self.assertRaisesRegex(RuntimeError, 'did not start with'):
+                _normalize_subvolume_path(path, subvol_name=b's')
+
     def test_ensure_demo_sendstreams_cover_all_operations(self):
         # Ensure we have implemented all the operations from here:
         # https://github.com/kdave/btrfs-progs/blob/master/send-dump.c#L319
@@ -133,6 +166,9 @@ class ParseBtrfsDumpTestCase(unittest.TestCase):
                 [subvol_line, ok_line.replace(b'/s/', b'/x/')]
             )
 
+        with self.assertRaisesRegex(RuntimeError, 'in line details:'):
+            _parse_lines_to_list([subvol_line, b'chmod ./s/cat mode=9'])
+
         with self.assertRaisesRegex(RuntimeError, "s/t' contains /"):
             _parse_lines_to_list([subvol_line.replace(b'./s', b'./s/t')])
 
@@ -4,15 +4,25 @@ This test only validates the binary send-stream parser. We rely on the fact
 that `test_parse_dump.py` already sanity-checks the gold data.
 '''
 import io
+import itertools
+import mmap
+import os
 import struct
+import tempfile
 import unittest
+import unittest.mock
 
 from .demo_sendstreams import gold_demo_sendstreams
 from .demo_sendstreams_expected import get_filtered_and_expected_items
 
+from .. import parse_send_stream as parse_send_stream_module
+from ..btrfs_crc32c import _py_btrfs_crc32c, btrfs_crc32c
+from ..send_stream import SendStreamItems
 from ..parse_send_stream import (
     AttributeKind, check_magic, check_version, CommandKind, file_unpack,
-    parse_send_stream, read_attribute, read_command,
+    index_send_streams, parse_send_stream, parse_send_stream_buffer,
+    parse_send_stream_files, parse_send_streams, read_attribute,
+    read_command, verify_send_stream_crcs,
 )
 
 # `unittest`'s output shortening makes tests much harder to debug.
@@ -41,6 +51,326 @@ class ParseSendStreamTestCase(unittest.TestCase):
         )
         self.assertEqual(filtered_items, expected_items)
 
+    def test_buffer_parse_matches_file_parse(self):
+        stream_dict = gold_demo_sendstreams()
+        num_writes = 0
+        for name in ['create_ops', 'mutate_ops']:
+            s = stream_dict[name]['sendstream']
+            file_items = list(_parse_stream_bytes(s))
+            self.assertEqual(file_items, list(parse_send_stream_buffer(s)))
+
+            with tempfile.TemporaryFile() as f:
+                f.write(s)
+                f.flush()
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    num_writes += self._check_mmap_items(file_items, m)
+        self.assertGreater(num_writes, 0)
+
+    def _check_mmap_items(self, expected_items, m):
+        'Separate so that the views into `m` are released before it closes'
+        mmap_items = list(parse_send_stream_buffer(m))
+        self.assertEqual(expected_items, mmap_items)
+        # `write` payloads are left as views into the buffer
+        writes = [
+            i for i in mmap_items if isinstance(i, SendStreamItems.write)
+        ]
+        for w in writes:
+            self.assertIsInstance(w.data, memoryview)
+            self.assertIsInstance(bytes(w.data), bytes)
+        return len(writes)
+
+    def test_skip_data(self):
+
+        class Unseekable(io.BytesIO):
+            def seekable(self):
+                return False
+
+        def expected_items(s):
+            for i in _parse_stream_bytes(s):
+                if isinstance(i, SendStreamItems.write):
+                    yield SendStreamItems.update_extent(
+                        path=i.path, offset=i.offset, len=len(i.data),
+                    )
+                else:
+                    yield i
+
+        stream_dict = gold_demo_sendstreams()
+        for name in ['create_ops', 'mutate_ops']:
+            s = stream_dict[name]['sendstream']
+            expected = list(expected_items(s))
+            for parsed in [
+                parse_send_stream(io.BytesIO(s), skip_data=True),
+                parse_send_stream(Unseekable(s), skip_data=True),
+                parse_send_stream_buffer(s, skip_data=True),
+            ]:
+                self.assertEqual(expected, list(parsed))
+
+        def write_cmd(attrs):
+            return struct.pack(
+                '<IHI', len(attrs), CommandKind.WRITE.value, 0,
+            ) + attrs
+
+        data_attr = struct.pack('<HH5s', AttributeKind.DATA.value, 5, b'abcde')
+        with self.assertRaisesRegex(RuntimeError, 'DATA occurred twice'):
+            read_command(
+                io.BytesIO(write_cmd(data_attr + data_attr)), skip_data=True,
+            )
+        with self.assertRaisesRegex(RuntimeError, 'AttributeH.* overflows'):
+            read_command(io.BytesIO(
+                struct.pack('<IHI', 3, CommandKind.WRITE.value, 0)
+                + data_attr
+            ), skip_data=True)
+        with self.assertRaisesRegex(RuntimeError, 'AttributeH.* got 1 bytes'):
+            read_command(io.BytesIO(
+                struct.pack('<IHI', 7, CommandKind.WRITE.value, 0)
+                + struct.pack('<HH', AttributeKind.PATH.value, 3) + b'x'
+            ), skip_data=True)
+        with self.assertRaisesRegex(RuntimeError, 'with 3 bytes to skip'):
+            read_command(
+                Unseekable(write_cmd(data_attr)[:-3]), skip_data=True,
+            )
+
+    def test_crc32c(self):
+        # The standard CRC32C check value, undoing the standard inversions
+        self.assertEqual(
+            0xE3069283, 0xFFFFFFFF ^ btrfs_crc32c(b'123456789', 0xFFFFFFFF),
+        )
+        data = bytes(range(256)) * 3
+        for split in [0, 1, 7, 8, 9, 300, len(data)]:
+            self.assertEqual(
+                btrfs_crc32c(data),
+                btrfs_crc32c(data[split:], btrfs_crc32c(data[:split])),
+            )
+            # The pure-Python fallback agrees with the one in use
+            for crc in [0, 0x12345678]:
+                self.assertEqual(
+                    btrfs_crc32c(data[:split], crc),
+                    _py_btrfs_crc32c(data[:split], crc),
+                )
+
+    def test_check_crc(self):
+        s = gold_demo_sendstreams()['create_ops']['sendstream']
+        items = list(_parse_stream_bytes(s))
+        skip_items = list(parse_send_stream(io.BytesIO(s), skip_data=True))
+        self.assertEqual(items, list(
+            parse_send_stream(io.BytesIO(s), check_crc=True)
+        ))
+        self.assertEqual(items, list(
+            parse_send_stream_buffer(s, check_crc=True)
+        ))
+        self.assertEqual(skip_items, list(parse_send_stream(
+            io.BytesIO(s), skip_data=True, check_crc=True,
+        )))
+
+        # Flip a bit in the last byte of the first `write`'s data
+        write_offset = 17  # Skip the magic & version
+        while True:
+            write_len, kind, _crc = struct.unpack_from('<IHI', s, write_offset)
+            if kind == CommandKind.WRITE.value:
+                break
+            write_offset += 10 + write_len
+        corrupt = bytearray(s)
+        corrupt[write_offset + 10 + write_len - 1] ^= 1
+        corrupt = bytes(corrupt)
+        # Without the check, the corruption goes unnoticed
+        self.assertEqual(len(items), len(list(_parse_stream_bytes(corrupt))))
+        for parse in [
+            lambda: parse_send_stream(io.BytesIO(corrupt), check_crc=True),
+            lambda: parse_send_stream_buffer(corrupt, check_crc=True),
+            lambda: parse_send_stream(
+                io.BytesIO(corrupt), skip_data=True, check_crc=True,
+            ),
+        ]:
+            with self.assertRaisesRegex(RuntimeError, 'WRITE.* has bad CRC'):
+                list(parse())
+
+        for data, err in [(s, None), (corrupt, 'WRITE.* has bad CRC')]:
+            with tempfile.NamedTemporaryFile() as f:
+                f.write(data)
+                f.flush()
+                for num_workers in [1, 2]:
+                    # Tiny batches make the pool do real work
+                    with unittest.mock.patch.object(
+                        parse_send_stream_module, '_CRC_BATCH_BYTES', 1000,
+                    ):
+                        if err:
+                            with self.assertRaisesRegex(RuntimeError, err):
+                                verify_send_stream_crcs(
+                                    f.name, num_workers=num_workers,
+                                )
+                        else:
+                            verify_send_stream_crcs(
+                                f.name, num_workers=num_workers,
+                            )
+
+        # Every concatenated send-stream is checked, not just the first.
+        for data, err in [
+            (s + s, None),
+            (s + corrupt, 'WRITE.* has bad CRC'),
+            (s + s[:write_offset + 20], 'Not enough bytes'),
+            (s + b'junk', "Magic b'junk', not "),
+        ]:
+            with tempfile.NamedTemporaryFile() as f:
+                f.write(data)
+                f.flush()
+                if err:
+                    with self.assertRaisesRegex(RuntimeError, err):
+                        verify_send_stream_crcs(f.name, num_workers=1)
+                else:
+                    verify_send_stream_crcs(f.name, num_workers=1)
+
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(s[:write_offset + 20])
+            f.flush()
+            with self.assertRaisesRegex(RuntimeError, 'Not enough bytes'):
+                verify_send_stream_crcs(f.name)
+
+    def test_concatenated_streams(self):
+        stream_dict = gold_demo_sendstreams()
+        streams = [
+            stream_dict[name]['sendstream']
+                for name in ['create_ops', 'mutate_ops', 'create_ops']
+        ]
+        expected = [
+            (idx, item)
+                for idx, s in enumerate(streams)
+                    for item in _parse_stream_bytes(s)
+        ]
+        concatenated = b''.join(streams)
+        self.assertEqual(
+            expected, list(parse_send_streams(io.BytesIO(concatenated))),
+        )
+
+        # A pipe works too, and the parse options are passed through.
+        r, w = os.pipe()
+        with open(r, 'rb') as r, open(w, 'wb') as w:
+            w.write(streams[1])
+            w.close()
+            self.assertEqual(
+                list(parse_send_stream(io.BytesIO(streams[1]), skip_data=True)),
+                [i for _, i in parse_send_streams(r, skip_data=True)],
+            )
+
+        with self.assertRaisesRegex(RuntimeError, "Magic b'', not "):
+            list(parse_send_streams(io.BytesIO(b'')))
+        with self.assertRaisesRegex(RuntimeError, "Magic b'junk', not "):
+            list(parse_send_streams(io.BytesIO(streams[0] + b'junk')))
+
+        index = index_send_streams(io.BytesIO(concatenated))
+        self.assertEqual(3, len(index))
+        offset = 0
+        for s, entry, (idx, items) in zip(streams, index, itertools.groupby(
+            expected, key=lambda idx_item: idx_item[0],
+        )):
+            self.assertEqual(offset, entry.offset)
+            offset += len(s)
+            self.assertEqual(offset, entry.end)
+            # One offset per item, plus END
+            self.assertEqual(len(list(items)) + 1, len(entry.command_offsets))
+            self.assertEqual(
+                CommandKind.END.value,
+                struct.unpack_from(
+                    '<IHI', concatenated, entry.command_offsets[-1],
+                )[1],
+            )
+
+            # Jump straight to the stream.
+            infile = io.BytesIO(concatenated)
+            infile.seek(entry.offset)
+            self.assertEqual(
+                list(_parse_stream_bytes(s)), list(parse_send_stream(infile)),
+            )
+            self.assertEqual(entry.end, infile.tell())
+
+        with self.assertRaisesRegex(RuntimeError, "Magic b'', not "):
+            index_send_streams(io.BytesIO(b''))
+
+    def test_parse_send_stream_files(self):
+        stream_dict = gold_demo_sendstreams()
+        create, mutate = (
+            stream_dict[name]['sendstream']
+                for name in ['create_ops', 'mutate_ops']
+        )
+        with tempfile.TemporaryDirectory() as td:
+            paths = []
+            for i, data in enumerate([create + mutate, mutate, create]):
+                paths.append(os.path.join(td, str(i)))
+                with open(paths[-1], 'wb') as f:
+                    f.write(data)
+            for kwargs in [{}, {'skip_data': True, 'check_crc': True}]:
+                expected = []
+                for path_idx, path in enumerate(paths):
+                    with open(path, 'rb') as f:
+                        expected.extend(
+                            (path_idx, stream_idx, item)
+                                for stream_idx, item
+                                    in parse_send_streams(f, **kwargs)
+                        )
+                for num_workers in [1, 2]:
+                    self.assertEqual(expected, list(parse_send_stream_files(
+                        paths, num_workers=num_workers, **kwargs,
+                    )))
+
+            # What the workers send us round-trips, sharing repeated paths.
+            encoded = parse_send_stream_module \
+                ._parse_and_encode_send_stream_file(paths[0], {})
+            self.assertEqual([
+                (stream_idx, item)
+                    for _, stream_idx, item
+                        in parse_send_stream_files(paths[:1])
+            ], [
+                (stream_idx, item)
+                    for stream_idx, items in encoded
+                        for item in parse_send_stream_module._decode_items(
+                            items,
+                        )
+            ])
+            self.assertEqual(2, len(encoded))
+            paths_in_stream = [items[1] for items in encoded[0][1]]
+            self.assertLess(
+                len({id(p) for p in paths_in_stream}), len(paths_in_stream),
+            )
+
+            # Workers' errors are raised in order, after the earlier files.
+            with open(paths[1], 'wb') as f:
+                f.write(b'junk')
+            items = parse_send_stream_files(paths, num_workers=2)
+            self.assertEqual(0, next(items)[0])
+            with self.assertRaisesRegex(RuntimeError, "Magic b'junk'"):
+                list(items)
+
+    def test_buffer_errors(self):
+        def parse(b):
+            return list(parse_send_stream_buffer(b))
+
+        header = b'btrfs-stream\0' + struct.pack('<I', 1)
+        with self.assertRaisesRegex(RuntimeError, "Magic b'xxx', not "):
+            parse(b'xxx')
+        with self.assertRaisesRegex(RuntimeError, 'we require version 1'):
+            parse(b'btrfs-stream\0' + struct.pack('<I', 2))
+        with self.assertRaisesRegex(RuntimeError, 'for command header'):
+            parse(header + b'abc')
+
+        def cmd(attrs):
+            return header + struct.pack(
+                '<IHI', len(attrs), CommandKind.MKFILE.value, 0,
+            ) + attrs
+
+        with self.assertRaisesRegex(RuntimeError, 'CommandHead.* got 0 bytes'):
+            parse(header + struct.pack('<IHI', 7, CommandKind.MKFILE.value, 0))
+        with self.assertRaisesRegex(RuntimeError, 'for attribute header'):
+            parse(cmd(b'ab'))
+        with self.assertRaisesRegex(RuntimeError, 'AttributeH.* got 0 bytes'):
+            parse(cmd(struct.pack('<HH', AttributeKind.PATH.value, 3)))
+        with self.assertRaisesRegex(ValueError, 'is not a valid AttributeK'):
+            parse(cmd(struct.pack('<HH', 12345, 0)))
+        with self.assertRaisesRegex(RuntimeError, '\\.PATH occurred twice'):
+            parse(cmd(struct.pack(
+                '<' + 'HH3s' * 2,
+                AttributeKind.PATH.value, 3, b'cat',
+                AttributeKind.PATH.value, 3, b'dog',
+            )))
+
     def test_errors(self):
         with self.assertRaisesRegex(RuntimeError, "Magic b'xxx', not "):
             check_magic(io.BytesIO(b'xxx'))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import unittest
+
+from collections import Counter
+
+from ..send_stream import (
+    get_frequency_of_selinux_xattrs, ItemFilters, ItemTransforms,
+    SendStreamItems,
+)
+
+si = SendStreamItems
+_SELINUX = b'security.selinux'
+
+
+class SendStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def test_filters(self):
+        items = [
+            si.subvol(path=b'sv', uuid=b'u', transid=1),
+            si.mkfile(path=b'a'),
+            si.set_xattr(path=b'a', name=_SELINUX, data=b'default'),
+            si.set_xattr(path=b'a', name=_SELINUX, data=b'special'),
+            si.set_xattr(path=b'a', name=b'user.x', data=b'default'),
+            si.utimes(path=b'a', atime=(5, 0), mtime=(15, 0), ctime=(9, 9)),
+            si.utimes(path=b'a', atime=(1, 0), mtime=(1, 0), ctime=(1, 0)),
+            si.rename(path=b'a', dest=b'b'),
+            si.link(path=b'c', dest=b'b'),
+            si.clone(
+                path=b'c', offset=0, len=1, from_uuid=b'u', from_transid=1,
+                from_path=b'b', clone_offset=0,
+            ),
+            si.symlink(path=b's', dest=b'b'),
+        ]
+        self.assertEqual(
+            {b'default': 1, b'special': 1},
+            get_frequency_of_selinux_xattrs(items),
+        )
+
+        selinux_freqs = Counter()
+        filtered = list(ItemFilters.fused(
+            items,
+            ItemTransforms.count_selinux_xattrs(selinux_freqs),
+            ItemTransforms.selinux_xattr(
+                discard_fn=lambda _path, ctx: ctx == b'default',
+            ),
+            ItemTransforms.normalize_utimes(
+                start_time=(5, 0), end_time=(10, 0),
+            ),
+            ItemTransforms.rewrite_paths(lambda p: b'x/' + p),
+        ))
+        self.assertEqual({b'default': 1, b'special': 1}, selinux_freqs)
+        self.assertEqual([
+            items[0],  # The subvolume name is not rewritten
+            si.mkfile(path=b'x/a'),
+            si.set_xattr(path=b'x/a', name=_SELINUX, data=b'special'),
+            si.set_xattr(path=b'x/a', name=b'user.x', data=b'default'),
+            si.utimes(path=b'x/a', atime=(5, 0), mtime=(15, 0), ctime=(5, 0)),
+            si.utimes(path=b'x/a', atime=(1, 0), mtime=(1, 0), ctime=(1, 0)),
+            si.rename(path=b'x/a', dest=b'x/b'),
+            si.link(path=b'x/c', dest=b'x/b'),
+            si.clone(
+                path=b'x/c', offset=0, len=1, from_uuid=b'u', from_transid=1,
+                from_path=b'x/b', clone_offset=0,
+            ),
+            si.symlink(path=b'x/s', dest=b'b'),  # Not a subvolume path
+        ], filtered)
+        # An unchanged item is passed through as-is.
+        self.assertIs(items[6], list(ItemFilters.normalize_utimes(
+            items, start_time=(5, 0), end_time=(10, 0),
+        ))[6])
+
+        # The fused filters match the individual ones.
+        self.assertEqual(filtered, list(ItemFilters.rewrite_paths(
+            ItemFilters.normalize_utimes(
+                ItemFilters.selinux_xattr(
+                    items, discard_fn=lambda _path, ctx: ctx == b'default',
+                ),
+                start_time=(5, 0),
+                end_time=(10, 0),
+            ),
+            lambda p: b'x/' + p,
+        )))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import copy
+import sys
 import unittest
 
 from ..coroutine_utils import while_not_exited
@@ -8,8 +8,8 @@ from ..freeze import freeze
 from ..inode_id import InodeIDMap
 from ..parse_dump import SendStreamItems
 from ..rendered_tree import (
-    emit_all_traversal_ids, emit_non_unique_traversal_ids, map_bottom_up,
-    TraversalID,
+    emit_all_traversal_ids, emit_non_unique_traversal_ids, gather_bottom_up,
+    map_bottom_up, TraversalID,
 )
 from ..subvolume import Subvolume
 
@@ -20,6 +20,18 @@ from .subvolume_utils import InodeRepr, expected_subvol_add_traversal_ids
 unittest.util._MAX_LENGTH = 12345
 
 
+def _flatten_emitted_non_unique(ser):
+    'The output of `emit_non_unique_traversal_ids` as `gen_rendered_inodes`'
+    res = []
+    with while_not_exited(gather_bottom_up(ser)) as ctx:
+        while True:
+            path, ino, _ = ctx.send(None)
+            res.append((path, ino, None) if isinstance(ino, str) else (
+                path, *ino,
+            ))
+    return res
+
+
 class SubvolumeTestCase(DeepCopyTestCase):
     def setUp(self):
         self.maxDiff = 12345
@@ -112,10 +124,7 @@ class SubvolumeTestCase(DeepCopyTestCase):
         cat = yield 'cat after error testing', cat
         self._check_both_renders(cat_final_repr, cat)
 
-        # Make a snapshot using the hack from `SubvolumeSetMutator`
-        tiger = copy.deepcopy(cat, memo={
-            id(cat.id_map.inner.description): 'tiger',
-        })
+        tiger = cat.snapshot(description='tiger')
         tiger = yield 'freshly copied tiger', tiger
         self._check_both_renders(cat_final_repr, tiger)
 
@@ -228,6 +237,11 @@ class SubvolumeTestCase(DeepCopyTestCase):
                 '(File h5(tiger@tamaskan:5+5@0)d5(tiger@tamaskan:10+5@0))'
             ],
         }], freeze(tiger))
+        self._check_render(['(Dir o123:456)', {
+            'wolf': ['(Char m444 4321)'],
+            'tamaskan': ['(File m700 d3h7(#0:0+7@0)d10(#1:0+10@0))'],
+            'dolly': ['(File h5(#0:2+5@0)d5(#1:0+5@0))'],
+        }], freeze(tiger, extent_ids=True))
         # We're about to clone from `cat`, so allow it do be `deepcopy`d here.
         cat = yield 'tiger clones from cat', cat
         self._check_both_renders(cat_final_repr, cat)
@@ -238,7 +252,8 @@ class SubvolumeTestCase(DeepCopyTestCase):
         ), cat)
 
         # The big comment below explains why we need `deepcopy_shenanigan`.
-        dog_extent = cat.inode_at_path(b'dog').extent
+        (_, _, dog_extent), = cat.inode_at_path(b'dog').extent \
+            .gen_trimmed_leaves()
         first_tamaskan_leaf = next(
             tiger.inode_at_path(b'tamaskan').extent.gen_trimmed_leaves(),
         )[2]
@@ -303,7 +318,8 @@ class SubvolumeTestCase(DeepCopyTestCase):
             frozen_tiger.apply_item(si.unlink(path=b'somedev'))
         with self.assertRaisesRegex(TypeError, 'no.* item deletion'):
             frozen_tiger.apply_item(si.rename(path=b'wolf', dest=b'cat'))
-        with self.assertRaisesRegex(AttributeError, "no .* 'apply_item'"):
+        # A frozen subvolume owns no inodes, so it fails trying to copy one.
+        with self.assertRaisesRegex(TypeError, 'no.* item assignment'):
             frozen_tiger.apply_item(si.chmod(path=b'tamaskan', mode=0o644))
         # Neither the error-testing, nor changing the parent changed us.
         self._check_render(frozen_repr, frozen_tiger)
@@ -335,10 +351,124 @@ class SubvolumeTestCase(DeepCopyTestCase):
                         emit_fn(frozen_repr),
                         emit_fn(frozen_subvol.render()),
                     )
+            with self.subTest(f'gen_rendered_inodes after {step}'):
+                self.assertEqual(
+                    _flatten_emitted_non_unique(
+                        emit_non_unique_traversal_ids(frozen_repr),
+                    ),
+                    list(frozen_subvol.gen_rendered_inodes()),
+                )
 
     def test_subvolume(self):
         self.check_deepcopy_at_each_step(self._check_subvolume)
 
+    def test_snapshot_copy_on_write(self):
+        si = SendStreamItems
+        cat = Subvolume.new(id_map=InodeIDMap.new(description='cat'))
+        cat.apply_item(si.mkfile(path=b'dog'))
+        cat.apply_item(si.set_xattr(path=b'dog', name=b'k', data=b'v'))
+        cat.apply_item(si.mkfile(path=b'cow'))
+        cat_dog = cat.inode_at_path(b'dog')
+
+        tiger = cat.snapshot(description='tiger')
+        self.assertIs(cat_dog, tiger.inode_at_path(b'dog'))
+        tiger.apply_item(si.set_xattr(path=b'dog', name=b'k', data=b'w'))
+        tiger_dog = tiger.inode_at_path(b'dog')
+        self.assertIsNot(cat_dog, tiger_dog)
+        self.assertEqual({b'k': b'v'}, cat_dog.xattrs)
+        self.assertEqual({b'k': b'w'}, tiger_dog.xattrs)
+        # Once copied, the inode is mutated in place.
+        tiger.apply_item(si.write(path=b'dog', offset=0, data=b'x'))
+        self.assertIs(tiger_dog, tiger.inode_at_path(b'dog'))
+        # Untouched inodes stay shared.
+        self.assertIs(cat.inode_at_path(b'cow'), tiger.inode_at_path(b'cow'))
+
+        # Cloning from the parent copies only the destination.
+        tiger.apply_clone(si.clone(
+            path=b'cow', offset=0, len=1, from_uuid='', from_transid=0,
+            from_path=b'dog', clone_offset=0,
+        ), tiger)
+        self.assertIsNot(
+            cat.inode_at_path(b'cow'), tiger.inode_at_path(b'cow'),
+        )
+        self._check_render(['(Dir)', {
+            'dog': ["(File x'k'='w' d1(tiger@cow:0+1@0))"],
+            'cow': ['(File d1(tiger@dog:0+1@0))'],
+        }], freeze(tiger))
+
+        # The parent also copies the inodes it had shared.
+        cat.apply_item(si.truncate(path=b'dog', size=5))
+        self.assertIsNot(cat_dog, cat.inode_at_path(b'dog'))
+        self._check_both_renders(['(Dir)', {
+            'dog': ["(File x'k'='v' h5)"], 'cow': ['(File)'],
+        }], cat)
+        self._check_render(['(Dir)', {
+            'dog': ["(File x'k'='w' d1)"], 'cow': ['(File d1)'],
+        }], tiger)
+
+        # Deleting an inode forgets that we owned it.
+        tiger.apply_item(si.unlink(path=b'dog'))
+        self.assertNotIn(tiger_dog, tiger.inodes())
+
+    def test_bottom_up_traversals(self):
+        si = SendStreamItems
+        subvol = Subvolume.new(id_map=InodeIDMap.new())
+        subvol.apply_item(si.mkdir(path=b'd'))
+        subvol.apply_item(si.mkfile(path=b'd/f'))
+        subvol.apply_item(si.link(path=b'g', dest=b'd/f'))
+        subvol.apply_item(si.mkdir(path=b'e'))
+
+        def gathered_paths_and_inodes(top_path):
+            res = []
+            with while_not_exited(subvol.gather_bottom_up(top_path)) as ctx:
+                result = None
+                while True:
+                    path, ino, child_results = ctx.send(result)
+                    res.append((path, ino))
+                    result = (path, child_results)
+            return res, ctx.result
+
+        res, result = gathered_paths_and_inodes(b'.')
+        self.assertEqual(
+            [b'd/f', b'd', b'e', b'g', b'.'], [p for p, _ in res],
+        )
+        self.assertEqual((b'.', {
+            b'd': (b'd', {b'f': (b'd/f', None)}),
+            b'e': (b'e', {}),
+            b'g': (b'g', None),
+        }), result)
+        self.assertEqual(res, list(subvol.gen_bottom_up()))
+
+        res, result = gathered_paths_and_inodes(b'd')
+        self.assertEqual((b'd', {b'f': (b'd/f', None)}), result)
+        self.assertEqual(res, list(subvol.gen_bottom_up(b'd')))
+        self.assertEqual(
+            [(b'g', subvol.inode_at_path(b'd/f'))],
+            list(subvol.gen_bottom_up(b'g')),
+        )
+
+    def test_deep_tree(self):
+        'The traversals do not recurse, so depth is not limited.'
+        si = SendStreamItems
+        depth = sys.getrecursionlimit() + 10
+        subvol = Subvolume.new(id_map=InodeIDMap.new())
+        path = b'.'
+        for _ in range(depth):
+            path = path + b'/d'
+            subvol.apply_item(si.mkdir(path=path))
+        subvol.apply_item(si.mkfile(path=path + b'/f'))
+
+        # Comparing deeply nested lists would hit the recursion limit, so
+        # check the rendered tree by traversing it.
+        inode_reprs = []
+        map_bottom_up(subvol.map_bottom_up(repr), inode_reprs.append)
+        self.assertEqual(['(File)'] + ['(Dir)'] * (depth + 1), inode_reprs)
+
+        paths = [p for p, _ in subvol.gen_bottom_up()]
+        self.assertEqual(depth + 2, len(paths))
+        self.assertEqual(b'/'.join([b'd'] * depth + [b'f']), paths[0])
+        self.assertEqual(b'.', paths[-1])
+
     def test_rendered_tree(self):
         'Miscellaneous coverage over `rendered_tree.py`.'
         with self.assertRaisesRegex(RuntimeError, 'Unknown type in rendered'):
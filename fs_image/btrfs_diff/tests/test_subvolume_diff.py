@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+import unittest
+
+from ..extent import Extent
+from ..freeze import freeze
+from ..inode import Chunk, ChunkClone, Clone, InodeOwner
+from ..inode_id import InodeIDMap
+from ..parse_dump import SendStreamItems
+from ..subvolume import Subvolume
+from ..subvolume_diff import (
+    AddedPath, ChangedData, ChangedMode, ChangedOwner, ChangedUtimes,
+    ChangedXAttr, RemovedPath, RenamedPath, gen_subvolume_diffs,
+    _gen_chunk_segments,
+)
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+si = SendStreamItems
+
+
+def _populate_layer(apply_item):
+    apply_item(si.mkdir(path=b'd'))
+    apply_item(si.mkfile(path=b'd/f'))
+    apply_item(si.write(path=b'd/f', offset=0, data=b'abcd'))
+    apply_item(si.mkdir(path=b'e'))
+    apply_item(si.mkfile(path=b'e/x'))
+    apply_item(si.mkfile(path=b'g'))
+    apply_item(si.mkfile(path=b'h'))
+    apply_item(si.write(path=b'h', offset=0, data=b'xyz'))
+    apply_item(si.symlink(path=b's', dest=b'd/f'))
+
+
+def _mutate_layer(apply_item):
+    apply_item(si.rename(path=b'd', dest=b'd2'))
+    apply_item(si.write(path=b'd2/f', offset=1, data=b'z'))
+    apply_item(si.chmod(path=b'g', mode=0o600))
+    apply_item(si.link(path=b'g2', dest=b'g'))
+    apply_item(si.set_xattr(path=b'h', name=b'k', data=b'v'))
+    apply_item(si.truncate(path=b'h', size=5))
+    apply_item(si.unlink(path=b'e/x'))
+    apply_item(si.mkfile(path=b'n'))
+    apply_item(si.rename(path=b's', dest=b'e/s'))
+
+
+# What `_mutate_layer` changed, in the order of `gen_subvolume_diffs`.
+_SNAPSHOT_DIFFS = [
+    RenamedPath(path=b'd', dest=b'd2'),
+    ChangedMode(path=b'g', old=None, new=0o600),
+    AddedPath(path=b'g2'),
+    ChangedXAttr(path=b'h', name=b'k', old=None, new=b'v'),
+    ChangedData(path=b'h', offset=3, length=2),
+    AddedPath(path=b'n'),
+    ChangedData(path=b'd2/f', offset=1, length=1),
+    RenamedPath(path=b's', dest=b'e/s'),
+    RemovedPath(path=b'e/x'),
+]
+
+
+class SubvolumeDiffTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def test_snapshot(self):
+        left = Subvolume.new(id_map=InodeIDMap.new(description='left'))
+        _populate_layer(left.apply_item)
+        right = left.snapshot(description='right')
+        self.assertEqual(
+            [], list(gen_subvolume_diffs(left, right, same_inode_ids=True)),
+        )
+        _mutate_layer(right.apply_item)
+        self.assertEqual(
+            _SNAPSHOT_DIFFS,
+            list(gen_subvolume_diffs(left, right, same_inode_ids=True)),
+        )
+        # Without `same_inode_ids`, moves are adds & removes.  `d2/f` is
+        # all "added", but the data of `d/f` is still shared with it.
+        self.assertEqual([
+            RemovedPath(path=b'd'),
+            AddedPath(path=b'd2'),
+            *_SNAPSHOT_DIFFS[1:6],
+            RemovedPath(path=b's'),
+            RemovedPath(path=b'd/f'),
+            AddedPath(path=b'd2/f'),
+            AddedPath(path=b'e/s'),
+            RemovedPath(path=b'e/x'),
+        ], list(gen_subvolume_diffs(left, right)))
+        # The reverse direction.
+        self.assertEqual([
+            RenamedPath(path=b'd2', dest=b'd'),
+            ChangedMode(path=b'g', old=0o600, new=None),
+            RemovedPath(path=b'g2'),
+            ChangedXAttr(path=b'h', name=b'k', old=b'v', new=None),
+            ChangedData(path=b'h', offset=3, length=2),
+            RemovedPath(path=b'n'),
+            RenamedPath(path=b'e/s', dest=b's'),
+            ChangedData(path=b'd/f', offset=1, length=1),
+            AddedPath(path=b'e/x'),
+        ], list(gen_subvolume_diffs(right, left, same_inode_ids=True)))
+
+    def test_frozen_snapshot(self):
+        for extent_ids in [False, True]:
+            subvols = SubvolumeSet.new()
+            left_mutator = SubvolumeSetMutator.new(subvols, si.subvol(
+                path=b'left', uuid=b'l', transid=1,
+            ))
+            _populate_layer(left_mutator.apply_item)
+            right_mutator = SubvolumeSetMutator.new(subvols, si.snapshot(
+                path=b'right', uuid=b'r', transid=2,
+                parent_uuid=b'l', parent_transid=1,
+            ))
+            _mutate_layer(right_mutator.apply_item)
+            frozen = freeze(subvols, extent_ids=extent_ids)
+            self.assertEqual(_SNAPSHOT_DIFFS, list(gen_subvolume_diffs(
+                frozen.uuid_to_subvolume['l'],
+                frozen.uuid_to_subvolume['r'],
+                same_inode_ids=True,
+            )))
+            # Frozen separately, the files share no data.
+            self.assertIn(
+                ChangedData(path=b'd2/f', offset=0, length=4),
+                list(gen_subvolume_diffs(
+                    freeze(left_mutator.subvolume),
+                    freeze(right_mutator.subvolume),
+                    same_inode_ids=True,
+                )),
+            )
+
+    def test_unrelated(self):
+        left = Subvolume.new(id_map=InodeIDMap.new(description='left'))
+        right = Subvolume.new(id_map=InodeIDMap.new(description='right'))
+        for subvol in [left, right]:
+            subvol.apply_item(si.mkfile(path=b'f'))
+            subvol.apply_item(si.chown(path=b'f', uid=1, gid=2))
+            subvol.apply_item(si.utimes(
+                path=b'f', ctime=(1, 0), mtime=(1, 0), atime=(1, 0),
+            ))
+            subvol.apply_item(si.set_xattr(path=b'f', name=b'k', data=b'v'))
+            subvol.apply_item(si.truncate(path=b'f', size=4))
+        right.apply_item(si.write(path=b'f', offset=1, data=b'ab'))
+        left.apply_item(si.mkdir(path=b'a'))
+        left.apply_item(si.mkfile(path=b'a/b'))
+        right.apply_item(si.mkfile(path=b'a'))
+        left.apply_item(si.mknod(path=b'dev', mode=0o20644, dev=1))
+        right.apply_item(si.mknod(path=b'dev', mode=0o20644, dev=2))
+        right.apply_item(si.chown(path=b'f', uid=3, gid=2))
+        right.apply_item(si.utimes(
+            path=b'f', ctime=(1, 0), mtime=(2, 0), atime=(1, 0),
+        ))
+        right.apply_item(si.set_xattr(path=b'f', name=b'k', data=b'w'))
+        right.apply_item(si.set_xattr(path=b'f', name=b'j', data=b'u'))
+        left_f = left.inode_at_path(b'f')
+        right_f = right.inode_at_path(b'f')
+        self.assertEqual([
+            RemovedPath(path=b'a'),
+            AddedPath(path=b'a'),
+            RemovedPath(path=b'dev'),
+            AddedPath(path=b'dev'),
+            ChangedOwner(path=b'f', old=left_f.owner, new=right_f.owner),
+            ChangedUtimes(path=b'f', old=left_f.utimes, new=right_f.utimes),
+            ChangedXAttr(path=b'f', name=b'j', old=None, new=b'u'),
+            ChangedXAttr(path=b'f', name=b'k', old=b'v', new=b'w'),
+            ChangedData(path=b'f', offset=1, length=2),
+            RemovedPath(path=b'a/b'),
+        ], list(gen_subvolume_diffs(left, right)))
+        self.assertEqual(InodeOwner(uid=3, gid=2), right_f.owner)
+
+        # The IDs of unrelated subvolumes may coincide, but any coinciding
+        # inodes of different types are still not taken to be renames.
+        self.assertEqual(
+            list(gen_subvolume_diffs(left, right)),
+            list(gen_subvolume_diffs(left, right, same_inode_ids=True)),
+        )
+
+    def test_chunk_segments(self):
+        id_map = InodeIDMap.new()
+        other_id = id_map.next()
+        data = Extent.Kind.DATA
+        self.assertEqual([
+            (0, 3, 'HOLE'),
+            (3, 1, None),
+            (4, 2, 'SHARED'),
+            (6, 1, 'SHARED'),
+            (7, 2, None),
+            (9, 2, 'SHARED'),
+        ], list(_gen_chunk_segments([
+            Chunk(kind=Extent.Kind.HOLE, length=3, chunk_clones=frozenset()),
+            Chunk(kind=data, length=8, chunk_clones=frozenset([
+                # Overlapping clones to the same place are merged.
+                ChunkClone(offset=1, clone=Clone(other_id, 4, 2)),
+                ChunkClone(offset=2, clone=Clone(other_id, 5, 2)),
+                ChunkClone(offset=2, clone=Clone(other_id, 5, 1)),
+                # Misaligned clones do not count.
+                ChunkClone(offset=6, clone=Clone(other_id, 0, 2)),
+                ChunkClone(offset=6, clone=Clone(other_id, 9, 2)),
+            ])),
+        ], other_id)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import unittest
+
+from io import BytesIO
+
+from ..freeze import freeze
+from ..inode_id import InodeIDMap
+from ..parse_dump import SendStreamItems
+from ..parse_send_stream import parse_send_stream
+from ..rendered_tree import emit_all_traversal_ids
+from ..subvolume import Subvolume
+from ..subvolume_freezer import SubvolumeFreezer
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+si = SendStreamItems
+
+
+def _clone(path, from_path, length=3):
+    return si.clone(
+        path=path, offset=0, len=length, from_uuid=b'', from_transid=0,
+        from_path=from_path, clone_offset=0,
+    )
+
+
+class SubvolumeFreezerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def _check_frozen(self, subvol, frozen):
+        expected = freeze(subvol)
+        self.assertEqual(
+            emit_all_traversal_ids(expected.render()),
+            emit_all_traversal_ids(frozen.render()),
+        )
+        # The reprs show the chunks & clones of each inode.
+        self.assertEqual(
+            {id: repr(ino) for id, ino in expected.id_to_inode.items()},
+            {id: repr(ino) for id, ino in frozen.id_to_inode.items()},
+        )
+        self.assertEqual(list(expected.id_to_inode), list(frozen.id_to_inode))
+        self.assertEqual(expected.id_map.inner, frozen.id_map.inner)
+        self.assertEqual(expected.id_map.root, frozen.id_map.root)
+        self.assertIsNone(frozen.id_map.inode_id_counter)
+        # Frozen subvolumes drop the copy-on-write bookkeeping.
+        for name in ['owned_inode_ids', 'id_to_version']:
+            self.assertEqual(getattr(expected, name), getattr(frozen, name))
+        for name in ['owned_dir_ids', 'dir_id_to_version']:
+            self.assertEqual(
+                getattr(expected.id_map, name), getattr(frozen.id_map, name),
+            )
+        for ino in frozen.inodes():
+            for chunk in ino.chunks or ():
+                for cc in chunk.chunk_clones:
+                    self.assertIs(
+                        frozen.id_map.inner, cc.clone.inode_id.inner_id_map,
+                    )
+
+    def test_gold_demo_sendstreams(self):
+        gold = gold_demo_sendstreams()
+        subvols = SubvolumeSet.new()
+        for op in ['create_ops', 'mutate_ops']:
+            items = parse_send_stream(BytesIO(gold[op]['sendstream']))
+            mutator = SubvolumeSetMutator.new(subvols, next(items))
+            subvol = mutator.subvolume
+            freezer = SubvolumeFreezer.new(subvol)
+            for item in items:
+                mutator.apply_item(item)
+                self._check_frozen(subvol, freezer.freeze())
+
+    def test_memoization(self):
+        subvol = Subvolume.new(id_map=InodeIDMap.new())
+        for item in [
+            si.mkdir(path=b'd'),
+            si.mkdir(path=b'd/e'),
+            si.mkfile(path=b'd/e/f'),
+            si.write(path=b'd/e/f', offset=0, data=b'abc'),
+            si.mkfile(path=b'g'),
+            si.mkfile(path=b'h'),
+            si.write(path=b'h', offset=0, data=b'xyz'),
+        ]:
+            subvol.apply_item(item)
+        subvol.apply_clone(_clone(b'g', b'd/e/f'), subvol)
+        freezer = SubvolumeFreezer.new(subvol)
+        first = freezer.freeze()
+        self._check_frozen(subvol, first)
+        # Freezing does not give up ownership, so `h` stays owned, and the
+        # `chmod` below mutates it in place.
+        self.assertEqual(
+            set(subvol.id_to_inode), set(subvol.owned_inode_ids),
+        )
+        self.assertEqual(
+            {subvol.id_map.get_id(p).id for p in [b'd', b'd/e']},
+            subvol.id_map.owned_dir_ids,
+        )
+        h_ino = subvol.inode_at_path(b'h')
+        # The root is mutated in place, so it is not memoized.
+        self.assertEqual(
+            {subvol.id_map.get_id(p).id for p in [b'd', b'd/e']},
+            set(freezer.id_to_dir_memo),
+        )
+
+        def ino(frozen, path):
+            return frozen.id_to_inode[frozen.id_map.get_id(path).id]
+
+        # Only `h` changes, and `f` & `g` are re-frozen for the new map.
+        subvol.apply_item(si.chmod(path=b'h', mode=0o644))
+        self.assertIs(h_ino, subvol.inode_at_path(b'h'))
+        second = freezer.freeze()
+        self._check_frozen(subvol, second)
+        self.assertIs(ino(first, b'd'), ino(second, b'd'))
+        self.assertIs(ino(first, b'd/e'), ino(second, b'd/e'))
+        self.assertIsNot(ino(first, b'h'), ino(second, b'h'))
+        self.assertIsNot(ino(first, b'g'), ino(second, b'g'))
+        self.assertIs(
+            first.id_map.root.name_to_child[b'd'],
+            second.id_map.root.name_to_child[b'd'],
+        )
+        self.assertIsNot(first.id_map.root, second.id_map.root)
+        self.assertEqual('(File m644 d3)', repr(ino(second, b'h')))
+
+        # `d/e` is changed in place, which re-freezes it and `d`.
+        subvol.apply_item(si.mkfile(path=b'd/e/x'))
+        third = freezer.freeze()
+        self._check_frozen(subvol, third)
+        self.assertIsNot(
+            second.id_map.root.name_to_child[b'd'],
+            third.id_map.root.name_to_child[b'd'],
+        )
+        self.assertIs(ino(second, b'h'), ino(third, b'h'))
+
+        # Changing `f`'s extent un-clones `g`, new writes to `h` don't
+        # affect the others.
+        for item in [
+            si.write(path=b'd/e/f', offset=0, data=b'qqq'),
+            si.write(path=b'h', offset=1, data=b'q'),
+        ]:
+            subvol.apply_item(item)
+            self._check_frozen(subvol, freezer.freeze())
+        self.assertEqual('(File d3)', repr(ino(freezer.freeze(), b'g')))
+
+        # Deleted inodes & directories are forgotten.
+        for item in [
+            si.unlink(path=b'd/e/f'),
+            si.unlink(path=b'd/e/x'),
+            si.rmdir(path=b'd/e'),
+            si.rename(path=b'h', dest=b'd/h'),
+        ]:
+            subvol.apply_item(item)
+            self._check_frozen(subvol, freezer.freeze())
+        self.assertEqual(
+            set(subvol.id_to_inode), set(freezer.id_to_inode_memo),
+        )
+        self.assertEqual(
+            {subvol.id_map.get_id(b'd').id}, set(freezer.id_to_dir_memo),
+        )
+        self.assertEqual(
+            {subvol.id_map.get_id(p).id for p in [b'g', b'd/h']},
+            set(freezer.id_to_extent),
+        )
+
+        # A snapshot gets a fresh freezer, the parent is not affected.
+        child = subvol.snapshot(description='child')
+        child.apply_item(si.mkfile(path=b'd/i'))
+        self._check_frozen(child, SubvolumeFreezer.new(child).freeze())
+        self._check_frozen(subvol, freezer.freeze())
+
+
+if __name__ == '__main__':
+    unittest.main()
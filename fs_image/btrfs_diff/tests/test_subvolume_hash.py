@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import unittest
+
+from io import BytesIO
+from unittest import mock
+
+from .. import subvolume_hash
+from ..freeze import freeze
+from ..inode_id import InodeIDMap
+from ..parse_dump import SendStreamItems
+from ..parse_send_stream import parse_send_stream
+from ..subvolume import Subvolume
+from ..subvolume_hash import SubvolumeHasher
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+si = SendStreamItems
+
+
+def _subvol(*items):
+    subvol = Subvolume.new(id_map=InodeIDMap.new())
+    for item in items:
+        subvol.apply_item(item)
+    return subvol
+
+
+def _hash(subvol):
+    return SubvolumeHasher.new().hash_subvolume(subvol)
+
+
+class SubvolumeHashTestCase(unittest.TestCase):
+
+    def test_deterministic(self):
+        base = _subvol(
+            si.mkdir(path=b'd'),
+            si.mkfile(path=b'd/f'),
+            si.write(path=b'd/f', offset=2, data=b'ab'),
+            si.chmod(path=b'd/f', mode=0o644),
+            si.mkfile(path=b'g'),
+        )
+        # Different items, inode IDs & order of creation, same filesystem.
+        self.assertEqual(_hash(base), _hash(_subvol(
+            si.mkfile(path=b'g'),
+            si.mkfile(path=b'tmp'),
+            si.chmod(path=b'tmp', mode=0o644),
+            si.write(path=b'tmp', offset=0, data=b'xyzw'),
+            si.truncate(path=b'tmp', size=2),
+            si.truncate(path=b'tmp', size=0),
+            si.truncate(path=b'tmp', size=2),
+            si.write(path=b'tmp', offset=2, data=b'cd'),
+            si.mkdir(path=b'd'),
+            si.rename(path=b'tmp', dest=b'd/f'),
+        )))
+
+        for item in [
+            si.chmod(path=b'g', mode=0o600),
+            si.chown(path=b'g', uid=1, gid=0),
+            si.utimes(path=b'g', ctime=(1, 0), mtime=(1, 0), atime=(1, 0)),
+            si.set_xattr(path=b'g', name=b'k', data=b'v'),
+            si.truncate(path=b'g', size=1),
+            si.write(path=b'd/f', offset=0, data=b'a'),  # Fill the hole
+            si.rename(path=b'g', dest=b'd/g'),
+            si.mkdir(path=b'e'),
+            si.symlink(path=b's', dest=b'g'),
+            si.mknod(path=b'c', mode=0o20644, dev=1),
+        ]:
+            changed = base.snapshot()
+            changed.apply_item(item)
+            self.assertNotEqual(_hash(base), _hash(changed), item)
+
+    def test_sharing(self):
+        copies = _subvol(
+            si.mkfile(path=b'f'),
+            si.write(path=b'f', offset=0, data=b'abc'),
+            si.mkfile(path=b'g'),
+            si.write(path=b'g', offset=0, data=b'abc'),
+        )
+        links = _subvol(
+            si.mkfile(path=b'f'),
+            si.write(path=b'f', offset=0, data=b'abc'),
+            si.link(path=b'g', dest=b'f'),
+        )
+        clones = _subvol(
+            si.mkfile(path=b'f'),
+            si.write(path=b'f', offset=0, data=b'abc'),
+            si.mkfile(path=b'g'),
+        )
+        clones.apply_clone(si.clone(
+            path=b'g', offset=0, len=3, from_uuid=b'', from_transid=0,
+            from_path=b'f', clone_offset=0,
+        ), clones)
+        self.assertEqual(3, len({_hash(copies), _hash(links), _hash(clones)}))
+
+        # Cloning `f:1+2` to `g:0+2` is shared differently than `f:0+2`.
+        partial = _subvol(
+            si.mkfile(path=b'f'),
+            si.write(path=b'f', offset=0, data=b'abc'),
+            si.mkfile(path=b'g'),
+            si.truncate(path=b'g', size=3),
+        )
+        partial_hashes = set()
+        for clone_offset in [0, 1]:
+            subvol = partial.snapshot()
+            subvol.apply_clone(si.clone(
+                path=b'g', offset=0, len=2, from_uuid=b'', from_transid=0,
+                from_path=b'f', clone_offset=clone_offset,
+            ), subvol)
+            partial_hashes.add(_hash(subvol))
+            self.assertEqual(
+                _hash(freeze(subvol, extent_ids=True)), _hash(subvol),
+            )
+            # Frozen with clones, the hash differs, but is deterministic.
+            self.assertNotIn(_hash(freeze(subvol)), partial_hashes)
+            self.assertEqual(_hash(freeze(subvol)), _hash(freeze(subvol)))
+        self.assertEqual(2, len(partial_hashes))
+
+    def test_memoization(self):
+        hasher = SubvolumeHasher.new()
+        parent = _subvol(
+            si.mkfile(path=b'f'),
+            si.mkfile(path=b'g'),
+        )
+        parent_hash = hasher.hash_subvolume(parent)
+        # The inodes are still owned by `parent`, so they may change.
+        self.assertEqual({}, hasher.id_to_memo)
+        parent.apply_item(si.truncate(path=b'f', size=1))
+        self.assertNotEqual(parent_hash, hasher.hash_subvolume(parent))
+        parent_hash = hasher.hash_subvolume(parent)
+
+        child = parent.snapshot()
+        self.assertEqual(parent_hash, hasher.hash_subvolume(child))
+        self.assertEqual(3, len(hasher.id_to_memo))
+        # Only the changed inodes are hashed anew, & they are not memoized.
+        child.apply_item(si.chmod(path=b'g', mode=0o600))
+        child_hash = hasher.hash_subvolume(child)
+        self.assertNotEqual(parent_hash, child_hash)
+        self.assertEqual(3, len(hasher.id_to_memo))
+        self.assertEqual(parent_hash, hasher.hash_subvolume(parent))
+        self.assertEqual(child_hash, _hash(child))
+
+    def test_memoization_frozen(self):
+        hasher = SubvolumeHasher.new()
+        frozen = freeze(_subvol(
+            si.mkfile(path=b'f'),
+            si.mkdir(path=b'd'),
+            si.mkfile(path=b'd/g'),
+        ))
+        frozen_hash = hasher.hash_subvolume(frozen)
+        # `Inode`s are immutable, so all 4 are memoized.
+        self.assertEqual(4, len(hasher.id_to_memo))
+        with mock.patch.object(
+            subvolume_hash, '_hash_inode', side_effect=AssertionError,
+        ):
+            self.assertEqual(frozen_hash, hasher.hash_subvolume(frozen))
+        self.assertEqual(4, len(hasher.id_to_memo))
+
+    def test_frozen_set(self):
+        subvols = SubvolumeSet.new()
+        for uuid, path in [(b'a', b'f'), (b'b', b'g')]:
+            mutator = SubvolumeSetMutator.new(subvols, si.subvol(
+                path=uuid, uuid=uuid, transid=1,
+            ))
+            mutator.apply_item(si.mkfile(path=path))
+            mutator.apply_item(si.write(path=path, offset=0, data=b'abc'))
+        # `b@g` shares `a@f`, but sharing with other subvolumes is ignored.
+        mutator.apply_item(si.mkfile(path=b'h'))
+        mutator.apply_item(si.clone(
+            path=b'h', offset=0, len=3, from_uuid=b'a', from_transid=1,
+            from_path=b'f', clone_offset=0,
+        ))
+        mutator.apply_item(si.clone(
+            path=b'g', offset=0, len=3, from_uuid=b'a', from_transid=1,
+            from_path=b'f', clone_offset=0,
+        ))
+        b = subvols.uuid_to_subvolume['b']
+        self.assertEqual(_hash(b), _hash(
+            freeze(subvols, extent_ids=True).uuid_to_subvolume['b'],
+        ))
+        # Frozen with clones, `b` hashes the same, whether or not it was
+        # frozen with `a`.
+        self.assertEqual(
+            _hash(freeze(b)), _hash(freeze(subvols).uuid_to_subvolume['b']),
+        )
+
+    def test_gold_demo_sendstreams(self):
+        gold = gold_demo_sendstreams()
+        subvols = SubvolumeSet.new()
+        for op in ['create_ops', 'mutate_ops']:
+            items = parse_send_stream(BytesIO(gold[op]['sendstream']))
+            mutator = SubvolumeSetMutator.new(subvols, next(items))
+            for item in items:
+                mutator.apply_item(item)
+        hasher = SubvolumeHasher.new()
+        hashes = [
+            hasher.hash_subvolume(subvol)
+                for subvol in subvols.uuid_to_subvolume.values()
+        ]
+        self.assertEqual(2, len(set(hashes)))
+        frozen = freeze(subvols, extent_ids=True)
+        self.assertEqual(hashes, [
+            hasher.hash_subvolume(subvol)
+                for subvol in frozen.uuid_to_subvolume.values()
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
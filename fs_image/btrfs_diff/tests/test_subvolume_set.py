@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 import unittest
 
+from io import BytesIO
+
+from ..clone_index import CloneIndex
 from ..freeze import freeze
 from ..parse_dump import SendStreamItems
-from ..rendered_tree import emit_all_traversal_ids
+from ..parse_send_stream import parse_send_stream
+from ..rendered_tree import (
+    emit_all_traversal_ids, emit_non_unique_traversal_ids,
+)
 from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
 
+from .demo_sendstreams import gold_demo_sendstreams
 from .subvolume_utils import expected_subvol_add_traversal_ids
 
 
@@ -35,7 +42,7 @@ class SubvolumeSetTestCase(unittest.TestCase):
 
     def test_subvolume_set(self):
         si = SendStreamItems
-        subvols = SubvolumeSet.new()
+        subvols = SubvolumeSet.new(clone_index=CloneIndex.new())
         # We'll check that freezing the SubvolumeSet at various points
         # results in an object that is not affected by future mutations.
         reprs_and_frozens = []
@@ -60,6 +67,16 @@ class SubvolumeSetTestCase(unittest.TestCase):
         self.assertEqual('cat', repr(cat.id_map.inner.description))
         self.assertEqual('cat', repr(cat.id_map.inner.description))
 
+        # The clone index knows what clones what without freezing.
+        self.assertEqual(
+            ['(cat@to:0+2, cat@from:0+2)'],
+            [f'({a}, {b})' for a, b in subvols.gen_clones(cat, b'to')],
+        )
+        with self.assertRaisesRegex(RuntimeError, 'No b.nope. in '):
+            subvols.gen_clones(cat, b'nope')
+        with self.assertRaisesRegex(RuntimeError, ' made with a clone_index'):
+            freeze(subvols).gen_clones(cat, b'to')
+
         reprs_and_frozens.append(({
             'cat': ['(Dir)', {
                 'from': ['(File d2(cat@to:0+2@0))'],
@@ -138,6 +155,18 @@ class SubvolumeSetTestCase(unittest.TestCase):
         }, freeze(subvols)))
         self._check_repr(*reprs_and_frozens[-1])
 
+        # The same, but with numbered extents instead of `ChunkClone`s.
+        self._check_repr({
+            'cat': ['(Dir)', {
+                'from': ['(File d2(#0:0+2@0))'],
+                'to': ['(File d2(#0:0+2@0))'],
+                'hole': ['(File h5(#1:0+5@0))'],
+            }],
+            'tiger': ['(Dir)', {
+                'to': ['(File d1(#0:0+1@0)h2(#1:2+2@0))'],
+            }],
+        }, freeze(subvols, extent_ids=True))
+
         # Get `repr` to show some disambiguation
         cat2 = SubvolumeSetMutator.new(subvols, si.subvol(
             path=b'cat', uuid=b'app', transid=3,
@@ -206,6 +235,69 @@ class SubvolumeSetTestCase(unittest.TestCase):
         with self.assertRaisesRegex(RuntimeError, ' is already in use: '):
             insert_cat(555)
 
+    def test_long_snapshot_chain(self):
+        '''
+        Applies the demo send-streams with a long chain of incremental
+        snapshots between them.  This doubles as a benchmark: snapshots are
+        copy-on-write, so this is about as fast as applying the two streams.
+        '''
+        si = SendStreamItems
+        chain_len = 40
+
+        def apply_stream(subvols, subvol_item, items):
+            mutator = SubvolumeSetMutator.new(subvols, subvol_item)
+            for item in items:
+                mutator.apply_item(item)
+            return mutator.subvolume
+
+        gold = gold_demo_sendstreams()
+        create_items = list(parse_send_stream(
+            BytesIO(gold['create_ops']['sendstream']),
+        ))
+        mutate_items = list(parse_send_stream(
+            BytesIO(gold['mutate_ops']['sendstream']),
+        ))
+        # The reference: `mutate_ops` applied directly to `create_ops`.
+        ref_subvols = SubvolumeSet.new()
+        apply_stream(ref_subvols, create_items[0], create_items[1:])
+        mutate_ops = apply_stream(
+            ref_subvols, mutate_items[0], mutate_items[1:],
+        )
+
+        subvols = SubvolumeSet.new()
+        create_ops = apply_stream(subvols, create_items[0], create_items[1:])
+
+        parent = create_items[0]
+        for i in range(chain_len):
+            parent = si.snapshot(
+                path=b'layer', uuid=f'layer{i}'.encode(), transid=i,
+                parent_uuid=parent.uuid, parent_transid=parent.transid,
+            )
+            layer = apply_stream(
+                subvols, parent, [si.mkfile(path=f'layer{i}'.encode())],
+            )
+        # Every layer shares all the inodes that it did not create.
+        self.assertEqual(
+            {id(ino) for ino in create_ops.inodes()},
+            {id(ino) for ino in layer.inodes()} - {
+                id(layer.inode_at_path(f'layer{i}'.encode()))
+                    for i in range(chain_len)
+            },
+        )
+
+        chained_mutate_ops = apply_stream(subvols, mutate_items[0]._replace(
+            parent_uuid=parent.uuid,
+            parent_transid=parent.transid,
+        ), mutate_items[1:])
+        for i in range(chain_len):
+            chained_mutate_ops.apply_item(
+                si.unlink(path=f'layer{i}'.encode()),
+            )
+        self.assertEqual(*[
+            emit_non_unique_traversal_ids(freeze(sv).render())
+                for sv in (mutate_ops, chained_mutate_ops)
+        ])
+
 
 if __name__ == '__main__':
     unittest.main()
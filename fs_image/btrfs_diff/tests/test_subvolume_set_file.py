@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+from ..freeze import freeze
+from ..inode_id import InodeIDMap
+from ..parse_send_stream import parse_send_stream
+from ..rendered_tree import emit_all_traversal_ids
+from ..send_stream import SendStreamItems
+from ..subvolume import Subvolume
+from ..subvolume_set import SubvolumeSet, SubvolumeSetMutator
+from ..subvolume_set_file import load_subvolume_set, write_subvolume_set
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+si = SendStreamItems
+
+
+def _demo_subvolume_set():
+    gold = gold_demo_sendstreams()
+    subvols = SubvolumeSet.new()
+    for op in ['create_ops', 'mutate_ops']:
+        items = parse_send_stream(io.BytesIO(gold[op]['sendstream']))
+        mutator = SubvolumeSetMutator.new(subvols, next(items))
+        for item in items:
+            mutator.apply_item(item)
+    return subvols
+
+
+def _render(subvols):
+    return subvols.map(lambda sv: emit_all_traversal_ids(sv.render()))
+
+
+class SubvolumeSetFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.temp_dir = td.name
+
+    def _write(self, subvols, name='subvols'):
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as outfile:
+            write_subvolume_set(subvols, outfile)
+        return path
+
+    def test_round_trip(self):
+        subvols = _demo_subvolume_set()
+        for extent_ids in [False, True]:
+            frozen = freeze(subvols, extent_ids=extent_ids)
+            path = self._write(frozen)
+            loaded = load_subvolume_set(path)
+
+            # Nothing is decoded until it is needed.
+            create_uuid = next(iter(frozen.uuid_to_subvolume))
+            create_ops = loaded.uuid_to_subvolume[create_uuid]
+            self.assertEqual({}, create_ops.id_to_inode._int_id_to_value)
+            self.assertEqual(
+                repr(frozen.uuid_to_subvolume[create_uuid].inode_at_path(
+                    b'hello',
+                )),
+                repr(create_ops.inode_at_path(b'hello')),
+            )
+            self.assertEqual(1, len(create_ops.id_to_inode._int_id_to_value))
+
+            # The renders show the inodes, hardlinks & clones.
+            self.assertEqual(_render(frozen), _render(loaded))
+            self.assertEqual(
+                frozen.name_uuid_prefix_counts, loaded.name_uuid_prefix_counts,
+            )
+            for uuid, subvol in frozen.uuid_to_subvolume.items():
+                loaded_subvol = loaded.uuid_to_subvolume[uuid]
+                self.assertEqual(
+                    subvol.id_map.inner.description,
+                    loaded_subvol.id_map.inner.description,
+                )
+                self.assertEqual(
+                    list(subvol.id_to_inode), list(loaded_subvol.id_to_inode),
+                )
+                self.assertEqual(
+                    list(subvol.gen_rendered_inodes()),
+                    list(loaded_subvol.gen_rendered_inodes()),
+                )
+            self.assertEqual(
+                sorted(repr(ino) for ino in frozen.inodes()),
+                sorted(repr(ino) for ino in loaded.inodes()),
+            )
+
+            # Writing is deterministic, and a loaded set writes the same.
+            with open(path, 'rb') as infile:
+                data = infile.read()
+            with open(self._write(frozen, 'again'), 'rb') as infile:
+                self.assertEqual(data, infile.read())
+            with open(self._write(loaded, 'loaded'), 'rb') as infile:
+                self.assertEqual(data, infile.read())
+
+    def test_sharing(self):
+        subvols = SubvolumeSet.new()
+        mutator = SubvolumeSetMutator.new(subvols, si.subvol(
+            path=b'parent', uuid=b'p', transid=1,
+        ))
+        for i in range(100):
+            mutator.apply_item(si.mkdir(path=b'd%d' % i))
+            mutator.apply_item(si.mkfile(path=b'd%d/f' % i))
+        one_path = self._write(freeze(subvols), 'one')
+        for i in range(5):
+            SubvolumeSetMutator.new(subvols, si.snapshot(
+                path=b'child%d' % i, uuid=b'c%d' % i, transid=2,
+                parent_uuid=b'p', parent_transid=1,
+            ))
+        six_path = self._write(freeze(subvols), 'six')
+        # The unchanged snapshots add little more than their headers.
+        self.assertLess(
+            os.path.getsize(six_path), 1.1 * os.path.getsize(one_path),
+        )
+        loaded = load_subvolume_set(six_path)
+        self.assertEqual(_render(freeze(subvols)), _render(loaded))
+        self.assertEqual(
+            100, len(loaded.uuid_to_subvolume['c0'].id_map.root.name_to_child),
+        )
+        # Unchanged directories are shared, like in frozen snapshots.
+        self.assertIs(
+            loaded.uuid_to_subvolume['c0'].id_map.root.name_to_child[b'd0'],
+            loaded.uuid_to_subvolume['c1'].id_map.root.name_to_child[b'd0'],
+        )
+
+    def test_errors(self):
+        subvols = _demo_subvolume_set()
+        with self.assertRaisesRegex(RuntimeError, 'Only frozen subvolumes '):
+            self._write(subvols)
+
+        # The `mutate_ops` subvolume clones from `create_ops`.
+        frozen = freeze(subvols)
+        create_uuid, mutate_uuid = frozen.uuid_to_subvolume
+        with self.assertRaisesRegex(RuntimeError, 'is not in the Subvol'):
+            self._write(frozen._replace(uuid_to_subvolume={
+                mutate_uuid: frozen.uuid_to_subvolume[mutate_uuid],
+            }))
+        subvol = Subvolume.new(id_map=InodeIDMap.new(description='x'))
+        with self.assertRaisesRegex(RuntimeError, 'x is not a SubvolumeDes'):
+            self._write(SubvolumeSet(
+                uuid_to_subvolume={'x': freeze(subvol)},
+                name_uuid_prefix_counts={},
+                clone_index=None,
+            ))
+
+        path = self._write(frozen)
+        id_to_inode = load_subvolume_set(path).uuid_to_subvolume[
+            create_uuid
+        ].id_to_inode
+        for bad_id in [-1, 10 ** 6, 'x']:
+            self.assertNotIn(bad_id, id_to_inode)
+        self.assertEqual(
+            len(frozen.uuid_to_subvolume[create_uuid].id_to_inode),
+            len(id_to_inode),
+        )
+
+        with open(path, 'rb') as infile:
+            data = infile.read()
+        for bad_data in [b'', b'x' * 100]:
+            with open(path, 'wb') as outfile:
+                outfile.write(bad_data)
+            with self.assertRaisesRegex(RuntimeError, 'is not a Subvolume'):
+                load_subvolume_set(path)
+        with open(path, 'wb') as outfile:
+            byteorder = sys.byteorder.encode()
+            outfile.write(data.replace(byteorder, b'x' * len(byteorder)))
+        with self.assertRaisesRegex(RuntimeError, 'byte order are not'):
+            load_subvolume_set(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import io
+import unittest
+
+from .demo_sendstreams import gold_demo_sendstreams
+
+from ..parse_send_stream import (
+    parse_send_stream, parse_send_stream_buffer, parse_send_streams,
+)
+from ..send_stream import ItemFilters, SendStreamItems
+from ..write_send_stream import serialize_item, write_send_stream
+
+# `unittest`'s output shortening makes tests much harder to debug.
+unittest.util._MAX_LENGTH = 12345
+
+
+def _write_to_bytes(items) -> bytes:
+    out = io.BytesIO()
+    write_send_stream(items, out)
+    return out.getvalue()
+
+
+class WriteSendStreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = 12345
+
+    def test_round_trip(self):
+        stream_dict = gold_demo_sendstreams()
+        for name in ['create_ops', 'mutate_ops']:
+            gold = stream_dict[name]['sendstream']
+            items = list(parse_send_stream(io.BytesIO(gold)))
+            written = _write_to_bytes(items)
+            self.assertEqual(items, list(
+                parse_send_stream(io.BytesIO(written), check_crc=True)
+            ))
+            # Re-serializing our own output is bit-identical.
+            self.assertEqual(written, _write_to_bytes(
+                parse_send_stream(io.BytesIO(written))
+            ))
+            # Lazy `memoryview` payloads serialize the same way.
+            self.assertEqual(
+                written, _write_to_bytes(parse_send_stream_buffer(gold)),
+            )
+            # The kernel's output only differs by the attributes that the
+            # parser drops, so ours is a bit shorter.
+            self.assertLess(len(written), len(gold))
+
+    def test_streaming_filter(self):
+        gold = gold_demo_sendstreams()['create_ops']['sendstream']
+
+        def discard_all(path, data):
+            return True
+
+        items = list(parse_send_stream(io.BytesIO(gold)))
+        filtered = list(ItemFilters.selinux_xattr(items, discard_all))
+        written = _write_to_bytes(ItemFilters.selinux_xattr(
+            parse_send_stream(io.BytesIO(gold)), discard_all,
+        ))
+        self.assertEqual(
+            filtered, list(parse_send_stream(io.BytesIO(written))),
+        )
+
+        # Concatenated output is just concatenated streams.
+        self.assertEqual(
+            [(0, i) for i in filtered] + [(1, i) for i in filtered],
+            list(parse_send_streams(io.BytesIO(written + written))),
+        )
+
+    def test_errors(self):
+        with self.assertRaisesRegex(RuntimeError, 'DATA of 65536 bytes'):
+            serialize_item(SendStreamItems.write(
+                path=b'p', offset=0, data=b'x' * 2 ** 16,
+            ))
+        with self.assertRaises(KeyError):
+            serialize_item(('not', 'an', 'item'))
+
+
+if __name__ == '__main__':
+    unittest.main()
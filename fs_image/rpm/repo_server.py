@@ -7,6 +7,24 @@ Validates content checksums, so the specified `--storage` does not have to
 be 100% trustworthy, we just need to trust the provenance of the
 `--snapshot-dir`.
 
+Serves up to `--num-threads` connections concurrently, so that one slow
+download does not hold up the others.  Speaks HTTP/1.1, so clients like
+`yum` can reuse a connection for many requests, and pipeline them.  If a
+blob is a local file (as with `FilesystemStorage`), it is verified before
+being sent via `sendfile`, which avoids copying the data through Python.
+With `--verified-blob-cache`, local blob files are only hashed once, see
+`verified_blob_cache.py`.
+
+With `--daemon-socket-fd`, it instead serves all the TCP sockets that
+its clients pass it over a Unix socket, so one resident server can serve
+the snapshot to many `yum-from-snapshot` invocations, each in its own
+network namespace.  See `RepoServerDaemon`.
+
+Supports conditional requests, using the snapshot checksum as the `ETag`,
+and byte ranges, so that `yum` can resume an interrupted download.  A
+range is only sent once the whole blob has been verified, so ranges are
+only supported for local blob files, which can be read twice.
+
 Here is how to run a test invocation of this server -- just be sure to use
 the same `--storage` configuration as you did for your test snapshot:
 
@@ -23,74 +41,142 @@ os.execlp(sys.argv[1], *sys.argv[1:], str(s.fileno()))
   --snapshot-dir YOUR_SNAPSHOT/ --socket-fd
 
 '''
+import datetime
+import email.utils
 import json
 import os
+import re
+import selectors
 import socket
+import threading
 import time
 import urllib.parse
+import uuid
 
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
 from socketserver import BaseServer
 from http.server import BaseHTTPRequestHandler, HTTPStatus
-from typing import Mapping, Tuple
+from typing import Iterator, List, Mapping, Optional, Tuple, Union
 
-from .common import Checksum, get_file_logger, Path, set_new_key
+from .common import (
+    Checksum, get_file_logger, Path, recv_fds, set_new_key,
+)
 from .repo_objects import RepoMetadata
 from .repo_snapshot import FileIntegrityError, ReportableError
-from .storage import Storage
+from .snapshot_index import (
+    content_bytes_obj, INDEX_FILENAME, REPOMD_LOCATION, SnapshotIndex,
+)
+from .storage import Storage, StorageInput
+from .verified_blob_cache import file_identity, VerifiedBlobCache
 
 log = get_file_logger(__file__)
 
 
 # How big are our reads against Storage? Exposed for the unit test.
 _CHUNK_SIZE = 2 ** 21
+# Each connection occupies a thread until the client closes it, or until it
+# is idle for `RepoSnapshotHTTPRequestHandler.timeout` seconds.
+_DEFAULT_NUM_THREADS = 16
+# A `Range` header is a list of `first-last`, `first-`, or `-suffix_len`.
+_RANGE_SPEC_RE = re.compile('([0-9]*)-([0-9]*)')
+# Beyond this many ranges, we just send the whole object.
+_MAX_RANGES = 100
+# The protocol of `RepoServerDaemon`, which see.
+DAEMON_LISTEN_MSG = b'listen'
+DAEMON_READY_MSG = b'ready'
+
+
+def _read_repo_dir(repo_path: Path) -> Mapping[str, dict]:
+    'Parses the snapshot of a repo that lacks an `index.sqlite3`.'
+    location_to_obj = {}
+    for filename in ['rpm.json', 'repodata.json']:
+        with open(repo_path / filename) as infile:
+            for location, obj in json.load(infile).items():
+                set_new_key(location_to_obj, location, obj)
+
+    # Re-parse and serialize the metadata to a format that ALMOST matches
+    # the other blobs (imitating `RepoSnapshot.to_directory()`).  If useful,
+    # it would not be offensive to make such a `repomd.json` be emitted by
+    # RepoSnapshot, instead of `repomd.xml`.  Caveat: JSON isn't suitable
+    # for bytes, and the XML is currently bytes.
+    with open(repo_path / 'repomd.xml', 'rb') as infile:
+        repomd = RepoMetadata.new(xml=infile.read())
+    location_to_obj[REPOMD_LOCATION] = content_bytes_obj(
+        repomd.xml, repomd.build_timestamp,
+    )
+    return location_to_obj
 
 
-def read_snapshot_dir(path: str):
-    location_to_obj = {}
+class _SnapshotDirLocations(Mapping):
+    'Maps `repo/location` to the object at `location` in `repo`.'
+
+    def __init__(self, repo_to_location_to_obj: Mapping[str, Mapping]):
+        self._repo_to_location_to_obj = repo_to_location_to_obj
+
+    def __getitem__(self, location: str) -> dict:
+        repo, _, repo_location = location.partition('/')
+        location_to_obj = self._repo_to_location_to_obj.get(repo)
+        if location_to_obj is None:
+            raise KeyError(location)
+        return location_to_obj[repo_location]
+
+    def __iter__(self) -> Iterator[str]:
+        for repo, location_to_obj in self._repo_to_location_to_obj.items():
+            for location in location_to_obj:
+                yield os.path.join(repo, location)
+
+    def __len__(self) -> int:
+        return sum(map(len, self._repo_to_location_to_obj.values()))
+
+
+def read_snapshot_dir(path: str) -> Mapping[str, dict]:
+    '''
+    Returns the objects to serve, keyed by `repo/location`.  The repos that
+    have an `index.sqlite3` are loaded lazily, see `snapshot_index.py`.
+    '''
+    repo_to_location_to_obj = {}
     for repo in os.listdir(path):
         if repo == 'yum.conf':
             continue
         repo_path = Path(path) / repo
 
-        for filename in ['rpm.json', 'repodata.json']:
-            with open(repo_path / filename) as infile:
-                for location, obj in json.load(infile).items():
-                    set_new_key(
-                        location_to_obj, os.path.join(repo, location), obj
-                    )
-
-        # Re-parse and serialize the metadata to a format that ALMOST
-        # matches the other blobs (imitating `RepoSnapshot.to_directory()`).
-        # If useful, it would not be offensive to make such a `repomd.json`
-        # be emitted by RepoSnapshot, instead of `repomd.xml`.  Caveat: JSON
-        # isn't suitable for bytes, and the XML is currently bytes.
-        with open(repo_path / 'repomd.xml', 'rb') as infile:
-            repomd = RepoMetadata.new(xml=infile.read())
-        location_to_obj[os.path.join(repo, 'repodata/repomd.xml')] = {
-            'size': repomd.size,
-            'build_timestamp': repomd.build_timestamp,
-            'content_bytes': repomd.xml,  # Instead of `storage_id`
-        }
-
-        # Similarly, make JSON metadata for the repo's GPG keys.
+        # Make JSON metadata for the repo's GPG keys, like for `repomd.xml`.
         key_dir = repo_path / 'gpg_keys'
+        key_location_to_obj = {}
         for key_filename in os.listdir(key_dir.decode()):
             with open(key_dir / key_filename, 'rb') as infile:
-                key_content = infile.read()
-            location_to_obj[os.path.join(repo, key_filename)] = {
-                'size': len(key_content),
-                # We don't have a good timestamp for these, so set it to
-                # "now".  Caching efficiency losses should be negligible :)
-                'build_timestamp': int(time.time()),
-                'content_bytes': key_content,  # Instead of `storage_id`
-            }
+                key_location_to_obj[key_filename] = content_bytes_obj(
+                    infile.read(),
+                    # We don't have a good timestamp for these, so set it to
+                    # "now".  Caching efficiency losses should be negligible.
+                    int(time.time()),
+                )
+
+        # The keys take precedence over any snapshot objects.
+        repo_to_location_to_obj[repo] = ChainMap(
+            key_location_to_obj,
+            SnapshotIndex(repo_path / INDEX_FILENAME)
+                if os.path.exists(repo_path / INDEX_FILENAME)
+                    else _read_repo_dir(repo_path),
+        )
 
-    return location_to_obj
+    return _SnapshotDirLocations(repo_to_location_to_obj)
 
 
 class RepoSnapshotHTTPRequestHandler(BaseHTTPRequestHandler):
     server_version = 'RPMRepoSnapshot'
-    protocol_version = 'HTTP/1.0'
+    # Keep-alive lets `yum` fetch many RPMs over one connection.  The
+    # catch is that every response must have an accurate `Content-Length`,
+    # and we must close the connection whenever we send a short body.
+    protocol_version = 'HTTP/1.1'
+    # Socket timeout in seconds.  This frees the thread of a connection
+    # that has been idle (or stalled) for this long.
+    timeout = 60
+    # We send the headers & body in separate writes.  On a reused
+    # connection, Nagle's algorithm would then hold back the body until
+    # the client's delayed ACK of the headers, costing ~40ms per request.
+    disable_nagle_algorithm = True
 
     def __init__(
         self, *args,
@@ -98,10 +184,12 @@ class RepoSnapshotHTTPRequestHandler(BaseHTTPRequestHandler):
         # retries from succeeding.
         location_to_obj: Mapping[str, dict],
         storage: Storage,
+        verified_blob_cache: Optional[VerifiedBlobCache],
         **kwargs,
     ):
         self.location_to_obj = location_to_obj
         self.storage = storage
+        self.verified_blob_cache = verified_blob_cache
         super().__init__(*args, **kwargs)
 
     def _memoize_error(self, obj, error: ReportableError):
@@ -109,82 +197,169 @@ class RepoSnapshotHTTPRequestHandler(BaseHTTPRequestHandler):
         Any size or checksum errors we see are likely to be permanent, so we
         MUTATE `obj` with the error, hiding the old `storage_id` inside.
         '''
+        storage_id = obj.pop('storage_id', None)
+        if storage_id is None:
+            return  # Another thread already memoized an error for `obj`.
         error_dict = {
             **error.to_dict(),
             # Since `storage_id` is hidden, `send_head` will show the error.
-            'storage_id': obj.pop('storage_id'),
+            'storage_id': storage_id,
         }
         set_new_key(obj, 'error', error_dict)
 
     def do_GET(self) -> None:
-        location, obj = self.send_head()
-        if not obj:
-            return  # Object not found, we already sent an error.
+        location, obj = self.find_obj()
+        if not obj or self._send_not_modified(obj):
+            return  # We already sent an error, or a 304.
         if 'content_bytes' in obj:
-            self.wfile.write(obj['content_bytes'])
+            for part in self.send_head(location, obj, self._parse_ranges(obj)):
+                self.wfile.write(
+                    part if isinstance(part, bytes)
+                        else obj['content_bytes'][part[0]:part[1]]
+                )
             return
 
         # This binary blob must be fetched from `self.storage`. We don't
         # trust our storage, so we have to verify the checksum before
         # sending the entire blob back to the client.
+        storage_id = obj.get('storage_id')
+        if storage_id is None:  # Another thread found an error.
+            self.send_head(location, obj, None)
+            self.close_connection = True  # The client will see an error.
+            return
+        with self.storage.reader(storage_id) as input:
+            if input.local_file is None:
+                # Without seeking, we could only send a range after
+                # verifying the whole blob by buffering it, so we just
+                # ignore `Range`, as RFC 7233 allows.
+                self.send_head(location, obj, None)
+                bytes_sent = 0
+                for chunk in self._gen_verified_chunks(location, obj, input):
+                    self.wfile.write(chunk)
+                    bytes_sent += len(chunk)
+                if bytes_sent != obj['size']:
+                    # A short body is how we signal errors, so the client
+                    # should not be able to send more requests on this
+                    # connection.
+                    self.close_connection = True
+                return
+            ranges = self._parse_ranges(obj)
+            parts = self.send_head(location, obj, ranges)
+            if ranges == []:
+                return  # A 416 has no body, so don't bother verifying.
+            # Verify the whole file before sending any of it, even if only
+            # a range was requested.  The `sendfile` will come up short if
+            # the file is truncated meanwhile, but we assume that storage
+            # does not modify committed blobs in place.
+            if not self._verify_local_file(location, obj, storage_id, input):
+                self.close_connection = True
+                return
+            for part in parts:
+                if isinstance(part, bytes):
+                    self.wfile.write(part)
+                    continue
+                start, end = part
+                if self.connection.sendfile(
+                    input.local_file, offset=start, count=end - start,
+                ) != end - start:
+                    self.close_connection = True
+                    return
+
+    def _verify_local_file(
+        self, location: str, obj: dict, storage_id: str, input: StorageInput,
+    ) -> bool:
+        'Hashes the file, unless `self.verified_blob_cache` vouches for it.'
+        cache = self.verified_blob_cache
+        if cache is not None:
+            stat = os.fstat(input.local_file.fileno())
+            if cache.is_verified(
+                storage_id=storage_id, checksum=obj['checksum'],
+                size=obj['size'], stat=stat,
+            ):
+                return True
+        if sum(
+            len(chunk)
+                for chunk in self._gen_verified_chunks(location, obj, input)
+        ) != obj['size']:
+            return False
+        # Don't cache the file if it changed while we were hashing it.
+        if cache is not None and file_identity(stat) == file_identity(
+            os.fstat(input.local_file.fileno())
+        ):
+            cache.add_verified(
+                storage_id=storage_id, checksum=obj['checksum'], stat=stat,
+            )
+        return True
+
+    def _gen_verified_chunks(
+        self, location: str, obj: dict, input: StorageInput,
+    ) -> Iterator[bytes]:
+        '''
+        Yields the blob in chunks.  On a size or checksum error, we memoize
+        the error, and stop without yielding the last chunk.
+        '''
         bytes_left = obj['size']
         checksum = Checksum.from_string(obj['checksum'])
-        with self.storage.reader(obj['storage_id']) as input:
-            hash = checksum.hasher()
-            while True:
-                chunk = input.read(_CHUNK_SIZE)
-                bytes_left -= len(chunk)
-                if not chunk:
-                    if bytes_left != 0:  # The client will see an error.
-                        self._memoize_error(obj, FileIntegrityError(
-                            location=location,
-                            failed_check='size',
-                            expected=obj['size'],
-                            actual=obj['size'] - bytes_left,
-                        ))
-                    break
-
-                #
-                # Check for errors **before** sending out more data -- this
-                # might be the last chunk, and so we signal errors by
-                # refusing to send the last bit of data.
-                #
-
-                # It's possible that we have a chunk after the last chunk,
-                # but we don't want to send that last chunk since the client
-                # might conclude all is well upon receiving enough data.
-                if bytes_left == 0:
-                    # The next `if` will error if we get a non-empty chunk.
-                    # The error's `actual=` might be an underestimate.
-                    bytes_left -= len(input.read())
-
-                if bytes_left < 0:
+        hash = checksum.hasher()
+        while True:
+            chunk = input.read(_CHUNK_SIZE)
+            bytes_left -= len(chunk)
+            if not chunk:
+                if bytes_left != 0:  # The client will see an error.
                     self._memoize_error(obj, FileIntegrityError(
                         location=location,
                         failed_check='size',
                         expected=obj['size'],
                         actual=obj['size'] - bytes_left,
                     ))
-                    break  # Incomplete content, client will see an error.
-
-                hash.update(chunk)
-                if bytes_left == 0 and hash.hexdigest() != checksum.hexdigest:
-                    self._memoize_error(obj, FileIntegrityError(
-                        location=location,
-                        failed_check=checksum.algorithm,
-                        expected=checksum.hexdigest,
-                        actual=hash.hexdigest(),
-                    ))
-                    break  # Incomplete content, client will see an error.
-
-                # If this is the last chunk, the stream was error-free.
-                self.wfile.write(chunk)
+                break
+
+            #
+            # Check for errors **before** yielding more data -- this
+            # might be the last chunk, and so we signal errors by
+            # refusing to send the last bit of data.
+            #
+
+            # It's possible that we have a chunk after the last chunk,
+            # but we don't want to send that last chunk since the client
+            # might conclude all is well upon receiving enough data.
+            if bytes_left == 0:
+                # The next `if` will error if we get a non-empty chunk.
+                # The error's `actual=` might be an underestimate.
+                bytes_left -= len(input.read())
+
+            if bytes_left < 0:
+                self._memoize_error(obj, FileIntegrityError(
+                    location=location,
+                    failed_check='size',
+                    expected=obj['size'],
+                    actual=obj['size'] - bytes_left,
+                ))
+                break  # Incomplete content, client will see an error.
+
+            hash.update(chunk)
+            if bytes_left == 0 and hash.hexdigest() != checksum.hexdigest:
+                self._memoize_error(obj, FileIntegrityError(
+                    location=location,
+                    failed_check=checksum.algorithm,
+                    expected=checksum.hexdigest,
+                    actual=hash.hexdigest(),
+                ))
+                break  # Incomplete content, client will see an error.
+
+            # If this is the last chunk, the stream was error-free.
+            yield chunk
 
     def do_HEAD(self):
-        self.send_head()
+        location, obj = self.find_obj()
+        if obj and not self._send_not_modified(obj):
+            self.send_head(location, obj, None)
 
-    def send_head(self) -> Tuple[str, dict]:
-        'Returns (location, obj) from the repo JSON snapshot.'
+    def find_obj(self) -> Tuple[str, dict]:
+        '''
+        Returns (location, obj) from the repo JSON snapshot, or sends an
+        error and returns (None, None).
+        '''
         # Ignore query parameters & fragment, remove leading / if present.
         # Promoting to unicode since we get our repo snapshot from JSON, and
         # though ideally we'd use `unquote_to_bytes`.
@@ -207,15 +382,154 @@ class RepoSnapshotHTTPRequestHandler(BaseHTTPRequestHandler):
             # `_memoize_error` hacks other errors to include a `storage_id`
             # in our in-memory representation -- do check the error type!
             return None, None
-        self.send_response(HTTPStatus.OK)
-        self.send_header('Content-type', self.type_for_path(location))
-        self.send_header('Content-Length', str(obj['size']))
+        return location, obj
+
+    def _etag(self, obj: dict) -> Optional[str]:
+        # A strong validator, since our content never changes for a given
+        # checksum -- and if the checksum is wrong, we never send it all.
+        return f'"{obj["checksum"]}"' if 'checksum' in obj else None
+
+    def _send_validators(self, obj: dict) -> None:
         self.send_header('Last-Modified', self.date_time_string(
             obj['build_timestamp'],
         ))
-        # Future: if useful, could send_header('ETag', obj['checksum'])
+        etag = self._etag(obj)
+        if etag is not None:
+            self.send_header('ETag', etag)
+
+    def _send_not_modified(self, obj: dict) -> bool:
+        '''
+        Sends a 304 and returns True if the client's cached copy is
+        current, as per the `If-None-Match` or `If-Modified-Since` headers.
+        This makes re-fetches of unchanged repodata nearly free.
+        '''
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # Per RFC 7232, the comparison is weak, and `*` matches any
+            # existing object.
+            etag = self._etag(obj)
+            if not any(
+                tag.strip() == '*' or (
+                    etag is not None and tag.strip() in (etag, 'W/' + etag)
+                ) for tag in if_none_match.split(',')
+            ):
+                return False
+        else:
+            if_modified_since = self.headers.get('If-Modified-Since')
+            if if_modified_since is None:
+                return False
+            try:
+                date = email.utils.parsedate_to_datetime(if_modified_since)
+            # As in `http.server.SimpleHTTPRequestHandler`, ignore bad dates.
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            if date.tzinfo is None:
+                date = date.replace(tzinfo=datetime.timezone.utc)
+            if obj['build_timestamp'] > date.timestamp():
+                return False
+        self.send_response(HTTPStatus.NOT_MODIFIED)
+        self._send_validators(obj)
         self.end_headers()
-        return location, obj
+        return True
+
+    def _parse_ranges(self, obj: dict) -> Optional[List[Tuple[int, int]]]:
+        '''
+        Returns the `(start, end)` byte ranges of `obj` requested via the
+        `Range` header, sorted, with overlapping & adjacent ranges merged.
+        An empty list means that no range is satisfiable.  As RFC 7233
+        permits, we return None, to send all of `obj`, when the header is
+        missing or invalid, when `If-Range` does not match our `ETag`, or
+        when there are too many ranges.
+        '''
+        range_header = self.headers.get('Range')
+        if range_header is None:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range != self._etag(obj):
+            return None  # The client's partial copy is not of this `obj`.
+        unit, _, range_specs = range_header.partition('=')
+        if unit.strip().lower() != 'bytes':
+            return None
+        size = obj['size']
+        ranges = []
+        for range_spec in range_specs.split(','):
+            m = _RANGE_SPEC_RE.fullmatch(range_spec.strip())
+            if not m:
+                return None
+            first, last = m.groups()
+            if first:
+                start = int(first)
+                if not last:
+                    end = size
+                elif int(last) < start:
+                    return None
+                else:
+                    end = min(size, int(last) + 1)
+                if start < size:
+                    ranges.append((start, end))
+            elif last:  # The final `last` bytes
+                if int(last) > 0 and size > 0:
+                    ranges.append((max(0, size - int(last)), size))
+            else:
+                return None
+        if len(ranges) > _MAX_RANGES:
+            return None
+        merged_ranges = []
+        for start, end in sorted(ranges):
+            if merged_ranges and start <= merged_ranges[-1][1]:
+                prev_start, prev_end = merged_ranges[-1]
+                merged_ranges[-1] = (prev_start, max(prev_end, end))
+            else:
+                merged_ranges.append((start, end))
+        return merged_ranges
+
+    def send_head(
+        self, location: str, obj: dict,
+        ranges: Optional[List[Tuple[int, int]]],
+    ) -> List[Union[bytes, Tuple[int, int]]]:
+        '''
+        Sends the status & headers for `obj`, or for its byte `ranges`, if
+        not None -- see `_parse_ranges`.  Returns the parts of the body:
+        `bytes` to send as-is, and `(start, end)` byte ranges of `obj`.
+        '''
+        size = obj['size']
+        content_type = self.type_for_path(location)
+        if ranges is None:
+            self.send_response(HTTPStatus.OK)
+            parts = [(0, size)] if size else []
+        elif not ranges:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{size}')
+            parts = []
+        elif len(ranges) == 1:
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            (start, end), = ranges
+            self.send_header(
+                'Content-Range', f'bytes {start}-{end - 1}/{size}',
+            )
+            parts = ranges
+        else:
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            boundary = uuid.uuid4().hex
+            parts = []
+            for start, end in ranges:
+                parts.append((
+                    f'\r\n--{boundary}\r\n'
+                    f'Content-type: {content_type}\r\n'
+                    f'Content-Range: bytes {start}-{end - 1}/{size}\r\n'
+                    '\r\n'
+                ).encode())
+                parts.append((start, end))
+            parts.append(f'\r\n--{boundary}--\r\n'.encode())
+            content_type = f'multipart/byteranges; boundary={boundary}'
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(sum(
+            len(part) if isinstance(part, bytes) else part[1] - part[0]
+                for part in parts
+        )))
+        self._send_validators(obj)
+        self.end_headers()
+        return parts
 
     # There is also the more expensive & comprehensive `mimetypes` module,
     # but we don't need too many extensions.
@@ -285,19 +599,181 @@ class HTTPSocketServer(BaseServer):
         request.close()
 
 
-def repo_server(sock, location_to_obj: Mapping[str, dict], storage: Storage):
+class ThreadPoolHTTPSocketServer(HTTPSocketServer):
+    '''
+    Like `socketserver.ThreadingMixIn`, but handles connections on a
+    bounded pool of threads, rather than starting a thread per connection.
+    Once all the threads are busy, newly accepted connections wait their
+    turn.
+
+    `server_close` lets the ongoing responses finish, but it does not wait
+    for idle keep-alive clients to hang up.
+    '''
+
+    def __init__(self, *args, num_threads: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_threads, thread_name_prefix='RepoServer',
+        )
+        self._lock = threading.Lock()
+        self._open_requests = set()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self._open_requests.add(request)
+        self._executor.submit(
+            self._process_request_thread, request, client_address,
+        )
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:  # pragma: no cover
+            self.handle_error(request, client_address)
+        finally:
+            with self._lock:
+                self._open_requests.discard(request)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        with self._lock:
+            for request in self._open_requests:
+                # The handler will see EOF once it tries to read the next
+                # request, but can still send its current response.
+                try:
+                    request.shutdown(socket.SHUT_RD)
+                except OSError:  # pragma: no cover
+                    pass  # Some platforms may raise ENOTCONN here
+        self._executor.shutdown(wait=True)
+
+
+class RepoServerDaemon(ThreadPoolHTTPSocketServer):
+    '''
+    Listens on a Unix socket, and serves HTTP connections from any number
+    of TCP sockets that its clients send over it, so that one long-lived
+    server can serve a snapshot to many `yum` containers.  A client:
+
+      - Connects, and sends `DAEMON_LISTEN_MSG` with the file descriptor
+        of a TCP socket that is bound & listening -- in practice, inside
+        the network namespace of a container.
+
+      - Receives `DAEMON_READY_MSG` once we accept connections on it.
+
+      - Closes its connection once it is done, at which point we stop
+        accepting connections on its TCP socket, and close it.
+
+    The TCP connections share the thread pool of our base class.  Each
+    client also gets a thread that waits for connections on its socket.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client_to_thread = {}  # Protected by `self._lock`
+        self._last_active = time.monotonic()
+        self._idle = False
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(
+            target=self._serve_client, args=(request,),
+            name='RepoServerDaemonClient',
+        )
+        with self._lock:
+            self._client_to_thread[request] = thread
+        thread.start()
+
+    def _serve_client(self, client: socket.socket):
+        try:
+            msg, fds = recv_fds(client, len(DAEMON_LISTEN_MSG), 1)
+            if msg != DAEMON_LISTEN_MSG or len(fds) != 1:
+                for fd in fds:
+                    os.close(fd)
+                log.error(f'Bad message {msg} with {len(fds)} FDs')
+                return
+            with socket.socket(fileno=fds[0]) as listener, \
+                    selectors.DefaultSelector() as selector:
+                # Never block in `accept`, even if the client that woke us
+                # up has already gone away.
+                listener.setblocking(False)
+                selector.register(listener, selectors.EVENT_READ)
+                selector.register(client, selectors.EVENT_READ)
+                client.sendall(DAEMON_READY_MSG)
+                while True:
+                    for key, _events in selector.select():
+                        # The client hung up (or, against protocol, wrote
+                        # something), or `server_close` shut it down.
+                        if key.fileobj is client:
+                            return
+                        try:
+                            request, address = listener.accept()
+                        except BlockingIOError:  # pragma: no cover
+                            continue  # The connection went away
+                        super().process_request(request, address)
+        except OSError:  # pragma: no cover
+            # E.g. if the client hung up before we sent "ready"
+            log.exception('Error serving daemon client')
+        finally:
+            with self._lock:
+                del self._client_to_thread[client]
+                self._last_active = time.monotonic()
+            client.close()
+
+    def serve_until_idle(self, idle_timeout: float) -> None:
+        '''
+        Like `serve_forever`, but returns once we have had no clients for
+        at least `idle_timeout` seconds.  Unlike `serve_forever`, this is
+        not interrupted by `shutdown`.
+        '''
+        self.timeout = idle_timeout
+        while not self._idle:
+            self.handle_request()
+
+    def handle_timeout(self):
+        with self._lock:
+            self._idle = not self._client_to_thread and (
+                time.monotonic() - self._last_active >= self.timeout
+            )
+
+    def server_close(self):
+        with self._lock:
+            client_to_thread = self._client_to_thread.copy()
+        # Stop accepting TCP connections before shutting down the threads
+        # that handle them.
+        for client, thread in client_to_thread.items():
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:  # pragma: no cover
+                pass  # The client thread may have closed it already
+            thread.join()
+        super().server_close()
+
+
+def repo_server(
+    sock,
+    location_to_obj: Mapping[str, dict],
+    storage: Storage,
+    *,
+    num_threads: int=_DEFAULT_NUM_THREADS,
+    verified_blob_cache: Optional[VerifiedBlobCache]=None,
+    daemon: bool=False,
+):
     '''
     BEWARE: `location_to_obj` is mutated if we discover checksum errors to
     prevent client retries from succeeding.
+
+    If `daemon` is set, `sock` is a listening Unix socket, and the server
+    is a `RepoServerDaemon`, which see.
     '''
-    return HTTPSocketServer(
+    return (RepoServerDaemon if daemon else ThreadPoolHTTPSocketServer)(
         sock,
         lambda *args, **kwargs: RepoSnapshotHTTPRequestHandler(
             *args,
             location_to_obj=location_to_obj,
             storage=storage,
+            verified_blob_cache=verified_blob_cache,
             **kwargs,
-        )
+        ),
+        num_threads=num_threads,
     )
 
 
@@ -316,24 +792,61 @@ if __name__ == '__main__':  # pragma: no cover
         help='Multi-repo snapshot directory, with per-repo subdirectories, '
             'each containing repomd.xml, repodata.json, and rpm.json',
     )
-    parser.add_argument(
-        '--socket-fd', required=True, type=int,
+    socket_group = parser.add_mutually_exclusive_group(required=True)
+    socket_group.add_argument(
+        '--socket-fd', type=int,
         help='Listen on this socket. We assume that another process creates '
             'and binds the socket for us.',
     )
+    socket_group.add_argument(
+        '--daemon-socket-fd', type=int,
+        help='Listen on this Unix socket for clients that send us TCP '
+            'sockets to serve, see `RepoServerDaemon`. We assume that '
+            'another process creates and binds the socket for us.',
+    )
+    parser.add_argument(
+        '--idle-timeout', type=float,
+        help='With `--daemon-socket-fd`, exit once there have been no '
+            'clients for this many seconds. By default, serve forever.',
+    )
     Storage.add_argparse_arg(
         parser, '--storage', required=True,
         help='What Storage do the storage IDs of the snapshots refer to? ',
     )
+    parser.add_argument(
+        '--num-threads', type=int, default=_DEFAULT_NUM_THREADS,
+        help='Serve this many connections concurrently. Default: %(default)s',
+    )
+    parser.add_argument(
+        '--verified-blob-cache',
+        default=':memory:',
+        help='Path to a SQLite database, which will be created if needed. '
+            'It remembers the local blob files that were already verified, '
+            'so that they are not hashed again. Only use a path that is as '
+            'trusted as `--snapshot-dir`. By default, blobs are remembered '
+            'until the server exits, so e.g. resuming a download via a '
+            '`Range` request does not hash the blob again.',
+    )
     opts = parser.parse_args()
 
     init_logging()
 
+    daemon = opts.daemon_socket_fd is not None
     with repo_server(
-        socket.socket(fileno=opts.socket_fd),
+        socket.socket(
+            fileno=opts.daemon_socket_fd if daemon else opts.socket_fd,
+        ),
         read_snapshot_dir(opts.snapshot_dir),
         opts.storage,
+        num_threads=opts.num_threads,
+        verified_blob_cache=VerifiedBlobCache(opts.verified_blob_cache),
+        daemon=daemon,
     ) as httpd:
         httpd.server_activate()
-        log.info(f'HTTP repo server is listening')
-        httpd.serve_forever()
+        if daemon and opts.idle_timeout is not None:
+            log.info('HTTP repo server daemon is listening')
+            httpd.serve_until_idle(opts.idle_timeout)
+            log.info('HTTP repo server daemon was idle, exiting')
+        else:
+            log.info('HTTP repo server is listening')
+            httpd.serve_forever()
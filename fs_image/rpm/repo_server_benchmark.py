@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+'''
+Load-tests `repo_server.py` against a local `--snapshot-dir`: forks a
+server, and then `--num-clients` parallel clients, each of which GETs
+every file of the snapshot, in a random order, `--rounds` times.  Prints
+the request & byte throughput.
+
+To compare with a server lacking concurrency & keep-alive, pass
+`--num-threads 1 --new-connection-per-request`.  Here is an invocation
+against the test snapshot, run from the `fs_image` directory:
+
+buck run .../rpm:repo-server-benchmark -- --storage '{
+    "key": "test", "kind": "filesystem",
+    "base_dir": "rpm/tests/snapshot/storage"
+  }' --snapshot-dir rpm/tests/snapshot/repos --num-clients 8
+'''
+import http.client
+import multiprocessing
+import random
+import socket
+import time
+import urllib.parse
+
+from typing import Iterable, Tuple
+
+from .repo_server import _DEFAULT_NUM_THREADS, read_snapshot_dir, repo_server
+from .storage import Storage
+
+
+def _serve(sock, snapshot_dir: str, storage: Storage, num_threads: int):
+    with repo_server(
+        sock, read_snapshot_dir(snapshot_dir), storage,
+        num_threads=num_threads,
+    ) as httpd:
+        httpd.server_activate()
+        httpd.serve_forever()
+
+
+def _client(
+    address: Tuple[str, int],
+    locations: Iterable[str],
+    rounds: int,
+    seed: int,
+    new_connection_per_request: bool,
+) -> Tuple[int, int]:
+    'Returns the number of requests & of bytes received.'
+    rng = random.Random(seed)
+    locations = list(locations)
+    num_bytes = 0
+    conn = None
+    for _ in range(rounds):
+        rng.shuffle(locations)
+        for location in locations:
+            if conn is None:
+                conn = http.client.HTTPConnection(*address)
+            conn.request('GET', '/' + urllib.parse.quote(location))
+            resp = conn.getresponse()
+            num_bytes += len(resp.read())  # Raises on a short read
+            if resp.status != 200:
+                raise RuntimeError(f'{location}: HTTP {resp.status}')
+            if new_connection_per_request:
+                conn.close()
+                conn = None
+    if conn is not None:
+        conn.close()
+    return rounds * len(locations), num_bytes
+
+
+def repo_server_benchmark(
+    *,
+    snapshot_dir: str,
+    storage: Storage,
+    num_clients: int,
+    num_threads: int,
+    rounds: int,
+    new_connection_per_request: bool,
+) -> dict:
+    # Skip the files that the server would refuse to serve.
+    locations = sorted(
+        location for location, obj in read_snapshot_dir(snapshot_dir).items()
+            if 'storage_id' in obj or 'content_bytes' in obj
+    )
+    # Forking lets the server & clients use multiple CPUs.
+    mp = multiprocessing.get_context('fork')
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.listen()  # Clients can connect before the server is ready
+        server = mp.Process(
+            target=_serve, args=(sock, snapshot_dir, storage, num_threads),
+        )
+        server.start()
+        try:
+            with mp.Pool(num_clients) as pool:
+                start_time = time.monotonic()
+                results = pool.starmap(_client, [
+                    (
+                        sock.getsockname(), locations, rounds, seed,
+                        new_connection_per_request,
+                    ) for seed in range(num_clients)
+                ])
+                seconds = time.monotonic() - start_time
+        finally:
+            server.terminate()
+            server.join()
+    num_requests = sum(r for r, _ in results)
+    num_bytes = sum(b for _, b in results)
+    return {
+        'requests': num_requests,
+        'bytes': num_bytes,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(num_requests / seconds, 1),
+        'megabytes_per_second': round(num_bytes / seconds / 2 ** 20, 1),
+    }
+
+
+# Not unit-tested, it is a tool for measuring `repo_server.py`.
+if __name__ == '__main__':  # pragma: no cover
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        '--snapshot-dir', required=True,
+        help='Multi-repo snapshot directory, as for `repo-server`',
+    )
+    Storage.add_argparse_arg(
+        parser, '--storage', required=True,
+        help='What Storage do the storage IDs of the snapshots refer to? ',
+    )
+    parser.add_argument('--num-clients', type=int, default=8)
+    parser.add_argument(
+        '--num-threads', type=int, default=_DEFAULT_NUM_THREADS,
+        help='The `--num-threads` of the server. Default: %(default)s',
+    )
+    parser.add_argument(
+        '--rounds', type=int, default=10,
+        help='Each client GETs each file in the snapshot this many times.',
+    )
+    parser.add_argument(
+        '--new-connection-per-request', action='store_true',
+        help='Make the clients close the connection after each request.',
+    )
+    opts = parser.parse_args()
+
+    print(json.dumps(repo_server_benchmark(
+        snapshot_dir=opts.snapshot_dir,
+        storage=opts.storage,
+        num_clients=opts.num_clients,
+        num_threads=opts.num_threads,
+        rounds=opts.rounds,
+        new_connection_per_request=opts.new_connection_per_request,
+    ), indent=4))
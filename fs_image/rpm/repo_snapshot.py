@@ -10,6 +10,7 @@ import json
 from typing import Mapping, NamedTuple, Union
 
 from .common import get_file_logger, create_ro, Path
+from .snapshot_index import write_snapshot_index
 
 log = get_file_logger(__file__)
 
@@ -89,6 +90,7 @@ class RepoSnapshot(NamedTuple):
         with create_ro(path / 'repomd.xml', 'wb') as out:
             out.write(self.repomd.xml)
 
+        obj_maps = []
         for filename, sid_to_obj in (
             ('repodata.json', self.storage_id_to_repodata),
             ('rpm.json', self.storage_id_to_rpm),
@@ -109,6 +111,10 @@ class RepoSnapshot(NamedTuple):
                 assert len(obj_map) == len(sid_to_obj), \
                     f'location collided {filename}'
                 json.dump(obj_map, out, sort_keys=True, indent=4)
+            obj_maps.append(obj_map)
+
+        # Lets `repo-server` start without parsing all of the above.
+        write_snapshot_index(path, self.repomd, *obj_maps)
         return self
 
     def visit(self, visitor):
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+'''
+`RepoSnapshot.to_directory` writes `rpm.json` and `repodata.json`, which
+are easy to review & to diff, but which `repo-server` would have to parse
+in full before it could serve any file.  So, next to them, it also writes
+`index.sqlite3`, a compiled index of every object that `repo-server`
+serves from the repo, except for the GPG keys:
+
+  - The snapshot objects, as the same JSON dicts as in the `.json` files.
+
+  - `repodata/repomd.xml`, along with the metadata that `repo-server`
+    would otherwise have to get by parsing the XML.
+
+`SnapshotIndex` opens this file in O(1) time, and decodes each object the
+first time it is looked up.
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+from typing import Iterator, Mapping
+
+from .common import Checksum, Path, set_new_key
+from .repo_objects import RepoMetadata
+
+INDEX_FILENAME = 'index.sqlite3'
+REPOMD_LOCATION = 'repodata/repomd.xml'
+
+
+def content_bytes_obj(content: bytes, build_timestamp: int) -> dict:
+    'An object that `repo-server` sends from memory, instead of storage.'
+    return {
+        'size': len(content),
+        'build_timestamp': build_timestamp,
+        'content_bytes': content,  # Instead of `storage_id`
+        'checksum': str(Checksum(  # For the `ETag`
+            algorithm='sha256', hexdigest=hashlib.sha256(content).hexdigest(),
+        )),
+    }
+
+
+def write_snapshot_index(
+    path: Path, repomd: RepoMetadata, *location_to_objs: Mapping[str, dict],
+) -> None:
+    '''
+    Writes `path / INDEX_FILENAME`, which must not exist.  The locations of
+    the `location_to_objs` must not collide.
+    '''
+    location_to_obj = {}
+    for l_to_o in location_to_objs:
+        for location, obj in l_to_o.items():
+            set_new_key(location_to_obj, location, obj)
+    set_new_key(location_to_obj, REPOMD_LOCATION, content_bytes_obj(
+        repomd.xml, repomd.build_timestamp,
+    ))
+
+    index_path = path / INDEX_FILENAME
+    assert not os.path.exists(index_path), index_path
+    conn = sqlite3.connect(index_path)
+    try:
+        with conn:  # Commits the transaction
+            conn.execute('''
+                CREATE TABLE "location_to_obj" (
+                    "location" TEXT PRIMARY KEY NOT NULL,
+                    "obj" TEXT NOT NULL,
+                    "content_bytes" BLOB
+                ) WITHOUT ROWID
+            ''')
+            conn.executemany(
+                'INSERT INTO "location_to_obj" VALUES (?, ?, ?)',
+                (
+                    (
+                        location,
+                        json.dumps({
+                            k: v for k, v in obj.items()
+                                if k != 'content_bytes'
+                        }, sort_keys=True),
+                        obj.get('content_bytes'),
+                    ) for location, obj in sorted(location_to_obj.items())
+                ),
+            )
+    finally:
+        conn.close()
+    os.chmod(index_path, 0o444)  # Like the other files of the snapshot
+
+
+class SnapshotIndex(Mapping):
+    '''
+    A read-only view of the `location_to_obj` of an `index.sqlite3`.
+
+    BEWARE: Just like with a plain `dict`, the objects are mutable, and
+    `repo-server` mutates them to memoize errors.  To keep such mutations,
+    we return the same object every time a location is looked up.
+    '''
+
+    def __init__(self, index_path: Path):
+        # The snapshot never changes, so SQLite can skip locking it.
+        self._conn = sqlite3.connect(
+            # `bytes()` since `Path.decode` does not take `os.fsdecode` args
+            'file:' + urllib.parse.quote(os.path.abspath(bytes(index_path)))
+                + '?immutable=1',
+            uri=True,
+            # The handler threads of `repo-server` share this connection,
+            # so we serialize its use ourselves.
+            check_same_thread=False,
+        )
+        self._lock = threading.Lock()
+        self._location_to_obj = {}
+
+    def __getitem__(self, location: str) -> dict:
+        obj = self._location_to_obj.get(location)
+        if obj is not None:
+            return obj
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT "obj", "content_bytes" FROM "location_to_obj" '
+                'WHERE "location" = ?', (location,),
+            ).fetchone()
+            if row is None:
+                raise KeyError(location)
+            obj = json.loads(row[0])
+            if row[1] is not None:
+                obj['content_bytes'] = row[1]
+            # Under the lock, so all threads see the same object.
+            return self._location_to_obj.setdefault(location, obj)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            locations = self._conn.execute(
+                'SELECT "location" FROM "location_to_obj" ORDER BY "location"'
+            ).fetchall()
+        return (location for location, in locations)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM "location_to_obj"'
+            ).fetchone()[0]
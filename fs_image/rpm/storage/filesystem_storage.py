@@ -63,7 +63,7 @@ class FilesystemStorage(Storage, plugin_kind='filesystem'):
     @contextmanager
     def reader(self, sid: str) -> ContextManager[StorageInput]:
         with open(self._path_for_storage_id(self.strip_key(sid)), 'rb') as inp:
-            yield StorageInput(input=inp)
+            yield StorageInput(input=inp, local_file=inp)
 
     def remove(self, sid: str) -> None:
         sid_path = self._path_for_storage_id(self.strip_key(sid))
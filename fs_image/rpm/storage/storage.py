@@ -15,7 +15,7 @@ import logging
 import re
 
 from contextlib import AbstractContextManager
-from typing import Callable, ContextManager, IO
+from typing import Callable, ContextManager, IO, Optional
 
 from rpm.pluggable import Pluggable
 
@@ -60,11 +60,18 @@ class StorageInput:
     '''
     Constructed by Storage.reader(). Use .read() to get data from a
     previously stored blob.
+
+    If the blob is a regular local file, `.local_file` is that file,
+    opened for binary reads.  Servers may send it via `socket.sendfile`,
+    which saves copying its data through userspace.  It is None for
+    storage engines without local files.
     '''
     _input: IO
+    local_file: Optional[IO]
 
-    def __init__(self, *, input: IO):
+    def __init__(self, *, input: IO, local_file: Optional[IO]=None):
         self._input = input
+        self.local_file = local_file
 
     def read(self, size=None):
         return self._input.read() if size is None else self._input.read(size)
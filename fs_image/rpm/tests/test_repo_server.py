@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
 import email
 import hashlib
+import http.client
 import os
+import re
 import socket
 import requests
 import tempfile
 import threading
+import time
 import unittest
 
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
+from unittest import mock
 
-from ..common import Checksum, Path
+from .. import verified_blob_cache
+from ..common import Checksum, Path, send_fds
 from ..repo_objects import Repodata, RepoMetadata, Rpm
-from ..repo_server import _CHUNK_SIZE, repo_server, read_snapshot_dir
+from ..repo_server import (
+    _CHUNK_SIZE, DAEMON_LISTEN_MSG, DAEMON_READY_MSG, repo_server,
+    read_snapshot_dir, RepoSnapshotHTTPRequestHandler,
+)
 from ..repo_snapshot import RepoSnapshot, MutableRpmError
+from ..snapshot_index import SnapshotIndex
 from ..storage import Storage
+from ..verified_blob_cache import VerifiedBlobCache
 
 
 def _checksum(algo: str, data: bytes) -> Checksum:
@@ -47,10 +57,12 @@ class RepoServerTestCase(unittest.TestCase):
         )
 
     @contextmanager
-    def repo_server_thread(self, location_to_obj):
+    def repo_server_thread(self, location_to_obj, **kwargs):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.bind(('127.0.0.1', 0))
-        with repo_server(sock, location_to_obj, self.storage) as httpd:
+        with repo_server(
+            sock, location_to_obj, self.storage, **kwargs,
+        ) as httpd:
             httpd.server_activate()
             thread = threading.Thread(name='RpSrv', target=httpd.serve_forever)
             thread.start()
@@ -118,6 +130,524 @@ class RepoServerTestCase(unittest.TestCase):
             self.assertIn(b'file_integrity', req.content)
             return req.content.decode()
 
+    @contextmanager
+    def _no_local_files(self):
+        'Makes the server stream blobs, instead of using `sendfile`.'
+        reader = self.storage.reader
+
+        @contextmanager
+        def streaming_reader(sid):
+            with reader(sid) as input:
+                input.local_file = None
+                yield input
+
+        with mock.patch.object(self.storage, 'reader', streaming_reader):
+            yield
+
+    def _prep_blob(self, content: bytes):
+        content, sid = self._write(content)
+        return {
+            'size': len(content),
+            'build_timestamp': 0,
+            'storage_id': sid,
+            'checksum': str(_checksum('sha256', content)),
+        }
+
+    def test_keep_alive_and_pipelining(self):
+        content = b'y' * (_CHUNK_SIZE + 17)
+        for local_files in [True, False]:
+            with ExitStack() as stack:
+                if not local_files:
+                    stack.enter_context(self._no_local_files())
+                host, port = stack.enter_context(self.repo_server_thread({
+                    'blob': self._prep_blob(content),
+                    'bad_blob': self._prep_bad_blob(
+                        actual_size=271828,
+                        expected_size=314159,
+                        checksummed_size=271828,
+                    ),
+                }))
+                conn = http.client.HTTPConnection(host, port)
+                for _ in range(3):
+                    conn.request('GET', '/blob')
+                    resp = conn.getresponse()
+                    self.assertEqual(content, resp.read())
+                    sock = conn.sock
+                    self.assertIsNotNone(sock)
+                # The connection was reused
+                conn.request('HEAD', '/blob')
+                self.assertEqual(b'', conn.getresponse().read())
+                self.assertIs(sock, conn.sock)
+
+                # Integrity errors make for a short body, and the server
+                # closes the connection, so the client cannot miss it.
+                conn.request('GET', '/bad_blob')
+                resp = conn.getresponse()
+                self.assertEqual(200, resp.status)
+                with self.assertRaises(http.client.IncompleteRead):
+                    resp.read()
+                self.assertEqual(b'', conn.sock.recv(1))
+                conn.close()
+                conn.request('GET', '/bad_blob')  # Reconnects
+                self.assertEqual(500, conn.getresponse().status)
+                # Keep `conn` open -- shutdown does not wait for it.
+
+                with socket.create_connection((host, port)) as sock:
+                    sock.sendall(
+                        b'GET /blob HTTP/1.1\r\n\r\n'
+                        b'HEAD /blob HTTP/1.1\r\n\r\n'
+                        b'GET /blob HTTP/1.1\r\n\r\n'
+                        # Errors close the connection, ending our `recv`s.
+                        b'GET /nope HTTP/1.1\r\n\r\n'
+                    )
+                    data = b''.join(iter(lambda: sock.recv(2 ** 16), b''))
+                self.assertEqual(
+                    [b'200', b'200', b'200', b'404'],
+                    re.findall(b'HTTP/1.1 ([0-9]+) ', data),
+                )
+                self.assertEqual(2, data.count(content))
+
+    def test_slow_client_does_not_block_others(self):
+        with self.repo_server_thread({
+            'blob': self._prep_blob(b'fast'),
+        }) as (host, port), socket.create_connection((host, port)) as slow:
+            slow.sendall(b'GET /blob HT')  # Never finishes its request
+            req = requests.get(f'http://{host}:{port}/blob', timeout=30)
+            self.assertEqual(b'fast', req.content)
+
+    @contextmanager
+    def repo_server_daemon_thread(self, location_to_obj, idle_timeout=None):
+        with tempfile.TemporaryDirectory() as td:
+            path = os.path.join(td, 'sock')
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(path)
+            with repo_server(
+                sock, location_to_obj, self.storage, daemon=True,
+            ) as httpd:
+                httpd.server_activate()
+                thread = threading.Thread(
+                    name='RpSrvDaemon',
+                    target=httpd.serve_forever if idle_timeout is None
+                        else lambda: httpd.serve_until_idle(idle_timeout),
+                )
+                thread.start()
+                try:
+                    yield path, thread
+                finally:
+                    if idle_timeout is None:
+                        httpd.shutdown()
+                    thread.join()
+
+    def _daemon_client(self, path):
+        'Returns a control socket, and the address that the daemon serves.'
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+            listener.bind(('127.0.0.1', 0))
+            listener.listen()
+            control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            control.connect(path)
+            send_fds(control, DAEMON_LISTEN_MSG, [listener.fileno()])
+            self.assertEqual(
+                DAEMON_READY_MSG, control.recv(len(DAEMON_READY_MSG)),
+            )
+            return control, listener.getsockname()
+
+    def test_daemon(self):
+        with self.repo_server_daemon_thread({
+            'blob': self._prep_blob(b'daemon'),
+        }) as (path, _thread):
+            control1, address1 = self._daemon_client(path)
+            control2, address2 = self._daemon_client(path)
+            with control1:
+                for host, port in [address1, address2]:
+                    self.assertEqual(b'daemon', requests.get(
+                        f'http://{host}:{port}/blob', timeout=30,
+                    ).content)
+
+            # Once its client hangs up, the daemon closes the socket.
+            for _ in range(300):
+                try:
+                    socket.create_connection(address1).close()
+                except ConnectionRefusedError:
+                    break
+                time.sleep(0.1)
+            else:  # pragma: no cover
+                self.fail(f'{address1} still accepts connections')
+            host, port = address2
+            self.assertEqual(b'daemon', requests.get(
+                f'http://{host}:{port}/blob', timeout=30,
+            ).content)
+
+            # Clients that break protocol get hung up on.
+            with open('/dev/null') as null:
+                for msg, fds in [
+                    (b'nope', []),
+                    (DAEMON_LISTEN_MSG, []),
+                    (b'nope', [null.fileno()]),
+                    (DAEMON_LISTEN_MSG, [null.fileno(), null.fileno()]),
+                ]:
+                    with socket.socket(
+                        socket.AF_UNIX, socket.SOCK_STREAM,
+                    ) as control:
+                        control.connect(path)
+                        if fds:
+                            send_fds(control, msg, fds)
+                        else:
+                            control.sendall(msg)
+                        self.assertEqual(b'', control.recv(1))
+
+        # Closing the server hangs up on the remaining clients.
+        with control2:
+            self.assertEqual(b'', control2.recv(1))
+
+    def test_daemon_idle_timeout(self):
+        with self.repo_server_daemon_thread(
+            {}, idle_timeout=0.2,
+        ) as (path, thread):
+            control, _address = self._daemon_client(path)
+            with control:
+                time.sleep(0.5)
+                self.assertTrue(thread.is_alive())  # The client is active
+            thread.join(timeout=30)  # Exits soon after the client left
+            self.assertFalse(thread.is_alive())
+
+    def test_errors_memoized_by_another_thread(self):
+
+        def memoize_error(obj):
+            obj['error'] = {'storage_id': obj.pop('storage_id')}
+
+        # Another thread finds the error while we read the blob.
+        reader = self.storage.reader
+
+        @contextmanager
+        def racing_reader(sid):
+            with reader(sid) as input:
+                memoize_error(bad_blob)
+                yield input
+
+        # Another thread finds the error right after we look up the blob.
+        find_obj = RepoSnapshotHTTPRequestHandler.find_obj
+
+        def racing_find_obj(handler):
+            location, obj = find_obj(handler)
+            memoize_error(obj)
+            return location, obj
+
+        for ctx in [
+            mock.patch.object(self.storage, 'reader', racing_reader),
+            mock.patch.object(
+                RepoSnapshotHTTPRequestHandler, 'find_obj', racing_find_obj,
+            ),
+        ]:
+            bad_blob = self._prep_bad_blob(
+                actual_size=3, expected_size=4, checksummed_size=3,
+            )
+            sid = bad_blob['storage_id']
+            with self.repo_server_thread({'bad_blob': bad_blob}) as (
+                host, port,
+            ), ctx:
+                conn = http.client.HTTPConnection(host, port)
+                conn.request('GET', '/bad_blob')
+                with self.assertRaises(http.client.IncompleteRead):
+                    conn.getresponse().read()
+                conn.close()
+            # The other thread's error was not overwritten.
+            self.assertEqual({'storage_id': sid}, bad_blob['error'])
+
+    def test_verified_blob_cache(self):
+        num_hashed = 0
+        gen_verified_chunks = RepoSnapshotHTTPRequestHandler \
+            ._gen_verified_chunks
+
+        def counting_gen_verified_chunks(handler, *args):
+            nonlocal num_hashed
+            num_hashed += 1
+            return gen_verified_chunks(handler, *args)
+
+        blob = self._prep_blob(b'cached')
+        blob_path = self.storage._path_for_storage_id(
+            self.storage.strip_key(blob['storage_id']),
+        )
+        with tempfile.TemporaryDirectory() as td, VerifiedBlobCache(
+            os.path.join(td, 'cache.db'),
+        ) as cache, self.repo_server_thread(
+            {'blob': blob}, verified_blob_cache=cache,
+        ) as (host, port), mock.patch.object(
+            RepoSnapshotHTTPRequestHandler, '_gen_verified_chunks',
+            counting_gen_verified_chunks,
+        ):
+
+            def get():
+                return requests.get(f'http://{host}:{port}/blob')
+
+            # The blob was just written, so it's too fresh to cache.
+            for i in range(2):
+                self.assertEqual(b'cached', get().content)
+                self.assertEqual(i + 1, num_hashed)
+
+            with mock.patch.object(
+                verified_blob_cache, '_MIN_FILE_AGE_NS', -10 ** 12,
+            ):
+                # Not cached if the file changes while we hash it.
+                with mock.patch.object(
+                    RepoSnapshotHTTPRequestHandler, '_gen_verified_chunks',
+                    lambda *args: (
+                        os.utime(blob_path, ns=(0, 0)),
+                        counting_gen_verified_chunks(*args),
+                    )[1],
+                ):
+                    self.assertEqual(b'cached', get().content)
+                self.assertEqual(3, num_hashed)
+
+                # Now the blob gets hashed once, and then just sent.
+                for _ in range(3):
+                    self.assertEqual(b'cached', get().content)
+                    self.assertEqual(4, num_hashed)
+
+                # Corrupting the blob in place invalidates the cache.
+                os.chmod(blob_path, 0o644)
+                with open(blob_path, 'r+b') as outfile:
+                    outfile.write(b'CACHED')
+                conn = http.client.HTTPConnection(host, port)
+                conn.request('GET', '/blob')
+                with self.assertRaises(http.client.IncompleteRead):
+                    conn.getresponse().read()
+                conn.close()
+                self.assertEqual(5, num_hashed)
+                self.assertEqual(500, get().status_code)
+
+    def test_ranges(self):
+        content = bytes(range(256)) * 40
+        size = len(content)
+        mem = {
+            'size': size,
+            'build_timestamp': 0,
+            'content_bytes': content,
+            'checksum': str(_checksum('sha256', content)),
+        }
+        for path, local_files in [
+            ('mem', True), ('blob', True), ('blob', False),
+        ]:
+            with ExitStack() as stack:
+                if not local_files:
+                    stack.enter_context(self._no_local_files())
+                host, port = stack.enter_context(self.repo_server_thread({
+                    'mem': mem,
+                    'blob': self._prep_blob(content),
+                    'empty': {
+                        'size': 0,
+                        'build_timestamp': 0,
+                        'content_bytes': b'',
+                    },
+                }))
+
+                def get(range_header, path=path, **headers):
+                    return requests.get(
+                        f'http://{host}:{port}/{path}',
+                        headers={'Range': range_header, **headers},
+                    )
+
+                def check_range(range_header, start, end, **headers):
+                    req = get(range_header, **headers)
+                    if not local_files:  # We can only send it all.
+                        self.assertEqual(200, req.status_code)
+                        self.assertEqual(content, req.content)
+                        return
+                    self.assertEqual(206, req.status_code)
+                    self.assertEqual(content[start:end], req.content)
+                    self.assertEqual(
+                        f'bytes {start}-{end - 1}/{size}',
+                        req.headers['content-range'],
+                    )
+                    self.assertEqual(
+                        'application/octet-stream',
+                        req.headers['content-type'],
+                    )
+
+                check_range('bytes=10-19', 10, 20)
+                check_range('bytes=100-', 100, size)
+                check_range('bytes=-5', size - 5, size)
+                check_range('bytes=-100000', 0, size)
+                check_range('bytes=10-100000', 10, size)
+                check_range('Bytes = 7-8', 7, 9)
+                check_range('bytes=1-5, 3-8', 1, 9)  # Overlap is merged
+                check_range('bytes=1-5', 1, 6, **{
+                    'If-Range': f'"{mem["checksum"]}"',
+                })
+
+                # Multiple ranges are sorted & merged, but not reordered.
+                req = get('bytes=20-29, 0-1,5-9, 3-4, 22-23')
+                if local_files:
+                    self.assertEqual(206, req.status_code)
+                    content_type, boundary = req.headers['content-type'] \
+                        .split('; boundary=')
+                    self.assertEqual('multipart/byteranges', content_type)
+                    self.assertEqual(b''.join(
+                        b'\r\n--%s\r\nContent-type: application/'
+                        b'octet-stream\r\nContent-Range: bytes %d-%d/%d'
+                        b'\r\n\r\n%s' % (
+                            boundary.encode(), start, end - 1, size,
+                            content[start:end],
+                        ) for start, end in [(0, 2), (3, 10), (20, 30)]
+                    ) + b'\r\n--%s--\r\n' % boundary.encode(), req.content)
+                    self.assertEqual(
+                        len(req.content), int(req.headers['content-length']),
+                    )
+                else:
+                    self.assertEqual(200, req.status_code)
+                    self.assertEqual(content, req.content)
+
+                # The range is unsatisfiable
+                for range_path, range_header, range_size in [
+                    (path, f'bytes={size}-', size),
+                    (path, 'bytes=-0', size),
+                    ('empty', 'bytes=-5', 0),
+                    ('empty', 'bytes=0-', 0),
+                ]:
+                    with mock.patch.object(
+                        RepoSnapshotHTTPRequestHandler, '_verify_local_file',
+                    ) as verify_local_file:
+                        req = get(range_header, path=range_path)
+                    # Sending no body should not make us hash the blob.
+                    verify_local_file.assert_not_called()
+                    if range_path == 'blob' and not local_files:
+                        self.assertEqual(200, req.status_code)
+                        self.assertEqual(content, req.content)
+                        continue
+                    self.assertEqual(416, req.status_code)
+                    self.assertEqual(b'', req.content)
+                    self.assertEqual(
+                        f'bytes */{range_size}', req.headers['content-range'],
+                    )
+
+                # We send it all for invalid & mismatched ranges.
+                for range_header, headers in [
+                    ('bytes=5-1', {}),
+                    ('bytes=-', {}),
+                    ('bytes=', {}),
+                    ('bytes=1-2,', {}),
+                    ('bytes=x-1', {}),
+                    ('items=0-1', {}),
+                    (
+                        'bytes=' + ','.join(f'{i}-{i}' for i in range(101)),
+                        {},
+                    ),
+                    ('bytes=0-1', {'If-Range': '"sha256:stale"'}),
+                ]:
+                    req = get(range_header, **headers)
+                    self.assertEqual(200, req.status_code)
+                    self.assertEqual(content, req.content)
+
+    def test_range_errors(self):
+        bad_blob = self._prep_bad_blob(
+            actual_size=271828, expected_size=271828, checksummed_size=3,
+        )
+        blob = self._prep_blob(b'x' * 271828)
+        verify_local_file = RepoSnapshotHTTPRequestHandler._verify_local_file
+
+        def truncating_verify_local_file(handler, location, obj, sid, input):
+            ret = verify_local_file(handler, location, obj, sid, input)
+            path = self.storage._path_for_storage_id(
+                self.storage.strip_key(sid),
+            )
+            os.chmod(path, 0o644)
+            os.truncate(path, 5)
+            return ret
+
+        with self.repo_server_thread({
+            'bad_blob': bad_blob, 'blob': blob,
+        }) as (host, port):
+            for path in ['bad_blob', 'blob']:
+                with mock.patch.object(
+                    RepoSnapshotHTTPRequestHandler, '_verify_local_file',
+                    truncating_verify_local_file,
+                ) if path == 'blob' else ExitStack():
+                    conn = http.client.HTTPConnection(host, port)
+                    conn.request('GET', f'/{path}', headers={
+                        'Range': 'bytes=1-2,10-200000',
+                    })
+                    resp = conn.getresponse()
+                    self.assertEqual(206, resp.status)
+                    # The client notices the short body, and the server
+                    # closes the connection.
+                    with self.assertRaises(http.client.IncompleteRead):
+                        resp.read()
+                    self.assertEqual(b'', conn.sock.recv(1))
+                    conn.close()
+
+    def test_conditional_requests(self):
+        content = b'repodata'
+        checksum = str(_checksum('sha256', content))
+        etag = f'"{checksum}"'
+        timestamp = 1234567890
+        last_modified = email.utils.formatdate(timestamp, usegmt=True)
+        blob = self._prep_blob(content)
+        blob['build_timestamp'] = timestamp
+        with self.repo_server_thread({
+            'mem': {
+                'size': len(content),
+                'build_timestamp': timestamp,
+                'content_bytes': content,
+                'checksum': checksum,
+            },
+            'blob': blob,
+            'no_etag': {
+                'size': len(content),
+                'build_timestamp': timestamp,
+                'content_bytes': content,
+            },
+        }) as (host, port):
+            for path in ['mem', 'blob']:
+                for method in ['GET', 'HEAD']:
+
+                    def check(status, path=path, **headers):
+                        req = requests.request(
+                            method, f'http://{host}:{port}/{path}',
+                            headers=headers,
+                        )
+                        self.assertEqual(status, req.status_code)
+                        if status == 304 or method == 'HEAD':
+                            self.assertEqual(b'', req.content)
+                        else:
+                            self.assertEqual(content, req.content)
+                        self.assertEqual(
+                            last_modified, req.headers['last-modified'],
+                        )
+                        self.assertEqual(
+                            None if path == 'no_etag' else etag,
+                            req.headers.get('etag'),
+                        )
+
+                    check(200)
+                    check(304, **{'If-None-Match': etag})
+                    check(304, **{'If-None-Match': f'"x", W/{etag}'})
+                    check(304, **{'If-None-Match': '*'})
+                    check(304, path='no_etag', **{'If-None-Match': '*'})
+                    check(200, **{'If-None-Match': '"x"'})
+                    check(200, path='no_etag', **{'If-None-Match': '"x"'})
+                    # `If-None-Match` takes precedence
+                    check(200, **{
+                        'If-None-Match': '"x"',
+                        'If-Modified-Since': last_modified,
+                    })
+                    check(304, **{'If-Modified-Since': last_modified})
+                    check(304, **{
+                        'If-Modified-Since': email.utils.formatdate(
+                            timestamp + 1, usegmt=True,
+                        ),
+                    })
+                    check(200, **{
+                        'If-Modified-Since': email.utils.formatdate(
+                            timestamp - 1, usegmt=True,
+                        ),
+                    })
+                    # No time zone means UTC
+                    check(304, **{
+                        'If-Modified-Since': last_modified.replace(
+                            'GMT', '-0000',
+                        ),
+                    })
+                    check(200, **{'If-Modified-Since': 'not a date'})
+
     def _check_bad_size(self, actual, expected, checksummed):
         msg = self._check_bad_blob(self._prep_bad_blob(
             actual_size=actual,
@@ -220,26 +750,60 @@ class RepoServerTestCase(unittest.TestCase):
             os.mkdir(repo_dir / 'gpg_keys')
             with open(repo_dir / 'gpg_keys' / 'RPM-GPG-safekey', 'wb') as outf:
                 outf.write(b'public key')
-            with self.repo_server_thread(read_snapshot_dir(td)) as (h, p):
-                # A vanilla 404 doesn't affect the server's operation
-                req = requests.get(f'http://{h}:{p}//DOES_NOT_EXIST')
-                self.assertEqual(404, req.status_code)
-
-                req = requests.get(f'http://{h}:{p}/mine/repodata/repomd.xml')
-                req.raise_for_status()
-                self.assertEqual(repomd.xml, req.content)
-
-                req = requests.get(f'http://{h}:{p}/mine/repodata/the_only')
-                req.raise_for_status()
-                self.assertEqual(repodata_bytes, req.content)
-
-                req = requests.get(f'http://{h}:{p}/mine/RPM-GPG-safekey')
-                req.raise_for_status()
-                self.assertEqual(b'public key', req.content)
-
-                req = requests.get(f'http://{h}:{p}/mine/pkgs/good.rpm')
-                req.raise_for_status()
-                self.assertEqual(rpm_bytes, req.content)
-                req = requests.get(f'http://{h}:{p}/mine/pkgs/mutable.rpm')
-                self.assertEqual(500, req.status_code)
-                self.assertIn(b"'mutable_rpm'", req.content)
+            for use_index in [True, False]:
+                if not use_index:  # Old snapshots lack the index
+                    os.unlink(repo_dir / 'index.sqlite3')
+                location_to_obj = read_snapshot_dir(td)
+                self.assertEqual(use_index, isinstance(
+                    location_to_obj._repo_to_location_to_obj['mine'].maps[1],
+                    SnapshotIndex,
+                ))
+                self.assertEqual([
+                    'mine/RPM-GPG-safekey',
+                    'mine/pkgs/good.rpm',
+                    'mine/pkgs/mutable.rpm',
+                    'mine/repodata/repomd.xml',
+                    'mine/repodata/the_only',
+                ], sorted(location_to_obj))
+                self.assertEqual(5, len(location_to_obj))
+                with self.repo_server_thread(location_to_obj) as (h, p):
+                    # A vanilla 404 doesn't affect the server's operation
+                    req = requests.get(f'http://{h}:{p}//DOES_NOT_EXIST')
+                    self.assertEqual(404, req.status_code)
+
+                    req = requests.get(
+                        f'http://{h}:{p}/mine/repodata/repomd.xml',
+                    )
+                    req.raise_for_status()
+                    self.assertEqual(repomd.xml, req.content)
+                    # `yum` can cheaply re-validate its cached `repomd.xml`.
+                    etag = req.headers['etag']
+                    self.assertEqual(
+                        f'"{_checksum("sha256", repomd.xml)}"', etag,
+                    )
+                    req = requests.get(
+                        f'http://{h}:{p}/mine/repodata/repomd.xml',
+                        headers={'If-None-Match': etag},
+                    )
+                    self.assertEqual(304, req.status_code)
+
+                    req = requests.get(f'http://{h}:{p}/mine/repodata/the_only')
+                    req.raise_for_status()
+                    self.assertEqual(repodata_bytes, req.content)
+
+                    req = requests.get(f'http://{h}:{p}/mine/RPM-GPG-safekey')
+                    req.raise_for_status()
+                    self.assertEqual(b'public key', req.content)
+                    self.assertEqual(
+                        f'"{_checksum("sha256", b"public key")}"',
+                        req.headers['etag'],
+                    )
+
+                    req = requests.get(f'http://{h}:{p}/mine/pkgs/good.rpm')
+                    req.raise_for_status()
+                    self.assertEqual(rpm_bytes, req.content)
+                    req = requests.get(f'http://{h}:{p}/mine/pkgs/mutable.rpm')
+                    self.assertEqual(500, req.status_code)
+                    self.assertIn(b"'mutable_rpm'", req.content)
+                    req = requests.get(f'http://{h}:{p}/mine/nope.rpm')
+                    self.assertEqual(404, req.status_code)
@@ -10,6 +10,7 @@ from ..repo_objects import Repodata, RepoMetadata, Rpm
 from ..repo_snapshot import (
     FileIntegrityError, HTTPError, MutableRpmError, RepoSnapshot,
 )
+from ..snapshot_index import SnapshotIndex
 
 
 class RepoSnapshotTestCase(unittest.TestCase):
@@ -74,8 +75,8 @@ class RepoSnapshotTestCase(unittest.TestCase):
         with tempfile.TemporaryDirectory() as td:
             snapshot.to_directory(Path(td))
             self.assertEqual(
-                ['repomd.xml', 'repodata.json', 'rpm.json'],
-                os.listdir(td),
+                ['index.sqlite3', 'repodata.json', 'repomd.xml', 'rpm.json'],
+                sorted(os.listdir(td)),
             )
             with open(os.path.join(td, 'repomd.xml'), 'rb') as f:
                 self.assertEqual(b'foo', f.read())
@@ -132,6 +133,18 @@ class RepoSnapshotTestCase(unittest.TestCase):
                     },
                 }, json.loads(f.read()))
 
+            # The index has the same objects, plus `repomd.xml`.
+            location_to_obj = dict(SnapshotIndex(Path(td) / 'index.sqlite3'))
+            self.assertEqual(
+                b'foo',
+                location_to_obj.pop('repodata/repomd.xml')['content_bytes'],
+            )
+            for filename in ['repodata.json', 'rpm.json']:
+                with open(os.path.join(td, filename)) as f:
+                    for location, obj in json.load(f).items():
+                        self.assertEqual(obj, location_to_obj.pop(location))
+            self.assertEqual({}, location_to_obj)
+
         # Check the visitor
         mock = unittest.mock.MagicMock()
         snapshot.visit(mock)
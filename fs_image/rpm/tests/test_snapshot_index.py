@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+import unittest
+
+from ..common import Path
+from ..repo_objects import RepoMetadata
+from ..snapshot_index import (
+    content_bytes_obj, INDEX_FILENAME, SnapshotIndex, write_snapshot_index,
+)
+
+
+class SnapshotIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.path = Path(td.name)
+        self.repomd = RepoMetadata(
+            xml=b'<repomd/>',
+            build_timestamp=123,
+            # Not needed by the index
+            fetch_timestamp=None,
+            repodatas=None,
+            checksum=None,
+            size=None,
+        )
+
+    def test_content_bytes_obj(self):
+        self.assertEqual({
+            'size': 3,
+            'build_timestamp': 4,
+            'content_bytes': b'abc',
+            'checksum': 'sha256:' + hashlib.sha256(b'abc').hexdigest(),
+        }, content_bytes_obj(b'abc', 4))
+
+    def test_index(self):
+        rpms = {
+            'b.rpm': {'size': 1, 'storage_id': 'sid_b'},
+            'a.rpm': {'size': 2, 'error': {'error': 'http'}},
+        }
+        repodatas = {'repodata/x': {'size': 3, 'storage_id': 'sid_x'}}
+        write_snapshot_index(self.path, self.repomd, rpms, repodatas)
+        index_path = self.path / INDEX_FILENAME
+        self.assertEqual(0o444, stat.S_IMODE(os.stat(index_path).st_mode))
+
+        index = SnapshotIndex(index_path)
+        self.assertEqual({}, index._location_to_obj)  # Nothing is decoded
+        self.assertEqual(
+            ['a.rpm', 'b.rpm', 'repodata/repomd.xml', 'repodata/x'],
+            list(index),
+        )
+        self.assertEqual(4, len(index))
+        self.assertEqual({
+            **rpms,
+            **repodatas,
+            'repodata/repomd.xml': content_bytes_obj(b'<repomd/>', 123),
+        }, dict(index))
+        self.assertNotIn('c.rpm', index)
+        with self.assertRaises(KeyError):
+            index['c.rpm']
+
+        # The objects are decoded once, so mutations are kept.
+        obj = index['b.rpm']
+        obj['error'] = obj.pop('storage_id')
+        self.assertIs(obj, index['b.rpm'])
+        self.assertEqual({'size': 1, 'error': 'sid_b'}, index['b.rpm'])
+
+        # Concurrent lookups also get the same object.
+        index = SnapshotIndex(index_path)
+        objs = []
+        threads = [
+            threading.Thread(target=lambda: objs.append(index['a.rpm']))
+                for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8, len(objs))
+        for obj in objs:
+            self.assertIs(objs[0], obj)
+
+    def test_errors(self):
+        with self.assertRaisesRegex(KeyError, 'a.rpm was already set'):
+            write_snapshot_index(
+                self.path, self.repomd, {'a.rpm': {}}, {'a.rpm': {}},
+            )
+        with self.assertRaisesRegex(KeyError, 'repomd.xml was already set'):
+            write_snapshot_index(
+                self.path, self.repomd, {'repodata/repomd.xml': {}},
+            )
+        # The errors came before writing anything, but now we write...
+        write_snapshot_index(self.path, self.repomd)
+        with self.assertRaises(AssertionError):  # ... and never overwrite.
+            write_snapshot_index(self.path, self.repomd)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+
+from .. import verified_blob_cache
+from ..verified_blob_cache import VerifiedBlobCache
+
+
+class VerifiedBlobCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.db_path = os.path.join(td.name, 'cache.db')
+        self.blob_path = os.path.join(td.name, 'blob')
+        with open(self.blob_path, 'wb') as outfile:
+            outfile.write(b'blob')
+
+    def _check(self, cache, stat, **kwargs):
+        return cache.is_verified(**{
+            'storage_id': 'sid', 'checksum': 'sha256:c', 'size': 4,
+            'stat': stat, **kwargs,
+        })
+
+    def test_cache(self):
+        stat = os.stat(self.blob_path)
+        with VerifiedBlobCache(self.db_path) as cache:
+            self.assertFalse(self._check(cache, stat))
+            # The blob was just written, so it is not safe to cache yet.
+            self.assertFalse(cache.add_verified(
+                storage_id='sid', checksum='sha256:c', stat=stat,
+            ))
+            self.assertFalse(self._check(cache, stat))
+            with mock.patch.object(
+                verified_blob_cache, '_MIN_FILE_AGE_NS', -10 ** 12,
+            ):
+                self.assertTrue(cache.add_verified(
+                    storage_id='sid', checksum='sha256:c', stat=stat,
+                ))
+            self.assertTrue(self._check(cache, stat))
+            self.assertFalse(self._check(cache, stat, storage_id='other'))
+            self.assertFalse(self._check(cache, stat, checksum='sha256:d'))
+            self.assertFalse(self._check(cache, stat, size=5))
+
+        # The cache persists, but a modification invalidates it.
+        with VerifiedBlobCache(self.db_path) as cache:
+            self.assertTrue(self._check(cache, stat))
+            os.utime(self.blob_path, ns=(0, 0))
+            self.assertFalse(self._check(cache, os.stat(self.blob_path)))
+
+        # As does replacing the file.
+        os.rename(self.blob_path, self.blob_path + '.old')
+        with open(self.blob_path, 'wb') as outfile:
+            outfile.write(b'blob')
+        os.utime(self.blob_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        with VerifiedBlobCache(self.db_path) as cache:
+            self.assertFalse(self._check(cache, os.stat(self.blob_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
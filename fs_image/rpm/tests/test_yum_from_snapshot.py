@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 import os
+import signal
+import socket
+import struct
 import tempfile
 import subprocess
+import time
 import unittest
 
 from ..common import init_logging, Path
@@ -55,3 +59,56 @@ class YumFromSnapshotTestCase(unittest.TestCase):
             assert install_root != '/'
             # Courtesy of `yum`, the `install_root` is now owned by root.
             subprocess.run(['sudo', 'rm', '-rf', install_root], check=True)
+
+    def _install_carrot(self, **kwargs):
+        install_root = Path(tempfile.mkdtemp())
+        try:
+            yum_from_test_snapshot(
+                install_root, ['install', '--assumeyes', 'rpm-test-carrot'],
+                **kwargs,
+            )
+            with open(install_root / 'usr/share/rpm_test/carrot.txt') as f:
+                self.assertEqual('carrot 2 rc0\n', f.read())
+        finally:
+            assert install_root != '/'
+            subprocess.run(['sudo', 'rm', '-rf', install_root], check=True)
+
+    def _shared_repo_server_pid(self, socket_path):
+        'Returns None if there is no live daemon.'
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except ConnectionRefusedError:
+                return None
+            pid, _uid, _gid = struct.unpack('3i', sock.getsockopt(
+                socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'),
+            ))
+            return pid
+
+    def test_shared_repo_server(self):
+        with tempfile.TemporaryDirectory() as shared_dir:
+            shared_dir = Path(shared_dir)
+            self._install_carrot(shared_repo_server_dir=shared_dir)
+            socket_path, = (
+                shared_dir / p for p in os.listdir(shared_dir)
+                    if not p.endswith(('.lock', '.log'))
+            )
+            pid = self._shared_repo_server_pid(socket_path)
+            self.assertIsNotNone(pid)
+            try:
+                # The second invocation reuses the resident server.
+                self._install_carrot(shared_repo_server_dir=shared_dir)
+                self.assertEqual(
+                    pid, self._shared_repo_server_pid(socket_path),
+                )
+
+                # A dead server gets replaced.
+                os.kill(pid, signal.SIGKILL)
+                while self._shared_repo_server_pid(socket_path) is not None:
+                    time.sleep(0.1)
+                self._install_carrot(shared_repo_server_dir=shared_dir)
+                pid = self._shared_repo_server_pid(socket_path)
+                self.assertIsNotNone(pid)
+            finally:
+                if pid is not None:
+                    os.kill(pid, signal.SIGKILL)
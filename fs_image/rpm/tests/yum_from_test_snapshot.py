@@ -10,7 +10,9 @@ from ..common import init_logging, Path
 from ..yum_from_snapshot import add_common_yum_args, yum_from_snapshot
 
 
-def yum_from_test_snapshot(install_root: 'AnyStr', yum_args: 'List[AnyStr]'):
+def yum_from_test_snapshot(
+    install_root: 'AnyStr', yum_args: 'List[AnyStr]', **kwargs,
+):
     # This works in @mode/opt since the snapshot is baked into the XAR
     snapshot_dir = Path(os.path.dirname(__file__)) / 'snapshot'
     yum_from_snapshot(
@@ -22,6 +24,7 @@ def yum_from_test_snapshot(install_root: 'AnyStr', yum_args: 'List[AnyStr]'):
         snapshot_dir=snapshot_dir / 'repos',
         install_root=Path(install_root),
         yum_args=yum_args,
+        **kwargs,
     )
 
 
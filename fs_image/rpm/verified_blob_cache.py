@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+'''
+`repo-server` does not trust its storage, so it checksums every blob
+before serving it.  For big RPMs, that hashing dominates the cost of a
+request, and a layer build may fetch the same RPMs across many `yum`
+invocations.  `VerifiedBlobCache` is a small SQLite table that remembers
+which local blob files were already verified, so they can be sent out
+without being hashed again.
+
+An entry records the storage ID & checksum of the blob, together with the
+identity of the file that was hashed -- device, inode, size, mtime, and
+ctime.  Replacing the file, or modifying it in place, changes at least
+one of these, so the entry stops matching.  Notes:
+
+  - Timestamps are only as fine as the kernel's clock tick, so a file
+    modified within a tick of its verification might keep its ctime &
+    mtime.  Like `git` does for its index, we do not cache files that
+    changed too recently for this to be safe.
+
+  - The ctime cannot be set by unprivileged users, so a modification that
+    preserves it needs root.  If your storage is controlled by someone
+    with root on this host, you should not use this cache.
+
+  - Treat the database as being as trusted as the snapshot: anyone who
+    can write it can make `repo-server` skip checksum verification.
+
+Only storage engines that provide a `StorageInput.local_file` benefit,
+since a remote blob cannot be identified without reading it.
+'''
+import os
+import sqlite3
+import threading
+import time
+
+from contextlib import AbstractContextManager
+from typing import Tuple
+
+
+# A file must be this old to be cached, see the docblock.  Kernel clock
+# ticks are at most 10ms, so 1 second leaves plenty of margin.
+_MIN_FILE_AGE_NS = 10 ** 9
+
+
+def file_identity(stat: os.stat_result) -> Tuple[int, ...]:
+    'The parts of `stat` that must match for a cache entry to be valid.'
+    return (
+        stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns,
+        stat.st_ctime_ns,
+    )
+
+
+class VerifiedBlobCache(AbstractContextManager):
+    '''
+    Thread-safe, and several processes may share one database.  The
+    context manager closes the database connection.
+    '''
+
+    def __init__(self, db_path: str):
+        # The handler threads of `repo-server` share this connection, so
+        # we serialize its use ourselves.
+        self._lock = threading.Lock()
+        # Autocommit, since every write is a single statement.
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None,
+        )
+        with self._lock:
+            # WAL lets other processes read while one of them writes.
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS "verified_blob" (
+                    "storage_id" TEXT NOT NULL,
+                    "checksum" TEXT NOT NULL,
+                    "st_dev" INTEGER NOT NULL,
+                    "st_ino" INTEGER NOT NULL,
+                    "st_size" INTEGER NOT NULL,
+                    "st_mtime_ns" INTEGER NOT NULL,
+                    "st_ctime_ns" INTEGER NOT NULL,
+                    PRIMARY KEY ("storage_id", "checksum")
+                )
+            ''')
+
+    # Does not suppress exceptions
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._conn.close()
+
+    def is_verified(
+        self, *, storage_id: str, checksum: str, size: int,
+        stat: os.stat_result,
+    ) -> bool:
+        '''
+        True if the file with this `stat` has the expected `size` and was
+        verified to have `checksum` as the blob `storage_id`.
+        '''
+        if stat.st_size != size:
+            return False
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT "st_dev", "st_ino", "st_size", "st_mtime_ns",
+                    "st_ctime_ns"
+                FROM "verified_blob"
+                WHERE "storage_id" = ? AND "checksum" = ?
+            ''', (storage_id, checksum)).fetchone()
+        return row == file_identity(stat)
+
+    def add_verified(
+        self, *, storage_id: str, checksum: str, stat: os.stat_result,
+    ) -> bool:
+        '''
+        Records that the file with this `stat` was verified to have
+        `checksum` as the blob `storage_id`, replacing any previous entry.
+        Returns False if the file changed too recently to be cached.
+        '''
+        if time.time_ns() - max(
+            stat.st_mtime_ns, stat.st_ctime_ns,
+        ) < _MIN_FILE_AGE_NS:
+            return False
+        with self._lock:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO "verified_blob" VALUES
+                (?, ?, ?, ?, ?, ?, ?)
+            ''', (storage_id, checksum, *file_identity(stat)))
+        return True
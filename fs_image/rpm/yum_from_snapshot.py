@@ -59,12 +59,14 @@ The current tool works well, with these caveats:
     a vanilla `yum install net-tools` takes about 1:00, while the current
     `yum-from-snapshot` needs 3:40. The two major reasons are:
 
-      * `repo-server` could be faster, specifically it (i) should support
-        serving multiple files in parallel, (ii) the Facebook-production
-        blob store has some notes on how to eliminate the ~1 second-per-blob
-        fetch latency at the expense of 1-2 days of work, (iii) some caching
-        of blobs may help, (iv) we could add a SQLite version of the
-        JSON snapshot data into the blobstore for faster boot.
+      * `repo-server` could be faster, specifically (i) the
+        Facebook-production blob store has some notes on how to eliminate
+        the ~1 second-per-blob fetch latency at the expense of 1-2 days of
+        work, (ii) some local caching of remote blobs may help -- local
+        blobs are already hashed just once given `--verified-blob-cache`.
+        Starting the server is cheap thanks to the snapshot's SQLite
+        index, and `--shared-repo-server-dir` lets consecutive `yum`
+        invocations reuse one resident server.
 
       * Since we typically run `yum` in an empty clean install-root, the
         initial run is extra-slow due to having to download the repodata,
@@ -84,7 +86,7 @@ The current tool works well, with these caveats:
     snapshot-based install?  Fake it?  Add `/etc/*-release` from the
     snapshot host to the snapshot?
 
-Besides the easy fix of parallelizing `repo-server`, the best
+Besides speeding up `repo-server`, the best
 reward-for-effort improvement to `yum-from-snapshot` would come from
 building a "yum appliance", along these lines:
 
@@ -108,52 +110,48 @@ building a "yum appliance", along these lines:
         One could `nspawn --bind /install_root --private-network -x` into
         the image to use `yum-from-snapshot` in a truly hermetic way.
 '''
-import array
+import fcntl
+import hashlib
+import json
 import os
 import shlex
 import socket
 import subprocess
 import tempfile
 import textwrap
-import time
 
 from contextlib import contextmanager
+from typing import AnyStr, Optional, Sequence
 from urllib.parse import urlparse, urlunparse
 
-from .common import get_file_logger, check_popen_returncode, Path
+from .common import (
+    check_popen_returncode, get_file_logger, Path, recv_fds, send_fds,
+)
+from .repo_server import DAEMON_LISTEN_MSG, DAEMON_READY_MSG
 from .yum_conf import YumConfParser
 
 log = get_file_logger(__file__)
 
+# A shared `repo-server` exits once it has had no clients for this long.
+_SHARED_REPO_SERVER_IDLE_TIMEOUT = 300
+
 
 @contextmanager
-def _listen_unix_socket(path: str) -> 'Iterator[socket.socket]':
+def _listen_unix_socket(path: AnyStr) -> 'Iterator[socket.socket]':
     with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as lsock:
         lsock.bind(path)
         lsock.listen()
         yield lsock
 
 
-def _recv_fds(sock, msglen, maxfds, inheritable=False):
-    '''
-    Receives via a Unix domain socket a message of at most `msglen` bytes,
-    with at most `maxfds` file descriptors in the ancillary data.  The file
-    descriptors will be marked O_CLOEXEC unless inheritable is set to False.
-    '''
-    fds = array.array('i')
-    msg, ancdata, msg_flags, _addr = sock.recvmsg(
-        msglen, maxfds * socket.CMSG_SPACE(fds.itemsize),
-        0 if inheritable else socket.MSG_CMSG_CLOEXEC,
-    )
-    assert not (msg_flags & socket.MSG_TRUNC), msg_flags
-    assert not (msg_flags & socket.MSG_CTRUNC), msg_flags
-    assert not (msg_flags & socket.MSG_ERRQUEUE), msg_flags
-    for cmsg_level, cmsg_type, cmsg_data in ancdata:
-        assert cmsg_level == socket.SOL_SOCKET, cmsg_level
-        assert cmsg_type == socket.SCM_RIGHTS, cmsg_type
-        assert len(cmsg_data) % fds.itemsize == 0, cmsg_data
-        fds.frombytes(cmsg_data)
-    return msg, list(fds)
+def _connect_unix_socket(path: AnyStr) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
 
 
 @contextmanager
@@ -190,27 +188,170 @@ def _prepare_isolated_yum_conf(
     yield  # The config we wrote is valid only inside the context.
 
 
-@contextmanager
-def _repo_server(sock: socket.socket, storage_cfg: str, snapshot_dir: Path):
+def _start_repo_server_daemon(
+    lsock: socket.socket, storage_cfg: str, snapshot_dir: Path,
+    verified_blob_cache: Optional[Path], *, idle_timeout: Optional[float],
+    wrapper: Sequence[str]=(), **popen_kwargs,
+) -> subprocess.Popen:
     '''
-    Invokes `repo-server` with the given storage & snapshot; passes it
-    ownership of the bound TCP socket -- it listens & accepts connections.
+    Starts `repo-server` as a `RepoServerDaemon` on the listening Unix
+    socket `lsock`.  Clients that already connected to `lsock` are served
+    once it starts, so we never have to wait for it.  `wrapper` is a
+    command prefix that will run `repo-server`.
     '''
     # This could be a thread, but it's probably not worth the risks
     # involved in mixing threads & subprocess (yes, lots of programs do,
     # but yes, far fewer do it safely).
-    with sock, subprocess.Popen([
+    return subprocess.Popen([
+        *wrapper,
         os.path.join(os.path.dirname(__file__), 'repo-server'),
-        '--socket-fd', str(sock.fileno()),
+        '--daemon-socket-fd', str(lsock.fileno()),
         '--storage', storage_cfg,
         '--snapshot-dir', snapshot_dir,
-    ], pass_fds=[sock.fileno()]) as server_proc:
+        *([] if verified_blob_cache is None else [
+            '--verified-blob-cache', verified_blob_cache,
+        ]),
+        *([] if idle_timeout is None else [
+            '--idle-timeout', str(idle_timeout),
+        ]),
+    ], pass_fds=[lsock.fileno()], **popen_kwargs)
+
+
+def _ask_repo_server_to_serve(
+    control: socket.socket, sock: socket.socket,
+) -> bool:
+    '''
+    Sends the listening TCP socket `sock` to the `repo-server` daemon at
+    the other end of `control`.  Returns once the daemon accepts
+    connections on it, or False if the daemon hung up instead.  The daemon
+    serves `sock` until we close `control`.
+    '''
+    try:
+        send_fds(control, DAEMON_LISTEN_MSG, [sock.fileno()])
+        return control.recv(len(DAEMON_READY_MSG)) == DAEMON_READY_MSG
+    except (BrokenPipeError, ConnectionResetError):  # pragma: no cover
+        return False
+
+
+@contextmanager
+def _private_repo_server(
+    sock: socket.socket, storage_cfg: str, snapshot_dir: Path,
+    verified_blob_cache: Optional[Path],
+):
+    'Serves `sock` from a `repo-server` that only lives for this context.'
+    with tempfile.TemporaryDirectory() as td, \
+            _listen_unix_socket(os.path.join(td, 'sock')) as lsock, \
+            _connect_unix_socket(lsock.getsockname()) as control, \
+            _start_repo_server_daemon(
+                lsock, storage_cfg, snapshot_dir, verified_blob_cache,
+                idle_timeout=None,
+            ) as server_proc:
         try:
-            yield server_proc
+            if not _ask_repo_server_to_serve(control, sock):
+                raise RuntimeError(  # pragma: no cover
+                    f'repo-server exited with {server_proc.wait()}'
+                )
+            yield
         finally:
             server_proc.kill()  # It's a read-only proxy, abort ASAP
 
 
+def _connect_to_shared_repo_server(
+    socket_path: Path, storage_cfg: str, snapshot_dir: Path,
+    verified_blob_cache: Optional[Path],
+) -> socket.socket:
+    '''
+    Connects to the `repo-server` daemon listening on `socket_path`, or
+    starts one if there is none.  The lock ensures that concurrent callers
+    start at most one daemon.
+    '''
+    with open(socket_path + b'.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released by `close`
+        try:
+            return _connect_unix_socket(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        try:  # Left behind by a daemon that went idle.
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+        log.info(f'Starting a shared repo-server at {socket_path}')
+        with _listen_unix_socket(socket_path) as lsock, \
+                open(socket_path + b'.log', 'ab') as log_file:
+            control = _connect_unix_socket(socket_path)
+            # Detach the daemon, since it outlives us: it must neither get
+            # our signals, nor keep our stdio open.  We can't reap it, so
+            # `sh` double-forks: it starts the daemon in the background
+            # and exits right away.  We reap `sh`, and `init` adopts the
+            # daemon, so neither lingers as a zombie.
+            _start_repo_server_daemon(
+                lsock, storage_cfg, snapshot_dir, verified_blob_cache,
+                idle_timeout=_SHARED_REPO_SERVER_IDLE_TIMEOUT,
+                wrapper=['sh', '-c', '"$@" &', 'sh'],
+                start_new_session=True,
+                stdin=subprocess.DEVNULL,
+                stdout=log_file,
+                stderr=log_file,
+            ).wait()
+        return control
+
+
+@contextmanager
+def _shared_repo_server(
+    sock: socket.socket, storage_cfg: str, snapshot_dir: Path,
+    verified_blob_cache: Optional[Path], shared_repo_server_dir: Path,
+):
+    '''
+    Serves `sock` from the resident `repo-server` for this snapshot in
+    `shared_repo_server_dir`, so that we neither start a server, nor read
+    the snapshot.  The daemon exits once it has been idle for
+    `_SHARED_REPO_SERVER_IDLE_TIMEOUT` seconds.
+    '''
+    # One daemon per configuration. Unix socket paths are limited to 108
+    # bytes, so we shorten the hash.
+    socket_path = shared_repo_server_dir / hashlib.sha256(json.dumps([
+        os.fsdecode(os.path.realpath(bytes(snapshot_dir))),
+        storage_cfg,
+        None if verified_blob_cache is None else os.fsdecode(
+            os.path.realpath(bytes(verified_blob_cache))
+        ),
+    ]).encode()).hexdigest()[:32]
+    for _attempt in range(2):
+        with _connect_to_shared_repo_server(
+            socket_path, storage_cfg, snapshot_dir, verified_blob_cache,
+        ) as control:
+            if _ask_repo_server_to_serve(control, sock):
+                yield
+                return
+        # The daemon went idle right as we connected.  It no longer
+        # listens, so we will start a new one.
+        log.warning(  # pragma: no cover
+            f'repo-server at {socket_path} hung up, retrying'
+        )
+    raise RuntimeError(  # pragma: no cover
+        f'repo-server at {socket_path} hung up, see {socket_path}.log'
+    )
+
+
+def _repo_server(
+    sock: socket.socket, storage_cfg: str, snapshot_dir: Path,
+    verified_blob_cache: Optional[Path],
+    shared_repo_server_dir: Optional[Path],
+):
+    '''
+    A context, in which a `repo-server` with the given storage & snapshot
+    accepts connections on `sock`, a bound & listening TCP socket.
+    '''
+    if shared_repo_server_dir is None:
+        return _private_repo_server(
+            sock, storage_cfg, snapshot_dir, verified_blob_cache,
+        )
+    return _shared_repo_server(
+        sock, storage_cfg, snapshot_dir, verified_blob_cache,
+        shared_repo_server_dir,
+    )
+
+
 @contextmanager
 def _temp_fifo() -> str:
     with tempfile.TemporaryDirectory() as td:
@@ -363,7 +504,8 @@ def _make_socket_and_send_via(*, unix_sock_fd):
 
 def yum_from_snapshot(
     *, storage_cfg: str, snapshot_dir: Path, install_root: Path,
-    yum_args: 'List[str]',
+    yum_args: 'List[str]', verified_blob_cache: Optional[Path]=None,
+    shared_repo_server_dir: Optional[Path]=None,
 ):
     # These user-specified arguments could really mess up hermeticity.
     for bad_arg in ['--installroot', '--config', '--setopt', '--downloaddir']:
@@ -415,35 +557,29 @@ def yum_from_snapshot(
             *_make_socket_and_send_via(unix_sock_fd=1),
         ], stdout=lsock.fileno()) as sock_proc, \
                 socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as unix_sock:
-            # Future: add timeout to connect & _recv_fds so that if the
+            # Future: add timeout to connect & recv_fds so that if the
             # `send_fds` helper crashes, we don't wait forever.
             unix_sock.connect(unix_sock_path)
-            _msg, (repo_server_sock_fd,) = _recv_fds(unix_sock, 128, 1)
+            _msg, (repo_server_sock_fd,) = recv_fds(unix_sock, 128, 1)
             repo_server_sock = socket.socket(fileno=repo_server_sock_fd)
         check_popen_returncode(sock_proc)
 
-        # Binds the socket to the loopback inside yum's netns
+        # Binds the socket to the loopback inside yum's netns.  Once it
+        # listens, `yum` can connect, even before the server accepts.
         repo_server_sock.bind(('127.0.0.1', 0))
+        repo_server_sock.listen()
         host, port = repo_server_sock.getsockname()
         log.info(f'Bound {netns_path} socket to {host}:{port}')
 
-        # The server takes ownership of the socket, so we don't enter it here.
-        with _repo_server(
-            repo_server_sock, storage_cfg, snapshot_dir
-        ) as server_proc, \
+        with repo_server_sock, _repo_server(
+            repo_server_sock, storage_cfg, snapshot_dir, verified_blob_cache,
+            shared_repo_server_dir,
+        ), \
                 open(snapshot_dir / 'yum.conf') as in_yum_conf, \
                 _prepare_isolated_yum_conf(
                     in_yum_conf, out_yum_conf, install_root, host, port
                 ):
 
-            log.info('Waiting for repo server to listen')
-            while server_proc.poll() is None:
-                if repo_server_sock.getsockopt(
-                    socket.SOL_SOCKET, socket.SO_ACCEPTCONN,
-                ):
-                    break
-                time.sleep(0.1)
-
             log.info('Ready to run yum')
             ready_out.write('ready')  # `yum` can run now.
             ready_out.close()  # Proceed past the inner `read`.
@@ -494,6 +630,20 @@ if __name__ == '__main__':  # pragma: no cover
         help='What Storage do the storage IDs of the snapshots refer to? '
             'Run `repo-server --help` to learn the syntax.',
     )
+    parser.add_argument(
+        '--verified-blob-cache', type=Path.from_argparse,
+        help='Passed to `repo-server`, which see.',
+    )
+    parser.add_argument(
+        '--shared-repo-server-dir', type=Path.from_argparse,
+        help='Instead of starting a `repo-server` for this invocation, use '
+            'a resident one, shared by all the invocations that pass this '
+            'directory with the same snapshot & storage.  It is started on '
+            'demand, and exits once it has been idle for '
+            f'{_SHARED_REPO_SERVER_IDLE_TIMEOUT} seconds.  Its socket, lock, '
+            'and log go in this directory, which must be as trusted as '
+            '`--snapshot-dir`.',
+    )
     add_common_yum_args(parser)
     args = parser.parse_args()
 
@@ -504,4 +654,6 @@ if __name__ == '__main__':  # pragma: no cover
         snapshot_dir=args.snapshot_dir,
         install_root=args.install_root,
         yum_args=args.yum_args,
+        verified_blob_cache=args.verified_blob_cache,
+        shared_repo_server_dir=args.shared_repo_server_dir,
     )